@@ -1,6 +1,13 @@
 # api_client_utils.py
 import sys
+import json
+import time
 from openai import OpenAI, AzureOpenAI
+from tracing import span
+from token_accounting import enforce_prompt_budget, record_call
+
+# --- 共享 API 并发槽位 (批量生成时由 batch_main.py 跨进程注入) ---
+_api_slots = None
 
 def create_api_client(config: dict, agent_name: str = "Agent"):
     """
@@ -42,4 +49,59 @@ def create_api_client(config: dict, agent_name: str = "Agent"):
 
     except Exception as e:
         print(f"!!! [{agent_name}] 从 config.py 初始化 API 客户端时出错: {e}", file=sys.stderr)
-        sys.exit(1) 
\ No newline at end of file
+        sys.exit(1) 
+
+
+def set_api_slots(slots):
+    """
+    注入一个 (可跨进程共享的) 信号量，限制同时进行的模型调用数量。
+    传入 None 则不限制。
+    """
+    global _api_slots
+    _api_slots = slots
+
+
+def call_chat_completion(client, agent_name: str, trace_attrs: dict = None, compact_fn=None, **kwargs):
+    """
+    所有 Agent 统一的模型调用入口：
+    1. 检查提示预算 (超出则先压缩，仍超出则拒绝)；
+    2. 占用一个共享 API 槽位 (如果配置了)；
+    3. 调用 client.chat.completions.create(**kwargs)；
+    4. 记录 Token / 成本 (token_accounting) 与调用追踪 (span "llm_call")。
+    异常原样抛出，由调用方自行处理 (与之前直接调用 client 的行为一致)。
+
+    :param trace_attrs: (可选) 附加到 span 上的属性 (e.g., {"asset_id": ..., "attempt": 2})
+    :param compact_fn: (可选) 无参函数，返回压缩后的 messages，提示超出预算时使用
+    """
+    messages, estimated_tokens, compacted = enforce_prompt_budget(agent_name, kwargs.get("messages", []), compact_fn)
+    kwargs["messages"] = messages
+
+    # 请求体大小 (消息中内嵌的 Base64 图片占绝大部分)
+    bytes_sent = len(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+
+    with span("llm_call", agent=agent_name, model=kwargs.get("model"), bytes_sent=bytes_sent, **(trace_attrs or {})) as s:
+        wait_start = time.time()
+        if _api_slots is not None:
+            _api_slots.acquire()
+        s.set(slot_wait_s=round(time.time() - wait_start, 4))
+        call_start = time.time()
+        try:
+            response = client.chat.completions.create(**kwargs)
+        finally:
+            if _api_slots is not None:
+                _api_slots.release()
+
+        try:
+            content = response.choices[0].message.content or ""
+            s.set(bytes_received=len(content.encode("utf-8")))
+        except (AttributeError, IndexError):
+            pass
+        record = record_call(agent_name, kwargs.get("model"), response, estimated_tokens,
+                             time.time() - call_start, compacted=compacted)
+        s.set(
+            prompt_tokens=record["prompt_tokens"],
+            completion_tokens=record["completion_tokens"],
+            tokens=record["prompt_tokens"] + record["completion_tokens"],
+            cost_usd=record["cost_usd"]
+        )
+    return response
@@ -4,9 +4,13 @@ import json
 import base64 
 import re 
 import random
-import copy
 import sys 
-from asset_retriever import find_closest_reference_image
+import shutil
+import contextvars
+from asset_retriever import find_closest_reference_image, find_closest_reference_images, score_reuse_candidate
+from checkpoint_store import compute_input_hash, load_job_manifest, save_job_manifest
+from reference_cache import get_reference_payload
+from asset_classifier import classify_asset, classify_assets
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
@@ -18,7 +22,8 @@ except ImportError:
     exit(1)
 
 from config import ARTIST_API_CONFIG
-from api_client_utils import create_api_client
+from api_client_utils import create_api_client, call_chat_completion
+from tracing import span, traced, current_span
 
 try:
     client = create_api_client(ARTIST_API_CONFIG, agent_name="Artist Agent")
@@ -33,158 +38,20 @@ except Exception as e:
 
 CHARACTER_BASE_SHEET_DIR = "character_base_sheets"
 
-CHARACTER_SHEET_MAP = {
-    "female_base.png": {
-        "woman", "female", "girl", "beauty", "lady", "waitress",
-        "nurse", "actress", "secretary", "hostess",
-        "gal", "lass", "miss"
-    },
-    "male_base.png": {
-        "man", "male", "boy", "guy", "waiter",
-        "doctor", "actor", "engineer", "policeman",
-        "chap", "lad", "bloke"
-    },
-    "old_woman_base.png": {
-        "old woman", "grandmother", "elderly woman",
-        "granny", "grandma", "senior woman", "mature woman"
-    },
-    "old_man_base.png": {
-        "old man", "grandfather", "elderly man",
-        "grandpa", "granddad", "senior man", "mature man"
-    },
-    "child_base.png": {
-        "child", "kid", "little one", "toddler", "youngster","student"  
-    },
-}
-DEFAULT_CHARACTER_SHEET = "male_base.png"
-
-
+# 材质/颜色预设与角色骨架关键词表已移至 asset_classifier.py (一次扫描完成路由与材质解析)
 
 TILE_SIZE = 16 # 1 个单位格子 = 16 像素
 
-COLOR_PRESETS_BGR = {
-    "red": [140, 150, 190],
-    "white": [210, 220, 225],
-    "blue": [220, 180, 170],
-    "grey": [200, 200, 200],
-    "green": [150, 190, 150],
-    "yellow": [150, 210, 220],
-    "brown": [116, 144, 192],
-    "black": [50, 50, 50],
-    "purple": [180, 150, 170],
-    "beige": [215, 228, 235],
-    "cream": [240, 250, 255],
-    "mint": [220, 230, 210],
-    "sky_blue": [235, 220, 200],
-    "pale_pink": [225, 215, 230],
-    "warm_grey": [210, 215, 220],
-    "light_wood": [180, 200, 220],
-    "terracotta": [190, 200, 220],
-    "sage": [200, 210, 190],
-    "lavender": [230, 210, 220],
-    "grass_green": [120, 200, 120], 
-    "hedge_green": [60, 100, 60],    
-    "water_blue": [230, 200, 100],   
-    "dirt_brown": [116, 144, 192],  
-    "asphalt_grey": [80, 80, 80],   
-    "sand_yellow": [180, 220, 240], 
-    "snow_white": [250, 250, 240],  
-    "rock_grey": [120, 120, 120],   
-    "metal_grey": [180, 180, 180], 
-    "wood_brown": [50, 100, 139],  
-    "glass_blue": [240, 230, 200]   
-}
-
-WALL_TEXTURE_PRESETS = ["brick", "plaster", "noise", "stripes", "hedge", "fence", "glass", "metal", "rock", "books"]
-
-FLOOR_TEXTURE_PRESETS = ["wood", "diamond", "marble", "checkerboard", "mosaic", "concrete", "gravel", "tiles", "carpet", "herringbone", "grass", "water", "dirt", "asphalt", "sand", "snow", "cobble"]
-
+# 检索优先: 素材包中有足够相似的物体 (词 + 尺寸，见 score_reuse_candidate) 时直接复用，不调用生图 API
+ARTIST_REUSE_PACK_ASSETS = True
+REUSE_CONFIDENCE_THRESHOLD = 0.6
+ARTIST_REPORT_FILE = "artist_report.json" # 每个场景的 "复用 vs 生成" 报告 (写在 generated_assets 下)
 
 BLACK_LINE_COLOR = (0, 0, 0)
 FLOATING_LINE_COLOR_LIGHT = np.array([220, 220, 220])
 # ---
 
 
-def parse_description(description: str) -> dict:
-    """
-    解析描述，优先匹配“语义材质”，然后匹配“颜色”。
-    """
-    desc_lower = description.lower()
-    params = {
-        "base_color_bgr": COLOR_PRESETS_BGR["grey"], 
-        "wall_texture": None,
-        "floor_texture": None
-    }
-
-    # --- A. 自然/户外 ---
-    if "grass" in desc_lower or "lawn" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["grass_green"]
-        params["floor_texture"] = "grass"
-        return params 
-    if "hedge" in desc_lower or "bush" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["hedge_green"]
-        params["wall_texture"] = "hedge"
-        return params
-    if "water" in desc_lower or "pond" in desc_lower or "pool" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["water_blue"]
-        params["floor_texture"] = "water"
-        return params
-    if "dirt" in desc_lower or "soil" in desc_lower or "earth" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["dirt_brown"]
-        params["floor_texture"] = "dirt"
-        return params
-    if "sand" in desc_lower or "beach" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["sand_yellow"]
-        params["floor_texture"] = "sand"
-        return params
-    if "snow" in desc_lower or "ice" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["snow_white"]
-        params["floor_texture"] = "snow"
-        return params
-
-    # --- B. 建筑/结构 ---
-    if "fence" in desc_lower or "picket" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["wood_brown"]
-        params["wall_texture"] = "fence"
-        return params
-    if "glass" in desc_lower or "window wall" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["glass_blue"]
-        params["wall_texture"] = "glass"
-        return params
-    if "metal" in desc_lower or "steel" in desc_lower or "iron" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["metal_grey"]
-        params["wall_texture"] = "metal"
-        return params
-    if "rock" in desc_lower or "stone" in desc_lower or "cave" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["rock_grey"]
-        params["wall_texture"] = "rock"
-
-        if "floor" in desc_lower:
-            params["floor_texture"] = "cobble"
-        return params
-    if "asphalt" in desc_lower or "road" in desc_lower or "street" in desc_lower:
-        params["base_color_bgr"] = COLOR_PRESETS_BGR["asphalt_grey"]
-        params["floor_texture"] = "asphalt"
-        return params
-
-    sorted_color_keys = sorted(COLOR_PRESETS_BGR.keys(), key=len, reverse=True)
-    for color_name in sorted_color_keys:
-        pattern = r"\b" + re.escape(color_name) + r"\b"
-        if re.search(pattern, desc_lower):
-            params["base_color_bgr"] = COLOR_PRESETS_BGR[color_name]
-            break
-            
-    for texture in WALL_TEXTURE_PRESETS:
-        if texture in desc_lower:
-            params["wall_texture"] = texture
-            break
-    for texture in FLOOR_TEXTURE_PRESETS:
-        if texture in desc_lower:
-            params["floor_texture"] = texture
-            break
-    return params
-
-
 def add_brick_texture(img_bgr, brick_height=12, mortar_offset=8):
     height, width, _ = img_bgr.shape
     mortar_color_np = (np.array(img_bgr[0,0]) * 0.85).astype(np.uint8)
@@ -635,6 +502,99 @@ GLOBAL_STYLE_ATTRIBUTES = (
 )
 
 
+def _fit_object_size(src_w: int, src_h: int, base_size_tiles: list, visual_size_tiles: list, tile_size: int = 16) -> tuple:
+    """
+    (V7 Logic) 物体贴图的目标像素尺寸 (生成与复用共用)
+    :return: (new_w, new_h)
+    """
+    target_w_guide = visual_size_tiles[0] * tile_size
+    target_h_guide = visual_size_tiles[1] * tile_size
+
+    # 判断逻辑：是高物体还是扁物体？
+    # 如果 visual 高度 > base 高度 -> 高物体 (Tall)
+    # 否则 -> 扁物体/标准物体 (Flat/Standard)
+    is_tall_object = visual_size_tiles[1] > base_size_tiles[1]
+
+    if is_tall_object:
+        # 【高物体逻辑】：固定宽度，高度随动
+        # 目的：确保物体能“坐”在瓦片上，但高度可以很高（如衣柜、路灯）
+        print(f"    > 检测为高物体 (Tall): 固定宽度 {target_w_guide}")
+        scale = target_w_guide / src_w
+        new_w = target_w_guide
+        new_h = int(src_h * scale)
+        # 最小高度保护
+        new_h = max(tile_size, new_h)
+    else:
+        # 【扁物体逻辑】：固定高度，宽度随动
+        # 目的：防止地毯、池塘被压扁。通常扁物体的高度就是瓦片高度。
+        # 如果 base 和 visual 一样大 (Standard)，我们也倾向于用这个，或者用 width。
+        # 你提到：如果一样大，按照宽度。
+        if visual_size_tiles == base_size_tiles:
+            print(f"    > 检测为标准物体 (Standard): 固定宽度 {target_w_guide}")
+            scale = target_w_guide / src_w
+            new_w = target_w_guide
+            new_h = int(src_h * scale)
+            new_h = max(tile_size, new_h)
+        else:
+            print(f"    > 检测为扁物体 (Flat): 固定高度 {target_h_guide}")
+            scale = target_h_guide / src_h
+            new_h = target_h_guide
+            new_w = int(src_w * scale)
+            new_w = max(tile_size, new_w)
+    return (new_w, new_h)
+
+
+def _reuse_pack_asset(asset_id: str, details: dict, save_dir: str, tile_size: int = 16, semantic_tag: str = None):
+    """
+    检索优先模式: 素材包中有置信度足够高 (且类型一致) 的物体时，直接裁边 + 缩放后存为 <asset_id>.png (不调用 API)。
+    尺寸已经吻合时原样复制文件。
+    :param semantic_tag: 规划 properties 中的 semantic_tag，用于类型匹配
+    :return: 复用信息 {"reference", "confidence", "mode"}；不满足阈值或处理失败时返回 None
+    """
+    reference_path, confidence, doc_id = score_reuse_candidate(asset_id, details, semantic_tag=semantic_tag)
+    if reference_path is None or confidence < REUSE_CONFIDENCE_THRESHOLD:
+        return None
+
+    img = cv2.imread(reference_path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        print(f"  - [Reuse] 警告: 无法读取素材 {reference_path}，改为生成。")
+        return None
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    elif img.shape[2] == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+
+    # A. 裁边: 有透明通道按 alpha 裁；整张不透明时按白底处理 (与生成结果的抠图规则一致)
+    alpha = img[:, :, 3]
+    if alpha.min() == 255:
+        gray = cv2.cvtColor(img[:, :, :3], cv2.COLOR_BGR2GRAY)
+        alpha = np.where(gray > 240, 0, 255).astype(np.uint8)
+        img[:, :, 3] = alpha
+    ys, xs = np.nonzero(alpha)
+    if not len(xs):
+        return None
+    x0, x1, y0, y1 = xs.min(), xs.max() + 1, ys.min(), ys.max() + 1
+    cropped = img[y0:y1, x0:x1]
+
+    # B. 缩放 (与生成模式相同的 Tall/Standard/Flat 规则)
+    base_size_tiles = details.get("base_size", [1, 1])
+    visual_size_tiles = details.get("visual_size", base_size_tiles)
+    src_h, src_w = cropped.shape[:2]
+    final_size = _fit_object_size(src_w, src_h, base_size_tiles, visual_size_tiles, tile_size)
+
+    final_file_path = os.path.join(save_dir, f"{asset_id}.png")
+    if final_size == (img.shape[1], img.shape[0]) and cropped.shape[:2] == img.shape[:2] and reference_path.lower().endswith(".png"):
+        shutil.copyfile(reference_path, final_file_path)
+        mode = "copy"
+    else:
+        # 像素画放大用最近邻保持硬边，缩小用 INTER_AREA
+        interpolation = cv2.INTER_NEAREST if final_size[0] >= src_w else cv2.INTER_AREA
+        cv2.imwrite(final_file_path, cv2.resize(cropped, final_size, interpolation=interpolation))
+        mode = "resize"
+    print(f"  - [Reuse] '{asset_id}' 复用素材 {doc_id} (置信度 {confidence:.2f}, {mode})")
+    return {"reference": doc_id, "confidence": confidence, "mode": mode}
+
+
 def generate_real_image(
     asset_id: str, 
     details: dict, 
@@ -661,13 +621,10 @@ def generate_real_image(
     base_size_tiles = details.get("base_size", [1, 1])
     visual_size_tiles = details.get("visual_size", base_size_tiles)
     
-    # 目标参考尺寸 (像素)
-    target_w_guide = visual_size_tiles[0] * tile_size
-    target_h_guide = visual_size_tiles[1] * tile_size
-
     # --- 3. 检索参考图 ---
     print(f"  - [Retriever] 正在为 '{asset_id}' 检索参考图...")
-    reference_image_path = find_closest_reference_image(asset_id, details)
+    with span("retrieve_reference", asset_id=asset_id):
+        reference_image_path = find_closest_reference_image(asset_id, details)
     
     # --- 4. 构建 Prompt (参考生成模式) ---
     # 这是一个通用的 Prompt，无论有没有参考图都能用
@@ -692,13 +649,13 @@ def generate_real_image(
     if reference_image_path:
         print(f"  - [Retriever] 注入参考图: {os.path.basename(reference_image_path)}")
         try:
-            with open(reference_image_path, "rb") as img_file:
-                b64_image = base64.b64encode(img_file.read()).decode('utf-8')
+            # 规范化 + 缩小后的载荷 (按内容哈希缓存，同一参考图只编码一次)
+            reference_url = get_reference_payload(reference_image_path)
             
             # 添加图像到 Prompt
             messages[1]["content"].append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{b64_image}"}
+                "image_url": {"url": reference_url}
             })
             
             # 添加具体的参考指令
@@ -726,7 +683,9 @@ def generate_real_image(
             print(f"  - [AI-Gen] 正在生成 (尝试 {attempt+1}/{MAX_RETRIES})...")
             start_time = time.time()
             
-            completion = client.chat.completions.create(
+            completion = call_chat_completion(
+                client, "Artist Agent",
+                trace_attrs={"asset_id": asset_id, "attempt": attempt + 1},
                 model=ARTIST_MODEL_NAME,
                 messages=messages
             )
@@ -767,43 +726,7 @@ def generate_real_image(
                 
                 # B. 智能缩放 (V7 Logic)
                 src_h, src_w = cropped.shape[:2]
-                
-                # 判断逻辑：是高物体还是扁物体？
-                # 如果 visual 高度 > base 高度 -> 高物体 (Tall)
-                # 否则 -> 扁物体/标准物体 (Flat/Standard)
-                is_tall_object = visual_size_tiles[1] > base_size_tiles[1]
-                
-                final_size = (0, 0)
-                
-                if is_tall_object:
-                    # 【高物体逻辑】：固定宽度，高度随动
-                    # 目的：确保物体能“坐”在瓦片上，但高度可以很高（如衣柜、路灯）
-                    print(f"    > 检测为高物体 (Tall): 固定宽度 {target_w_guide}")
-                    scale = target_w_guide / src_w
-                    new_w = target_w_guide
-                    new_h = int(src_h * scale)
-                    # 最小高度保护
-                    new_h = max(tile_size, new_h)
-                    final_size = (new_w, new_h)
-                else:
-                    # 【扁物体逻辑】：固定高度，宽度随动
-                    # 目的：防止地毯、池塘被压扁。通常扁物体的高度就是瓦片高度。
-                    # 如果 base 和 visual 一样大 (Standard)，我们也倾向于用这个，或者用 width。
-                    # 你提到：如果一样大，按照宽度。
-                    if visual_size_tiles == base_size_tiles:
-                        print(f"    > 检测为标准物体 (Standard): 固定宽度 {target_w_guide}")
-                        scale = target_w_guide / src_w
-                        new_w = target_w_guide
-                        new_h = int(src_h * scale)
-                        new_h = max(tile_size, new_h)
-                        final_size = (new_w, new_h)
-                    else:
-                        print(f"    > 检测为扁物体 (Flat): 固定高度 {target_h_guide}")
-                        scale = target_h_guide / src_h
-                        new_h = target_h_guide
-                        new_w = int(src_w * scale)
-                        new_w = max(tile_size, new_w)
-                        final_size = (new_w, new_h)
+                final_size = _fit_object_size(src_w, src_h, base_size_tiles, visual_size_tiles, tile_size)
 
                 # C. 执行缩放并保存
                 print(f"    > 缩放: {src_w}x{src_h} -> {final_size[0]}x{final_size[1]}")
@@ -896,8 +819,8 @@ def generate_character_sprite_sheet(
         return False
         
     try:
-        with open(base_image_path, "rb") as img_file:
-            b64_image_data = base64.b64encode(img_file.read()).decode('utf-8')
+        # 骨架图不缩放 (输出必须与骨架同尺寸)，只复用已编码的载荷
+        base_image_url = get_reference_payload(base_image_path, max_side=None)
         print(f"  - 成功加载基础参考图: {os.path.basename(base_image_path)}")
     except Exception as e:
         print(f"  - !!! 错误: 加载基础参考图失败: {e}")
@@ -923,7 +846,7 @@ def generate_character_sprite_sheet(
             {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/png;base64,{b64_image_data}"
+                    "url": base_image_url
                 }
             }
         ]}
@@ -940,7 +863,9 @@ def generate_character_sprite_sheet(
             print(f"  - 正在尝试第 {attempt + 1}/{max_retries} 次 API 调用...")
             start_time = time.time()
             
-            completion = client.chat.completions.create(
+            completion = call_chat_completion(
+                client, "Artist Agent",
+                trace_attrs={"asset_id": asset_id_for_log, "attempt": attempt + 1},
                 model=model_name,
                 messages=messages
             )
@@ -992,26 +917,30 @@ def generate_character_sprite_sheet(
     return False # <-- 失败
 
 
-def process_single_asset(asset_id, details, original_properties, save_dir, character_base_dir, client, artist_model_name):
+def process_single_asset(asset_id, details, original_properties, save_dir, character_base_dir, client, artist_model_name, classification=None):
     """
     [多线程工人函数] 处理单个资产的生成逻辑。
-    返回: (原始ID, 生成的Assets字典, 生成的Properties字典, 需要标记删除的墙壁ID)
+    classification: asset_classifier 的分类结果 (路由类别 / 材质 / 角色骨架)；不传则现场分类。
+    返回: (原始ID, 生成的Assets字典, 生成的Properties字典, 需要标记删除的墙壁ID, 来源记录)
+    来源记录: {"source": "procedural" / "reused" / "generated" / "cached" / "skipped" / "failed", ...}
     """
-    asset_type = details.get("type")
-    description = details.get("description", "").lower()
+    if classification is None:
+        classification = classify_asset(asset_id, details)
+    kind = classification["kind"]
     
     # 本次任务产生的结果容器
     generated_assets = {}     
     generated_props = {}      
     wall_id_to_delete = None  # 仅针对程序化墙壁
+    source = {"source": "skipped"}
 
     try:
         # --- 逻辑 A: 程序化墙壁 (Procedural Wall) ---
-        if (asset_type == "tile" and "wall" in description) or (asset_id.startswith("wall_") and "clock" not in asset_id):
+        if kind == "wall":
             print(f" [Thread] 🧱 处理墙壁: '{asset_id}'")
             wall_id_to_delete = asset_id # 标记这个ID稍后需要在 layout 中被替换
             
-            params = parse_description(description)
+            params = classification["material"]
             asset_id_top = f"{asset_id}_top"
             asset_id_side = f"{asset_id}_side"
             
@@ -1031,24 +960,22 @@ def process_single_asset(asset_id, details, original_properties, save_dir, chara
             _generate_procedural_wall_tile(side_width_px, side_height_px, params, False, path_side)
 
             # 构造返回数据
-            new_top = copy.deepcopy(details)
-            new_top["description"] = f"Top-Down view of {asset_id}"
-            
-            new_side = copy.deepcopy(details)
-            new_side["description"] = f"Side-view of {asset_id}"
-            new_side["visual_size"] = top_size_tiles
+            # 写时复制: 只替换改动的字段，其余字段与原资产共享 (下游不会原地修改)
+            new_top = {**details, "description": f"Top-Down view of {asset_id}"}
+            new_side = {**details, "description": f"Side-view of {asset_id}", "visual_size": top_size_tiles}
 
             generated_assets[asset_id_top] = new_top
             generated_assets[asset_id_side] = new_side
             
             if asset_id in original_properties:
-                generated_props[asset_id_top] = copy.deepcopy(original_properties[asset_id])
-                generated_props[asset_id_side] = copy.deepcopy(original_properties[asset_id])
+                generated_props[asset_id_top] = dict(original_properties[asset_id])
+                generated_props[asset_id_side] = dict(original_properties[asset_id])
+            source = {"source": "procedural"}
 
         # --- 逻辑 B: 程序化地板 (Procedural Floor) ---
-        elif (asset_type == "tile" and "floor" in description) or (asset_id.startswith("floor_") and "clock" not in asset_id):
+        elif kind == "floor":
             print(f" [Thread] 🟫 处理地板: '{asset_id}'")
-            params = parse_description(description)
+            params = classification["material"]
             floor_size_tiles = details.get("visual_size", [2, 2])
             floor_width_px = floor_size_tiles[0] * TILE_SIZE
             floor_height_px = floor_size_tiles[1] * TILE_SIZE
@@ -1056,18 +983,26 @@ def process_single_asset(asset_id, details, original_properties, save_dir, chara
             path_floor = os.path.join(save_dir, f"{asset_id}.png")
             # 地板生成极快，通常不跳过，若想跳过可在此加 os.path.exists 判断
             _generate_procedural_floor_tile(floor_width_px, floor_height_px, params, save_path=path_floor)
+            source = {"source": "procedural"}
             
             generated_assets[asset_id] = details
             if asset_id in original_properties:
                 generated_props[asset_id] = original_properties[asset_id]
 
         # --- 逻辑 C: AI 物体 (Object) ---
-        elif asset_type == "object":
+        elif kind == "object":
             final_object_path = os.path.join(save_dir, f"{asset_id}.png")
             if os.path.exists(final_object_path):
                 print(f" [Thread] ⏩ [Cache] 物体 '{asset_id}' 已存在，跳过。")
+                source = {"source": "cached"}
+            elif ARTIST_REUSE_PACK_ASSETS and (reuse := _reuse_pack_asset(
+                    asset_id, details, save_dir, tile_size=TILE_SIZE,
+                    semantic_tag=original_properties.get(asset_id, {}).get("semantic_tag"))):
+                print(f" [Thread] ♻️ [Reuse] 物体 '{asset_id}' 直接复用素材包，跳过生成。")
+                source = {"source": "reused", **reuse}
             else:
                 print(f" [Thread] 🛋️ [AI-Gen] 正在生成物体: '{asset_id}'...")
+                source = {"source": "generated"}
                 # 调用生成函数 (注意：generate_real_image 内部包含重试逻辑)
                 generate_real_image(
                     asset_id, 
@@ -1082,27 +1017,18 @@ def process_single_asset(asset_id, details, original_properties, save_dir, chara
                 generated_props[asset_id] = original_properties[asset_id]
 
         # --- 逻辑 D: AI 角色 (NPC/Agent) ---
-        elif asset_type == "npc" or asset_type == "agent":
+        elif kind == "character":
             final_save_path = os.path.join(save_dir, f"{asset_id}.png")
             if os.path.exists(final_save_path):
                 print(f" [Thread] ⏩ [Cache] 角色 '{asset_id}' 已存在，跳过。")
+                source = {"source": "cached"}
             else:
                 print(f" [Thread] 👤 [AI-Edit] 正在生成角色: '{asset_id}'...")
+                source = {"source": "generated"}
                 description_prompt = details.get("description", "一个普通人")
                 
-                # --- 匹配基础骨架 ---
-                base_sheet_name = DEFAULT_CHARACTER_SHEET
-                desc_lower = description_prompt.lower()
-                found_sheet = False
-                for sheet_name, keywords in CHARACTER_SHEET_MAP.items():
-                    for keyword in keywords:
-                        if keyword in desc_lower:
-                            base_sheet_name = sheet_name
-                            found_sheet = True
-                            break
-                    if found_sheet: break
-                
-                base_sheet_path = os.path.join(character_base_dir, base_sheet_name)
+                # --- 匹配基础骨架 (分类时已按关键词选好) ---
+                base_sheet_path = os.path.join(character_base_dir, classification["base_sheet"])
                 
                 # 调用生成函数
                 generate_character_sprite_sheet(
@@ -1129,15 +1055,47 @@ def process_single_asset(asset_id, details, original_properties, save_dir, chara
         print(f"!!! [Thread Error] 处理 '{asset_id}' 时发生异常: {e}")
         # 即使出错，也要把原始信息填回去，防止 JSON 缺失
         generated_assets[asset_id] = details
-        
-    return asset_id, generated_assets, generated_props, wall_id_to_delete
+        source = {"source": "failed"}
+
+    return asset_id, generated_assets, generated_props, wall_id_to_delete, source
+
 
+def _traced_asset_job(asset_id, details, *args):
+    """ 为单个资产任务记录一个 "asset" span (在线程池中运行) """
+    with span("asset", asset_id=asset_id, kind=details.get("type")) as asset_span:
+        result = process_single_asset(asset_id, details, *args)
+        asset_span.set(source=result[4]["source"])
+        return result
 
-def run_artist_agent(scene_plan: dict, godot_project_path: str) -> dict:
+
+def _save_artist_report(save_dir: str, asset_sources: dict) -> dict:
+    """
+    写出本场景的 "复用 vs 生成" 报告: 每个资产的来源 (复用时附素材 ID 与置信度) + 各来源计数
+    """
+    counts = {}
+    for record in asset_sources.values():
+        counts[record["source"]] = counts.get(record["source"], 0) + 1
+    report = {
+        "reuse_threshold": REUSE_CONFIDENCE_THRESHOLD,
+        "counts": counts,
+        "assets": dict(sorted(asset_sources.items()))
+    }
+    with open(os.path.join(save_dir, ARTIST_REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    summary = ", ".join(f"{k} {v}" for k, v in sorted(counts.items()))
+    print(f"[Artist Agent] 📊 资产来源: {summary} (报告: {ARTIST_REPORT_FILE})")
+    return report
+
+
+@traced("artist")
+def run_artist_agent(scene_plan: dict, godot_project_path: str, character_base_dir: str = None) -> dict:
     """
     (V15 多线程版) 统一资产生成入口
     - 墙壁/地板 -> OpenCV 并行生成
     - 物体/NPC -> OpenAI 并行生成
+
+    :param character_base_dir: (可选) 角色基础骨架目录。批量生成时每个场景的输出目录
+                               不是 Godot 项目本身，需要显式指向项目中的骨架目录。
     """
     print(f"\n[Artist Agent] (V15 Multi-threaded) 🚀 开始并行资产生成...")
     
@@ -1147,40 +1105,82 @@ def run_artist_agent(scene_plan: dict, godot_project_path: str) -> dict:
         os.makedirs(save_dir)
         print(f" ➡️ 创建文件夹: {save_dir}")
 
-    character_base_dir = os.path.join(godot_project_path, CHARACTER_BASE_SHEET_DIR)
+    if character_base_dir is None:
+        character_base_dir = os.path.join(godot_project_path, CHARACTER_BASE_SHEET_DIR)
     
-    # 准备数据副本
-    processed_plan = copy.deepcopy(scene_plan)
-    original_assets = processed_plan.get("assets", {})
-    original_properties = processed_plan.get("properties", {})
+    # 写时复制: 输入规划只读，只有 assets / properties / 被重写的 wall_layer 条目是新对象，
+    # 其余部分与输入 (以及场景版本库中的上一个版本) 共享，不再整份 deepcopy
+    processed_plan = dict(scene_plan)
+    original_assets = scene_plan.get("assets", {})
+    original_properties = scene_plan.get("properties", {})
     
     # 结果容器 (将在主线程汇总)
     new_assets = {}
     new_properties = {}
     assets_to_delete = [] # 存储需要被重写的墙壁 ID
+    asset_sources = {}    # asset_id -> 来源记录 (写入复用报告)
 
     # --- 2. 配置线程池 ---
     # 建议设置 5-8 个线程。太高可能导致 OpenAI 报 429 Rate Limit 错误。
     MAX_WORKERS = 5 
     tasks = []
 
+    # --- 断点续跑: 读取作业清单，输入未变且文件齐全的资产直接复用 ---
+    manifest = load_job_manifest("artist")
+    job_hashes = {}
+    reused_count = 0
+
+    # 整个场景的参考图一次性批量检索 (工人线程中的检索直接命中缓存)
+    # 整个规划的资产一次性分类 (路由 / 材质 / 角色骨架)，结果随任务交给工人线程
+    classifications = classify_assets(original_assets)
+    object_assets = {aid: d for aid, d in original_assets.items() if classifications[aid]["kind"] == "object"}
+    if object_assets:
+        with span("retrieve_reference.batch", assets=len(object_assets)):
+            find_closest_reference_images(object_assets)
+
     print(f"--- 正在提交任务到线程池 (Max Workers: {MAX_WORKERS}) ---")
 
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         # 提交所有任务
         for asset_id, details in original_assets.items():
+            job_hash = compute_input_hash(asset_id, details, original_properties.get(asset_id), ARTIST_MODEL_NAME)
+            job_hashes[asset_id] = job_hash
+
+            entry = manifest.get(asset_id)
+            if entry and entry.get("job_hash") == job_hash and all(os.path.exists(p) for p in entry.get("files", [])):
+                new_assets.update(entry["assets"])
+                new_properties.update(entry["properties"])
+                if entry.get("wall_del"):
+                    assets_to_delete.append(entry["wall_del"])
+                asset_sources[asset_id] = {"source": "checkpoint"}
+                reused_count += 1
+                continue
+
+            if entry and entry.get("job_hash") != job_hash:
+                # 输入已变化：删除旧贴图，防止下面的 "已存在则跳过" 缓存误用过期文件
+                for stale_path in entry.get("files", []):
+                    if os.path.exists(stale_path):
+                        os.remove(stale_path)
+
+            # 每个任务复制一份上下文，使 "asset" span 挂在 "artist" span 之下
             future = executor.submit(
-                process_single_asset,
+                contextvars.copy_context().run,
+                _traced_asset_job,
                 asset_id,
                 details,
                 original_properties,
                 save_dir,
                 character_base_dir,
                 client,            # 传递全局 client
-                ARTIST_MODEL_NAME  # 传递全局 model name
+                ARTIST_MODEL_NAME, # 传递全局 model name
+                classifications[asset_id]
             )
             tasks.append(future)
         
+        current_span().set(assets_reused=reused_count, assets_submitted=len(tasks))
+        if reused_count:
+            print(f"--- [Checkpoint] ⏩ {reused_count} 个资产输入未变，直接复用已生成的贴图。 ---")
+
         # 收集结果 (as_completed 会在某个任务一完成就立即返回)
         total_tasks = len(tasks)
         completed_count = 0
@@ -1189,13 +1189,26 @@ def run_artist_agent(scene_plan: dict, godot_project_path: str) -> dict:
             completed_count += 1
             try:
                 # 获取工人函数的返回值
-                _, gen_assets, gen_props, wall_del = future.result()
+                done_id, gen_assets, gen_props, wall_del, source = future.result()
                 
                 # 【主线程汇聚数据】
+                asset_sources[done_id] = source
                 new_assets.update(gen_assets)
                 new_properties.update(gen_props)
                 if wall_del:
                     assets_to_delete.append(wall_del)
+
+                # 只有所有贴图都真实落盘，才记为已完成 (生成失败的资产下次会重跑)
+                output_files = [os.path.join(save_dir, f"{gen_id}.png") for gen_id in gen_assets]
+                if all(os.path.exists(p) for p in output_files):
+                    manifest[done_id] = {
+                        "job_hash": job_hashes[done_id],
+                        "files": output_files,
+                        "assets": gen_assets,
+                        "properties": gen_props,
+                        "wall_del": wall_del
+                    }
+                    save_job_manifest("artist", manifest)
                 
                 # 打印简略进度条
                 print(f" ✅ 进度: [{completed_count}/{total_tasks}]", end="\r")
@@ -1204,15 +1217,18 @@ def run_artist_agent(scene_plan: dict, godot_project_path: str) -> dict:
                 print(f"\n ❌ 任务结果获取失败: {e}")
 
     print(f"\n--- 所有线程任务执行完毕。 ---")
+    report = _save_artist_report(save_dir, asset_sources)
+    current_span().set(**{f"source_{k}": v for k, v in report["counts"].items()})
 
     # --- 3. JSON 自动重写 (Layout 修正) ---
     # (这部分逻辑必须在所有资产生成完后，在主线程串行执行)
     print("[Artist Agent] ➡️ [JSON] 正在重写 wall_layer 布局...")
 
-    wall_layer_cmds = processed_plan.get("layout", {}).get("wall_layer", [])
+    wall_layer_cmds = scene_plan.get("layout", {}).get("wall_layer", [])
     if not wall_layer_cmds:
         print("   (没有检测到 wall_layer，跳过布局重写)")
     
+    rewritten_walls = []
     for cmd in wall_layer_cmds:
         original_id = cmd.get("asset_id")
         
@@ -1223,15 +1239,19 @@ def run_artist_agent(scene_plan: dict, godot_project_path: str) -> dict:
             
             # V15 逻辑: 宽的(w > h)是 "Top", 窄的(h > w)是 "Side"
             if w > h:
-                cmd["asset_id"] = f"{original_id}_top"
+                cmd = {**cmd, "asset_id": f"{original_id}_top"}
                 # print(f"   - 重定向 '{original_id}' -> '{cmd['asset_id']}' (Top)")
             elif h > w:
-                cmd["asset_id"] = f"{original_id}_side"
+                cmd = {**cmd, "asset_id": f"{original_id}_side"}
                 # print(f"   - 重定向 '{original_id}' -> '{cmd['asset_id']}' (Side)")
             else:
                 # (边缘情况) 1x1 的墙, 默认为 _top
-                cmd["asset_id"] = f"{original_id}_top"
+                cmd = {**cmd, "asset_id": f"{original_id}_top"}
                 # print(f"   - 重定向 '{original_id}' -> '{cmd['asset_id']}' (1x1 Default)")
+        rewritten_walls.append(cmd)
+
+    if wall_layer_cmds:
+        processed_plan["layout"] = {**scene_plan["layout"], "wall_layer": rewritten_walls}
     
     # 4. 更新 JSON 对象并返回
     processed_plan["assets"] = new_assets
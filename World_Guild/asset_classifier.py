@@ -0,0 +1,449 @@
+# 文件名: asset_classifier.py
+import sys
+import time
+
+# ===================================================================
+# 资产关键词分类器 (Asset Classifier)
+# ===================================================================
+# 资产路由原本分散在各处的子串扫描里:
+#   - process_single_asset 用 "wall" in description / "floor" in description 选择生成方式；
+#   - parse_description 走一长串 if，并且每次调用都为每种颜色重新拼 \b{color}\b 正则；
+#   - 角色骨架逐个关键词遍历 CHARACTER_SHEET_MAP；
+#   - _enforce_hard_constraints 再扫一遍描述找 "floor"。
+# 这里把所有关键词一次性编译成 Aho–Corasick 自动机，对 (小写) 描述只扫描一遍，
+# 从命中集合中按原有优先级一次得出: 路由类别 (kind)、材质参数、颜色、角色骨架。
+# 判定规则与原实现逐条一致 (子串匹配、颜色要求单词边界、各组的先后顺序)，
+# 运行 python asset_classifier.py 会用随机描述与原实现逐一比对，并给出吞吐量对比。
+
+CHARACTER_SHEET_MAP = {
+    "female_base.png": {
+        "woman", "female", "girl", "beauty", "lady", "waitress",
+        "nurse", "actress", "secretary", "hostess",
+        "gal", "lass", "miss"
+    },
+    "male_base.png": {
+        "man", "male", "boy", "guy", "waiter",
+        "doctor", "actor", "engineer", "policeman",
+        "chap", "lad", "bloke"
+    },
+    "old_woman_base.png": {
+        "old woman", "grandmother", "elderly woman",
+        "granny", "grandma", "senior woman", "mature woman"
+    },
+    "old_man_base.png": {
+        "old man", "grandfather", "elderly man",
+        "grandpa", "granddad", "senior man", "mature man"
+    },
+    "child_base.png": {
+        "child", "kid", "little one", "toddler", "youngster","student"
+    },
+}
+DEFAULT_CHARACTER_SHEET = "male_base.png"
+
+COLOR_PRESETS_BGR = {
+    "red": [140, 150, 190],
+    "white": [210, 220, 225],
+    "blue": [220, 180, 170],
+    "grey": [200, 200, 200],
+    "green": [150, 190, 150],
+    "yellow": [150, 210, 220],
+    "brown": [116, 144, 192],
+    "black": [50, 50, 50],
+    "purple": [180, 150, 170],
+    "beige": [215, 228, 235],
+    "cream": [240, 250, 255],
+    "mint": [220, 230, 210],
+    "sky_blue": [235, 220, 200],
+    "pale_pink": [225, 215, 230],
+    "warm_grey": [210, 215, 220],
+    "light_wood": [180, 200, 220],
+    "terracotta": [190, 200, 220],
+    "sage": [200, 210, 190],
+    "lavender": [230, 210, 220],
+    "grass_green": [120, 200, 120],
+    "hedge_green": [60, 100, 60],
+    "water_blue": [230, 200, 100],
+    "dirt_brown": [116, 144, 192],
+    "asphalt_grey": [80, 80, 80],
+    "sand_yellow": [180, 220, 240],
+    "snow_white": [250, 250, 240],
+    "rock_grey": [120, 120, 120],
+    "metal_grey": [180, 180, 180],
+    "wood_brown": [50, 100, 139],
+    "glass_blue": [240, 230, 200]
+}
+
+WALL_TEXTURE_PRESETS = ["brick", "plaster", "noise", "stripes", "hedge", "fence", "glass", "metal", "rock", "books"]
+
+FLOOR_TEXTURE_PRESETS = ["wood", "diamond", "marble", "checkerboard", "mosaic", "concrete", "gravel", "tiles", "carpet", "herringbone", "grass", "water", "dirt", "asphalt", "sand", "snow", "cobble"]
+
+# 语义材质 (按优先级): (关键词, 颜色预设, 墙面纹理, 地面纹理)
+# 命中第一组即返回，不再看颜色与纹理预设。岩石类描述里同时有 "floor" 时地面用鹅卵石。
+MATERIAL_RULES = [
+    # --- A. 自然/户外 ---
+    (("grass", "lawn"), "grass_green", None, "grass"),
+    (("hedge", "bush"), "hedge_green", "hedge", None),
+    (("water", "pond", "pool"), "water_blue", None, "water"),
+    (("dirt", "soil", "earth"), "dirt_brown", None, "dirt"),
+    (("sand", "beach"), "sand_yellow", None, "sand"),
+    (("snow", "ice"), "snow_white", None, "snow"),
+    # --- B. 建筑/结构 ---
+    (("fence", "picket"), "wood_brown", "fence", None),
+    (("glass", "window wall"), "glass_blue", "glass", None),
+    (("metal", "steel", "iron"), "metal_grey", "metal", None),
+    (("rock", "stone", "cave"), "rock_grey", "rock", None),
+    (("asphalt", "road", "street"), "asphalt_grey", None, "asphalt"),
+]
+ROCK_FLOOR_TEXTURE = "cobble"
+
+DEFAULT_COLOR = "grey"
+# 颜色按名称长度从长到短匹配 (长度相同保持定义顺序)，"sky_blue" 优先于 "blue"
+COLOR_PRIORITY = sorted(COLOR_PRESETS_BGR.keys(), key=len, reverse=True)
+
+
+# ===================================================================
+# Aho–Corasick 自动机
+# ===================================================================
+
+class KeywordAutomaton:
+    """
+    多模式子串匹配: 构建一次，之后每段文本只扫描一遍。
+    find_all(text) -> { 关键词: [起始位置, ...] } (包含重叠命中，e.g., "woman" 同时命中 "man")
+    """
+
+    def __init__(self, keywords):
+        self.keywords = sorted(set(keywords))
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for kw_index, keyword in enumerate(self.keywords):
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(kw_index)
+
+        # BFS 计算失败指针，并把失败链上的输出合并到当前状态；
+        # 同时把失败跳转展开成完整的状态转移表 (DFA)，扫描时每个字符只查一次字典
+        self._delta = [dict(self._goto[0])] + [None] * (len(self._goto) - 1)
+        queue = list(self._goto[0].values())
+        while queue:
+            next_queue = []
+            for state in queue:
+                if state != 0 and self._delta[state] is None:
+                    self._delta[state] = {**self._delta[self._fail[state]], **self._goto[state]}
+                for ch, nxt in self._goto[state].items():
+                    fail = self._fail[state]
+                    while fail and ch not in self._goto[fail]:
+                        fail = self._fail[fail]
+                    self._fail[nxt] = self._goto[fail].get(ch, 0)
+                    self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                    next_queue.append(nxt)
+            queue = next_queue
+        self._out = [[(kw_index, len(self.keywords[kw_index])) for kw_index in out] for out in self._out]
+
+    def find_all(self, text: str) -> dict:
+        delta, out, keywords = self._delta, self._out, self.keywords
+        hits = {}
+        state = 0
+        for pos, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if out[state]:
+                for kw_index, length in out[state]:
+                    hits.setdefault(keywords[kw_index], []).append(pos - length + 1)
+        return hits
+
+
+def _is_word_char(ch: str) -> bool:
+    """ 与正则 \\w 一致: Unicode 字母数字或下划线 """
+    return ch.isalnum() or ch == "_"
+
+
+def _has_word_match(text: str, keyword: str, starts: list) -> bool:
+    """ 关键词的某次出现两侧都是单词边界 (等价于 re.search(r"\\b" + keyword + r"\\b")) """
+    for start in starts:
+        end = start + len(keyword)
+        if (start == 0 or not _is_word_char(text[start - 1])) and (end == len(text) or not _is_word_char(text[end])):
+            return True
+    return False
+
+
+_ROUTING_KEYWORDS = ("wall", "floor")
+
+# 关键词 -> 优先级 (数值越小越优先)，判定时只遍历本次命中的关键词
+_MATERIAL_RANK = {kw: i for i, rule in reversed(list(enumerate(MATERIAL_RULES))) for kw in rule[0]}
+_COLOR_RANK = {name: i for i, name in enumerate(COLOR_PRIORITY)}
+_WALL_RANK = {name: i for i, name in enumerate(WALL_TEXTURE_PRESETS)}
+_FLOOR_RANK = {name: i for i, name in enumerate(FLOOR_TEXTURE_PRESETS)}
+_SHEET_RANK = {kw: i for i, keywords in reversed(list(enumerate(CHARACTER_SHEET_MAP.values()))) for kw in keywords}
+_SHEET_NAMES = list(CHARACTER_SHEET_MAP)
+
+_automaton = KeywordAutomaton(
+    [kw for rule in MATERIAL_RULES for kw in rule[0]]
+    + list(COLOR_PRESETS_BGR)
+    + WALL_TEXTURE_PRESETS
+    + FLOOR_TEXTURE_PRESETS
+    + [kw for keywords in CHARACTER_SHEET_MAP.values() for kw in keywords]
+    + list(_ROUTING_KEYWORDS)
+)
+
+
+# ===================================================================
+# 判定 (从命中集合按原有优先级得出结果)
+# ===================================================================
+
+def _material_from_hits(text: str, hits: dict) -> dict:
+    """ 与原 parse_description 相同的规则，返回 {"base_color_bgr", "wall_texture", "floor_texture", "color"} """
+    rule_index = min((_MATERIAL_RANK[kw] for kw in hits if kw in _MATERIAL_RANK), default=None)
+    if rule_index is not None:
+        _, color, wall_texture, floor_texture = MATERIAL_RULES[rule_index]
+        if wall_texture == "rock" and "floor" in hits:
+            floor_texture = ROCK_FLOOR_TEXTURE
+        return {"base_color_bgr": COLOR_PRESETS_BGR[color], "wall_texture": wall_texture,
+                "floor_texture": floor_texture, "color": color}
+
+    color = DEFAULT_COLOR
+    for color_name in sorted((kw for kw in hits if kw in _COLOR_RANK), key=_COLOR_RANK.get):
+        if _has_word_match(text, color_name, hits[color_name]):
+            color = color_name
+            break
+    return {
+        "base_color_bgr": COLOR_PRESETS_BGR[color],
+        "wall_texture": min((kw for kw in hits if kw in _WALL_RANK), key=_WALL_RANK.get, default=None),
+        "floor_texture": min((kw for kw in hits if kw in _FLOOR_RANK), key=_FLOOR_RANK.get, default=None),
+        "color": color
+    }
+
+
+def _base_sheet_from_hits(hits: dict) -> str:
+    sheet_index = min((_SHEET_RANK[kw] for kw in hits if kw in _SHEET_RANK), default=None)
+    return DEFAULT_CHARACTER_SHEET if sheet_index is None else _SHEET_NAMES[sheet_index]
+
+
+def _is_procedural(asset_id: str, prefix: str) -> bool:
+    return asset_id.startswith(prefix) and "clock" not in asset_id
+
+
+def classify_asset(asset_id: str, details: dict) -> dict:
+    """
+    对一个资产的描述只扫描一遍，返回:
+      kind:       "wall" / "floor" (程序化贴图) / "object" / "character" / "other" —— 与 Artist 的路由一致
+      floor_tile: type 为 tile 且 ID 或描述含 "floor" (地板尺寸硬性规则)
+      material:   程序化贴图参数 {"base_color_bgr", "wall_texture", "floor_texture"}
+      color:      材质所用的颜色预设名
+      base_sheet: 角色骨架文件名 (仅 character)
+    """
+    asset_type = details.get("type")
+    text = details.get("description", "").lower()
+    hits = _automaton.find_all(text)
+
+    if (asset_type == "tile" and "wall" in hits) or _is_procedural(asset_id, "wall_"):
+        kind = "wall"
+    elif (asset_type == "tile" and "floor" in hits) or _is_procedural(asset_id, "floor_"):
+        kind = "floor"
+    elif asset_type == "object":
+        kind = "object"
+    elif asset_type in ("npc", "agent"):
+        kind = "character"
+    else:
+        kind = "other"
+
+    material = _material_from_hits(text, hits)
+    return {
+        "kind": kind,
+        "floor_tile": asset_type == "tile" and ("floor" in asset_id.lower() or "floor" in hits),
+        "color": material.pop("color"),
+        "material": material,
+        "base_sheet": _base_sheet_from_hits(hits) if kind == "character" else None
+    }
+
+
+def classify_assets(assets: dict) -> dict:
+    """ 批量接口: { asset_id: classify_asset(...) }，整个规划的资产一次分类 """
+    return {asset_id: classify_asset(asset_id, details) for asset_id, details in assets.items()}
+
+
+def parse_material(description: str) -> dict:
+    """ 只要材质参数 (原 parse_description 的替代) """
+    text = description.lower()
+    material = _material_from_hits(text, _automaton.find_all(text))
+    material.pop("color")
+    return material
+
+
+def select_base_sheet(description: str) -> str:
+    """ 只要角色骨架 (原 CHARACTER_SHEET_MAP 逐词遍历的替代) """
+    return _base_sheet_from_hits(_automaton.find_all(description.lower()))
+
+
+# ===================================================================
+# 自检: 与原实现逐一比对 + 吞吐量
+# ===================================================================
+if __name__ == "__main__":
+    import re
+    import random
+
+    # --- 原实现 (逐字照搬，作为参照) ---
+    def legacy_parse_description(description: str) -> dict:
+        """
+        解析描述，优先匹配“语义材质”，然后匹配“颜色”。
+        """
+        desc_lower = description.lower()
+        params = {
+            "base_color_bgr": COLOR_PRESETS_BGR["grey"], 
+            "wall_texture": None,
+            "floor_texture": None
+        }
+
+        # --- A. 自然/户外 ---
+        if "grass" in desc_lower or "lawn" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["grass_green"]
+            params["floor_texture"] = "grass"
+            return params 
+        if "hedge" in desc_lower or "bush" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["hedge_green"]
+            params["wall_texture"] = "hedge"
+            return params
+        if "water" in desc_lower or "pond" in desc_lower or "pool" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["water_blue"]
+            params["floor_texture"] = "water"
+            return params
+        if "dirt" in desc_lower or "soil" in desc_lower or "earth" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["dirt_brown"]
+            params["floor_texture"] = "dirt"
+            return params
+        if "sand" in desc_lower or "beach" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["sand_yellow"]
+            params["floor_texture"] = "sand"
+            return params
+        if "snow" in desc_lower or "ice" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["snow_white"]
+            params["floor_texture"] = "snow"
+            return params
+
+        # --- B. 建筑/结构 ---
+        if "fence" in desc_lower or "picket" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["wood_brown"]
+            params["wall_texture"] = "fence"
+            return params
+        if "glass" in desc_lower or "window wall" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["glass_blue"]
+            params["wall_texture"] = "glass"
+            return params
+        if "metal" in desc_lower or "steel" in desc_lower or "iron" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["metal_grey"]
+            params["wall_texture"] = "metal"
+            return params
+        if "rock" in desc_lower or "stone" in desc_lower or "cave" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["rock_grey"]
+            params["wall_texture"] = "rock"
+
+            if "floor" in desc_lower:
+                params["floor_texture"] = "cobble"
+            return params
+        if "asphalt" in desc_lower or "road" in desc_lower or "street" in desc_lower:
+            params["base_color_bgr"] = COLOR_PRESETS_BGR["asphalt_grey"]
+            params["floor_texture"] = "asphalt"
+            return params
+
+        sorted_color_keys = sorted(COLOR_PRESETS_BGR.keys(), key=len, reverse=True)
+        for color_name in sorted_color_keys:
+            pattern = r"\b" + re.escape(color_name) + r"\b"
+            if re.search(pattern, desc_lower):
+                params["base_color_bgr"] = COLOR_PRESETS_BGR[color_name]
+                break
+
+        for texture in WALL_TEXTURE_PRESETS:
+            if texture in desc_lower:
+                params["wall_texture"] = texture
+                break
+        for texture in FLOOR_TEXTURE_PRESETS:
+            if texture in desc_lower:
+                params["floor_texture"] = texture
+                break
+        return params
+
+    def legacy_route(asset_id: str, details: dict) -> str:
+        asset_type = details.get("type")
+        description = details.get("description", "").lower()
+        if (asset_type == "tile" and "wall" in description) or (asset_id.startswith("wall_") and "clock" not in asset_id):
+            return "wall"
+        elif (asset_type == "tile" and "floor" in description) or (asset_id.startswith("floor_") and "clock" not in asset_id):
+            return "floor"
+        elif asset_type == "object":
+            return "object"
+        elif asset_type == "npc" or asset_type == "agent":
+            return "character"
+        return "other"
+
+    def legacy_base_sheet(description_prompt: str) -> str:
+        base_sheet_name = DEFAULT_CHARACTER_SHEET
+        desc_lower = description_prompt.lower()
+        found_sheet = False
+        for sheet_name, keywords in CHARACTER_SHEET_MAP.items():
+            for keyword in keywords:
+                if keyword in desc_lower:
+                    base_sheet_name = sheet_name
+                    found_sheet = True
+                    break
+            if found_sheet: break
+        return base_sheet_name
+
+    def legacy_floor_tile(asset_id: str, details: dict) -> bool:
+        description = details.get("description", "").lower()
+        return details.get("type") == "tile" and ("floor" in asset_id.lower() or "floor" in description)
+
+    # --- 随机语料: 关键词 + 易混词 (office 含 ice, woman 含 man) + 标点 / 下划线 / 中文紧邻 ---
+    vocab = list(_automaton.keywords) + [
+        "office", "nice", "police", "wooden", "reddish", "redwood", "blue-green", "sky", "pink", "mahogany",
+        "table", "chair", "clock", "wall_clock", "tiles", "steel-blue", "old", "woman", "gentleman", "stoneware",
+        "Red", "WHITE", "Floor", "红色", "地板", "墙", "_", "-", ",", ".", "(floor)", "(wall)", "a", "the", "with"
+    ]
+    rng = random.Random(47)
+    cases = []
+    for _ in range(20000):
+        words = [rng.choice(vocab) for _ in range(rng.randint(0, 12))]
+        seps = [rng.choice([" ", " ", " ", "", "_", ", ", "-"]) for _ in words]
+        description = "".join(w + s for w, s in zip(words, seps))
+        asset_id = rng.choice(["wall_", "floor_", "", "wall_clock_", "Floor_", "obj_"]) + rng.choice(["brick", "oak", "x", "clock"])
+        cases.append((asset_id, {"type": rng.choice(["tile", "object", "npc", "agent", "other"]), "description": description}))
+
+    mismatches = 0
+    for asset_id, details in cases:
+        result = classify_asset(asset_id, details)
+        expected = (
+            legacy_route(asset_id, details),
+            legacy_floor_tile(asset_id, details),
+            legacy_parse_description(details["description"]),
+            legacy_base_sheet(details["description"])
+        )
+        actual = (result["kind"], result["floor_tile"], parse_material(details["description"]), select_base_sheet(details["description"]))
+        if result["material"] != expected[2] or (result["kind"] == "character" and result["base_sheet"] != expected[3]):
+            actual = ("<classify_asset 不一致>",) + actual[1:]
+        if actual != expected:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"不一致: {asset_id!r} {details}\n  原实现: {expected}\n  分类器: {actual}")
+    print(f"正确性: {len(cases) - mismatches}/{len(cases)} 个随机用例与原实现一致。")
+
+    # --- 吞吐量: 原实现 (路由 + 材质 + 骨架 + 地板规则各扫一遍) vs 分类器一遍 ---
+    sample = cases[:5000]
+    start = time.perf_counter()
+    for asset_id, details in sample:
+        legacy_route(asset_id, details)
+        legacy_floor_tile(asset_id, details)
+        legacy_parse_description(details["description"])
+        legacy_base_sheet(details["description"])
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for asset_id, details in sample:
+        classify_asset(asset_id, details)
+    new_time = time.perf_counter() - start
+    print(f"吞吐量: 原实现 {len(sample) / legacy_time:,.0f} 个/秒, 分类器 {len(sample) / new_time:,.0f} 个/秒 ({legacy_time / new_time:.1f}x)")
+    sys.exit(1 if mismatches else 0)
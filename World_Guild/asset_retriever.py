@@ -3,6 +3,13 @@ import json
 import os
 import re
 
+try:
+    import numpy as np
+except ImportError:
+    print("!!! 错误: 缺少 'numpy' !!!")
+    print("请运行: pip install numpy")
+    exit(1)
+
 # 索引文件的路径
 INDEX_FILE_PATH = "./asset_index.json"
 
@@ -35,6 +42,7 @@ def _load_index():
         _asset_index = {} # 标记为已加载 (空)
         return _asset_index
 
+
 def _normalize_query_to_set(text: str) -> set:
     """
     将查询文本 ("cafe_sofa a comfortable sofa") 
@@ -54,84 +62,346 @@ def _normalize_query_to_set(text: str) -> set:
     return tokens
 
 
+_PACK_SUFFIX_PATTERN = re.compile(r'^(tile|\d+|\d+x\d+)$')
+
+
+def _singular(word: str) -> str:
+    """ 粗略的单数化 ("doors" -> "door", "shelves" 不处理)，只用于类型名比较 """
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def _head_noun(tokens: list) -> str:
+    """
+    素材包条目的类型名: 去掉 "__tile_<编号>_<WxH>" 后缀后的最后一个词
+    (e.g., "tall_gray_metal_glass_door_cabinet__tile_3645_2x4" -> "cabinet")
+    """
+    words = list(tokens)
+    while words and _PACK_SUFFIX_PATTERN.match(words[-1]):
+        words.pop()
+    return _singular(words[-1]) if words else ""
+
+
+# ===================================================================
+# 检索索引 (Token 倒排 + 尺寸分桶)
+# ===================================================================
+# 旧算法对每次查询都遍历整份索引。这里在第一次查询时建立:
+#   - 倒排表: token -> 文档序号数组
+#   - 尺寸桶: (w, h) -> 文档序号数组，以及所有桶尺寸组成的数组
+# 单次查询: 从查询尺寸所在的桶开始，按曼哈顿距离由近到远检查各个桶，
+#           第一个含有文本匹配文档的桶即为答案 (同距离取索引中靠前的文档，与旧算法一致)。
+# 批量查询: 整个场景的所有资产一次性组成 (查询 x 文档) 的矩阵，用 numpy 一次求出。
+# 近似重复簇 (见 build_asset_index 的 cluster_near_duplicates): 每个成员按自己的关键词匹配、返回自己的路径；
+#           同一距离上同簇的成员取命中关键词最多的一个 (e.g., "red sofa" 取红色变体)，nearest 的 k 个结果按簇去重。
+
+class _RetrievalIndex:
+    def __init__(self, assets: dict, clusters: list = None):
+        self.doc_ids = list(assets.keys())
+        # 每个文档所属簇的编号 (未聚类时每个文档自成一簇)
+        self.clusters = np.array(clusters if clusters is not None else range(len(self.doc_ids)), dtype=np.int32)
+        self.paths = [doc["path_relative"] for doc in assets.values()]
+        self.head_nouns = np.array([_head_noun(doc["tokens"]) for doc in assets.values()], dtype=object)
+        self.dims = np.array([doc["dimensions_tiles"][:2] for doc in assets.values()], dtype=np.int32).reshape(-1, 2)
+
+        postings = {}
+        buckets = {}
+        for ordinal, doc in enumerate(assets.values()):
+            for token in set(doc["tokens"]):
+                postings.setdefault(token, []).append(ordinal)
+            buckets.setdefault(tuple(doc["dimensions_tiles"][:2]), []).append(ordinal)
+        self.postings = {token: np.array(ords, dtype=np.int32) for token, ords in postings.items()}
+        self.bucket_keys = list(buckets.keys())
+        self.bucket_members = [np.array(buckets[key], dtype=np.int32) for key in self.bucket_keys]
+        self.bucket_dims = np.array(self.bucket_keys, dtype=np.int32).reshape(-1, 2)
+
+    def token_hits(self, query_tokens: set) -> np.ndarray:
+        """ 每个文档命中的查询 token 数 """
+        hits = np.zeros(len(self.doc_ids), dtype=np.int32)
+        for token in query_tokens:
+            if token in self.postings:
+                hits[self.postings[token]] += 1
+        return hits
+
+    def candidate_mask(self, query_tokens: set) -> np.ndarray:
+        """ 与查询至少有一个相同 token 的文档 """
+        return self.token_hits(query_tokens) > 0
+
+    def _best_member(self, ordinals: np.ndarray, hits: np.ndarray) -> int:
+        """ 一组 (同距离、同簇的) 候选中命中 token 最多的文档；平局取索引中靠前的 """
+        ordinals = np.sort(ordinals)
+        return int(ordinals[hits[ordinals].argmax()])
+
+    def nearest(self, query_tokens: set, query_dims: list, k: int = 1) -> list:
+        """
+        尺寸最接近的 k 个文本匹配文档 (来自 k 个不同的簇)。
+        :return: [(文档序号, 曼哈顿距离)]，按距离、索引顺序排列
+        """
+        hits_per_doc = self.token_hits(query_tokens)
+        mask = hits_per_doc > 0
+        if not mask.any() or not len(self.bucket_keys):
+            return []
+        bucket_distance = np.abs(self.bucket_dims - np.asarray(query_dims[:2], dtype=np.int32)).sum(axis=1)
+        results = []
+        seen_clusters = set()
+        # 由近到远展开 (同距离的桶一起处理，保证按索引顺序打破平局)
+        for distance in np.unique(bucket_distance):
+            hits = np.concatenate([
+                members[mask[members]]
+                for members, d in zip(self.bucket_members, bucket_distance) if d == distance
+            ])
+            for ordinal in np.sort(hits):
+                cluster = int(self.clusters[ordinal])
+                if cluster not in seen_clusters:
+                    seen_clusters.add(cluster)
+                    member = self._best_member(hits[self.clusters[hits] == cluster], hits_per_doc)
+                    results.append((member, int(distance)))
+            if len(results) >= k:
+                break
+        return results[:k]
+
+    def nearest_batch(self, queries: list) -> tuple:
+        """
+        批量查询 (一次矩阵运算)。
+        :param queries: [(query_tokens, query_dims)]
+        :return: (每个查询的最佳文档序号 (无匹配为 -1), 对应的距离)
+        """
+        if not queries or not len(self.doc_ids):
+            return np.full(len(queries), -1), np.zeros(len(queries), dtype=np.int32)
+        token_hits = np.stack([self.token_hits(tokens) for tokens, _ in queries])
+        masks = token_hits > 0
+        query_dims = np.array([dims[:2] for _, dims in queries], dtype=np.int32)
+        penalty = np.abs(query_dims[:, None, :] - self.dims[None, :, :]).sum(axis=2)
+        penalty = np.where(masks, penalty, np.iinfo(np.int32).max)
+        best = penalty.argmin(axis=1)  # argmin 取第一个最小值 = 索引中靠前的文档
+        best_penalty = penalty[np.arange(len(queries)), best]
+        best = np.where(masks.any(axis=1), best, -1)
+        for i in np.flatnonzero(best >= 0):
+            # 同距离的同簇成员中取命中 token 最多的变体
+            same = np.flatnonzero((penalty[i] == best_penalty[i]) & (self.clusters == self.clusters[best[i]]))
+            best[i] = self._best_member(same, token_hits[i])
+        return best, best_penalty
+
+
+    def reuse_scores(self, id_tokens: set, desc_tokens: set, query_dims: list, type_tokens: set) -> np.ndarray:
+        """ 每个文档的复用置信度 (见 score_reuse_candidate)；类型名不在 type_tokens 中的文档为 0 """
+        n = len(self.doc_ids)
+        id_hits = np.zeros(n, dtype=np.float32)
+        desc_hits = np.zeros(n, dtype=np.float32)
+        for tokens, hits in ((id_tokens, id_hits), (desc_tokens, desc_hits)):
+            for token in tokens:
+                if token in self.postings:
+                    hits[self.postings[token]] += 1
+        token_score = (REUSE_ID_WEIGHT * id_hits / max(1, len(id_tokens))
+                       + (1 - REUSE_ID_WEIGHT) * desc_hits / max(1, len(desc_tokens)))
+        penalty = np.abs(self.dims - np.asarray(query_dims[:2], dtype=np.int32)).sum(axis=1)
+        type_match = np.isin(self.head_nouns, list(type_tokens))
+        return np.where(type_match, token_score / (1.0 + penalty), 0.0)
+
+
+# 复用置信度: asset_id 中的词比描述中的词更重要 (e.g., "chair_library" 的 chair)
+REUSE_ID_WEIGHT = 0.7
+
+_retrieval_index = None
+_cluster_members = None
+_reference_cache = {}
+
+
+def _cluster_labels(assets: dict) -> list:
+    """
+    每个文档所属近似重复簇的编号 (见 build_asset_index 的 cluster_near_duplicates)，
+    同时记录 簇代表 -> 成员列表。旧索引没有 "cluster" 字段时每个文档自成一簇。
+    """
+    global _cluster_members
+    _cluster_members = {}
+    for doc_id, doc in assets.items():
+        _cluster_members.setdefault(doc.get("cluster", doc_id), []).append(doc_id)
+    numbering = {canonical_id: n for n, canonical_id in enumerate(_cluster_members)}
+    return [numbering[doc.get("cluster", doc_id)] for doc_id, doc in assets.items()]
+
+
+def _get_retrieval_index():
+    """
+    检索索引 (全部条目): 每个成员按自己的关键词匹配，返回的是颜色/细节真正匹配的那个变体；
+    nearest 的多个结果按簇去重。
+    """
+    global _retrieval_index
+    if _retrieval_index is None:
+        index = _load_index()
+        assets = index.get("assets", {}) if index else {}
+        _retrieval_index = _RetrievalIndex(assets, _cluster_labels(assets)) if index else None
+    return _retrieval_index
+
+
+def cluster_members(doc_id: str) -> list:
+    """ 与 doc_id 同簇的全部文档 ID (代表在前)；未聚类时只有它自己 """
+    _get_retrieval_index()
+    canonical_id = _load_index().get("assets", {}).get(doc_id, {}).get("cluster", doc_id)
+    return (_cluster_members or {}).get(canonical_id, [doc_id])
+
+
+def _query_of(asset_id: str, details: dict) -> tuple:
+    """ (查询关键词, 查询尺寸) """
+    query_tokens = _normalize_query_to_set(f"{asset_id} {details.get('description', '')}")
+    query_dims = details.get("visual_size", details.get("base_size", [1, 1]))
+    return query_tokens, query_dims
+
+
+def _cache_key(query_tokens: set, query_dims: list) -> tuple:
+    return (frozenset(query_tokens), tuple(query_dims[:2]))
+
+
+def _resolve_path(ordinal: int, penalty: int) -> str | None:
+    """ 文档序号 -> 完整路径 (文件不存在则返回 None) """
+    retrieval_index = _get_retrieval_index()
+    path_relative = retrieval_index.paths[ordinal]
+    print(f"  - [Retriever] 匹配成功 (Penalty={penalty}): {os.path.basename(path_relative)}")
+
+    base_path = _load_index().get("metadata", {}).get("base_path", ".")
+    full_path = os.path.join(base_path, path_relative)
+    if not os.path.exists(full_path):
+        print(f"!!! [Retriever] 警告: 索引文件 '{path_relative}' 在磁盘上不存在！")
+        return None
+    return full_path
+
+
+def find_nearest_assets(tokens, dims: list, k: int = 3) -> list:
+    """
+    "尺寸最接近 dims、且含有 tokens 中任一关键词的 k 个资产"
+    :param tokens: 关键词 (字符串会被标准化)
+    :return: [(索引中的文档 ID, 曼哈顿距离)]
+    """
+    retrieval_index = _get_retrieval_index()
+    if retrieval_index is None:
+        return []
+    query_tokens = _normalize_query_to_set(tokens) if isinstance(tokens, str) else set(tokens)
+    return [(retrieval_index.doc_ids[o], d) for o, d in retrieval_index.nearest(query_tokens, dims, k)]
+
+
+def _best_reuse_candidate(asset_id: str, details: dict, semantic_tag: str = None) -> tuple:
+    """ (文档序号, 置信度)；没有任何候选时返回 (None, 0.0) """
+    retrieval_index = _get_retrieval_index()
+    if retrieval_index is None or not len(retrieval_index.doc_ids):
+        return None, 0.0
+    id_tokens = _normalize_query_to_set(asset_id)
+    desc_tokens = _normalize_query_to_set(details.get("description", "")) - id_tokens
+    if not id_tokens and not desc_tokens:
+        return None, 0.0
+    query_dims = details.get("visual_size", details.get("base_size", [1, 1]))
+    type_tokens = {_singular(t) for t in id_tokens | _normalize_query_to_set(semantic_tag or "")}
+
+    scores = retrieval_index.reuse_scores(id_tokens, desc_tokens, query_dims, type_tokens)
+    best = int(scores.argmax())
+    if scores[best] <= 0:
+        return None, 0.0
+    return best, round(float(scores[best]), 3)
+
+
+def score_reuse_candidate(asset_id: str, details: dict, semantic_tag: str = None):
+    """
+    给 "直接复用素材包中的图" 打分:
+        置信度 = (0.7 * asset_id 词覆盖率 + 0.3 * 描述词覆盖率) / (1 + 尺寸曼哈顿距离)
+    例如 asset_id 的词全部命中、尺寸完全一致时置信度 >= 0.7；尺寸差一格时减半。
+    类型必须一致: 候选的类型名 (文件名的最后一个词，e.g., "..._door_cabinet" 是 cabinet)
+    要出现在 asset_id 或 semantic_tag 的词中，否则置信度为 0 ("door_glass" 不会复用玻璃门柜子)。
+    在全部条目 (包括同簇的换色变体) 上打分，复用的是颜色/细节真正匹配的那一个。
+    :param semantic_tag: 规划 properties 中的 semantic_tag (可选，补充类型词)
+    :return: (完整路径, 置信度, 文档 ID)；没有任何候选时返回 (None, 0.0, None)
+    """
+    best, confidence = _best_reuse_candidate(asset_id, details, semantic_tag)
+    if best is None:
+        return None, 0.0, None
+    retrieval_index = _get_retrieval_index()
+    base_path = _load_index().get("metadata", {}).get("base_path", ".")
+    full_path = os.path.join(base_path, retrieval_index.paths[best])
+    if not os.path.exists(full_path):
+        return None, 0.0, None
+    return full_path, confidence, retrieval_index.doc_ids[best]
+
+
+def find_reference_alternatives(asset_id: str, details: dict, k: int = 3) -> list:
+    """
+    k 个来自不同近似重复簇的参考图 (按尺寸接近程度排序)，用于需要多样参考的场合
+    :return: [完整路径]
+    """
+    retrieval_index = _get_retrieval_index()
+    query_tokens, query_dims = _query_of(asset_id, details)
+    if retrieval_index is None or not query_tokens:
+        return []
+    base_path = _load_index().get("metadata", {}).get("base_path", ".")
+    paths = [os.path.join(base_path, retrieval_index.paths[o]) for o, _ in retrieval_index.nearest(query_tokens, query_dims, k)]
+    return [p for p in paths if os.path.exists(p)]
+
+
+def find_closest_reference_images(assets: dict) -> dict:
+    """
+    批量检索: 为场景中的一组资产一次性找到参考图 (结果同时写入缓存，
+    之后 find_closest_reference_image 对同样的查询直接命中)。
+    :param assets: { asset_id: details }
+    :return: { asset_id: 完整路径或 None }
+    """
+    retrieval_index = _get_retrieval_index()
+    if retrieval_index is None:
+        return {asset_id: None for asset_id in assets}
+
+    queries = {asset_id: _query_of(asset_id, details) for asset_id, details in assets.items()}
+    valid_ids = [asset_id for asset_id, (tokens, _) in queries.items() if tokens]
+    best, best_penalty = retrieval_index.nearest_batch([queries[asset_id] for asset_id in valid_ids])
+
+    results = {asset_id: None for asset_id in assets}
+    for asset_id, ordinal, penalty in zip(valid_ids, best, best_penalty):
+        path = _resolve_path(int(ordinal), int(penalty)) if ordinal >= 0 else None
+        _reference_cache[_cache_key(*queries[asset_id])] = path
+        results[asset_id] = path
+    print(f"[Asset Retriever] 批量检索 {len(assets)} 个资产，命中 {sum(1 for p in results.values() if p)} 个。")
+    return results
+
+
 def find_closest_reference_image(asset_id: str, details: dict) -> str | None:
     """
-    【核心】执行两阶段检索算法 (Token Matching + Dimension Ranking)
+    【核心】两阶段检索 (Token Matching + Dimension Ranking)，通过倒排表与尺寸桶完成，不再遍历整份索引。
     
     :param asset_id: e.g., "cafe_sofa"
     :param details: 包含 "description" 和 "visual_size" 的字典
     :return: 最佳匹配的【完整文件路径】或 None
     """
-    index = _load_index()
-    if not index or "assets" not in index:
-        return None # 索引加载失败或为空
-
     # --- 1. 查询标准化 (Query Normalization) ---
-    
-    # 1a. 准备查询文本 ("cafe_sofa" + "a comfortable sofa")
-    query_text = f"{asset_id} {details.get('description', '')}"
-    
-    # 1b. 查询关键词 (Qt): {"cafe", "sofa", "comfortable"}
-    query_tokens = _normalize_query_to_set(query_text)
-    
+    # 关键词 (Qt): {"cafe", "sofa", "comfortable"}；尺寸 (Qdims): e.g., [2, 1]
+    query_tokens, query_dims = _query_of(asset_id, details)
     if not query_tokens:
         return None # 查询无效
 
-    # 1c. 查询尺寸 (Qdims): e.g., [2, 1]
-    query_dims = details.get("visual_size", details.get("base_size", [1, 1]))
+    key = _cache_key(query_tokens, query_dims)
+    if key in _reference_cache:
+        return _reference_cache[key]
 
-    
-    # --- 2. 算法执行 ---
-    
-    best_match_path_relative = None
-    # (我们使用曼哈顿距离，所以惩罚分越低越好)
-    lowest_dimension_penalty = float('inf') 
-
-    # 遍历索引中的每一篇文档 (D)
-    for doc_id, doc in index["assets"].items():
-        
-        # --- 阶段 1: 文本过滤 (Set Intersection) ---
-        
-        doc_tokens = set(doc["tokens"]) # Dt: e.g., {"pink", "sofa"}
-        
-        intersection = query_tokens.intersection(doc_tokens)
-        
-        # 如果交集为空 (e.g., 搜 "sofa" 却匹配到 "bookshelf")，立即跳过
-        if not intersection:
-            continue
-            
-        # --- 阶段 2: 尺寸排序 (Manhattan Distance) ---
-        
-        doc_dims = doc["dimensions_tiles"] # Ddims: e.g., [2, 1]
-        
-        # 公式: P = |Qw - Dw| + |Qh - Dh|
-        penalty = abs(query_dims[0] - doc_dims[0]) + \
-                abs(query_dims[1] - doc_dims[1])
-                
-        # 如果这个文档的惩罚分更低，它就是新的“最佳匹配”
-        if penalty < lowest_dimension_penalty:
-            lowest_dimension_penalty = penalty
-            best_match_path_relative = doc["path_relative"]
-            
-            # 优化：如果惩罚分为 0 (完美尺寸匹配)，我们没必要再搜了
-            if penalty == 0:
-                break
-                
-    # --- 3. 最终决策 ---
-    
-    if best_match_path_relative:
-        print(f"  - [Retriever] 匹配成功 (Penalty={lowest_dimension_penalty}): {os.path.basename(best_match_path_relative)}")
-        
-        # 拼接完整路径并返回
-        base_path = index.get("metadata", {}).get("base_path", ".")
-        full_path = os.path.join(base_path, best_match_path_relative)
-        
-        if not os.path.exists(full_path):
-            print(f"!!! [Retriever] 警告: 索引文件 '{best_match_path_relative}' 在磁盘上不存在！")
-            return None
-            
-        return full_path
-
-    # 未找到匹配
-    print(f"  - [Retriever] '{asset_id}' 未能在索引中找到任何匹配。")
-    return None
\ No newline at end of file
+    retrieval_index = _get_retrieval_index()
+    if retrieval_index is None:
+        return None # 索引加载失败或为空
+
+    # --- 2. 从查询尺寸所在的桶向外展开 ---
+    matches = retrieval_index.nearest(query_tokens, query_dims, k=1)
+    if not matches:
+        print(f"  - [Retriever] '{asset_id}' 未能在索引中找到任何匹配。")
+        return None
+
+    path = _resolve_path(*matches[0])
+    _reference_cache[key] = path
+    return path
+
+
+
+def _check_reuse_types():
+    """ 自检 (使用当前索引): 复用候选的类型名必须与查询一致 """
+    assert _head_noun(["tall", "gray", "metal", "glass", "door", "cabinet", "tile", "3645", "2x4"]) == "cabinet"
+    door = {"description": "Double glass door.", "base_size": [3, 2], "visual_size": [2, 4]}
+    best, confidence = _best_reuse_candidate("door_glass", door, semantic_tag="door_main")
+    retrieval_index = _get_retrieval_index()
+    assert best is None or retrieval_index.head_nouns[best] == "door", (retrieval_index.doc_ids[best], confidence)
+    return (retrieval_index.doc_ids[best] if best is not None else None), confidence
+
+
+if __name__ == "__main__":
+    print(f"[Asset Retriever] 复用类型自检通过: door_glass -> {_check_reuse_types()}")
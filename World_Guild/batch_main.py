@@ -0,0 +1,245 @@
+# 文件名: batch_main.py
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# ===================================================================
+# 批量世界生成 (Batch World Generation)
+# ===================================================================
+# 从 JSONL 文件流式读取提示，每个场景在独立进程中跑完整流水线：
+#   Enricher -> Manager/Validator -> Critic -> Artist -> Soul Writer -> 保存
+# - 进程池: 承担 OpenCV 贴图、碰撞检测、草图绘制等 CPU 阶段；
+# - 共享 API 槽位: 一个跨进程信号量，限制所有场景同时发起的模型调用数；
+# - 每个场景写入独立的输出目录 (检查点、版本库、Critic 草图也都在其中)，结果逐行追加到 results JSONL；
+#   范例库 (<output_root>/exemplars) 由所有 worker 共享，见 exemplar_library.py。
+# 注意: generate_and_iterate_scene 的草稿默认不调用 LLM (use_llm=False，调试开关)，
+#       此时同一批里的每个提示都从同一个备用计划起步，只靠 Critic 修复轮次产生差异；
+#       需要按提示生成不同场景时使用 --llm-draft。
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_API_SLOTS = 8
+
+
+def iter_prompts(jsonl_path: str):
+    """
+    流式读取 JSONL，每行一个请求。
+    支持的字段: "prompt" (或 "body" / "text") 为场景描述，
+               "scene_id" (或 "request_id") 为场景 ID，缺省时使用行号。
+    """
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"!!! [Batch] 警告: 第 {line_no} 行不是合法 JSON，跳过: {e}")
+                continue
+
+            prompt = record.get("prompt") or record.get("body") or record.get("text")
+            if not prompt:
+                print(f"!!! [Batch] 警告: 第 {line_no} 行缺少 'prompt' 字段，跳过。")
+                continue
+
+            scene_id = str(record.get("scene_id") or record.get("request_id") or f"scene_{line_no:05d}")
+            yield {"scene_id": scene_id, "prompt": prompt}
+
+
+def _load_finished_scene_ids(results_path: str) -> set:
+    """ 读取已有结果文件中成功的场景，重跑批次时跳过它们 """
+    finished = set()
+    if not os.path.exists(results_path):
+        return finished
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok":
+                finished.add(record.get("scene_id"))
+    return finished
+
+
+def _init_worker(api_slots):
+    """ 进程池初始化：注入共享 API 槽位 """
+    from api_client_utils import set_api_slots
+    set_api_slots(api_slots)
+
+
+def run_scene_pipeline(job: dict, output_root: str, godot_project_path: str, max_repair_attempts: int = 1, llm_draft: bool = False) -> dict:
+    """
+    [进程池工人函数] 为单个提示跑完整流水线。
+    Agent 模块在这里才导入，保证每个子进程持有自己的 API 客户端。
+    :return: 结果记录 (写入 results JSONL)
+    """
+    from generation_workflow import generate_and_iterate_scene
+    from artist_agent import run_artist_agent, CHARACTER_BASE_SHEET_DIR
+    from soul_writer_agent import generate_npc_souls, generate_world_context
+    from save_scene import save_scene_to_file
+    from checkpoint_store import configure_checkpoints
+    from scene_store import configure_scene_store
+    from critic_agent import configure_sketch_path
+    from exemplar_library import configure_exemplar_library
+    from token_accounting import get_usage_totals, reset_usage, save_cost_report
+    from tracing import span, reset_trace, export_trace, summarize_trace
+
+    scene_id = job["scene_id"]
+    scene_dir = os.path.join(output_root, scene_id)
+    os.makedirs(scene_dir, exist_ok=True)
+
+    # 每个场景拥有独立的检查点目录，失败的场景重跑时可以续跑
+    configure_checkpoints(os.path.join(scene_dir, "checkpoints"))
+    # 版本库同样按场景隔离: 各进程不会交错写入同一个文件，版本链也不会混入其它场景
+    configure_scene_store(os.path.join(scene_dir, "scene_store"))
+    configure_sketch_path(os.path.join(scene_dir, "critic_sketch"))
+    # 范例库在整个批次中共享 (后面的场景可以用前面通过审查的场景作范例)；写入由文件锁保护
+    configure_exemplar_library(os.path.join(output_root, "exemplars"))
+    reset_usage()
+    reset_trace()
+
+    result = {"scene_id": scene_id, "status": "ok", "output_dir": scene_dir, "timings": {}, "error": None}
+    timings = result["timings"]
+    scene_start = time.perf_counter()
+
+    def _timed(stage_name, fn, *args, **kwargs):
+        stage_start = time.perf_counter()
+        try:
+            with span("scene." + stage_name, scene_id=scene_id):
+                return fn(*args, **kwargs)
+        finally:
+            timings[stage_name] = round(time.perf_counter() - stage_start, 3)
+
+    try:
+        plan = _timed("plan", generate_and_iterate_scene, job["prompt"], max_repair_attempts=max_repair_attempts, use_llm=llm_draft)
+        if not plan:
+            result["status"] = "no_plan"
+        else:
+            character_base_dir = os.path.join(godot_project_path, CHARACTER_BASE_SHEET_DIR)
+            plan = _timed("artist", run_artist_agent, plan, scene_dir, character_base_dir=character_base_dir)
+            _timed("souls", generate_npc_souls, plan, scene_dir)
+            _timed("world_context", generate_world_context, plan, scene_dir)
+            save_path = _timed("save", save_scene_to_file, plan, scene_dir, "final_scene.json")
+            if not save_path:
+                result["status"] = "save_failed"
+            result["scene_path"] = save_path
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+
+    timings["total"] = round(time.perf_counter() - scene_start, 3)
+    result["tokens"] = get_usage_totals()
+    result["cost_report"] = save_cost_report(scene_dir, scene_name=scene_id)
+
+    summary = summarize_trace()
+    result["critical_path"] = [step["name"] for step in summary["critical_path"]]
+    result["slowest_assets"] = summary["slowest_assets"]
+    result["trace_path"], _ = export_trace(os.path.join(scene_dir, "traces"))
+    return result
+
+
+def run_batch(prompts_path: str, output_root: str, godot_project_path: str, results_path: str = None,
+              max_workers: int = DEFAULT_MAX_WORKERS, api_slots: int = DEFAULT_API_SLOTS,
+              max_repair_attempts: int = 1, llm_draft: bool = False) -> int:
+    """
+    批量生成入口。
+    :param llm_draft: 草稿由 LLM 按提示生成 (默认使用备用计划，见文件头的说明)
+    :return: 成功生成的场景数量
+    """
+    os.makedirs(output_root, exist_ok=True)
+    if results_path is None:
+        results_path = os.path.join(output_root, "results.jsonl")
+
+    finished = _load_finished_scene_ids(results_path)
+    if finished:
+        print(f"--- [Batch] 结果文件中已有 {len(finished)} 个成功场景，将跳过。 ---")
+
+    # spawn: 子进程不继承父进程的 HTTP 连接池，各自初始化 API 客户端
+    ctx = multiprocessing.get_context("spawn")
+    manager = ctx.Manager()
+    shared_slots = manager.BoundedSemaphore(api_slots)
+
+    print(f"--- [Batch] 启动进程池 (Workers: {max_workers}, API 槽位: {api_slots}) ---")
+    ok_count = 0
+    submitted = 0
+    batch_start = time.perf_counter()
+
+    with open(results_path, 'a', encoding='utf-8') as results_file, \
+            ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx,
+                                initializer=_init_worker, initargs=(shared_slots,)) as executor:
+        in_flight = {}
+        prompts = iter_prompts(prompts_path)
+
+        def _drain(return_when):
+            nonlocal ok_count
+            done, _ = wait(list(in_flight), return_when=return_when)
+            for future in done:
+                job = in_flight.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # 工人进程本身崩溃 (例如被 OOM 杀掉)
+                    record = {"scene_id": job["scene_id"], "status": "crashed", "error": f"{type(e).__name__}: {e}"}
+                if record.get("status") == "ok":
+                    ok_count += 1
+                results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                results_file.flush()
+                print(f" ✅ [Batch] {record['scene_id']}: {record['status']} "
+                      f"({record.get('timings', {}).get('total', '?')}s)")
+
+        for job in prompts:
+            if job["scene_id"] in finished:
+                continue
+            # 流式提交: 在途任务保持在 2 倍进程数以内，避免一次性读入全部提示
+            while len(in_flight) >= max_workers * 2:
+                _drain(FIRST_COMPLETED)
+            future = executor.submit(run_scene_pipeline, job, output_root, godot_project_path, max_repair_attempts, llm_draft)
+            in_flight[future] = job
+            submitted += 1
+
+        while in_flight:
+            _drain(FIRST_COMPLETED)
+
+    manager.shutdown()
+    print(f"\n--- [Batch] 完成: {ok_count}/{submitted} 个场景成功，"
+          f"用时 {time.perf_counter() - batch_start:.1f}s。结果: {results_path} ---")
+    return ok_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从 JSONL 批量生成世界场景")
+    parser.add_argument("prompts", help="提示 JSONL 文件 (每行一个 {\"prompt\": ...})")
+    parser.add_argument("--output", default="./output/batch", help="批量输出根目录 (每个场景一个子目录)")
+    parser.add_argument("--godot-project", default="", help="Godot 项目路径 (用于读取角色基础骨架)")
+    parser.add_argument("--results", default=None, help="结果 JSONL 路径 (默认: <output>/results.jsonl)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="进程池大小")
+    parser.add_argument("--api-slots", type=int, default=DEFAULT_API_SLOTS, help="全局同时进行的模型调用上限")
+    parser.add_argument("--repairs", type=int, default=1, help="每个场景的 Critic 修复轮数")
+    parser.add_argument("--llm-draft", action="store_true", help="草稿由 LLM 生成 (默认使用备用计划，所有提示起点相同)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.prompts):
+        print(f"!!! [Batch] 错误: 找不到提示文件 {args.prompts}")
+        sys.exit(1)
+
+    run_batch(
+        args.prompts,
+        args.output,
+        args.godot_project,
+        results_path=args.results,
+        max_workers=args.workers,
+        api_slots=args.api_slots,
+        max_repair_attempts=args.repairs,
+        llm_draft=args.llm_draft
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# 文件名: bench_scene_build.py
+import os
+import copy
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+from scene_format import load_scene_file
+from godot_client import build_scene, stream_scene, format_build_profile
+
+# ===================================================================
+# Godot 场景构建基准 (Scene Build Benchmark)
+# ===================================================================
+# 把一个模板场景按 k x k 平铺成不同规模的场景，逐个发给正在监听的 Godot，
+# 收集 scene_builder_server.gd 回传的构建剖析 (各步骤耗时、新增节点、地板格、墙块、烘焙耗时)。
+# 每次运行按 "版本标签" 追加到 bench_history.jsonl，并与上一个标签在同一规模下的结果对比，
+# 用来跟踪构建耗时随场景规模的变化以及版本之间的回退。
+# --streamed 使用分块流式构建 (scene_chunker.py)，额外记录首块就绪时间与单帧最长耗时；两种模式分开对比。
+# 模板的贴图都在 generated_assets 中，平铺只复制摆放，不引入新贴图。
+
+BENCH_HISTORY_FILE = "./bench_history.jsonl"
+BENCH_TILE_FACTORS = [1, 2, 3, 4]   # 平铺倍数 (场景边长 = 模板边长 * k)
+BENCH_REPEAT = 3                    # 每个规模重复次数，取中位数
+BENCH_REGRESSION_RATIO = 1.15       # 比上一个标签慢 15% 以上时标记为回退
+
+_POSITION_KEYS = ("position", "area")
+
+
+def tile_scene(plan: dict, factor: int) -> dict:
+    """
+    把场景在 x/y 两个方向各平铺 factor 次
+    不带导航数据 (它按原尺寸烘焙)；贴图清单按资产 ID 查找，平铺后仍然有效。
+    """
+    width, height = plan.get("metadata", {}).get("grid_size", [25, 20])
+    tiled = copy.deepcopy(plan)
+    tiled["metadata"] = {k: v for k, v in tiled.get("metadata", {}).items() if k != "navigation"}
+    tiled["metadata"]["grid_size"] = [width * factor, height * factor]
+
+    layout = {}
+    for layer_name, entries in plan.get("layout", {}).items():
+        if not isinstance(entries, list):
+            layout[layer_name] = copy.deepcopy(entries)
+            continue
+        layer = []
+        for ty in range(factor):
+            for tx in range(factor):
+                for entry in entries:
+                    moved = copy.deepcopy(entry)
+                    for key in _POSITION_KEYS:
+                        if key in moved:
+                            moved[key] = [moved[key][0] + tx * width, moved[key][1] + ty * height] + list(moved[key][2:])
+                    layer.append(moved)
+        layout[layer_name] = layer
+    tiled["layout"] = layout
+    return tiled
+
+
+def _scene_size(plan: dict) -> dict:
+    layout = plan.get("layout", {})
+    return {
+        "grid_size": plan["metadata"]["grid_size"],
+        "objects": len(layout.get("object_layer", [])),
+        "characters": len(layout.get("npc_layer", [])),
+        "walls": len(layout.get("wall_layer", [])),
+    }
+
+
+def _default_label() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, check=True).stdout.strip() or "unlabeled"
+    except (OSError, subprocess.CalledProcessError):
+        return "unlabeled"
+
+
+def _load_history(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _previous_result(history: list, label: str, grid_size: list, mode: str):
+    """ 同一规模、同一构建模式下，标签不同的最近一条记录 """
+    for record in reversed(history):
+        if record["label"] != label and record["grid_size"] == grid_size and record.get("mode", "full") == mode:
+            return record
+    return None
+
+
+def run_benchmark(template_path: str, factors=BENCH_TILE_FACTORS, repeat: int = BENCH_REPEAT,
+                  label: str = None, history_path: str = BENCH_HISTORY_FILE, host='127.0.0.1', port=8080,
+                  streamed: bool = False) -> list:
+    """
+    :param streamed: 使用分块流式构建
+    :return: 本次运行写入历史的记录列表 (每个规模一条)
+    """
+    label = label or _default_label()
+    mode = "streamed" if streamed else "full"
+    build = stream_scene if streamed else build_scene
+    template = load_scene_file(template_path)
+    history = _load_history(history_path)
+    records = []
+
+    for factor in factors:
+        plan = tile_scene(template, factor)
+        size = _scene_size(plan)
+        profiles = []
+        for i in range(repeat):
+            profile = build(plan, host=host, port=port)
+            if profile is None:
+                print(f"[Bench] 规模 {size['grid_size']} 第 {i + 1} 次构建失败，跳过该规模。")
+                break
+            print(f"[Bench] {size['grid_size']} #{i + 1}: {format_build_profile(profile)}")
+            profiles.append(profile)
+        if len(profiles) < repeat:
+            continue
+
+        record = {
+            "label": label,
+            "mode": mode,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "template": os.path.basename(template_path),
+            "repeat": repeat,
+            **size,
+            "total_ms": statistics.median(p["total_ms"] for p in profiles),
+            "bake_ms": statistics.median(p.get("bake_ms", 0) for p in profiles),
+            "steps": {step: statistics.median(p["steps"].get(step, 0) for p in profiles) for step in profiles[0]["steps"]},
+            "counts": profiles[0].get("counts", {}),
+            "cells": profiles[0].get("cells", 0),
+            "wall_tiles": profiles[0].get("wall_tiles", 0),
+            "textures": profiles[-1].get("textures", {}),
+        }
+        if streamed:
+            record["first_chunk_ms"] = statistics.median(p["first_chunk_ms"] for p in profiles)
+            record["max_frame_ms"] = statistics.median(p["max_frame_ms"] for p in profiles)
+            record["chunks"] = profiles[0].get("chunks", 0)
+        records.append(record)
+
+        previous = _previous_result(history, label, record["grid_size"], mode)
+        if previous:
+            ratio = record["total_ms"] / max(previous["total_ms"], 1e-6)
+            flag = "  <-- 回退" if ratio > BENCH_REGRESSION_RATIO else ""
+            print(f"[Bench] {record['grid_size']}: {record['total_ms']:.1f} ms vs {previous['label']} "
+                  f"{previous['total_ms']:.1f} ms ({(ratio - 1) * 100:+.1f}%){flag}")
+
+    if records:
+        with open(history_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"[Bench] 已追加 {len(records)} 条记录到 {history_path} (标签 {label})")
+    _print_table(records)
+    return records
+
+
+def _print_table(records: list):
+    if not records:
+        return
+    steps = list(records[0]["steps"])
+    streamed = records[0].get("mode") == "streamed"
+    extra = f"{'首块ms':>9} {'单帧最长ms':>10} " if streamed else ""
+    print(f"\n{'尺寸':>10} {'物体':>6} {'总计ms':>9} " + extra + " ".join(f"{s:>12}" for s in steps))
+    for r in records:
+        dims = f"{r['grid_size'][0]}x{r['grid_size'][1]}"
+        extra = f"{r['first_chunk_ms']:>9.1f} {r['max_frame_ms']:>10.1f} " if streamed else ""
+        print(f"{dims:>10} {r['objects']:>6} {r['total_ms']:>9.1f} " + extra + " ".join(f"{r['steps'].get(s, 0):>12.1f}" for s in steps))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按场景规模测量 Godot 构建耗时，并跨版本记录")
+    parser.add_argument("template", help="模板场景 (.wgscene 或 .json)，其贴图需已在 generated_assets 中")
+    parser.add_argument("--factors", type=int, nargs="+", default=BENCH_TILE_FACTORS, help="平铺倍数")
+    parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    parser.add_argument("--label", default=None, help="版本标签 (默认 git describe)")
+    parser.add_argument("--history", default=BENCH_HISTORY_FILE)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--streamed", action="store_true", help="使用分块流式构建")
+    args = parser.parse_args()
+    run_benchmark(args.template, args.factors, args.repeat, args.label, args.history, args.host, args.port, args.streamed)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,28 @@
 import os
 import json
 import re
+from concurrent.futures import ProcessPoolExecutor
+from reference_cache import build_reference_cache
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    print("!!! 错误: 缺少 'opencv-python-headless' 或 'numpy' !!!")
+    print("请运行: pip install opencv-python-headless numpy")
+    exit(1)
 
 INDEX_SAVE_PATH = "./asset_index.json"
 
+# --- 近似重复聚类 (感知哈希) ---
+# 素材包中大量条目是换色或几乎相同的变体 (tile_2925 之类)。对每张图计算 64 位 dHash，
+# 同一尺寸桶内与某个代表的汉明距离不超过阈值的图归入该簇 (不做传递闭包，避免 A~B~C 链式合并)，
+# 代表是簇内索引顺序最靠前的条目。
+# 检索在全部条目上进行: 每个成员按自己的关键词匹配、返回自己的图 (同簇同距离时取命中词最多的成员)，
+# 需要多个结果时按簇去重，不同结果来自不同的簇 (见 asset_retriever.py)。
+DEDUP_HAMMING_THRESHOLD = 6
+DEDUP_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
 ENGLISH_STOP_WORDS = {
     "a", "an", "the", "is", "are", "was", "were", "of", "in", 
     "on", "at", "to", "for", "with", "by", "and", "or"
@@ -29,6 +48,61 @@ def normalize_text_to_tokens(text: str) -> list[str]:
     ]
     return tokens
 
+def _dhash(image_path: str):
+    """
+    64 位差值哈希 (dHash): 透明区域先合成到白底，缩到 9x8 灰度，比较左右相邻像素。
+    :return: 16 位十六进制字符串；无法读取时返回 None
+    """
+    img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+    if img.ndim == 3 and img.shape[2] == 4:
+        alpha = img[:, :, 3:4].astype(np.float32) / 255.0
+        img = (img[:, :, :3].astype(np.float32) * alpha + 255.0 * (1.0 - alpha)).astype(np.uint8)
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+
+def compute_perceptual_hashes(paths: list, workers: int = DEDUP_HASH_WORKERS) -> list:
+    """ 多进程计算 dHash (与 paths 顺序一致) """
+    if workers <= 1 or len(paths) < 64:
+        return [_dhash(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_dhash, paths, chunksize=max(1, len(paths) // (workers * 8))))
+
+
+def _hamming(hashes: np.ndarray, value: np.uint64) -> np.ndarray:
+    """ hashes 中每个 64 位哈希与 value 的汉明距离 (异或后数 1 的个数) """
+    return np.unpackbits((hashes ^ value).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def cluster_near_duplicates(assets: dict, threshold: int = DEDUP_HAMMING_THRESHOLD) -> dict:
+    """
+    按索引顺序逐个处理: 与同尺寸桶内最近的代表距离 <= threshold 则归入该簇，否则自己成为新代表。
+    :param assets: 索引条目 (需要 "dimensions_tiles" 与 "phash"；没有哈希的条目各自成簇)
+    :return: { 文档 ID: 代表文档 ID }
+    """
+    clusters = {}
+    leaders = {}  # 尺寸 -> (代表 ID 列表, 代表哈希数组)
+    for doc_id, doc in assets.items():
+        if not doc.get("phash"):
+            clusters[doc_id] = doc_id
+            continue
+        value = np.uint64(int(doc["phash"], 16))
+        ids, hashes = leaders.get(tuple(doc["dimensions_tiles"]), ([], np.zeros(0, dtype=np.uint64)))
+        if ids:
+            distance = _hamming(hashes, value)
+            nearest = int(distance.argmin())
+            if distance[nearest] <= threshold:
+                clusters[doc_id] = ids[nearest]
+                continue
+        clusters[doc_id] = doc_id
+        leaders[tuple(doc["dimensions_tiles"])] = (ids + [doc_id], np.append(hashes, value))
+    return clusters
+
+
 # 【【【 核心修改：函数现在接收 asset_pack_path 】】】
 def build_index(asset_pack_path: str):
     """
@@ -92,7 +166,23 @@ def build_index(asset_pack_path: str):
             if indexed_files % 100 == 0:
                 print(f"  ...已索引 {indexed_files} 个文件...")
 
-    # --- 4. 保存索引 ---
+    # --- 4. 感知哈希 + 近似重复聚类 ---
+    doc_entries = asset_database["assets"]
+    hashes = compute_perceptual_hashes([os.path.join(asset_pack_path, doc["path_relative"]) for doc in doc_entries.values()])
+    for doc, phash in zip(doc_entries.values(), hashes):
+        doc["phash"] = phash
+    clusters = cluster_near_duplicates(doc_entries)
+    for doc_id, canonical_id in clusters.items():
+        doc_entries[doc_id]["cluster"] = canonical_id
+    cluster_count = len(set(clusters.values()))
+    asset_database["metadata"]["dedup"] = {
+        "hash": "dhash64",
+        "threshold": DEDUP_HAMMING_THRESHOLD,
+        "clusters": cluster_count
+    }
+    print(f"  [Dedup] {indexed_files} 个资产聚为 {cluster_count} 簇 (汉明距离 <= {DEDUP_HAMMING_THRESHOLD})。")
+
+    # --- 5. 保存索引 ---
     try:
         with open(INDEX_SAVE_PATH, 'w', encoding='utf-8') as f:
             json.dump(asset_database, f, indent=2)
@@ -100,10 +190,16 @@ def build_index(asset_pack_path: str):
         print(f"  总共扫描 {total_files} 个文件。")
         print(f"  成功索引 {indexed_files} 个资产。")
         print(f"  索引已保存到: {INDEX_SAVE_PATH}")
-        return True 
     except Exception as e:
         print(f"\n!!! [Index Builder] 错误: 无法保存索引文件: {e}")
         return False
 
+    # --- 6. 预构建参考图载荷缓存 (全部条目都可能被检索到；失败不影响索引本身) ---
+    try:
+        build_reference_cache(asset_database)
+    except Exception as e:
+        print(f"  [Index Builder] 警告: 参考图载荷缓存构建失败: {e}")
+    return True
+
 if __name__ == "__main__":
     build_index()
\ No newline at end of file
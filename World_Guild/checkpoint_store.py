@@ -0,0 +1,147 @@
+# 文件名: checkpoint_store.py
+import os
+import json
+import hashlib
+import time
+from tracing import span
+
+# ===================================================================
+# 阶段检查点 (Stage Checkpoints)
+# ===================================================================
+# 每个流水线阶段 (丰富提示、草稿、Validator、Critic、Artist、灵魂) 都用
+# "输入内容的哈希" 作为键，把产物持久化到磁盘。
+# 重新运行时，只要输入没变，就直接读取产物，跳过整个阶段。
+
+CHECKPOINT_DIR = "./output/checkpoints"
+
+_checkpoints_enabled = True
+
+
+def configure_checkpoints(checkpoint_dir: str = None, enabled: bool = True):
+    """
+    设置检查点目录与开关。
+    :param checkpoint_dir: 检查点根目录 (None 则保持当前设置)
+    :param enabled: False 则所有阶段都会重新执行，且不写入检查点
+    """
+    global CHECKPOINT_DIR, _checkpoints_enabled
+    if checkpoint_dir:
+        CHECKPOINT_DIR = checkpoint_dir
+    _checkpoints_enabled = enabled
+    state = "启用" if enabled else "禁用"
+    print(f"[Checkpoint] 检查点已{state}，目录: {CHECKPOINT_DIR}")
+
+
+def compute_input_hash(*inputs) -> str:
+    """
+    计算任意 JSON 可序列化输入的内容哈希 (键顺序无关)。
+    """
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _atomic_write_json(path: str, data) -> None:
+    """ 先写临时文件再替换，避免崩溃时留下半个 JSON 文件 """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _checkpoint_path(stage: str, input_hash: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, stage, f"{input_hash}.json")
+
+
+def load_checkpoint(stage: str, input_hash: str):
+    """
+    读取某个阶段的检查点产物。
+    :return: 产物 (artifact)；不存在或已禁用则返回 None
+    """
+    if not _checkpoints_enabled:
+        return None
+    path = _checkpoint_path(stage, input_hash)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("artifact")
+    except Exception as e:
+        print(f"!!! [Checkpoint] 警告: 检查点 {path} 损坏，将重新执行该阶段: {e}")
+        return None
+
+
+def save_checkpoint(stage: str, input_hash: str, artifact) -> None:
+    """ 持久化某个阶段的产物 """
+    if not _checkpoints_enabled:
+        return
+    try:
+        _atomic_write_json(_checkpoint_path(stage, input_hash), {
+            "stage": stage,
+            "input_hash": input_hash,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "artifact": artifact
+        })
+    except Exception as e:
+        print(f"!!! [Checkpoint] 警告: 无法保存阶段 '{stage}' 的检查点: {e}")
+
+
+def run_checkpointed_stage(stage: str, inputs: list, compute_fn, is_valid=None, **span_attrs):
+    """
+    执行一个带检查点的阶段：输入未变则直接复用产物，否则执行 compute_fn 并保存。
+
+    :param stage: 阶段名 (e.g., "enrich", "draft", "critic")
+    :param inputs: 决定该阶段产物的全部输入 (会被哈希)
+    :param compute_fn: 无参函数，返回 JSON 可序列化的产物
+    :param is_valid: (可选) 判断产物是否值得保存，例如 API 调用失败时不保存
+    :param span_attrs: (可选) 附加到追踪 span 上的属性 (e.g., attempt=2)
+    :return: 产物
+    """
+    with span(stage, stage=stage, **span_attrs) as s:
+        input_hash = compute_input_hash(stage, *inputs)
+        cached = load_checkpoint(stage, input_hash)
+        if cached is not None:
+            s.set(cached=True)
+            print(f"--- [Checkpoint] ⏩ 阶段 '{stage}' 输入未变 ({input_hash[:10]})，复用检查点。 ---")
+            return cached
+
+        s.set(cached=False)
+        artifact = compute_fn()
+        if artifact is not None and (is_valid is None or is_valid(artifact)):
+            save_checkpoint(stage, input_hash, artifact)
+        return artifact
+
+
+# ===================================================================
+# 作业清单 (Job Manifest) —— 用于阶段内部的断点续跑
+# ===================================================================
+# 例如 Artist 阶段：每完成一个资产就记录一次，崩溃后只需重跑未完成的资产。
+
+def _manifest_path(name: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"{name}_manifest.json")
+
+
+def load_job_manifest(name: str) -> dict:
+    """
+    读取作业清单: { job_id: {"job_hash": ..., ...} }
+    """
+    if not _checkpoints_enabled:
+        return {}
+    path = _manifest_path(name)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"!!! [Checkpoint] 警告: 作业清单 {path} 损坏，将全部重跑: {e}")
+        return {}
+
+
+def save_job_manifest(name: str, manifest: dict) -> None:
+    """ 持久化作业清单 (每完成一个作业调用一次) """
+    if not _checkpoints_enabled:
+        return
+    try:
+        _atomic_write_json(_manifest_path(name), manifest)
+    except Exception as e:
+        print(f"!!! [Checkpoint] 警告: 无法保存作业清单 '{name}': {e}")
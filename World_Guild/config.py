@@ -45,6 +45,26 @@ SOUL_API_CONFIG = {
     "api_key": "" # <--- 在此替换你的密钥
 }
 
+# ===================================================================
+# Token 预算与价格 (token_accounting.py 使用)
+# ===================================================================
+# 每个 Agent 单次调用的提示 Token 上限 (估算值)。超出时先压缩，仍超出则拒绝调用。
+# 不在此表中的 Agent 不限制。
+PROMPT_TOKEN_BUDGETS = {
+    "Enricher Agent": 4000,
+    "Manager Agent": 24000,
+    "Critic Agent": 12000,
+    "Artist Agent": 6000,
+    "Soul Writer Agent": 8000,
+}
+
+# 模型价格 (美元 / 百万 Token)。用于成本报告，请按你的服务商价格修改。
+MODEL_PRICING = {
+    "gpt-4.1": {"prompt": 2.00, "completion": 8.00},
+    "gemini-3-pro-preview": {"prompt": 2.00, "completion": 12.00},
+    "gemini-3-pro-image-preview": {"prompt": 2.00, "completion": 120.00},
+}
+
 
     # azure示例:
     # "type": "azure",
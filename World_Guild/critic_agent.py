@@ -1,21 +1,30 @@
 import os
+import re
 import json
 import sys
 import io
+import math
 import base64
+import hashlib
+import threading
 from typing import List, Dict, Any, Optional
 
 # 关键：导入 Pillow (PIL) 用于绘图
 try:
-    from PIL import Image, ImageDraw, ImageFont
+    from PIL import Image, ImageColor, ImageDraw, ImageFont
+    import numpy as np
 except ImportError:
-    print("!!! 错误: Critic Agent 需要 'Pillow' 库来绘制布局草图。", file=sys.stderr)
-    print("!!! 请运行: pip install Pillow", file=sys.stderr)
+    print("!!! 错误: Critic Agent 需要 'Pillow' 和 'numpy' 库来绘制布局草图。", file=sys.stderr)
+    print("!!! 请运行: pip install Pillow numpy", file=sys.stderr)
     sys.exit(1)
 
 # --- 从我们的独立文件中导入 ---
 from config import CRITIC_API_CONFIG
-from api_client_utils import create_api_client
+from api_client_utils import create_api_client, call_chat_completion
+from token_accounting import PromptBudgetExceeded
+from tracing import span, traced
+from plan_codec import encode_size_table
+from pre_critic import run_pre_critic
 
 # --- 初始化 Critic 的 VLM 客户端 ---
 try:
@@ -33,149 +42,342 @@ except Exception as e:
 # 核心功能 1：提取尺寸数据 (用于 Task 1)
 # ===================================================================
 
-def _extract_size_data(plan_json: Dict[str, Any]) -> str:
+# 提示超出 Critic 的 Token 预算时 (compact_fn)，尺寸表中的描述截断到这个长度
+COMPACT_DESCRIPTION_MAX_CHARS = 40
+
+def _extract_size_data(plan_json: Dict[str, Any], max_description_chars: Optional[int] = None) -> str:
     """
     (辅助函数)
     正如你的提议，我们不发送整个 JSON，而是提取一个简化的、
     专注于尺寸的列表，以便 VLM 检查比例。
+    :param max_description_chars: (可选) 描述截断长度，用于压缩超出预算的提示
     """
     print("[Critic Agent] 正在提取资产尺寸数据...")
-    size_data = []
     assets = plan_json.get("assets", {})
-    
-    for asset_id, details in assets.items():
-        size_data.append({
-            "asset_id": asset_id,
-            "type": details.get("type"),
-            "description": details.get("description"),
-            "base_size (WxH)": details.get("base_size"),
-            "visual_size (WxH)": details.get("visual_size")
-        })
-        
-    return json.dumps(size_data, indent=2, ensure_ascii=False)
+    if max_description_chars is not None:
+        assets = {
+            asset_id: {**details, "description": (details.get("description") or "")[:max_description_chars]}
+            for asset_id, details in assets.items()
+        }
+    # 紧凑表格: {"columns": [...], "rows": [[...], ...]}，尺寸均为 [宽, 高]
+    return encode_size_table(assets)
 
 # ===================================================================
 # 核心功能 2：生成布局草图 (用于 Task 2)
 # ===================================================================
-# 瓦片大小（像素）- 用于绘制草图
+# 瓦片大小（像素）上限 - 用于绘制草图 (大场景会自动缩小)
 SKETCH_TILE_SIZE = 16 
+# 瓦片大小下限；低于此值时不再绘制文字标签
+SKETCH_MIN_TILE_SIZE = 2
+SKETCH_LABEL_MIN_TILE_SIZE = 8
+# 草图像素预算 (宽 x 高)。VLM 按图片大小计费/降采样，超出预算时自动降低每瓦片像素数
+SKETCH_MAX_PIXELS = 1024 * 1024
+# 输出格式: "PNG" (调色板，无损) / "JPEG" / "WEBP"
+SKETCH_FORMAT = "PNG"
+SKETCH_LOSSY_QUALITY = 80
+SKETCH_IMAGE_DETAIL = "low" # 草图不需要高分辨率
+SKETCH_SAVE_PATH = "output/critic_sketch"
 # 颜色
 COLOR_WALL = "#888888"
 COLOR_OBJECT = "#333333"
 COLOR_NPC = "#FF0000" # 红色
 COLOR_TEXT = "#000000"
+COLOR_WALL_FILL = "#E0E0E0"
+
+# 调色板索引 (草图只用这几种颜色，直接以调色板图像绘制，无需再量化)
+_PALETTE = ["#FFFFFF", COLOR_WALL_FILL, COLOR_WALL, COLOR_OBJECT, COLOR_NPC, COLOR_TEXT]
+_P_WALL_FILL, _P_WALL, _P_OBJECT, _P_NPC, _P_TEXT = 1, 2, 3, 4, 5
+_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def configure_sketch_path(save_path: str):
+    """ 设置草图保存路径 (不含扩展名)；批量生成时每个场景写到自己的目录 """
+    global SKETCH_SAVE_PATH
+    SKETCH_SAVE_PATH = save_path
+
 
+def _pick_sketch_tile_size(width_tiles: int, height_tiles: int) -> int:
+    """ 在像素预算内选择最大的每瓦片像素数 """
+    fit = int(math.sqrt(SKETCH_MAX_PIXELS / max(1, width_tiles * height_tiles)))
+    return max(SKETCH_MIN_TILE_SIZE, min(SKETCH_TILE_SIZE, fit))
 
-def _generate_layout_sketch(plan_json: Dict[str, Any]) -> str:
+
+def _rasterize_rects(canvas, rects, value: int):
+    """
+    (向量化) 把一组矩形 [[x1, y1, x2, y2], ...] (像素，右下开区间) 填充为 value。
+    用二维差分数组一次性累加所有矩形，再做前缀和得到覆盖区域。
+    """
+    if len(rects) == 0:
+        return
+    h, w = canvas.shape
+    rects = np.asarray(rects, dtype=np.int64)
+    x1 = np.clip(rects[:, 0], 0, w)
+    y1 = np.clip(rects[:, 1], 0, h)
+    x2 = np.clip(rects[:, 2], 0, w)
+    y2 = np.clip(rects[:, 3], 0, h)
+    keep = (x2 > x1) & (y2 > y1)
+    x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+
+    diff = np.zeros((h + 1, w + 1), dtype=np.int32)
+    np.add.at(diff, (y1, x1), 1)
+    np.add.at(diff, (y1, x2), -1)
+    np.add.at(diff, (y2, x1), -1)
+    np.add.at(diff, (y2, x2), 1)
+    covered = diff.cumsum(axis=0).cumsum(axis=1)[:h, :w] > 0
+    canvas[covered] = value
+
+
+def _rect_edges(rects, width: int):
+    """ 把矩形转换为 4 条宽度为 width 的边 (每条边也是一个矩形)，用于绘制空心框 """
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+    x1, y1, x2, y2 = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+    return np.concatenate([
+        np.stack([x1, y1, x2, y1 + width], axis=1),
+        np.stack([x1, y2 - width, x2, y2], axis=1),
+        np.stack([x1, y1, x1 + width, y2], axis=1),
+        np.stack([x2 - width, y1, x2, y2], axis=1),
+    ])
+
+
+def _encode_sketch(img) -> tuple:
+    """ 按 SKETCH_FORMAT 编码一次，返回 (bytes, mime_type, 文件扩展名) """
+    image_format = SKETCH_FORMAT.upper()
+    buffered = io.BytesIO()
+    if image_format in ("JPEG", "WEBP"):
+        img.convert("RGB").save(buffered, format=image_format, quality=SKETCH_LOSSY_QUALITY)
+    else:
+        image_format = "PNG"
+        img.save(buffered, format="PNG", optimize=True)
+    return buffered.getvalue(), _MIME_TYPES[image_format], image_format.lower().replace("jpeg", "jpg")
+
+
+def _generate_layout_sketch(plan_json: Dict[str, Any], crop_area: Optional[list] = None) -> tuple:
     """
     (辅助函数)
     按照你的要求，生成一个简笔画布局图：
     - 框框大小 = base_size
     - 框框内有文字 = asset_id
+    墙壁与框线用 numpy 一次性光栅化到调色板图像上，按像素预算自动选择分辨率；
+    图像只编码一次，同一份字节既写入磁盘也作为 VLM 的输入。
+    :param crop_area: (可选) [x, y, w, h] 瓦片范围，只输出这部分草图 (局部复审)
+    :return: (Base64 字符串, MIME 类型)；失败时返回 ("", None)
     """
     print("[Critic Agent] 正在生成布局草图...")
     try:
         grid_size = plan_json.get("metadata", {}).get("grid_size", [25, 20])
         layout = plan_json.get("layout", {})
         assets = plan_json.get("assets", {})
-        
-        img_width = grid_size[0] * SKETCH_TILE_SIZE
-        img_height = grid_size[1] * SKETCH_TILE_SIZE
-        
-        # 创建一个白色背景的图像
-        img = Image.new('RGB', (img_width, img_height), 'white')
-        draw = ImageDraw.Draw(img)
-        
-        # 尝试加载一个字体
-        try:
-            # 你可以指定一个 .ttf 字体路径以获得更好的效果
-            font = ImageFont.load_default()
-        except IOError:
-            print("[Critic Agent] 警告: 无法加载默认字体。")
-            font = None
-
-        # --- 【【【 BUG 修复：第 1 步：创建 base_size 的查找字典 】】】 ---
-        size_lookup = {}
-        for asset_id, details in assets.items():
-            if details and "base_size" in details:
-                size_lookup[asset_id] = details["base_size"]
-        # -------------------------------------------------------------
-
-        # 1. 绘制墙壁 (灰色粗框)
+
+        origin_x, origin_y, width_tiles, height_tiles = crop_area or [0, 0, grid_size[0], grid_size[1]]
+        tile = _pick_sketch_tile_size(width_tiles, height_tiles)
+        img_width = width_tiles * tile
+        img_height = height_tiles * tile
+
+        def _to_px(x, y):
+            return round((x - origin_x) * tile), round((y - origin_y) * tile)
+
+        # 1. 墙壁 (浅灰填充 + 灰色粗框)
+        wall_rects = []
         for wall in layout.get("wall_layer", []):
             if wall.get("command") == "fill_rect":
                 area = wall.get("area") # [x, y, w, h]
                 if not area or len(area) != 4: continue
-                x1 = area[0] * SKETCH_TILE_SIZE
-                y1 = area[1] * SKETCH_TILE_SIZE
-                x2 = (area[0] + area[2]) * SKETCH_TILE_SIZE
-                y2 = (area[1] + area[3]) * SKETCH_TILE_SIZE
-                draw.rectangle([x1, y1, x2, y2], outline=COLOR_WALL, width=2, fill="#E0E0E0")
-
-        # 2. 绘制物体和 NPC (使用 AABB 逻辑)
-        items_to_draw = layout.get("object_layer", []) + layout.get("npc_layer", [])
-        
-        for item in items_to_draw:
-            # 使用与 Validator 相同的 AABB 计算逻辑
+                wall_rects.append([*_to_px(area[0], area[1]), *_to_px(area[0] + area[2], area[1] + area[3])])
+
+        # 2. 物体和 NPC (使用与 Validator 相同的 AABB 逻辑)
+        object_rects, npc_rects, labels = [], [], []
+        for item in layout.get("object_layer", []) + layout.get("npc_layer", []):
             pos = item.get("position")
             asset_id = item.get("asset_id", "N/A")
-            
-            # --- 【【【 BUG 修复：第 2 步：从查找字典中获取 base_size 】】】 ---
-            size = size_lookup.get(asset_id)
-            # -------------------------------------------------------------
-            
-            item_type = assets.get(asset_id, {}).get("type", "object")
-            
+            details = assets.get(asset_id) or {}
+            size = details.get("base_size")
+
             if not pos or not size or len(pos) != 2 or len(size) != 2:
                 # 如果 尺寸(size) 为空 (因为 assets 里就没有)，则跳过绘制
                 continue
-
-            pos_x_tile, pos_y_tile = pos[0], pos[1]
-            size_w_tile, size_h_tile = size[0], size[1]
-            
-            if not all(isinstance(v, (int, float)) for v in [pos_x_tile, pos_y_tile, size_w_tile, size_h_tile]):
+            if not all(isinstance(v, (int, float)) for v in [*pos, *size]):
                 print(f"[Critic Agent] 警告: {asset_id} 的 position 或 base_size 含有无效数据。跳过绘制。")
                 continue
+            if size[0] <= 0 or size[1] <= 0:
+                continue
 
-            if size_w_tile <= 0 or size_h_tile <= 0:
+            x1, y1 = _to_px(pos[0] - size[0] / 2.0, pos[1] - size[1])
+            x2, y2 = _to_px(pos[0] + size[0] / 2.0, pos[1])
+            if x2 <= 0 or y2 <= 0 or x1 >= img_width or y1 >= img_height:
                 continue
+            (npc_rects if details.get("type") in ["npc", "agent"] else object_rects).append([x1, y1, x2, y2])
+            labels.append((x1 + 2, y1 + 2, asset_id))
+
+        canvas = np.zeros((img_height, img_width), dtype=np.uint8)
+        _rasterize_rects(canvas, wall_rects, _P_WALL_FILL)
+        if wall_rects:
+            _rasterize_rects(canvas, _rect_edges(wall_rects, 2), _P_WALL)
+        if object_rects:
+            _rasterize_rects(canvas, _rect_edges(object_rects, 1), _P_OBJECT)
+        if npc_rects:
+            _rasterize_rects(canvas, _rect_edges(npc_rects, 1), _P_NPC)
+
+        img = Image.fromarray(canvas, mode="P")
+        img.putpalette([c for color in _PALETTE for c in ImageColor.getrgb(color)])
+
+        # 3. 文字标签 (瓦片太小时文字会互相重叠，不再绘制)
+        if tile >= SKETCH_LABEL_MIN_TILE_SIZE:
+            draw = ImageDraw.Draw(img)
+            try:
+                font = ImageFont.load_default()
+            except IOError:
+                print("[Critic Agent] 警告: 无法加载默认字体。")
+                font = None
+            for x, y, text in labels:
+                draw.text((x, y), text, fill=_P_TEXT, font=font)
+        else:
+            print(f"[Critic Agent] 草图缩放到 {tile} px/瓦片，省略文字标签。")
 
-            half_width_tile = size_w_tile / 2.0
-            
-            # 计算像素坐标
-            px_x1 = (pos_x_tile - half_width_tile) * SKETCH_TILE_SIZE
-            px_y1 = (pos_y_tile - size_h_tile) * SKETCH_TILE_SIZE
-            px_x2 = (pos_x_tile + half_width_tile) * SKETCH_TILE_SIZE
-            px_y2 = pos_y_tile * SKETCH_TILE_SIZE
-            
-            color = COLOR_NPC if item_type in ["npc", "agent"] else COLOR_OBJECT
-            
-            # 绘制矩形
-            draw.rectangle([px_x1, px_y1, px_x2, px_y2], outline=color, width=1)
-            # 绘制文字
-            draw.text((px_x1 + 2, px_y1 + 2), asset_id, fill=COLOR_TEXT, font=font)
-
-        # 3. 将图像转换为 Base64
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
+        # 4. 只编码一次: 同一份字节写入磁盘并转为 Base64
+        img_bytes, mime_type, extension = _encode_sketch(img)
 
         try:
-            save_path = "output/critic_sketch.png"
+            save_path = f"{SKETCH_SAVE_PATH}.{extension}"
             os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            img.save(save_path)
+            with open(save_path, "wb") as f:
+                f.write(img_bytes)
             print(f"[Critic Agent] 布局草图已保存到 {save_path}")
         except Exception as save_e:
             print(f"!!! [Critic Agent] 警告: 无法保存草图文件: {save_e}", file=sys.stderr)
-        # ------------------------------------
 
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        
-        print("[Critic Agent] 布局草图生成完毕。")
-        return img_base64
+        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
+
+        print(f"[Critic Agent] 布局草图生成完毕 ({img_width}x{img_height}, {tile} px/瓦片, {len(img_bytes)} 字节)。")
+        return img_base64, mime_type
 
     except Exception as e:
         print(f"!!! [Critic Agent] 生成布局草图失败: {e}", file=sys.stderr)
-        return ""
+        return "", None
+
+
+# ===================================================================
+# 核心功能 3：区域差异 (Region Diff) —— 修复后只复审变化的区域
+# ===================================================================
+# 把场景按固定大小切成区域，记录每个区域内容的签名与上次的审查结论:
+#   - 修复后只把签名变化的区域 (的包围框) 裁剪出来交给 VLM，尺寸数据也只发这些区域内的资产；
+#   - 未变化区域沿用缓存的结论 (只有能归属到具体资产的错误能按区域沿用)；
+#   - 与某次审查过的版本完全相同时，原样沿用那次的全部错误 (包括整体性的意见)，不调用 VLM；
+#   - 变化范围过大时退回整体审查。
+# 缓存按规划内容 (区域签名) 索引，对比的基准是已审查版本中未变化区域最多的一个，与 scene_name 无关。
+
+# 区域边长 (瓦片)
+CRITIC_REGION_SIZE = 16
+# 裁剪框面积超过场景面积的此比例时，直接整体审查
+REGION_DIFF_MAX_FRACTION = 0.6
+
+# 内容哈希 -> {"signatures": {区域: 签名}, "verdicts": {区域: [错误]}, "errors": [本次审查的全部错误]}
+_critique_cache = {}
+_critique_cache_lock = threading.Lock()
+
+
+def reset_critique_cache():
+    """ 清空区域审查缓存 (每个场景的生成流程开始前调用) """
+    with _critique_cache_lock:
+        _critique_cache.clear()
+
+
+def _regions_of_rect(x0: float, y0: float, x1: float, y1: float) -> set:
+    """ 瓦片矩形 [x0, x1) x [y0, y1) 覆盖的区域坐标 """
+    r = CRITIC_REGION_SIZE
+    x1, y1 = max(x1, x0 + 1), max(y1, y0 + 1)
+    return {
+        (rx, ry)
+        for rx in range(math.floor(x0) // r, (math.ceil(x1) - 1) // r + 1)
+        for ry in range(math.floor(y0) // r, (math.ceil(y1) - 1) // r + 1)
+    }
+
+
+def _index_regions(plan_json: Dict[str, Any]) -> tuple:
+    """
+    :return: (signatures, asset_regions)
+        signatures: {区域: 区域内容的哈希} (内容包括图层条目与对应资产的尺寸/属性)
+        asset_regions: {asset_id: 该资产出现的区域集合}
+    """
+    grid_w, grid_h = plan_json.get("metadata", {}).get("grid_size", [25, 20])
+    layout = plan_json.get("layout", {})
+    assets = plan_json.get("assets", {})
+    properties = plan_json.get("properties", {})
+
+    contents = {region: [] for region in _regions_of_rect(0, 0, grid_w, grid_h)}
+    asset_regions = {}
+
+    def _add(regions, asset_id, entry):
+        token = json.dumps([entry, assets.get(asset_id), properties.get(asset_id)], sort_keys=True, ensure_ascii=False)
+        for region in regions:
+            contents.setdefault(region, []).append(token)
+        asset_regions.setdefault(asset_id, set()).update(regions)
+
+    for layer in ("floor_layer", "wall_layer"):
+        for entry in layout.get(layer, []):
+            area = entry.get("area")
+            if isinstance(area, list) and len(area) == 4:
+                x, y, w, h = area
+                _add(_regions_of_rect(x, y, x + w, y + h), entry.get("asset_id"), entry)
+
+    for layer in ("object_layer", "npc_layer"):
+        for entry in layout.get(layer, []):
+            asset_id = entry.get("asset_id")
+            pos = entry.get("position")
+            size = (assets.get(asset_id) or {}).get("base_size") or [1, 1]
+            if not (isinstance(pos, list) and len(pos) == 2 and len(size) == 2):
+                continue
+            # 与草图相同的 AABB: position 为底边中点
+            _add(_regions_of_rect(pos[0] - size[0] / 2, pos[1] - size[1], pos[0] + size[0] / 2, pos[1]), asset_id, entry)
+
+    signatures = {
+        region: hashlib.sha1("\n".join(sorted(tokens)).encode("utf-8")).hexdigest()
+        for region, tokens in contents.items()
+    }
+    return signatures, asset_regions
+
+
+def _content_key(signatures: dict, grid_size: list) -> str:
+    """ 规划内容 (Critic 看得到的部分) 的哈希 """
+    return hashlib.sha1(json.dumps([grid_size, sorted(signatures.items())]).encode("utf-8")).hexdigest()
+
+
+def _closest_review(signatures: dict, grid_size: list) -> Optional[dict]:
+    """ 已审查版本中 (同尺寸) 未变化区域最多的一个；没有任何区域相同时返回 None """
+    best, best_same = None, 0
+    with _critique_cache_lock:
+        entries = list(_critique_cache.values())
+    for entry in entries:
+        if entry["grid_size"] != grid_size:
+            continue
+        same = sum(1 for r, sig in signatures.items() if entry["signatures"].get(r) == sig)
+        if same > best_same:
+            best, best_same = entry, same
+    return best
+
+
+def _regions_bbox(regions: set, grid_size: list) -> list:
+    """ 区域集合的包围框 [x, y, w, h] (瓦片，裁剪到场景范围内) """
+    r = CRITIC_REGION_SIZE
+    x0 = max(0, min(rx for rx, _ in regions) * r)
+    y0 = max(0, min(ry for _, ry in regions) * r)
+    x1 = min(grid_size[0], (max(rx for rx, _ in regions) + 1) * r)
+    y1 = min(grid_size[1], (max(ry for _, ry in regions) + 1) * r)
+    return [x0, y0, max(1, x1 - x0), max(1, y1 - y0)]
+
+
+def _attribute_errors(errors: list, asset_regions: dict, reviewed_regions: set) -> dict:
+    """
+    把 VLM 的错误归属到区域: 错误文本中提到的 asset_id 所在的 (本次审查的) 区域。
+    无法归属的整体性意见不进入区域结论 (只随该版本的全部错误一起缓存)。
+    """
+    verdicts = {}
+    for error in errors:
+        text = str(error)
+        for asset_id, regions in asset_regions.items():
+            if re.search(rf"(?<!\w){re.escape(asset_id)}(?!\w)", text):
+                for region in regions & reviewed_regions:
+                    verdicts.setdefault(region, []).append(error)
+    return verdicts
 
 
 # ===================================================================
@@ -186,7 +388,7 @@ CRITIC_SYSTEM_PROMPT = """
     你是一个资深的游戏关卡设计师和QA（质量保证）专家。
     你的任务是审查一个由AI生成的2.5D像素游戏场景设计。
     你将收到两部分信息：
-    1. 【尺寸数据】：一个 JSON 列表，包含所有资产的 `base_size` (物理底座) 和 `visual_size` (视觉贴图)。
+    1. 【尺寸数据】：一个 JSON 表格 (columns 为列名，rows 每行一个资产)，包含所有资产的 `base_size` (物理底座) 和 `visual_size` (视觉贴图)，尺寸均为 [宽, 高]。
     2. 【布局草图】：一张简笔画，显示了物体在场景中的位置和 `base_size`。
 
     你的工作是找出**比例失调**和**布局不合理**的问题。
@@ -209,6 +411,7 @@ CRITIC_USER_PROMPT_TEMPLATE = """
     ---
     **第 2 部分：布局草图 (用于语义检查)** [请查看你下方看到的图片]
     ---
+    {scope_note}
 
     **你的审查任务：**
 
@@ -235,34 +438,51 @@ CRITIC_USER_PROMPT_TEMPLATE = """
 # ===================================================================
 # VLM API 调用
 # ===================================================================
-def _call_vlm_for_critique(size_data_str: str, image_base64: str) -> Optional[dict]:
-    """ (辅助函数) 调用 VLM API (多模态) """
+def _call_vlm_for_critique(size_data_str: str, image_base64: str, crop_area: Optional[list] = None, mime_type: str = "image/png", compact_size_data_str: Optional[str] = None) -> Optional[dict]:
+    """
+    (辅助函数) 调用 VLM API (多模态)
+    :param compact_size_data_str: (可选) 提示超出预算时改用的精简尺寸表
+    :raises PromptBudgetExceeded: 压缩后仍超出预算 (与 API 失败区分，由 run_critic 处理)
+    """
     print("[Critic Agent] 正在连接 VLM API 进行评估...")
 
-    user_prompt = CRITIC_USER_PROMPT_TEMPLATE.format(size_data_str=size_data_str)
-
-    messages = [
-        {"role": "system", "content": CRITIC_SYSTEM_PROMPT},
-        {
-            "role": "user",
-            "content": [
-                # 1. 文本部分：提示
-                {"type": "text", "text": user_prompt},
-                
-                # 2. 图像部分：草图
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/png;base64,{image_base64}",
-                        "detail": "low" # 草图不需要高分辨率
+    scope_note = ""
+    if crop_area:
+        x, y, w, h = crop_area
+        scope_note = (
+            f"**注意：这是修复后的局部复审。** 草图只包含场景中发生变化的区域 "
+            f"(瓦片范围: x={x}~{x + w - 1}, y={y}~{y + h - 1})，尺寸数据也只包含该区域内的资产。"
+            f"只审查这部分内容，不要因为看不到区域外的内容而报告问题。请在错误描述中写明相关的 asset_id。"
+        )
+
+    def _build_messages(size_text: str) -> list:
+        user_prompt = CRITIC_USER_PROMPT_TEMPLATE.format(size_data_str=size_text, scope_note=scope_note)
+        return [
+            {"role": "system", "content": CRITIC_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    # 1. 文本部分：提示
+                    {"type": "text", "text": user_prompt},
+                    
+                    # 2. 图像部分：草图
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{image_base64}",
+                            "detail": SKETCH_IMAGE_DETAIL
+                        }
                     }
-                }
-            ]
-        }
-    ]
+                ]
+            }
+        ]
+
+    messages = _build_messages(size_data_str)
 
     try:
-        response = client.chat.completions.create(
+        response = call_chat_completion(
+            client, "Critic Agent",
+            compact_fn=(lambda: _build_messages(compact_size_data_str)) if compact_size_data_str else None,
             model=CRITIC_MODEL_NAME,
             messages=messages,
             # 许多 VLM API (如 Azure) 不支持 response_format，我们手动解析 JSON
@@ -291,21 +511,29 @@ def _call_vlm_for_critique(size_data_str: str, image_base64: str) -> Optional[di
             # 即使不是 JSON，也要将其视为一个“错误报告”
             return {"errors": [f"VLM 非结构化响应: {response_content}"]}
 
+    except PromptBudgetExceeded:
+        raise
     except Exception as e:
         print(f"!!! [Critic Agent] VLM API 调用或 JSON 解析失败: {e}", file=sys.stderr)
         return None
 # ===================================================================
 # 主入口函数
 # ===================================================================
-def run_critic(plan_json: Dict[str, Any], use_vlm: bool = True) -> Optional[str]:
+@traced("critic.review")
+def run_critic(plan_json: Dict[str, Any], use_vlm: bool = True, use_pre_critic: bool = True, use_region_diff: bool = True, review_info: Optional[dict] = None) -> Optional[str]:
     """ 
     运行 Critic (VLM QA) 检查。
 
     :param plan_json: 待检查的场景 JSON (dict)
     :param use_vlm: 是否启用 VLM 检查
+    :param use_pre_critic: 是否先运行规则预审 (发现阻断性问题或没有任何问题时跳过 VLM)
+    :param use_region_diff: 是否只复审与上次审查相比发生变化的区域
+    :param review_info: (可选) 用于收集审查信息的字典: "vlm_reviewed" = 结论是否来自 VLM 审查 (本次调用或沿用的缓存)
     :return: 如果有错误，返回一个格式化的错误报告 (str)；
             如果没有错误，返回 None。
     """
+    if review_info is not None:
+        review_info["vlm_reviewed"] = False
     if not use_vlm:
         print("[Critic Agent] VLM 检查被禁用。")
         return None
@@ -317,27 +545,109 @@ def run_critic(plan_json: Dict[str, Any], use_vlm: bool = True) -> Optional[str]
         print(f"[Critic Agent] 错误: 传入的 plan_json 不是一个字典 (dict)。")
         return "严重错误: Critic 接收到的数据不是一个有效的 JSON 字典。"
 
-    # 1. 提取尺寸数据 (Task 1 Input)
-    size_data_str = _extract_size_data(plan_json)
+    # 0. 规则预审 (快速通道)
+    rule_issues = []
+    if use_pre_critic:
+        with span("critic.pre_critic") as s:
+            pre_result = run_pre_critic(plan_json)
+            s.set(score=pre_result["score"], blocking=len(pre_result["blocking"]), skip_vlm=pre_result["skip_vlm"])
+
+        if pre_result["blocking"]:
+            print(f"[Critic Agent] 规则预审发现 {len(pre_result['blocking'])} 个阻断性问题，跳过 VLM，直接修复。")
+            issues = pre_result["blocking"] + pre_result["warnings"]
+            return "规则审查报告 (请修复以下问题):\n" + "\n".join(f"- {issue}" for issue in issues)
+
+        if pre_result["skip_vlm"]:
+            print("[Critic Agent] 规则预审未发现任何问题，跳过 VLM 评估。")
+            return None
+
+        rule_issues = pre_result["warnings"]
+
+    # 1. 区域差异: 与最接近的已审查版本对比，确定需要复审的区域
+    grid_size = plan_json.get("metadata", {}).get("grid_size", [25, 20])
+    signatures, asset_regions = _index_regions(plan_json)
+    content_key = _content_key(signatures, grid_size)
+    cached = _closest_review(signatures, grid_size) if use_region_diff else None
+
+    crop_area = None
+    reviewed_regions = set(signatures)
+    carried_errors = []
+    if cached:
+        changed = {r for r in signatures if cached["signatures"].get(r) != signatures[r]}
+        if not changed:
+            # 完全相同的版本: 原样沿用上次的全部错误 (包括无法归属到资产的整体性意见)
+            print("[Critic Agent] 与已审查的版本相比没有变化，沿用该次审查的全部结论。")
+            reviewed_regions = set()
+            carried_errors = list(cached["errors"])
+        else:
+            bbox = _regions_bbox(changed, grid_size)
+            if bbox[2] * bbox[3] <= REGION_DIFF_MAX_FRACTION * grid_size[0] * grid_size[1]:
+                crop_area = bbox
+                reviewed_regions = _regions_of_rect(bbox[0], bbox[1], bbox[0] + bbox[2], bbox[1] + bbox[3]) & set(signatures)
+                print(f"[Critic Agent] {len(changed)}/{len(signatures)} 个区域发生变化，只复审范围 {crop_area}。")
+            # 未变化区域沿用缓存的结论
+            for region in sorted(set(signatures) - reviewed_regions):
+                carried_errors += cached["verdicts"].get(region, [])
+
+    errors = []
+    if reviewed_regions:
+        # 2. 提取尺寸数据 (Task 1 Input) —— 局部复审时只包含裁剪范围内的资产
+        size_source = plan_json
+        if crop_area:
+            size_source = {"assets": {
+                asset_id: details for asset_id, details in plan_json.get("assets", {}).items()
+                if asset_regions.get(asset_id, set()) & reviewed_regions
+            }}
+        size_data_str = _extract_size_data(size_source)
+        compact_size_data_str = _extract_size_data(size_source, max_description_chars=COMPACT_DESCRIPTION_MAX_CHARS)
+
+        # 3. 生成布局草图 (Task 2 Input)
+        with span("critic.sketch", region_diff=bool(crop_area), reviewed_regions=len(reviewed_regions)) as s:
+            sketch_base64, sketch_mime = _generate_layout_sketch(plan_json, crop_area=crop_area)
+            s.set(sketch_bytes=len(sketch_base64 or ""))
+        if not sketch_base64:
+            return "严重错误: Critic 无法生成布局草图。"
+
+        # 4. 调用 VLM
+        try:
+            report_json = _call_vlm_for_critique(size_data_str, sketch_base64, crop_area=crop_area, mime_type=sketch_mime,
+                                                 compact_size_data_str=compact_size_data_str)
+        except PromptBudgetExceeded as e:
+            print(f"!!! [Critic Agent] {e}", file=sys.stderr)
+            return "严重错误: Critic 提示超出 Token 预算，无法进行语义评估。"
+
+        if not report_json:
+            # API 调用失败
+            return "严重错误: VLM API 调用失败，无法进行语义评估。"
 
-    # 2. 生成布局草图 (Task 2 Input)
-    sketch_base64 = _generate_layout_sketch(plan_json)
-    if not sketch_base64:
-        return "严重错误: Critic 无法生成布局草图。"
+        # 5. 解析 VLM 的 JSON 响应
+        errors = report_json.get("errors", [])
 
-    # 3. 调用 VLM
-    report_json = _call_vlm_for_critique(size_data_str, sketch_base64)
+    if review_info is not None:
+        review_info["vlm_reviewed"] = True
 
-    if not report_json:
-        # API 调用失败
-        return "严重错误: VLM API 调用失败，无法进行语义评估。"
-        
-    # 4. 解析 VLM 的 JSON 响应
-    errors = report_json.get("errors", [])
+    # 6. 与未变化区域的结论合并，并以内容哈希写入缓存
+    verdicts = {r: v for r, v in (cached or {}).get("verdicts", {}).items() if r in signatures and r not in reviewed_regions}
+    verdicts.update(_attribute_errors(errors, asset_regions, reviewed_regions))
+
+    for error in carried_errors:
+        if error not in errors:
+            errors.append(error)
+
+    if use_region_diff:
+        with _critique_cache_lock:
+            _critique_cache[content_key] = {"grid_size": grid_size, "signatures": signatures,
+                                            "verdicts": verdicts, "errors": list(errors)}
 
     if not errors:
         print("[Critic Agent] VLM 评估通过，未发现语义问题。")
-        return None
+        if not rule_issues:
+            return None
+        # 规则预审发现的轻微问题仍交给 Manager 修复
+        return "规则审查报告 (请修复以下问题):\n" + "\n".join(f"- {issue}" for issue in rule_issues)
+
+    # 规则预审发现的轻微问题一并交给 Manager 修复
+    errors += rule_issues
         
     # 5. 格式化错误报告
     print(f"[Critic Agent] VLM 发现 {len(errors)} 个语义问题。")
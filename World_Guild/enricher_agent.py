@@ -2,7 +2,8 @@
 import sys
 import json
 from config import ENRICHER_API_CONFIG
-from api_client_utils import create_api_client
+from api_client_utils import create_api_client, call_chat_completion
+from tracing import traced
 
 # --- 1. 从 config.py 初始化 API 客户端 ---
 # (此部分无变化)
@@ -70,6 +71,7 @@ ENRICHER_USER_PROMPT_TEMPLATE = """
 
 # --- 3. Agent 主函数 ---
 # (此部分无变化)
+@traced("enricher")
 def enrich_prompt(prompt: str, use_llm: bool = True) -> str:
     """
     Enricher Agent 负责将简单的用户提示扩充为丰富的场景描述。
@@ -87,7 +89,8 @@ def enrich_prompt(prompt: str, use_llm: bool = True) -> str:
     full_prompt = ENRICHER_USER_PROMPT_TEMPLATE.format(user_request=prompt)
     
     try:
-        response = client.chat.completions.create(
+        response = call_chat_completion(
+            client, "Enricher Agent",
             model=ENRICHER_MODEL_NAME,
             messages=[
                 {"role": "system", "content": ENRICHER_SYSTEM_PROMPT},
@@ -0,0 +1,356 @@
+# 文件名: exemplar_library.py
+import os
+import sys
+import json
+import math
+import hashlib
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from memory_service import tokenize
+from plan_codec import dumps_compact
+
+# ===================================================================
+# 场景范例库 (Exemplar Library)
+# ===================================================================
+# Manager 的提示模板一直内联同一个大范例 (The Verdant Scholar's Hub)，
+# 无论用户要的是城堡、街道还是海滩；备用计划也总是同一个场景。
+# 这里把 "验证通过的历史场景" 存成范例库，按 (丰富后的提示 + 场景元数据 + 资产 ID) 的词建立索引:
+#   - few-shot 槽位: 在足够相关的范例中选最小的一个；仍超过 EXEMPLAR_MAX_CHARS 时，
+#                    裁出资产种类最多的一块子区域 (坐标平移到子区域原点)
+#   - 备用计划: 直接返回最相关的完整范例 (指定了 grid_size 时，相关度乘以尺寸相似度，尺寸相差太大的不用)
+# 只有经过 VLM 审查并通过的场景才加入范例库 (generation_workflow 判断)。
+# 库为空或没有相关范例时，调用方退回内置范例。
+#
+# 存储: exemplars/index.json (每个范例的词、尺寸、字符数等) + exemplars/<id>.json (完整规划)
+# 多进程共享 (batch_main 的各个 worker 使用同一个库):
+#   - 写入在文件锁 (index.lock) 内进行: 重新读取磁盘上的索引、合并新条目，再写临时文件 + os.replace；
+#   - 读取不加锁 (os.replace 保证读到的是完整的文件)，索引文件的 mtime/大小变化时重新加载内存缓存。
+
+EXEMPLAR_DIR = "./exemplars"
+EXEMPLAR_INDEX_FILE = "index.json"
+EXEMPLAR_LOCK_FILE = "index.lock"
+EXEMPLAR_MAX_CHARS = 3500          # few-shot 范例 (紧凑编码) 的字符上限
+EXEMPLAR_MIN_SCORE = 0.15          # 低于此相关度视为 "没有相关范例"
+EXEMPLAR_RELEVANCE_RATIO = 0.8     # 相关度不低于最佳的 80% 的范例中，选最小的
+EXEMPLAR_MIN_CROP = 12             # 子区域的最小边长 (瓦片)
+EXEMPLAR_CROP_SCALES = (0.85, 0.7, 0.55, 0.4)
+EXEMPLAR_MIN_GRID_SIMILARITY = 0.5  # 备用计划: 宽、高之比的乘积低于此值的范例不使用
+
+_library_lock = threading.Lock()
+_library = None                    # (index, 目录, 索引文件签名) 的内存缓存
+
+
+def configure_exemplar_library(exemplar_dir: str):
+    """ 设置范例库目录 (批量生成时所有 worker 共享同一个目录) """
+    global EXEMPLAR_DIR
+    EXEMPLAR_DIR = exemplar_dir
+    print(f"[Exemplar Library] 范例库目录: {EXEMPLAR_DIR}")
+
+
+def _scene_tokens(plan: dict, prompt: str = "") -> list:
+    """ 范例的检索词: 提示 + 场景名/描述 + 资产 ID """
+    metadata = plan.get("metadata", {})
+    text = " ".join([
+        prompt or "",
+        metadata.get("scene_name", ""),
+        metadata.get("description", ""),
+        " ".join(asset_id.replace("_", " ") for asset_id in plan.get("assets", {}))
+    ])
+    return sorted(set(tokenize(text)))
+
+
+def _index_signature(index_path: str):
+    """ 索引文件的 (mtime, 大小)；不存在时为 None。其它进程替换索引后签名会变化 """
+    try:
+        stat = os.stat(index_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load_library(exemplar_dir: str) -> dict:
+    global _library
+    index_path = os.path.join(exemplar_dir, EXEMPLAR_INDEX_FILE)
+    signature = _index_signature(index_path)
+    if _library is not None and _library[1] == exemplar_dir and _library[2] == signature:
+        return _library[0]
+    index = {}
+    if signature is not None:
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"  [Exemplar Library] 警告: 无法读取范例索引 {index_path}: {e}")
+    _library = (index, exemplar_dir, signature)
+    return index
+
+
+@contextmanager
+def _locked_library(exemplar_dir: str):
+    """ 跨进程的写锁 (exemplars/index.lock)；同一进程内的线程由 _library_lock 互斥 """
+    os.makedirs(exemplar_dir, exist_ok=True)
+    with _library_lock, open(os.path.join(exemplar_dir, EXEMPLAR_LOCK_FILE), "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK 重试 10 秒后仍未拿到锁
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _write_json_atomic(path: str, data, **dump_kwargs):
+    """ 写临时文件 (带进程号，避免多个进程共用同一个临时文件) 后 os.replace """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, **dump_kwargs)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _load_plan(entry: dict, exemplar_dir: str):
+    try:
+        with open(os.path.join(exemplar_dir, entry["file"]), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"  [Exemplar Library] 警告: 无法读取范例 {entry['file']}: {e}")
+        return None
+
+
+def add_exemplar(plan: dict, prompt: str, exemplar_dir: str = None, **info) -> str:
+    """
+    把一个验证通过的场景加入范例库 (内容相同的场景只保存一次)
+    :param prompt: 生成它的 (丰富后的) 提示
+    :param exemplar_dir: 范例库目录 (默认 EXEMPLAR_DIR，下同)
+    :param info: 额外记录到索引中的信息 (e.g., repair_rounds)
+    :return: 范例 ID
+    """
+    exemplar_dir = exemplar_dir or EXEMPLAR_DIR
+    compact = dumps_compact(plan)
+    exemplar_id = hashlib.sha1(compact.encode("utf-8")).hexdigest()[:12]
+    with _locked_library(exemplar_dir):
+        # 在锁内重新读取: 其它 worker 可能刚刚加入了范例
+        index = dict(_load_library(exemplar_dir))
+        if exemplar_id in index:
+            return exemplar_id
+        file_name = f"{exemplar_id}.json"
+        _write_json_atomic(os.path.join(exemplar_dir, file_name), plan)
+        index[exemplar_id] = {
+            "file": file_name,
+            "scene_name": plan.get("metadata", {}).get("scene_name", ""),
+            "grid_size": plan.get("metadata", {}).get("grid_size"),
+            "chars": len(compact),
+            "assets": len(plan.get("assets", {})),
+            "tokens": _scene_tokens(plan, prompt),
+            **info
+        }
+        _write_json_atomic(os.path.join(exemplar_dir, EXEMPLAR_INDEX_FILE), index, indent=1)
+    print(f"  [Exemplar Library] 新增范例 {exemplar_id} ('{index[exemplar_id]['scene_name']}', {len(compact)} 字符)，库中共 {len(index)} 个。")
+    return exemplar_id
+
+
+def record_exemplar(plan: dict, prompt: str, **info):
+    """ 工作流用: 与 add_exemplar 相同，但失败只打印警告 (范例库不应中断生成) """
+    try:
+        return add_exemplar(plan, prompt, **info)
+    except Exception as e:
+        print(f"  [Exemplar Library] 警告: 保存范例失败: {e}")
+        return None
+
+
+def _rank_exemplars(prompt: str, index: dict) -> list:
+    """
+    :return: [(相关度, 范例 ID)]，从高到低
+    相关度 = 命中的查询词 idf 之和 / 全部查询词 idf 之和 (越稀有的词越重要)
+    """
+    query = set(tokenize(prompt))
+    if not query or not index:
+        return []
+    doc_freq = Counter(t for entry in index.values() for t in entry["tokens"])
+    n = len(index)
+    idf = {t: math.log(1 + n / (1 + doc_freq.get(t, 0))) for t in query}
+    total = sum(idf.values())
+    ranked = []
+    for exemplar_id, entry in index.items():
+        hits = query.intersection(entry["tokens"])
+        ranked.append((sum(idf[t] for t in hits) / total, exemplar_id))
+    ranked.sort(key=lambda r: (-r[0], index[r[1]]["chars"]))
+    return ranked
+
+
+# ===================================================================
+# 子区域裁剪
+# ===================================================================
+
+def crop_plan(plan: dict, rect: list) -> dict:
+    """
+    把规划裁到 rect = [x, y, w, h] (瓦片)，坐标平移到子区域原点:
+      - fill_rect 按区域求交；
+      - 摆放类条目要求锚点在子区域内，且底座 (底边中点锚定) 不越过左右边界；
+      - 只保留仍被引用的资产和属性。
+    """
+    x0, y0, w, h = rect
+    layout = {}
+    for layer, entries in plan.get("layout", {}).items():
+        cropped = []
+        for entry in entries if isinstance(entries, list) else []:
+            if "area" in entry:
+                ax, ay, aw, ah = entry["area"]
+                left, top = max(ax, x0), max(ay, y0)
+                right, bottom = min(ax + aw, x0 + w), min(ay + ah, y0 + h)
+                if right > left and bottom > top:
+                    cropped.append({**entry, "area": [left - x0, top - y0, right - left, bottom - top]})
+            elif "position" in entry:
+                px, py = entry["position"][:2]
+                half_w = plan.get("assets", {}).get(entry.get("asset_id"), {}).get("base_size", [1, 1])[0] / 2
+                if x0 <= px - half_w and px + half_w <= x0 + w and y0 <= py < y0 + h:
+                    cropped.append({**entry, "position": [px - x0, py - y0]})
+        layout[layer] = cropped
+
+    used = {e.get("asset_id") for entries in layout.values() for e in entries}
+    metadata = dict(plan.get("metadata", {}))
+    metadata["grid_size"] = [w, h]
+    return {
+        "metadata": metadata,
+        "assets": {k: v for k, v in plan.get("assets", {}).items() if k in used},
+        "layout": layout,
+        "properties": {k: v for k, v in plan.get("properties", {}).items() if k in used}
+    }
+
+
+def trim_exemplar(plan: dict, max_chars: int = EXEMPLAR_MAX_CHARS) -> dict:
+    """
+    紧凑编码超过 max_chars 时，按比例缩小窗口，在每个尺寸下选资产种类最多的位置裁剪，
+    第一个不超限的子区域即为结果 (都超限时返回最小的那个)
+    """
+    if len(dumps_compact(plan)) <= max_chars:
+        return plan
+    grid_w, grid_h = plan.get("metadata", {}).get("grid_size", [0, 0])[:2]
+    best = plan
+    for scale in EXEMPLAR_CROP_SCALES:
+        w = max(min(grid_w, EXEMPLAR_MIN_CROP), int(grid_w * scale))
+        h = max(min(grid_h, EXEMPLAR_MIN_CROP), int(grid_h * scale))
+        step_x, step_y = max(1, (grid_w - w) // 4), max(1, (grid_h - h) // 4)
+        candidates = []
+        for y in range(0, grid_h - h + 1, step_y):
+            for x in range(0, grid_w - w + 1, step_x):
+                cropped = crop_plan(plan, [x, y, w, h])
+                placements = sum(len(v) for v in cropped["layout"].values())
+                candidates.append((len(cropped["assets"]), placements, -y, -x, cropped))
+        if not candidates:
+            continue
+        best = max(candidates, key=lambda c: c[:4])[4]
+        if len(dumps_compact(best)) <= max_chars:
+            break
+    if best is not plan:
+        best["metadata"]["scene_name"] = f"{best['metadata'].get('scene_name', '')} (excerpt)".strip()
+    return best
+
+
+# ===================================================================
+# 对外接口
+# ===================================================================
+
+def select_exemplar(prompt: str, exemplar_dir: str = None, max_chars: int = EXEMPLAR_MAX_CHARS):
+    """
+    为 few-shot 槽位选择范例: 足够相关的范例中最小的一个，必要时裁剪到 max_chars 以内
+    :return: (范例规划, 范例 ID)；没有相关范例时返回 (None, None)
+    """
+    exemplar_dir = exemplar_dir or EXEMPLAR_DIR
+    with _library_lock:
+        index = _load_library(exemplar_dir)
+    ranked = _rank_exemplars(prompt, index)
+    if not ranked or ranked[0][0] < EXEMPLAR_MIN_SCORE:
+        return None, None
+    cutoff = ranked[0][0] * EXEMPLAR_RELEVANCE_RATIO
+    relevant = [exemplar_id for score, exemplar_id in ranked if score >= cutoff]
+    for exemplar_id in sorted(relevant, key=lambda i: index[i]["chars"]):
+        plan = _load_plan(index[exemplar_id], exemplar_dir)
+        if plan is not None:
+            return trim_exemplar(plan, max_chars), exemplar_id
+    return None, None
+
+
+def grid_similarity(grid_a, grid_b) -> float:
+    """ 两个尺寸的相似度: 宽之比 (小/大) x 高之比 (小/大)，1 为相同；尺寸未知时为 0 """
+    if not grid_a or not grid_b or len(grid_a) < 2 or len(grid_b) < 2 or min(*grid_a[:2], *grid_b[:2]) <= 0:
+        return 0.0
+    return (min(grid_a[0], grid_b[0]) / max(grid_a[0], grid_b[0])) * (min(grid_a[1], grid_b[1]) / max(grid_a[1], grid_b[1]))
+
+
+def closest_exemplar_plan(prompt: str, grid_size: list = None, exemplar_dir: str = None):
+    """
+    备用计划: 最相关的完整范例；没有相关范例时返回 None
+    :param grid_size: (可选) 需要的场景尺寸；相关度按尺寸相似度打折，相差太大的范例跳过
+    """
+    exemplar_dir = exemplar_dir or EXEMPLAR_DIR
+    with _library_lock:
+        index = _load_library(exemplar_dir)
+    ranked = []
+    for score, exemplar_id in _rank_exemplars(prompt, index):
+        if score < EXEMPLAR_MIN_SCORE:
+            break
+        if grid_size:
+            similarity = grid_similarity(index[exemplar_id].get("grid_size"), grid_size)
+            if similarity < EXEMPLAR_MIN_GRID_SIMILARITY:
+                continue
+            score *= similarity
+        ranked.append((score, exemplar_id))
+    for _, exemplar_id in sorted(ranked, key=lambda r: -r[0]):
+        plan = _load_plan(index[exemplar_id], exemplar_dir)
+        if plan is not None:
+            return plan
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="场景范例库")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_add = sub.add_parser("add", help="把场景 JSON 加入范例库")
+    p_add.add_argument("scene", help="场景 JSON 文件")
+    p_add.add_argument("--prompt", default="", help="生成该场景的提示")
+    p_query = sub.add_parser("query", help="查看某个提示会选中哪个范例")
+    p_query.add_argument("prompt")
+    parser.add_argument("--dir", default=EXEMPLAR_DIR, help="范例库目录")
+    args = parser.parse_args()
+
+    if args.cmd == "add":
+        try:
+            with open(args.scene, "r", encoding="utf-8") as f:
+                scene = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"!!! [Exemplar Library] 无法读取场景 {args.scene}: {e}", file=sys.stderr)
+            sys.exit(1)
+        add_exemplar(scene, args.prompt, exemplar_dir=args.dir)
+    else:
+        library = _load_library(args.dir)
+        for score, exemplar_id in _rank_exemplars(args.prompt, library)[:5]:
+            print(f"{score:.2f}  {exemplar_id}  {library[exemplar_id]['chars']:>6} 字符  {library[exemplar_id]['scene_name']}")
+        chosen, chosen_id = select_exemplar(args.prompt, exemplar_dir=args.dir)
+        if chosen is None:
+            print("没有相关范例 (将使用内置范例)。")
+        else:
+            print(f"选中 {chosen_id}: {len(dumps_compact(chosen))} 字符, grid_size {chosen['metadata'].get('grid_size')}")
@@ -1,10 +1,21 @@
 import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # --- 导入此工作流所需的 Agent ---
 from enricher_agent import enrich_prompt
-from manager_agent_zh import get_scene_plan, repair_scene_plan
+from manager_agent_zh import get_scene_plan, repair_scene_plan, get_zone_map
 from validator_agent import run_validator
-from critic_agent import run_critic
+from critic_agent import run_critic, reset_critique_cache
+from checkpoint_store import run_checkpointed_stage
+from scene_store import record_scene_version
+from asset_classifier import classify_assets
+from exemplar_library import record_exemplar
+from tracing import span, traced
+from zone_stitcher import resolve_doors, build_zone_task_prompt, check_zone_bounds, stitch_zone_plans
+
+# 分区生成时同时进行的区域数量 (实际并发还受 API 槽位限制)
+MAX_ZONE_WORKERS = 8
 
 # ===================================================================
 # 【【【 新增：硬性规则执行器 (Hard Rule Enforcer) 】】】
@@ -19,13 +30,11 @@ def _enforce_hard_constraints(plan: dict) -> dict:
         
     # print(f"--- [Workflow] 正在执行硬性规则筛查... ---")
     
+    classifications = classify_assets(plan["assets"])
     for asset_id, details in plan["assets"].items():
-        asset_type = details.get("type")
-        description = details.get("description", "").lower()
-        
         # --- 规则 1: 地板 (Floor) 必须是 visual_size [2, 2] ---
         # 识别逻辑：type=tile 且 (ID含floor 或 描述含floor)
-        if asset_type == "tile" and ("floor" in asset_id.lower() or "floor" in description):
+        if classifications[asset_id]["floor_tile"]:
             current_base = details.get("base_size", [0, 0])
             current_visual = details.get("visual_size", [0, 0])
             
@@ -39,9 +48,16 @@ def _enforce_hard_constraints(plan: dict) -> dict:
     return plan
 
 
-def _run_manager_with_validation(task_prompt: str, base_plan: dict = None, max_validator_loops: int = 3) -> dict:
+def _run_manager_with_validation(task_prompt: str, base_plan: dict = None, max_validator_loops: int = 3, validator_reports: list = None, local_checks: list = None, store_branch: str = "main", use_llm: bool = False, grid_size: list = None, call_info: dict = None) -> dict:
     """
     原子执行单元：生成 -> 强制修正 -> 验证 -> 修复 -> 强制修正 -> ...
+
+    :param use_llm: 草稿 (base_plan 为空时) 是否调用 LLM 生成；False 时使用备用计划 (调试用)
+    :param grid_size: (可选) 草稿的目标尺寸，LLM 失败退回备用计划时用来挑选尺寸相近的范例
+    :param validator_reports: (可选) 用于收集每一轮 Validator 报告的列表 (写入检查点)
+    :param local_checks: (可选) 额外的检查函数列表 plan -> [错误]，结果并入 Validator 报告
+    :param store_branch: 中间版本保存到场景版本库的哪个分支
+    :param call_info: (可选) 任何一次 Manager 调用退回备用结果时写入 {"llm_failed": True}
     """
     
     current_plan = None
@@ -49,19 +65,28 @@ def _run_manager_with_validation(task_prompt: str, base_plan: dict = None, max_v
     # --- 1. Manager 生成 (v-draft) ---
     print(f"\n--- [Manager] 正在根据任务生成草稿... ---")
     if base_plan is None:
-        current_plan = get_scene_plan(task_prompt, use_llm=False)
+        current_plan = get_scene_plan(task_prompt, use_llm=use_llm, grid_size=grid_size, call_info=call_info)
     else:
-        current_plan = repair_scene_plan(base_plan, task_prompt, use_llm=True)
+        current_plan = repair_scene_plan(base_plan, task_prompt, use_llm=True, call_info=call_info)
     
     # 【【【 关键插入 1：生成后立即强制修正 】】】
     current_plan = _enforce_hard_constraints(current_plan)
+    record_scene_version(current_plan, "manager_draft", branch=store_branch)
 
     # --- 2. Validator 内部循环 (最多3次) ---
     for i in range(max_validator_loops):
         print(f"--- [Validator 内部循环 {i + 1}/{max_validator_loops}] 正在检查 Manager 草稿... ---")
         
         # 运行代码QA
-        validator_report = run_validator(current_plan)
+        with span("validator", attempt=i + 1) as s:
+            validator_report = run_validator(current_plan)
+            extra_errors = [e for check in (local_checks or []) for e in check(current_plan)]
+            if extra_errors:
+                extra_report = "\n".join(f"- {error}" for error in extra_errors)
+                validator_report = f"{validator_report}\n{extra_report}" if validator_report else extra_report
+            s.set(passed=not validator_report)
+        if validator_reports is not None:
+            validator_reports.append(validator_report)
         
         if not validator_report:
             # 验证通过！
@@ -73,22 +98,76 @@ def _run_manager_with_validation(task_prompt: str, base_plan: dict = None, max_v
         print(f"--- [Manager] 正在修复物理错误... ---")
         
         # 让 Manager 修复 Validator 发现的“代码级”错误
-        current_plan = repair_scene_plan(current_plan, validator_report, use_llm=True) 
+        current_plan = repair_scene_plan(current_plan, validator_report, use_llm=True, call_info=call_info)
         
         # 【【【 关键插入 2：修复后再次强制修正 】】】
         # 防止 Manager 在修复碰撞时，又把尺寸改回错误的数值
         current_plan = _enforce_hard_constraints(current_plan)
+        record_scene_version(current_plan, "validator_fix", branch=store_branch, attempt=i + 1)
     
     print(f"\n!!! 警告: [Validator] 达到最大尝试次数 ({max_validator_loops})。")
     print(f"!!! 将使用最后一次修复的版本（可能仍有物理问题）。")
     return current_plan
 
 
-def generate_and_iterate_scene(original_prompt: str, max_repair_attempts: int = 1) -> dict | None:
-    
+def _run_checkpointed_manager(stage: str, task_prompt: str, base_plan: dict = None, attempt: int = 1, local_checks: list = None, store_branch: str = "main", use_llm: bool = False, grid_size: list = None) -> dict:
+    """
+    带检查点的 Manager + Validator 原子单元。
+    产物 = 通过 (或尽力) 验证的规划 + 每轮 Validator 报告。
+    验证后的规划 (包括复用检查点的情况) 以阶段名为标签保存到场景版本库。
+    use_llm 是检查点输入的一部分: 备用计划生成的草稿不会被 LLM 草稿的请求复用。
+    任何一次 LLM 调用失败 (退回备用计划 / 原样返回) 的产物不保存，续跑时会重新调用。
+    """
+    def _compute():
+        reports = []
+        call_info = {}
+        plan = _run_manager_with_validation(
+            task_prompt=task_prompt,
+            base_plan=base_plan,
+            max_validator_loops=3,
+            validator_reports=reports,
+            local_checks=local_checks,
+            store_branch=store_branch,
+            use_llm=use_llm,
+            grid_size=grid_size,
+            call_info=call_info
+        )
+        return {"plan": plan, "validator_reports": reports, "llm_failed": call_info.get("llm_failed", False)}
+
+    artifact = run_checkpointed_stage(
+        stage, [task_prompt, base_plan, use_llm, grid_size], _compute,
+        is_valid=lambda a: not a.get("llm_failed"),
+        attempt=attempt
+    )
+    record_scene_version(artifact["plan"], stage, branch=store_branch, attempt=attempt)
+    return artifact["plan"]
+
+
+def _run_critic_stage(plan: dict) -> dict:
+    """ Critic 阶段的产物: 报告 + 结论是否来自 VLM (规则预审直接放行 / 拦下时为 False) """
+    review_info = {}
+    report = run_critic(plan, use_vlm=True, review_info=review_info)
+    return {"report": report, "vlm_reviewed": review_info.get("vlm_reviewed", False)}
+
+
+@traced("workflow")
+def generate_and_iterate_scene(original_prompt: str, max_repair_attempts: int = 1, use_llm: bool = False) -> dict | None:
+    """
+    :param use_llm: 初始草稿是否由 LLM 生成；False (默认，调试用) 时草稿来自备用计划 (范例库 / 内置范例)，
+                    同一批提示会得到相同的起点，只靠修复轮次区分。
+    """
+    # 区域审查缓存只在同一个场景的修复轮次之间有效
+    reset_critique_cache()
+
     # --- 0. 丰富提示 ---
     print("--- 0. Enricher Agent 正在丰富提示... ---")
-    enriched_prompt = enrich_prompt(original_prompt, use_llm=True)
+    enriched_prompt = run_checkpointed_stage(
+        "enrich",
+        [original_prompt],
+        lambda: enrich_prompt(original_prompt, use_llm=True),
+        # 丰富失败时 Enricher 会原样返回输入，这种结果不写入检查点
+        is_valid=lambda p: p != original_prompt
+    )
     print(f"--- 0. 生成的提示内容：... ---{enriched_prompt}")
     
     
@@ -97,25 +176,41 @@ def generate_and_iterate_scene(original_prompt: str, max_repair_attempts: int =
     print(f" 高层循环: 初始生成 (V1)")
     print(f"==========================================")
     
-    current_plan = _run_manager_with_validation(
-        task_prompt=enriched_prompt,
-        base_plan=None,
-        max_validator_loops=3
-    )
+    current_plan = _run_checkpointed_manager("draft", enriched_prompt, base_plan=None, use_llm=use_llm)
     
     # --- 2. 迭代修复循环 ---
     for i in range(max_repair_attempts):
         print(f"\n--- [Critic] 正在进行第 {i + 1}/{max_repair_attempts} 次语义评估... ---")
         
         # 步骤 A: Critic 审查
-        critic_report = run_critic(current_plan, use_vlm=True)
+        critic_artifact = run_checkpointed_stage(
+            "critic",
+            [current_plan],
+            lambda: _run_critic_stage(current_plan),
+            # API 失败的报告不写入检查点，下次重跑时重新评估
+            is_valid=lambda a: not (a["report"] or "").startswith("严重错误"),
+            attempt=i + 1
+        )
+        critic_report = critic_artifact["report"]
 
         # 步骤 B: 检查 Critic 报告
         if not critic_report:
             print(f"\n--- [Critic] 评估通过！语义合理。 ---")
             print(f"--- 高层循环在第 {i + 1} 次评估中完美结束。 ---")
+            # Validator 与 VLM 都通过、且草稿由 LLM 生成的场景加入范例库，供之后的 few-shot / 备用计划检索
+            if not critic_artifact.get("vlm_reviewed"):
+                print("--- [Exemplar] 本轮结论没有经过 VLM 审查，不加入范例库。 ---")
+            elif not use_llm:
+                print("--- [Exemplar] 草稿来自备用计划，不加入范例库。 ---")
+            elif not run_validator(current_plan):
+                record_exemplar(current_plan, enriched_prompt, repair_rounds=i)
             break 
 
+        # Critic 本身失败 (API 错误、提示超出预算、无法绘制草图) 时报告不是审查意见，不能交给 Manager 修复
+        if critic_report.startswith("严重错误"):
+            print(f"\n--- [Critic] 评估失败，跳过本轮修复: {critic_report} ---")
+            break
+
         # 步骤 C: Critic 不满意，准备修复
         print(f"\n--- [Critic] 提出语义建议: {critic_report} ---")
         print(f"\n==========================================")
@@ -129,13 +224,110 @@ def generate_and_iterate_scene(original_prompt: str, max_repair_attempts: int =
         )
 
         # 步骤 D: 调用“原子单元”进行修复
-        current_plan = _run_manager_with_validation(
-            task_prompt=repair_task_prompt,
-            base_plan=current_plan, 
-            max_validator_loops=3
-        )
+        current_plan = _run_checkpointed_manager("repair", repair_task_prompt, base_plan=current_plan, attempt=i + 1)
 
     if max_repair_attempts > 0:
         print(f"\n--- [Main Workflow] 达到最大修复次数 ({max_repair_attempts})。停止迭代。 ---")
 
-    return current_plan
\ No newline at end of file
+    return current_plan
+
+
+# ===================================================================
+# 分区生成模式 (Hierarchical Generation) —— 用于大型世界
+# ===================================================================
+
+def _generate_zone(zone: dict, zone_map: dict, resolved_doors: list, world_prompt: str) -> dict:
+    """ [线程池工人函数] 用局部坐标生成并验证单个区域 """
+    zone_size = zone["rect"][2:]
+    task_prompt = build_zone_task_prompt(zone, zone_map, resolved_doors, world_prompt)
+    with span("zone", zone_id=zone["zone_id"]):
+        return _run_checkpointed_manager(
+            "zone",
+            task_prompt,
+            local_checks=[lambda plan: check_zone_bounds(plan, zone_size)],
+            store_branch=f"zone/{zone['zone_id']}",
+            # 备用计划是固定的示例场景，尺寸与区域无关；区域必须由 LLM 按任务中的局部尺寸生成
+            use_llm=True,
+            grid_size=zone_size
+        )
+
+
+@traced("workflow.hierarchical")
+def generate_hierarchical_scene(original_prompt: str, grid_size: list, max_zone_workers: int = MAX_ZONE_WORKERS) -> dict | None:
+    """
+    分区生成: 区域图 -> 各区域并行生成与局部验证 -> 拼接 + 接缝检查。
+    总耗时约等于最慢的一个区域，而不是整个世界一次生成。
+
+    :param grid_size: 世界尺寸 [宽, 高] (例如 [200, 200])
+    :return: 拼接后的全局场景规划
+    """
+    # --- 0. 丰富提示 ---
+    print("--- 0. Enricher Agent 正在丰富提示... ---")
+    enriched_prompt = run_checkpointed_stage(
+        "enrich",
+        [original_prompt],
+        lambda: enrich_prompt(original_prompt, use_llm=True),
+        is_valid=lambda p: p != original_prompt
+    )
+
+    # --- 1. 区域图 ---
+    print(f"\n--- 1. [Zone Map] 正在为 {grid_size} 的世界规划区域... ---")
+    zone_map_info = {}
+    zone_map = run_checkpointed_stage(
+        "zone_map",
+        [enriched_prompt, grid_size],
+        lambda: get_zone_map(enriched_prompt, grid_size, use_llm=True, call_info=zone_map_info),
+        is_valid=lambda _: not zone_map_info.get("llm_failed")
+    )
+    resolved_doors = resolve_doors(zone_map)
+    zones = zone_map["zones"]
+    print(f"--- [Zone Map] {len(zones)} 个区域, {len(resolved_doors)} 扇门。 ---")
+
+    # --- 2. 并行生成各区域 ---
+    print(f"\n--- 2. 正在并行生成 {len(zones)} 个区域 (Max Workers: {max_zone_workers}) ---")
+    zone_plans = {}
+    with ThreadPoolExecutor(max_workers=max_zone_workers) as executor:
+        futures = {
+            # 每个任务复制一份上下文，使 "zone" span 挂在当前 span 之下
+            executor.submit(contextvars.copy_context().run, _generate_zone, zone, zone_map, resolved_doors, enriched_prompt): zone["zone_id"]
+            for zone in zones
+        }
+        for future in as_completed(futures):
+            zone_id = futures[future]
+            try:
+                plan = future.result()
+                if plan:
+                    zone_plans[zone_id] = plan
+                print(f" ✅ [Zone] '{zone_id}' 完成 ({len(zone_plans)}/{len(zones)})")
+            except Exception as e:
+                print(f" ❌ [Zone] '{zone_id}' 生成失败: {e}")
+
+    if not zone_plans:
+        print("!!! [Hierarchical] 所有区域都生成失败。")
+        return None
+
+    # --- 3. 拼接 + 接缝检查 ---
+    print("\n--- 3. [Zone Stitcher] 正在拼接区域... ---")
+    with span("stitch"):
+        stitched_plan, seam_report = stitch_zone_plans(zone_map, zone_plans)
+        stitched_plan = _enforce_hard_constraints(stitched_plan)
+    record_scene_version(stitched_plan, "stitched")
+
+    # 跨区域的最终检查 (只报告；各区域已在局部修复过)
+    global_report = run_validator(stitched_plan)
+    if global_report:
+        print(f"--- [Hierarchical] 拼接后的全局检查仍有问题: {global_report} ---")
+
+    # 整个世界的语义评估 (一次，只报告): 区域各自生成，跨区域的布局问题只有在拼接后才看得到
+    critic_artifact = run_checkpointed_stage(
+        "critic",
+        [stitched_plan],
+        lambda: _run_critic_stage(stitched_plan),
+        is_valid=lambda a: not (a["report"] or "").startswith("严重错误")
+    )
+    if critic_artifact["report"]:
+        print(f"--- [Hierarchical] 拼接后的语义评估: {critic_artifact['report']} ---")
+    blocked = [item for item in seam_report if item.get("blocked_doors")]
+    print(f"--- [Hierarchical] 接缝: {len(seam_report)} 条, 门洞被堵: {len(blocked)} 条。 ---")
+
+    return stitched_plan
@@ -1,18 +1,131 @@
 # 文件名: godot_client.py
 import socket
 import json
+from tracing import span
+from scene_chunker import CHUNK_TILES, stream_commands
 
-def send_command(command_dict, host='127.0.0.1', port=8080):
-    """连接到 Godot 服务器并发送一个 JSON 指令"""
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((host, port))
-            command_json = json.dumps(command_dict, ensure_ascii=False)
-            payload = command_json.encode('utf-8')
-            s.sendall(payload)
-            # 打印部分指令，避免刷屏
-            print(f"[Godot Client] 成功发送指令 (部分): {command_json[:200]}...")
-    except ConnectionRefusedError:
-        print(f"错误: 连接被拒绝。请确认 Godot 服务器正在运行于 {host}:{port}。")
-    except Exception as e:
-        print(f"发送失败: {e}")
\ No newline at end of file
+# 协议: 每条指令是一行 JSON (以 "\n" 结尾)。指令带 "reply": true 时，
+# Godot 处理完后回写一行 JSON: {"action", "status": "ok"/"error", "profile" 或 "error"}。
+# 构建场景的 profile 见 scene_builder_server.gd 的 _last_build_profile。
+GODOT_REPLY_TIMEOUT = 120.0  # 秒；大场景的导航烘焙可能要几十秒
+
+
+def _read_line(sock) -> bytes:
+    """ 读到第一个换行为止 (不含换行)；对端提前关闭时返回已读到的部分 """
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        newline = chunk.find(b"\n")
+        if newline != -1:
+            chunks.append(chunk[:newline])
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def send_command(command_dict, host='127.0.0.1', port=8080, wait_reply=False, timeout=GODOT_REPLY_TIMEOUT):
+    """
+    连接到 Godot 服务器并发送一个 JSON 指令
+    :param wait_reply: True 时要求 Godot 回传结果，并阻塞等待 (最多 timeout 秒)
+    :return: wait_reply 时返回 Godot 的回复字典，否则 (或失败时) 返回 None
+    """
+    return send_commands([command_dict], host=host, port=port, wait_reply=wait_reply, timeout=timeout)
+
+
+def send_commands(commands: list, host='127.0.0.1', port=8080, wait_reply=False, timeout=GODOT_REPLY_TIMEOUT):
+    """
+    在同一个连接上按顺序发送多条指令 (Godot 收到新连接会断开旧连接，多条指令不能分开连)
+    :param wait_reply: True 时只对最后一条要求回复并等待
+    :return: 同 send_command
+    """
+    if wait_reply:
+        commands = commands[:-1] + [{**commands[-1], "reply": True}]
+    with span("godot_send", action=commands[0].get("action"), commands=len(commands)) as trace_span:
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.connect((host, port))
+                bytes_sent = 0
+                for command_dict in commands:
+                    command_json = json.dumps(command_dict, ensure_ascii=False)
+                    payload = command_json.encode('utf-8') + b"\n"
+                    s.sendall(payload)
+                    bytes_sent += len(payload)
+                trace_span.set(bytes_sent=bytes_sent)
+                # 打印部分指令，避免刷屏
+                if len(commands) == 1:
+                    print(f"[Godot Client] 成功发送指令 (部分): {command_json[:200]}...")
+                else:
+                    print(f"[Godot Client] 成功发送 {len(commands)} 条指令 ({bytes_sent / 1024:.1f} KB)。")
+                if not wait_reply:
+                    return None
+
+                s.settimeout(timeout)
+                reply = json.loads(_read_line(s).decode('utf-8') or "null")
+                if not isinstance(reply, dict):
+                    trace_span.set(error="empty_reply")
+                    print("[Godot Client] 错误: Godot 未返回结果 (连接已关闭)。")
+                    return None
+                trace_span.set(status=reply.get("status"))
+                profile = reply.get("profile") or {}
+                if "total_ms" in profile:
+                    trace_span.set(godot_total_ms=profile["total_ms"], godot_bake_ms=profile.get("bake_ms"))
+                return reply
+        except ConnectionRefusedError:
+            trace_span.set(error="connection_refused")
+            print(f"错误: 连接被拒绝。请确认 Godot 服务器正在运行于 {host}:{port}。")
+        except socket.timeout:
+            trace_span.set(error="reply_timeout")
+            print(f"[Godot Client] 错误: 等待 Godot 回复超时 ({timeout} 秒)。")
+        except Exception as e:
+            trace_span.set(error=str(e))
+            print(f"发送失败: {e}")
+    return None
+
+
+def build_scene(scene_plan: dict, host='127.0.0.1', port=8080, timeout=GODOT_REPLY_TIMEOUT):
+    """
+    让 Godot 构建场景并等待完成
+    :return: 构建剖析 (各步骤毫秒、节点/地板格/墙块/贴图计数、烘焙耗时)；失败返回 None
+    """
+    reply = send_command({"action": "build_scene_from_json", "payload": scene_plan},
+                         host=host, port=port, wait_reply=True, timeout=timeout)
+    if not reply or reply.get("status") != "ok":
+        if reply:
+            print(f"[Godot Client] 构建失败: {reply.get('error')}")
+        return None
+    return reply.get("profile")
+
+
+def stream_scene(scene_plan: dict, host='127.0.0.1', port=8080, chunk_tiles=CHUNK_TILES, focus=None, timeout=GODOT_REPLY_TIMEOUT):
+    """
+    分块流式构建 (见 scene_chunker.py): 块按离焦点由近到远发送，Godot 每帧只构建预算内的部分并按块烘焙导航
+    :param focus: 优先构建的位置 (瓦片坐标，例如相机中心)；默认出生点
+    :return: 构建剖析 (含 first_chunk_ms / frames / max_frame_ms)；失败返回 None
+    """
+    reply = send_commands(stream_commands(scene_plan, chunk_tiles, focus), host=host, port=port,
+                          wait_reply=True, timeout=timeout)
+    if not reply or reply.get("status") != "ok":
+        if reply:
+            print(f"[Godot Client] 流式构建失败: {reply.get('error')}")
+        return None
+    return reply.get("profile")
+
+
+def get_build_profile(host='127.0.0.1', port=8080, timeout=10.0):
+    """ 读取 Godot 最近一次构建的剖析 (可能由其它客户端触发)；还没有构建过时返回 {} """
+    reply = send_command({"action": "get_build_profile"}, host=host, port=port, wait_reply=True, timeout=timeout)
+    return (reply or {}).get("profile") or {}
+
+
+def format_build_profile(profile: dict) -> str:
+    """ 一行摘要: 总耗时、各步骤耗时与新增节点数 """
+    steps = ", ".join(f"{name} {ms:.1f}ms/{profile.get('counts', {}).get(name, 0)}n"
+                      for name, ms in profile.get("steps", {}).items())
+    textures = profile.get("textures", {})
+    if profile.get("streamed"):
+        steps = (f"首块 {profile.get('first_chunk_ms', 0):.1f} ms, {profile.get('chunks', 0)} 块 / {profile.get('frames', 0)} 帧, "
+                 f"单帧最长 {profile.get('max_frame_ms', 0):.1f} ms, " + steps)
+    return (f"总计 {profile.get('total_ms', 0):.1f} ms | {steps} | 地板格 {profile.get('cells', 0)}, "
+            f"墙块 {profile.get('wall_tiles', 0)}, 贴图 解码 {textures.get('decoded', 0)}/命中 {textures.get('cached', 0)}")
@@ -5,10 +5,19 @@ import time
 # --- 从我们的独立文件中导入 Agent 功能 ---
 from artist_agent import run_artist_agent
 from soul_writer_agent import generate_npc_souls, generate_world_context
-from godot_client import send_command
+from godot_client import build_scene, stream_scene, format_build_profile
+from scene_chunker import CHUNK_TILES
+from scene_format import load_scene_file
 from save_scene import save_scene_to_file
-from generation_workflow import generate_and_iterate_scene
+from memory_service import ensure_memory_service
+from scene_store import record_scene_version
+from generation_workflow import generate_and_iterate_scene, generate_hierarchical_scene
 from build_asset_index import build_index, INDEX_SAVE_PATH
+from checkpoint_store import configure_checkpoints
+from tracing import export_trace, summarize_trace
+from token_accounting import save_cost_report
+
+TRACE_DIR = "./output/traces"
 
 # ===================================================================
 # 主函数 (只负责协调)
@@ -20,12 +29,18 @@ def main():
     ASSET_PACK_FOLDER_NAME = "External_Asset_Pack"
 
     # --- 【【【 调试开关 】】】 ---
-    USE_EXISTING_PLAN = True  # True: 使用本地现有 JSON; False: 从头生成
-    EXISTING_PLAN_PATH = "" # 现有文件的路径
+    USE_EXISTING_PLAN = True  # True: 使用本地现有场景文件; False: 从头生成
+    EXISTING_PLAN_PATH = "" # 现有文件的路径 (.wgscene 或 .json)
+    USE_CHECKPOINTS = True    # True: 输入未变的阶段直接复用检查点 (崩溃后可秒级续跑); False: 全部重跑
+    CHECKPOINT_DIR = "./output/checkpoints"
+    USE_HIERARCHICAL = False  # True: 大型世界分区生成 (区域图 -> 并行生成各区域 -> 拼接)
+    WORLD_GRID_SIZE = [200, 200]  # 分区生成时的世界尺寸
+    START_MEMORY_SERVICE = True  # True: 后台启动角色记忆服务 (memory_service.py)，Godot 中的角色通过它读写记忆
     # ---------------------------
 
     # --- 启动检查与索引构建 ---
     print("--- [Main] 正在启动... ---")
+    configure_checkpoints(CHECKPOINT_DIR, enabled=USE_CHECKPOINTS)
     ASSET_PACK_PATH = os.path.join(GODOT_PROJECT_PATH, ASSET_PACK_FOLDER_NAME)
     
     if not os.path.exists(GODOT_PROJECT_PATH):
@@ -44,8 +59,7 @@ def main():
     if USE_EXISTING_PLAN:
         print(f"\n--- [Main] 模式: 加载现有文件 '{EXISTING_PLAN_PATH}' ---")
         if os.path.exists(EXISTING_PLAN_PATH):
-            with open(EXISTING_PLAN_PATH, 'r', encoding='utf-8') as f:
-                final_plan_from_loop = json.load(f)
+            final_plan_from_loop = load_scene_file(EXISTING_PLAN_PATH)
             print("--- 加载成功。 ---")
         else:
             print(f"!!! 错误: 找不到文件 {EXISTING_PLAN_PATH}")
@@ -55,10 +69,16 @@ def main():
         
         original_task_prompt = "一个阴森的，黑暗的古堡，里面还有一些神秘的人物和物品"
     
-        final_plan_from_loop = generate_and_iterate_scene(
-            original_prompt=original_task_prompt,
-            max_repair_attempts=1 
-        )
+        if USE_HIERARCHICAL:
+            final_plan_from_loop = generate_hierarchical_scene(
+                original_prompt=original_task_prompt,
+                grid_size=WORLD_GRID_SIZE
+            )
+        else:
+            final_plan_from_loop = generate_and_iterate_scene(
+                original_prompt=original_task_prompt,
+                max_repair_attempts=1 
+            )
 
     if not final_plan_from_loop:
         print("\n[Main] !!! 未能获取有效规划。程序终止。 !!!"); return
@@ -69,7 +89,9 @@ def main():
     print("\n--- 2. Artist Agent 正在生成贴图... ---")
     processed_scene_plan = run_artist_agent(final_plan_from_loop, GODOT_PROJECT_PATH)
 
-    # 4. Soul Writer Agent
+    # 4. Soul Writer Agent (先启动记忆服务: 初始记忆写入后通知它重新加载，Godot 运行时也依赖它)
+    if START_MEMORY_SERVICE:
+        ensure_memory_service(GODOT_PROJECT_PATH)
     print("\n--- 3. Soul Writer Agent 正在生成灵魂... ---")
     generate_npc_souls(processed_scene_plan, GODOT_PROJECT_PATH)
 
@@ -80,18 +102,31 @@ def main():
     # 6. 保存最终结果
     print("\n--- 5. 正在保存最终场景... ---")
     final_save_path = save_scene_to_file(processed_scene_plan, GODOT_PROJECT_PATH, "my_final_scene.json")
+    record_scene_version(processed_scene_plan, "final")
     
     if final_save_path:
-        print(f" ✅ 最终 JSON 已保存: {final_save_path}")
+        print(f" ✅ 最终场景已保存: {final_save_path}")
         # print(json.dumps(processed_scene_plan, indent=4, ensure_ascii=False))
 
     # 7. 发送给 Godot
     print("\n[Main] 正在发送给 Godot...")
-    send_command({
-        "action": "build_scene_from_json",
-        "payload": processed_scene_plan
-    })
-    print("[Main] 指令已发送。")
+    # 超过一个块的场景分块流式构建: 出生点附近先可见，引擎不会整段卡住
+    grid_w, grid_h = processed_scene_plan.get("metadata", {}).get("grid_size", [25, 20])
+    if grid_w * grid_h > CHUNK_TILES * CHUNK_TILES:
+        build_profile = stream_scene(processed_scene_plan)
+    else:
+        build_profile = build_scene(processed_scene_plan)
+    if build_profile:
+        print(f"[Main] Godot 构建完成: {format_build_profile(build_profile)}")
+    else:
+        print("[Main] 指令已发送，但未收到 Godot 的构建结果。")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        # 无论成功与否都导出追踪，定位慢在 Manager、修复循环还是图像模型
+        summarize_trace()
+        run_stamp = time.strftime('%Y%m%d_%H%M%S')
+        export_trace(TRACE_DIR, basename=f"trace_{run_stamp}")
+        save_cost_report(TRACE_DIR, filename=f"cost_report_{run_stamp}.json")
\ No newline at end of file
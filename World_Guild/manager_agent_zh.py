@@ -3,7 +3,11 @@ import os
 import json
 import sys
 from config import MANAGER_API_CONFIG
-from api_client_utils import create_api_client
+from api_client_utils import create_api_client, call_chat_completion
+from tracing import traced
+from plan_codec import CODEC_LEGEND, dumps_compact, loads_plan
+from zone_stitcher import build_fallback_zone_map, validate_zone_map, MIN_ZONE_SIZE
+from exemplar_library import select_exemplar, closest_exemplar_plan, trim_exemplar
 
 
 try:
@@ -20,6 +24,13 @@ except Exception as e:
     print(f"!!! Error loading Manager Agent config: {e}", file=sys.stderr)
     sys.exit(1)
 
+# 提示超出 Manager 的 Token 预算时的压缩 (call_chat_completion 的 compact_fn):
+#   - 生成: few-shot 范例裁成更小的子区域；
+#   - 修复: 错误报告去重并只保留前几条；原始规划的布局必须完整发送，但报告中没有提到的资产
+#           不发送描述 (置为 "")，修复结果中仍为空的描述从原规划恢复。
+COMPACT_EXEMPLAR_MAX_CHARS = 1200
+COMPACT_REPORT_MAX_LINES = 30
+
 
 # ===================================================================
 # 【【【 统一范例定义 (Single Source of Truth) 】】】
@@ -278,7 +289,8 @@ USER_PROMPT_TEMPLATE = """
 
     ---
     ### 【完整范例 (Example)】
-    请完全模仿以下 JSON 的结构、字段命名和逻辑关系进行输出：
+    请完全模仿以下 JSON 的结构、字段命名和逻辑关系进行输出 (范例使用紧凑格式，你可以输出紧凑格式或完整格式)：
+    {codec_legend}
     ```json
     {example_json}
     ```
@@ -303,7 +315,8 @@ REPAIR_USER_PROMPT_TEMPLATE = """
     * **绝对不要**因为你个人的“审美”或“偏好”而去修改一个功能上正确的、且未被报告有误的条目。
 
     ---
-    **原始 JSON**:
+    **原始 JSON** (紧凑格式，你可以输出紧凑格式或完整格式):
+    {codec_legend}
     ```json
     {original_json_str}
     ```
@@ -316,13 +329,62 @@ REPAIR_USER_PROMPT_TEMPLATE = """
 
 
 
+# 3. 区域图提示 (分区生成模式，用于大型世界)
+ZONE_MAP_PROMPT_TEMPLATE = """
+    你是一个大型开放世界的总规划师。请把下面的世界划分为若干个**互不重叠**的矩形区域 (房间、建筑、街区、广场等)。
+    每个区域之后会由另一位设计师单独设计，所以你只需要给出区域划分，不要设计家具。
+
+    ---
+    **用户请求**: "{user_request}"
+    **世界尺寸**: grid_size = {grid_size} (单位: 瓦片)
+    ---
+
+    【规则】:
+    1. 区域 `rect` 为 [x, y, 宽, 高] (整数，左上角坐标)，必须完全位于世界范围内，且互不重叠。
+    2. 每个区域的宽和高都不小于 {min_zone_size}，建议 20~50。尽量铺满整个世界 (道路、广场也是区域)。
+    3. `doors`: 相邻 (共享一条边) 的区域之间如果需要通行，添加一扇门。
+       `position` 是共享边上的任意一个坐标 [x, y]。保证所有区域都能互相到达。
+    4. `theme` 和 `description` 使用英文，描述区域的功能与风格。
+    5. 只输出 JSON 对象，不要添加任何解释。
+
+    【输出格式】:
+    {{
+        "metadata": {{"scene_name": "...", "grid_size": {grid_size}, "description": "...", "style_prompt": "..."}},
+        "zones": [{{"zone_id": "market_square", "rect": [0, 0, 40, 30], "theme": "market", "description": "..."}}],
+        "doors": [{{"between": ["market_square", "tavern"], "position": [40, 12]}}]
+    }}
+    """
+
+
 def _call_llm_for_scene_plan(prompt: str) -> dict | None: 
     """ Internal function, responsible for calling the LLM API and processing the response. """ 
     print("[Manager Agent] Connecting to LLM API to generate scene...")
-    full_prompt = USER_PROMPT_TEMPLATE.format(user_request=prompt)
+    # 范例从范例库中按相关度检索 (最小的相关范例，必要时裁成子区域)；没有相关范例时裁剪内置范例
+    example, example_id = select_exemplar(prompt)
+    if example is None:
+        example, example_id = trim_exemplar(EXAMPLE_SCENE_JSON), "builtin"
+    # 范例使用无损紧凑编码 (plan_codec)，提示体积约为 indent=4 版本的 1/4
+    example_json = dumps_compact(example)
+    print(f"[Manager Agent] Few-shot exemplar: {example_id} ({len(example_json)} chars)")
+    full_prompt = USER_PROMPT_TEMPLATE.format(
+        user_request=prompt,
+        codec_legend=CODEC_LEGEND,
+        example_json=example_json
+    )
+
+    def _compact_messages():
+        # 超出 Token 预算时: 范例裁成更小的子区域
+        compact_prompt = USER_PROMPT_TEMPLATE.format(
+            user_request=prompt,
+            codec_legend=CODEC_LEGEND,
+            example_json=dumps_compact(trim_exemplar(example, max_chars=COMPACT_EXEMPLAR_MAX_CHARS))
+        )
+        return [{"role": "user", "content": compact_prompt}]
 
     try:
-        response = client.chat.completions.create(
+        response = call_chat_completion(
+            client, "Manager Agent",
+            compact_fn=_compact_messages,
             # 【【【 修改：使用 DESIGN_MODEL_NAME 】】】
             model=DESIGN_MODEL_NAME, 
             messages=[
@@ -335,19 +397,53 @@ def _call_llm_for_scene_plan(prompt: str) -> dict | None:
         response_content = response.choices[0].message.content
         print("[Manager Agent] LLM response received, parsing JSON...")
         
-        return json.loads(response_content)
+        return loads_plan(response_content)
 
     except Exception as e:
         print(f"[Manager Agent] LLM API call or JSON parsing failed: {e}")
         return None
 
-def _call_llm_for_repair(plan_str: str, report: str) -> dict | None: 
+def _compact_report(report: str, max_lines: int = COMPACT_REPORT_MAX_LINES) -> str:
+    """ 错误报告去掉重复行，只保留前 max_lines 行 """
+    lines = list(dict.fromkeys(line for line in report.splitlines() if line.strip()))
+    if len(lines) <= max_lines:
+        return "\n".join(lines)
+    return "\n".join(lines[:max_lines] + [f"- (其余 {len(lines) - max_lines} 条问题省略，请先修复以上问题)"])
+
+
+def _strip_unreported_descriptions(plan: dict, report: str) -> dict:
+    """ 报告中没有提到的资产去掉描述 (置为 "" 以保持表格化编码)，布局与属性不变 """
+    assets = {
+        asset_id: details if asset_id in report or not isinstance(details, dict) else {**details, "description": ""}
+        for asset_id, details in plan.get("assets", {}).items()
+    }
+    return {**plan, "assets": assets}
+
+
+def _restore_descriptions(repaired: dict, base_plan: dict) -> dict:
+    """ 修复结果中描述为空的资产，从原规划恢复描述 (见 _strip_unreported_descriptions) """
+    base_assets = base_plan.get("assets", {})
+    for asset_id, details in repaired.get("assets", {}).items():
+        if isinstance(details, dict) and not details.get("description") and base_assets.get(asset_id, {}).get("description"):
+            details["description"] = base_assets[asset_id]["description"]
+    return repaired
+
+
+def _call_llm_for_repair(plan_str: str, report: str, base_plan: dict = None) -> dict | None: 
     """ Internal function, calls LLM with the repair prompt. """ 
     print("[Manager Agent] Connecting to LLM API to repair scene...") 
-    full_prompt = REPAIR_USER_PROMPT_TEMPLATE.format( original_json_str=plan_str, error_report=report )
+    full_prompt = REPAIR_USER_PROMPT_TEMPLATE.format( original_json_str=plan_str, error_report=report, codec_legend=CODEC_LEGEND )
+
+    def compact_fn():
+        # 超出 Token 预算时: 错误报告去重、截断；报告未提到的资产不发送描述
+        compact_plan_str = dumps_compact(_strip_unreported_descriptions(base_plan, report)) if base_plan else plan_str
+        return [{"role": "user", "content": REPAIR_USER_PROMPT_TEMPLATE.format(
+            original_json_str=compact_plan_str, error_report=_compact_report(report), codec_legend=CODEC_LEGEND)}]
 
     try:
-        response = client.chat.completions.create(
+        response = call_chat_completion(
+            client, "Manager Agent",
+            compact_fn=compact_fn,
             model=DESIGN_MODEL_NAME,
             messages=[
                 # {"role": "system", "content": REPAIR_SYSTEM_PROMPT},
@@ -359,7 +455,8 @@ def _call_llm_for_repair(plan_str: str, report: str) -> dict | None:
         response_content = response.choices[0].message.content
         print("[Manager Agent] LLM repair response received, parsing JSON...")
         
-        return json.loads(response_content)
+        repaired = loads_plan(response_content)
+        return _restore_descriptions(repaired, base_plan) if base_plan and isinstance(repaired, dict) else repaired
 
     except Exception as e:
         print(f"[Manager Agent] LLM API repair call or JSON parsing failed: {e}")
@@ -367,13 +464,16 @@ def _call_llm_for_repair(plan_str: str, report: str) -> dict | None:
 
 
 
-def get_scene_plan(prompt: str, use_llm: bool = True) -> dict:
+@traced("manager.draft")
+def get_scene_plan(prompt: str, use_llm: bool = True, grid_size: list = None, call_info: dict = None) -> dict:
     """
     Manager Agent 负责生成场景 JSON。
     它会尝试调用 LLM，如果失败，则返回一个备用的硬编码场景。
     
     :param prompt: 用户的场景描述。
     :param use_llm: 布尔值开关。True (默认) 则尝试 LLM, False 则立即使用备用计划。
+    :param grid_size: (可选) 需要的场景尺寸，用于挑选尺寸相近的备用计划
+    :param call_info: (可选) LLM 调用失败、退回备用计划时写入 {"llm_failed": True} (调用方据此不保存检查点)
     """
     print(f"[Manager Agent] 收到任务: '{prompt}'。")
 
@@ -385,19 +485,23 @@ def get_scene_plan(prompt: str, use_llm: bool = True) -> dict:
             print("[Manager Agent] LLM 统一规划生成完毕。")
             return llm_plan
         else:
-            print("[Manager Agent] LLM 生成失败，将使用备用硬编码计划。")
-            return get_fallback_plan()
+            print("[Manager Agent] LLM 生成失败，将使用备用计划。")
+            if call_info is not None:
+                call_info["llm_failed"] = True
+            return get_fallback_plan(prompt, grid_size)
     else:
-        print("[Manager Agent] 模式: 手动选择使用备用硬编码计划 (调试)。")
-        return get_fallback_plan()
+        print("[Manager Agent] 模式: 手动选择使用备用计划 (调试)。")
+        return get_fallback_plan(prompt, grid_size)
 
 
-def repair_scene_plan(base_plan: dict, report: str, use_llm: bool = True) -> dict: 
+@traced("manager.repair")
+def repair_scene_plan(base_plan: dict, report: str, use_llm: bool = True, call_info: dict = None) -> dict: 
     """ 
     Manager Agent 负责根据“错误报告”修复现有的场景 JSON。
     :param base_plan: 上一版（有错误）的场景 JSON (dict)
     :param report: Validator (代码QA) 或 Critic (VLM QA) 生成的错误报告 (str)
     :param use_llm: 布尔值开关。
+    :param call_info: (可选) 同 get_scene_plan: LLM 修复失败、原样返回时写入 {"llm_failed": True}
     :return: 修复后的场景 JSON (dict)
     """
     print(f"[Manager Agent] 收到修复任务。")
@@ -408,14 +512,14 @@ def repair_scene_plan(base_plan: dict, report: str, use_llm: bool = True) -> dic
         return base_plan
 
     try:
-        # 将 dict 序列化为字符串，以便送入 LLM
-        plan_str = json.dumps(base_plan, indent=4, ensure_ascii=False)
+        # 将 dict 序列化为紧凑编码字符串，以便送入 LLM
+        plan_str = dumps_compact(base_plan)
     except Exception as e:
         print(f"[Manager Agent] 无法序列化 base_plan: {e}。返回原始计划。")
         return base_plan
 
     # 尝试从 LLM 获取修复后的规划
-    llm_repaired_plan = _call_llm_for_repair(plan_str, report)
+    llm_repaired_plan = _call_llm_for_repair(plan_str, report, base_plan=base_plan)
 
     if llm_repaired_plan:
         print("[Manager Agent] LLM 修复规划生成完毕。")
@@ -423,12 +527,64 @@ def repair_scene_plan(base_plan: dict, report: str, use_llm: bool = True) -> dic
     else:
         # 如果 LLM 修复失败，返回原始的（未修复的）计划
         print("[Manager Agent] LLM 修复失败，将返回上一版（未修复）的计划。")
+        if call_info is not None:
+            call_info["llm_failed"] = True
         return base_plan
 
 
-def get_fallback_plan() -> dict: 
+def _call_llm_for_zone_map(prompt: str, grid_size: list) -> dict | None:
+    """ Internal function, calls LLM with the zone map prompt. """
+    print("[Manager Agent] Connecting to LLM API to plan zones...")
+    full_prompt = ZONE_MAP_PROMPT_TEMPLATE.format(user_request=prompt, grid_size=grid_size, min_zone_size=MIN_ZONE_SIZE)
+
+    try:
+        response = call_chat_completion(
+            client, "Manager Agent",
+            model=DESIGN_MODEL_NAME,
+            messages=[{"role": "user", "content": full_prompt}],
+            response_format={"type": "json_object"}
+        )
+        return json.loads(response.choices[0].message.content)
+
+    except Exception as e:
+        print(f"[Manager Agent] LLM zone map call or JSON parsing failed: {e}")
+        return None
+
+
+@traced("manager.zone_map")
+def get_zone_map(prompt: str, grid_size: list, use_llm: bool = True, call_info: dict = None) -> dict:
+    """
+    Manager Agent 负责为大型世界生成区域图 (分区生成的第一步)。
+    LLM 失败或区域图不合法时，退回到按网格均匀切分的区域图。
+
+    :param prompt: 世界描述。
+    :param grid_size: 世界尺寸 [宽, 高]。
+    :param call_info: (可选) 同 get_scene_plan: 调用了 LLM 却退回备用区域图时写入 {"llm_failed": True}
+    :return: 区域图 (见 zone_stitcher.py)
+    """
+    print(f"[Manager Agent] 收到区域规划任务: {grid_size}。")
+    if use_llm:
+        zone_map = _call_llm_for_zone_map(prompt, grid_size)
+        if zone_map:
+            # 世界尺寸以调用方为准
+            zone_map.setdefault("metadata", {})["grid_size"] = list(grid_size)
+            errors = validate_zone_map(zone_map)
+            if not errors:
+                print(f"[Manager Agent] 区域图生成完毕: {len(zone_map['zones'])} 个区域。")
+                return zone_map
+            print(f"[Manager Agent] 区域图不合法: {errors[:5]}")
+        print("[Manager Agent] 将使用按网格切分的备用区域图。")
+        if call_info is not None:
+            call_info["llm_failed"] = True
+
+    return build_fallback_zone_map(grid_size, description=prompt)
+
+
+def get_fallback_plan(prompt: str = "", grid_size: list = None) -> dict: 
     """ 
     【【【 已升级：V4 精致备用计划 】】】
-    返回一个备用的硬编码场景计划 (直接使用定义的范例)。
+    返回范例库中与提示最相关 (且尺寸相近，如果指定了 grid_size) 的完整范例；
+    库为空或没有合适的范例时，返回内置范例。
     """ 
-    return EXAMPLE_SCENE_JSON
\ No newline at end of file
+    plan = closest_exemplar_plan(prompt, grid_size) if prompt else None
+    return plan if plan is not None else EXAMPLE_SCENE_JSON
\ No newline at end of file
@@ -0,0 +1,374 @@
+# 文件名: memory_service.py
+import os
+import re
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+import subprocess
+import urllib.request
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ===================================================================
+# 角色记忆服务 (Memory Sidecar)
+# ===================================================================
+# Godot 中的角色不再把整个记忆数组写回灵魂文件、也不再把全部记忆塞进提示，
+# 而是通过本地 HTTP 调用本服务:
+#   POST /append  {"entries": [{"character", "time", "event", "thought"}, ...]}
+#   POST /recall  {"character", "query", "k"} -> {"summary": [...], "memories": [...], "total": n}
+#   POST /reload  {"character"}  (日志在服务之外被重写后，丢弃该角色的内存索引)
+#   GET  /health
+# 启动: main.py 在写灵魂文件之前调用 ensure_memory_service() 以独立进程启动 (主流程结束后继续运行)；
+#       也可以手动运行 `python memory_service.py <Godot 项目路径>`。
+# 服务不可用时 Godot 的 MemoryClient 把记忆写入 user://npc_memory/ 并从那里召回，服务恢复后补发。
+# - 每个角色一个只追加的日志 (<项目>/npc_memory/<角色>/log.jsonl)，每条事件只写一行；
+# - 每积累 SUMMARY_EVERY 条做一次抽取式摘要 (时间段 + 高频关键词 + 代表性事件)，摘要条数有上限；
+# - 召回用词法相关度 (BM25，中文按双字切分，不需要向量模型) 加近期加权，返回固定的 top-k。
+# 因此无论模拟运行多久，单次提示与单次写入的大小都是常数。
+
+MEMORY_DIR_NAME = "npc_memory"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MEMORY_SERVICE_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+
+# 每积累多少条新记忆做一次摘要 / 最多保留的摘要条数 (超出时合并最早的两条)
+SUMMARY_EVERY = 40
+MAX_SUMMARIES = 6
+# 摘要中列出的关键词数 / 代表性事件数
+SUMMARY_KEYWORDS = 6
+SUMMARY_EXAMPLES = 2
+# 召回默认条数；近期加权的半衰期 (条)
+RECALL_TOP_K = 8
+RECENCY_HALF_LIFE = 30
+RECENCY_WEIGHT = 0.5
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+|[一-鿿]+")
+_STOPWORDS = {"the", "a", "an", "to", "of", "and", "in", "on", "at", "is", "i", "you", "me", "my"}
+
+
+def tokenize(text: str) -> list:
+    """ 英文按单词，中文按相邻双字 (单字词保留单字) """
+    tokens = []
+    for piece in _TOKEN_RE.findall((text or "").lower()):
+        if "一" <= piece[0] <= "鿿":
+            tokens.extend(piece[i:i + 2] for i in range(max(1, len(piece) - 1)))
+        elif piece not in _STOPWORDS:
+            tokens.append(piece)
+    return tokens
+
+
+def character_key(character: str) -> str:
+    """ 角色名 -> 目录名 """
+    return re.sub(r"[^\w\-]+", "_", character).strip("_") or "unknown"
+
+
+def _entry_text(entry: dict) -> str:
+    return f"{entry.get('event', '')} {entry.get('thought', '')}"
+
+
+# ===================================================================
+# 单个角色的记忆
+# ===================================================================
+
+class CharacterMemory:
+    """ 一个角色的只追加日志 + 词法索引 + 滚动摘要 """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.log_path = os.path.join(directory, "log.jsonl")
+        self.summary_path = os.path.join(directory, "summary.json")
+        self.lock = threading.Lock()
+        self.entries = []
+        self.entry_tokens = []
+        self.doc_freq = Counter()
+        self.total_length = 0
+        self.summaries = []
+        self.summarized_upto = 0
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.summary_path):
+            with open(self.summary_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            self.summaries = saved.get("summaries", [])
+            self.summarized_upto = saved.get("summarized_upto", 0)
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        try:
+                            self._index(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue  # 进程中断时可能留下半行
+
+    def _index(self, entry: dict):
+        tokens = Counter(tokenize(_entry_text(entry)))
+        self.entries.append(entry)
+        self.entry_tokens.append(tokens)
+        self.doc_freq.update(tokens.keys())
+        self.total_length += sum(tokens.values())
+
+    def append(self, entries: list) -> int:
+        """ 追加若干条记忆 (每条写一行)，返回总条数 """
+        with self.lock:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                for entry in entries:
+                    record = {k: entry.get(k, "") for k in ("time", "event", "thought")}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    self._index(record)
+            if len(self.entries) - self.summarized_upto >= SUMMARY_EVERY:
+                self._summarize()
+            return len(self.entries)
+
+    # --- 摘要 ---
+
+    def _summarize(self):
+        """ 把尚未摘要的一段记忆压缩成一行抽取式摘要 """
+        start, end = self.summarized_upto, len(self.entries)
+        block = range(start, end)
+        n = max(1, len(self.entries))
+
+        # 段内 TF-IDF 最高的词作为关键词 (单字多为虚词，不参与)
+        block_tf = Counter()
+        for i in block:
+            block_tf.update(t for t in self.entry_tokens[i].elements() if len(t) > 1)
+        weights = {t: c * math.log(1 + n / self.doc_freq[t]) for t, c in block_tf.items()}
+        keywords = [t for t, _ in sorted(weights.items(), key=lambda kv: -kv[1])[:SUMMARY_KEYWORDS]]
+
+        # 覆盖关键词最多的事件作为代表
+        keyword_set = set(keywords)
+        ranked = sorted(block, key=lambda i: -sum(weights.get(t, 0) for t in self.entry_tokens[i] if t in keyword_set))
+        examples = [self.entries[i].get("event", "")[:60] for i in sorted(ranked[:SUMMARY_EXAMPLES])]
+
+        first, last = self.entries[start].get("time", "?"), self.entries[end - 1].get("time", "?")
+        self.summaries.append(
+            f"{first}~{last} ({end - start} 条): 关键词 {', '.join(keywords)}；例如: {' / '.join(examples)}"
+        )
+        if len(self.summaries) > MAX_SUMMARIES:
+            self.summaries[:2] = [self.summaries[0].split("；")[0] + " | " + self.summaries[1].split("；")[0]]
+        self.summarized_upto = end
+
+        tmp_path = self.summary_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"summaries": self.summaries, "summarized_upto": self.summarized_upto}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.summary_path)
+
+    # --- 召回 ---
+
+    def recall(self, query: str, k: int = RECALL_TOP_K) -> dict:
+        """ BM25 + 近期加权的 top-k；query 为空时返回最近的 k 条 """
+        with self.lock:
+            n = len(self.entries)
+            if n == 0:
+                return {"summary": list(self.summaries), "memories": [], "total": 0}
+
+            query_tokens = set(tokenize(query))
+            avg_len = self.total_length / n if n else 1.0
+            scores = []
+            for i in range(n):
+                tokens = self.entry_tokens[i]
+                recency = 1.0 + RECENCY_WEIGHT * 0.5 ** ((n - 1 - i) / RECENCY_HALF_LIFE)
+                relevance = 0.0
+                if query_tokens:
+                    length = sum(tokens.values()) or 1
+                    for t in query_tokens & tokens.keys():
+                        idf = math.log(1 + (n - self.doc_freq[t] + 0.5) / (self.doc_freq[t] + 0.5))
+                        tf = tokens[t]
+                        relevance += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+                scores.append((relevance * recency if query_tokens else recency, i))
+
+            top = sorted(i for _, i in sorted(scores, reverse=True)[:max(1, k)])
+            return {"summary": list(self.summaries), "memories": [self.entries[i] for i in top], "total": n}
+
+
+# ===================================================================
+# 服务 (HTTP)
+# ===================================================================
+
+_memories = {}
+_memories_lock = threading.Lock()
+_memory_root = os.path.join(".", MEMORY_DIR_NAME)
+
+
+def get_memory(character: str) -> CharacterMemory:
+    key = character_key(character)
+    with _memories_lock:
+        if key not in _memories:
+            _memories[key] = CharacterMemory(os.path.join(_memory_root, key))
+        return _memories[key]
+
+
+def drop_memory(character: str):
+    """ 丢弃某个角色的内存索引，下次访问时从磁盘重新加载 """
+    with _memories_lock:
+        _memories.pop(character_key(character), None)
+
+
+def seed_memory(project_path: str, character: str, entries: list, service_url: str = MEMORY_SERVICE_URL) -> str:
+    """
+    (Soul Writer 调用) 用初始记忆重置某个角色的记忆目录。
+    日志整体替换后通知正在运行的服务重新加载该角色，否则服务会继续使用旧的索引。
+    :return: 日志路径
+    """
+    directory = os.path.join(project_path, MEMORY_DIR_NAME, character_key(character))
+    os.makedirs(directory, exist_ok=True)
+    log_path = os.path.join(directory, "log.jsonl")
+    tmp_path = log_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            record = {k: entry.get(k, "") for k in ("time", "event", "thought")}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    summary_path = os.path.join(directory, "summary.json")
+    if os.path.exists(summary_path):
+        os.remove(summary_path)
+    os.replace(tmp_path, log_path)
+
+    drop_memory(character)
+    _post(service_url, "/reload", {"character": character})
+    return log_path
+
+
+def _post(service_url: str, path: str, payload: dict, timeout: float = 2.0):
+    """ 向服务发送一个请求；服务没有运行时返回 None """
+    request = urllib.request.Request(service_url + path, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def memory_service_health(service_url: str = MEMORY_SERVICE_URL, timeout: float = 1.0):
+    """ :return: 服务的 /health 结果；服务没有运行时返回 None """
+    try:
+        with urllib.request.urlopen(service_url + "/health", timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def ensure_memory_service(project_path: str, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, wait_seconds: float = 5.0) -> bool:
+    """
+    确保记忆服务在运行: 没有运行时以独立进程启动 (生成流程结束后继续为 Godot 服务)，
+    输出写入 <project>/npc_memory/service.log。
+    :return: 服务是否可用
+    """
+    service_url = f"http://{host}:{port}"
+    memory_root = os.path.abspath(os.path.join(project_path, MEMORY_DIR_NAME))
+    health = memory_service_health(service_url)
+    if health is not None:
+        if health.get("root") and os.path.normcase(health["root"]) != os.path.normcase(memory_root):
+            print(f"[Memory Service] 警告: {service_url} 上运行的服务使用另一个数据目录: {health['root']}")
+        else:
+            print(f"[Memory Service] 记忆服务已在运行: {service_url}")
+        return True
+
+    os.makedirs(memory_root, exist_ok=True)
+    popen_kwargs = {"start_new_session": True}
+    if os.name == "nt":
+        popen_kwargs = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS}
+    with open(os.path.join(memory_root, "service.log"), 'a', encoding='utf-8') as log:
+        subprocess.Popen(
+            [sys.executable, "-u", os.path.abspath(__file__), project_path, "--host", host, "--port", str(port)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, **popen_kwargs
+        )
+
+    deadline = time.monotonic() + wait_seconds
+    while time.monotonic() < deadline:
+        if memory_service_health(service_url) is not None:
+            print(f"[Memory Service] 已在后台启动记忆服务: {service_url} (日志: {os.path.join(memory_root, 'service.log')})")
+            return True
+        time.sleep(0.2)
+    print(f"!!! [Memory Service] 警告: 记忆服务未能在 {wait_seconds} 秒内启动，Godot 将退回本地记忆文件。")
+    return False
+
+
+class _MemoryRequestHandler(BaseHTTPRequestHandler):
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"ok": True, "characters": len(_memories), "root": os.path.abspath(_memory_root)})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except (ValueError, UnicodeDecodeError) as e:
+            self._reply(400, {"error": f"invalid JSON: {e}"})
+            return
+
+        if self.path == "/append":
+            entries = request.get("entries") or [request]
+            by_character = {}
+            for entry in entries:
+                if entry.get("character"):
+                    by_character.setdefault(entry["character"], []).append(entry)
+            totals = {name: get_memory(name).append(items) for name, items in by_character.items()}
+            self._reply(200, {"ok": True, "totals": totals})
+
+        elif self.path == "/recall":
+            if not request.get("character"):
+                self._reply(400, {"error": "'character' is required"})
+                return
+            k = int(request.get("k") or RECALL_TOP_K)
+            self._reply(200, get_memory(request["character"]).recall(request.get("query", ""), k))
+
+        elif self.path == "/reload":
+            if not request.get("character"):
+                self._reply(400, {"error": "'character' is required"})
+                return
+            drop_memory(request["character"])
+            self._reply(200, {"ok": True})
+
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        pass  # 每次请求都打印会刷屏
+
+
+def run_memory_service(project_path: str, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    """ 启动记忆服务 (阻塞) """
+    global _memory_root
+    _memory_root = os.path.join(project_path, MEMORY_DIR_NAME)
+    os.makedirs(_memory_root, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), _MemoryRequestHandler)
+    print(f"[Memory Service] 记忆服务已启动: http://{host}:{port} (数据目录: {_memory_root})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("[Memory Service] 已停止。")
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Godot 角色的本地记忆服务 (追加 + top-k 召回)")
+    parser.add_argument("project", help="Godot 项目路径 (记忆保存在 <project>/npc_memory/)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    run_memory_service(args.project, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
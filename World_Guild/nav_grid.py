@@ -0,0 +1,287 @@
+# 文件名: nav_grid.py
+import os
+import json
+import numpy as np
+
+# ===================================================================
+# 导航网格 (Navigation Grid)
+# ===================================================================
+# 用场景规划在 Python 端重建 Godot 中的可行走区域 (与 scene_builder_server.gd 的规则一致):
+#   - 地板: navigation 为 "walkable" (或未定义) 且不是 solid 的格子可行走；
+#   - 墙壁: 实心；
+#   - 物体: physics 为 "solid" 或 navigation 为 "obstacle" 的底座阻挡，"walkable_door" 的门可通行。
+# 再用 numpy 做 (批量) 多源 BFS，得到到每个语义标签最近实例的距离场 (flow field)
+# 与最近实例表。距离场中 UNREACHABLE (-1) 表示不可达。
+# 保存阶段把这些数据烘焙到 <项目>/navigation/ 下，Godot 的 NavData 自动加载脚本直接查表，
+# 运行时选目标、寻路都不再需要搜索。
+
+UNREACHABLE = -1
+
+# 4 邻接方向 (dy, dx)
+NEIGHBOR_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+# BFS 扩展时的 (目标切片, 来源切片)，与 NEIGHBOR_OFFSETS 对应
+_SHIFTS = (
+    (np.s_[..., :-1, :], np.s_[..., 1:, :]),
+    (np.s_[..., 1:, :], np.s_[..., :-1, :]),
+    (np.s_[..., :, :-1], np.s_[..., :, 1:]),
+    (np.s_[..., :, 1:], np.s_[..., :, :-1]),
+)
+
+# 烘焙文件: 与 scene_builder_server.gd / NavData.gd 保持一致
+NAV_DATA_DIR = "navigation"
+NAV_DATA_VERSION = 1
+NAV_TILE_SIZE = 16
+# 二进制中 uint16 的 "不可达 / 无实例"
+NAV_NONE_U16 = 65535
+
+
+def footprint_cells(position: list, base_size: list) -> tuple:
+    """
+    物体底座占据的格子 (x0, y0, x1, y1)，右下为开区间。
+    position 为底座底边中间的格子 (与 Godot 中 sprite 的锚点一致)。
+    """
+    x, y = int(position[0]), int(position[1])
+    w, h = max(1, int(base_size[0])), max(1, int(base_size[1]))
+    x0 = x - w // 2
+    y1 = y + 1
+    return x0, y1 - h, x0 + w, y1
+
+
+def _fill(grid: np.ndarray, x0: int, y0: int, x1: int, y1: int, value):
+    h, w = grid.shape[-2:]
+    grid[..., max(0, y0):min(h, y1), max(0, x0):min(w, x1)] = value
+
+
+def build_walkable_grid(plan: dict) -> np.ndarray:
+    """ 可行走位图 bool [H, W] """
+    grid_w, grid_h = plan.get("metadata", {}).get("grid_size", [25, 20])
+    layout = plan.get("layout", {})
+    assets = plan.get("assets", {})
+    properties = plan.get("properties", {})
+
+    floor_layer = layout.get("floor_layer", [])
+    # 没有地板信息时视为整张地图可行走
+    walkable = np.zeros((grid_h, grid_w), dtype=bool) if floor_layer else np.ones((grid_h, grid_w), dtype=bool)
+
+    for entry in floor_layer:
+        area = entry.get("area")
+        if not (isinstance(area, list) and len(area) == 4):
+            continue
+        props = properties.get(entry.get("asset_id")) or {}
+        ok = props.get("physics") != "solid" and props.get("navigation", "walkable") in ("walkable", "walkable_door")
+        x, y, w, h = area
+        _fill(walkable, x, y, x + w, y + h, ok)
+
+    for entry in layout.get("wall_layer", []):
+        area = entry.get("area")
+        if isinstance(area, list) and len(area) == 4:
+            x, y, w, h = area
+            _fill(walkable, x, y, x + w, y + h, False)
+
+    doors = []
+    for entry in layout.get("object_layer", []):
+        asset_id = entry.get("asset_id")
+        position = entry.get("position")
+        if not (isinstance(position, list) and len(position) == 2):
+            continue
+        props = properties.get(asset_id) or {}
+        cells = footprint_cells(position, (assets.get(asset_id) or {}).get("base_size") or [1, 1])
+        if props.get("navigation") == "walkable_door":
+            doors.append(cells)
+        elif props.get("physics") == "solid" or props.get("navigation") == "obstacle":
+            _fill(walkable, *cells, False)
+
+    # 门最后处理: 门所在的墙格可以通过
+    for cells in doors:
+        _fill(walkable, *cells, True)
+    return walkable
+
+
+def collect_tag_instances(plan: dict) -> dict:
+    """
+    语义标签对应的地点实例:
+    { semantic_tag: [((x0, y0, x1, y1), [锚点 x, y]), ...] }
+    - object_layer 中的物体 (与 Godot 中 add_to_group(semantic_tag) 对应)，锚点为 position；
+    - floor_layer 中带语义标签的地面区域 (如 [floor_garden])，锚点为区域中心。
+      Godot 中地砖不属于任何组，只能通过烘焙的导航数据到达。
+    """
+    assets = plan.get("assets", {})
+    properties = plan.get("properties", {})
+    layout = plan.get("layout", {})
+    instances = {}
+    for entry in layout.get("object_layer", []):
+        asset_id = entry.get("asset_id")
+        details = assets.get(asset_id) or {}
+        tag = (properties.get(asset_id) or {}).get("semantic_tag")
+        position = entry.get("position")
+        if details.get("type") != "object" or not tag or not (isinstance(position, list) and len(position) == 2):
+            continue
+        cells = footprint_cells(position, details.get("base_size") or [1, 1])
+        instances.setdefault(tag, []).append((cells, [int(position[0]), int(position[1])]))
+
+    for entry in layout.get("floor_layer", []):
+        tag = (properties.get(entry.get("asset_id")) or {}).get("semantic_tag")
+        area = entry.get("area")
+        if not tag or tag == "floor" or not (isinstance(area, list) and len(area) == 4):
+            continue
+        x, y, w, h = area
+        instances.setdefault(tag, []).append(((x, y, x + w, y + h), [x + w // 2, y + h // 2]))
+    return instances
+
+
+def goal_mask(walkable: np.ndarray, footprints: list) -> np.ndarray:
+    """ 到达区域: 底座本身及其 4 邻接格中可行走的格子 """
+    goals = np.zeros_like(walkable)
+    for x0, y0, x1, y1 in footprints:
+        _fill(goals, x0, y0, x1, y1, True)
+    grown = goals.copy()
+    grown[1:, :] |= goals[:-1, :]
+    grown[:-1, :] |= goals[1:, :]
+    grown[:, 1:] |= goals[:, :-1]
+    grown[:, :-1] |= goals[:, 1:]
+    return grown & walkable
+
+
+def distance_fields(walkable: np.ndarray, goals: np.ndarray, labels: np.ndarray = None):
+    """
+    (向量化) 批量多源 BFS。
+    :param goals: bool [K, H, W] (或 [H, W])，每一层是一组起点
+    :param labels: (可选) int32，与 goals 同形状，起点格的实例编号；会随 BFS 传播 (最近实例表)
+    :return: int32 [K, H, W]，每格到该层最近起点的步数，不可达为 UNREACHABLE；
+             传入 labels 时返回 (距离场, 最近实例编号 (不可达为 -1))
+    """
+    goals = goals & walkable
+    dist = np.full(goals.shape, UNREACHABLE, dtype=np.int32)
+    dist[goals] = 0
+    if labels is not None:
+        labels = np.where(goals, labels, -1).astype(np.int32)
+    frontier = goals
+    d = 0
+    while frontier.any():
+        d += 1
+        nxt = np.zeros_like(frontier)
+        for dst, src in _SHIFTS:
+            nxt[dst] |= frontier[src]
+        nxt &= walkable
+        nxt &= dist == UNREACHABLE
+        if labels is not None:
+            for dst, src in _SHIFTS:
+                take = nxt[dst] & frontier[src] & (labels[dst] < 0)
+                labels[dst][take] = labels[src][take]
+        dist[nxt] = d
+        frontier = nxt
+    return dist if labels is None else (dist, labels)
+
+
+def build_tag_fields(plan: dict, walkable: np.ndarray = None, with_nearest: bool = False) -> tuple:
+    """
+    每个语义标签一层距离场。
+    :return: (tags 列表, int32 [T, H, W] 距离场, tag_instances)；
+             with_nearest=True 时再附加 int32 [T, H, W] 最近实例编号
+    """
+    if walkable is None:
+        walkable = build_walkable_grid(plan)
+    instances = collect_tag_instances(plan)
+    tags = sorted(instances)
+    if not tags:
+        empty = np.zeros((0,) + walkable.shape, dtype=np.int32)
+        return ([], empty, instances, empty) if with_nearest else ([], empty, instances)
+
+    goals = np.stack([goal_mask(walkable, [cells for cells, _ in instances[tag]]) for tag in tags])
+    if not with_nearest:
+        return tags, distance_fields(walkable, goals), instances
+
+    labels = np.full(goals.shape, -1, dtype=np.int32)
+    for t, tag in enumerate(tags):
+        for k, (cells, _) in enumerate(instances[tag]):
+            own = goal_mask(walkable, [cells]) & (labels[t] < 0)
+            labels[t][own] = k
+    fields, nearest = distance_fields(walkable, goals, labels)
+    return tags, fields, instances, nearest
+
+
+def step_downhill(fields: np.ndarray, layer: np.ndarray, ys: np.ndarray, xs: np.ndarray) -> tuple:
+    """
+    (向量化) 每个智能体沿自己的距离场走一步 (移动到距离更小的邻格)。
+    :param fields: [K, H, W] 距离场
+    :param layer: 每个智能体使用的层下标 [N]
+    :return: (新 ys, 新 xs)
+    """
+    h, w = fields.shape[-2:]
+    big = np.iinfo(np.int32).max
+    current = fields[layer, ys, xs]
+    best = np.where(current == UNREACHABLE, big, current)
+    best_y, best_x = ys.copy(), xs.copy()
+    for dy, dx in NEIGHBOR_OFFSETS:
+        ny = np.clip(ys + dy, 0, h - 1)
+        nx = np.clip(xs + dx, 0, w - 1)
+        d = fields[layer, ny, nx]
+        better = (d != UNREACHABLE) & (d < best)
+        best = np.where(better, d, best)
+        best_y = np.where(better, ny, best_y)
+        best_x = np.where(better, nx, best_x)
+    return best_y, best_x
+
+
+# ===================================================================
+# 烘焙 (Bake) —— 保存阶段调用，供 Godot 的 NavData.gd 读取
+# ===================================================================
+
+def bake_navigation(plan: dict) -> dict:
+    """
+    :return: {"walkable": bool [H, W], "tags": [...], "fields": [T, H, W], "nearest": [T, H, W], "instances": {...}}
+    """
+    walkable = build_walkable_grid(plan)
+    tags, fields, instances, nearest = build_tag_fields(plan, walkable, with_nearest=True)
+    return {"walkable": walkable, "tags": tags, "fields": fields, "nearest": nearest, "instances": instances}
+
+
+def save_navigation_artifacts(plan: dict, project_path: str, basename: str) -> str:
+    """
+    写入 <project>/navigation/<basename>.nav.json (元数据) 与 <basename>.nav.bin (数据)。
+    二进制布局 (小端，按行优先 y * W + x):
+      - 可行走位图: uint8 [H * W]
+      - 每个标签: 距离场 uint16 [H * W]，最近实例编号 uint16 [H * W] (NAV_NONE_U16 = 不可达 / 无)
+    :return: Godot 中的元数据路径 (res://navigation/<basename>.nav.json)
+    """
+    baked = bake_navigation(plan)
+    walkable, fields, nearest = baked["walkable"], baked["fields"], baked["nearest"]
+    grid_h, grid_w = walkable.shape
+    cell_count = grid_h * grid_w
+
+    nav_dir = os.path.join(project_path, NAV_DATA_DIR)
+    os.makedirs(nav_dir, exist_ok=True)
+    bin_name = f"{basename}.nav.bin"
+
+    def _u16(array):
+        return np.where(array < 0, NAV_NONE_U16, np.minimum(array, NAV_NONE_U16 - 1)).astype("<u2")
+
+    tags_meta = {}
+    offset = cell_count
+    with open(os.path.join(nav_dir, bin_name), 'wb') as f:
+        f.write(walkable.astype(np.uint8).tobytes())
+        for t, tag in enumerate(baked["tags"]):
+            f.write(_u16(fields[t]).tobytes())
+            f.write(_u16(nearest[t]).tobytes())
+            tags_meta[tag] = {
+                "field_offset": offset,
+                "nearest_offset": offset + 2 * cell_count,
+                "instances": [anchor for _, anchor in baked["instances"][tag]]
+            }
+            offset += 4 * cell_count
+
+    meta = {
+        "version": NAV_DATA_VERSION,
+        "grid_size": [grid_w, grid_h],
+        "tile_size": NAV_TILE_SIZE,
+        "none_value": NAV_NONE_U16,
+        "data_file": bin_name,
+        "walkable_offset": 0,
+        "tags": tags_meta
+    }
+    with open(os.path.join(nav_dir, f"{basename}.nav.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    print(f"[Navigation] 已烘焙导航数据: {len(tags_meta)} 个标签, {grid_w}x{grid_h} 网格 ({offset / 1024:.0f} KB)")
+    return f"res://{NAV_DATA_DIR}/{basename}.nav.json"
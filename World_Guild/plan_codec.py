@@ -0,0 +1,298 @@
+# 文件名: plan_codec.py
+import json
+
+# ===================================================================
+# 紧凑场景规划编码 (Compact Plan Codec)
+# ===================================================================
+# 发送给 LLM 的场景 JSON 以前是 indent=4 的完整格式，
+# object_layer 中每个物体都是一个冗长的 {"asset_id": ..., "position": [...]}。
+# 这里定义一种无损的紧凑编码 (用于提示)，以及能同时接受紧凑/完整格式的解码器 (用于响应):
+#
+#   1. 最小化 JSON (无缩进、无多余空格)；
+#   2. assets / properties 表格化: 字段固定的条目写成一行数组；
+#   3. layout 每个图层写成 "游程" 列表: 连续使用同一资产的条目合并为
+#        [asset_id, 条目, 条目, ...]
+#      条目:
+#        [x, y]                 -> {"asset_id", "position": [x, y]}
+#        [x, y, w, h]           -> {"asset_id", "command": "fill_rect", "area": [x, y, w, h]}
+#        [x, y, dx, dy, n]      -> n 个等间距放置: (x, y), (x+dx, y+dy), ...
+#      不符合以上形状的条目 (有额外字段) 原样保留为对象，单独成一个游程元素。
+
+CODEC_VERSION = "wgc1"
+
+ASSET_COLUMNS = ["type", "description", "base_size", "visual_size"]
+PROPERTY_COLUMNS = ["physics", "navigation", "semantic_tag"]
+
+# 给 LLM 的格式说明 (与编码后的 JSON 一起放进提示)
+CODEC_LEGEND = (
+    f'紧凑格式说明 ("_codec": "{CODEC_VERSION}"):\n'
+    f'- assets 中的数组 = [{", ".join(ASSET_COLUMNS)}]；properties 中的数组 = [{", ".join(PROPERTY_COLUMNS)}]；对象照常。\n'
+    '- layout 每个图层是游程列表，每个游程 = [asset_id, 条目, 条目, ...]，连续的同一资产合并在一个游程中:\n'
+    '  [x, y] = 在 position [x, y] 放置一个；[x, y, w, h] = fill_rect 区域；\n'
+    '  [x, y, dx, dy, n] = 从 (x, y) 起每次偏移 (dx, dy)，共放置 n 个。\n'
+    '- 游程位置上也可以直接写完整对象 (如 {"asset_id": ..., "position": [...]})。'
+)
+
+_MIN_PROGRESSION = 3
+
+
+def _minify(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_point(value) -> bool:
+    return isinstance(value, list) and len(value) == 2 and all(_is_number(v) for v in value)
+
+
+# ===================================================================
+# 编码 (Encode)
+# ===================================================================
+
+def _encode_row(entry: dict, columns: list):
+    """ 字段恰好为 columns 的条目写成数组，否则原样保留 """
+    if isinstance(entry, dict) and set(entry) == set(columns):
+        return [entry[c] for c in columns]
+    return entry
+
+
+def _layer_item(entry):
+    """
+    把一个图层条目转成 (asset_id, 紧凑条目)；无法紧凑表示则返回 (None, entry)。
+    """
+    if not isinstance(entry, dict) or not isinstance(entry.get("asset_id"), str):
+        return None, entry
+    keys = set(entry)
+    if keys == {"asset_id", "position"} and _is_point(entry["position"]):
+        return entry["asset_id"], list(entry["position"])
+    area = entry.get("area")
+    if (keys == {"asset_id", "command", "area"} and entry["command"] == "fill_rect"
+            and isinstance(area, list) and len(area) == 4 and all(_is_number(v) for v in area)):
+        return entry["asset_id"], list(area)
+    return None, entry
+
+
+def _compress_points(items: list) -> list:
+    """ 把连续的等间距点 (>= 3 个) 合并为 [x, y, dx, dy, n]；只在能精确还原时合并 """
+    result = []
+    i = 0
+    while i < len(items):
+        item = items[i]
+        if len(item) == 2 and i + 1 < len(items) and len(items[i + 1]) == 2:
+            dx = items[i + 1][0] - item[0]
+            dy = items[i + 1][1] - item[1]
+            j = i + 1
+            while (j + 1 < len(items) and len(items[j + 1]) == 2
+                   and items[j + 1][0] == item[0] + dx * (j + 1 - i)
+                   and items[j + 1][1] == item[1] + dy * (j + 1 - i)):
+                j += 1
+            # 第二个点也必须能由 dx/dy 精确还原 (浮点误差)
+            count = j - i + 1
+            if count >= _MIN_PROGRESSION and all(
+                    items[i + k] == [item[0] + dx * k, item[1] + dy * k] for k in range(count)):
+                result.append([item[0], item[1], dx, dy, count])
+                i = j + 1
+                continue
+        result.append(item)
+        i += 1
+    return result
+
+
+def _encode_layer(entries: list) -> list:
+    runs = []
+    current_id = None
+    for entry in entries:
+        asset_id, item = _layer_item(entry)
+        if asset_id is None:
+            runs.append(item)
+            current_id = None
+        elif asset_id == current_id:
+            runs[-1].append(item)
+        else:
+            runs.append([asset_id, item])
+            current_id = asset_id
+    for run in runs:
+        if isinstance(run, list):
+            run[1:] = _compress_points(run[1:])
+    return runs
+
+
+def encode_plan(plan: dict) -> dict:
+    """ 完整场景规划 -> 紧凑编码 (dict)。无法识别的字段原样保留。 """
+    encoded = {"_codec": CODEC_VERSION}
+    for key, value in plan.items():
+        if key == "assets" and isinstance(value, dict):
+            encoded[key] = {k: _encode_row(v, ASSET_COLUMNS) for k, v in value.items()}
+        elif key == "properties" and isinstance(value, dict):
+            encoded[key] = {k: _encode_row(v, PROPERTY_COLUMNS) for k, v in value.items()}
+        elif key == "layout" and isinstance(value, dict):
+            encoded[key] = {
+                layer: _encode_layer(entries) if isinstance(entries, list) else entries
+                for layer, entries in value.items()
+            }
+        else:
+            encoded[key] = value
+    return encoded
+
+
+def dumps_compact(plan: dict) -> str:
+    """ 完整场景规划 -> 紧凑编码的最小化 JSON 字符串 (用于提示) """
+    return _minify(encode_plan(plan))
+
+
+# ===================================================================
+# 解码 (Decode)
+# ===================================================================
+
+def _decode_row(row, columns: list):
+    if isinstance(row, list):
+        if len(row) != len(columns):
+            raise ValueError(f"紧凑条目长度应为 {len(columns)}: {row}")
+        return dict(zip(columns, row))
+    return row
+
+
+def _decode_item(asset_id: str, item) -> list:
+    if isinstance(item, dict):
+        return [item]
+    if not isinstance(item, list):
+        raise ValueError(f"无法解码的图层条目: {item}")
+    if len(item) == 2:
+        return [{"asset_id": asset_id, "position": list(item)}]
+    if len(item) == 4:
+        return [{"asset_id": asset_id, "command": "fill_rect", "area": list(item)}]
+    if len(item) == 5:
+        x, y, dx, dy, n = item
+        return [{"asset_id": asset_id, "position": [x + dx * k, y + dy * k]} for k in range(int(n))]
+    raise ValueError(f"无法解码的图层条目: {item}")
+
+
+def _decode_layer(runs: list) -> list:
+    entries = []
+    for run in runs:
+        if isinstance(run, dict):
+            entries.append(run)
+        elif isinstance(run, list) and run and isinstance(run[0], str):
+            for item in run[1:]:
+                entries.extend(_decode_item(run[0], item))
+        else:
+            raise ValueError(f"无法解码的图层游程: {run}")
+    return entries
+
+
+def decode_plan(data: dict) -> dict:
+    """
+    紧凑编码 -> 完整场景规划。
+    没有 "_codec" 标记的输入视为完整格式，原样返回 (兼容 LLM 直接输出完整 JSON)。
+    :raises ValueError: 紧凑编码格式错误
+    """
+    if not isinstance(data, dict) or data.get("_codec") != CODEC_VERSION:
+        return data
+    plan = {}
+    for key, value in data.items():
+        if key == "_codec":
+            continue
+        if key == "assets" and isinstance(value, dict):
+            plan[key] = {k: _decode_row(v, ASSET_COLUMNS) for k, v in value.items()}
+        elif key == "properties" and isinstance(value, dict):
+            plan[key] = {k: _decode_row(v, PROPERTY_COLUMNS) for k, v in value.items()}
+        elif key == "layout" and isinstance(value, dict):
+            plan[key] = {
+                layer: _decode_layer(runs) if isinstance(runs, list) else runs
+                for layer, runs in value.items()
+            }
+        else:
+            plan[key] = value
+    return plan
+
+
+def loads_plan(text: str) -> dict:
+    """ 解析 LLM 响应 (紧凑或完整格式) -> 完整场景规划 """
+    return decode_plan(json.loads(text))
+
+
+# ===================================================================
+# Critic 尺寸表 (Size Table)
+# ===================================================================
+
+SIZE_TABLE_COLUMNS = ["asset_id", "type", "description", "base_size", "visual_size"]
+
+
+def encode_size_table(assets: dict) -> str:
+    """ 资产尺寸数据 -> 带列名的紧凑表格 (最小化 JSON) """
+    rows = [
+        [asset_id, details.get("type"), details.get("description"), details.get("base_size"), details.get("visual_size")]
+        for asset_id, details in assets.items()
+    ]
+    return _minify({"columns": SIZE_TABLE_COLUMNS, "rows": rows})
+
+
+# ===================================================================
+# 自检: python plan_codec.py
+# ===================================================================
+if __name__ == "__main__":
+    import copy
+    import random
+
+    def _check_round_trip(plan: dict, label: str):
+        decoded = loads_plan(dumps_compact(plan))
+        assert decoded == plan, f"{label}: 往返编码不一致"
+        # 完整格式也必须能被解码器原样接受
+        assert decode_plan(copy.deepcopy(plan)) == plan, f"{label}: 完整格式未原样返回"
+
+    base = {
+        "metadata": {"scene_name": "test", "grid_size": [20, 15]},
+        "assets": {
+            "floor_wood": {"type": "tile", "description": "wood floor", "base_size": [1, 1], "visual_size": [2, 2]},
+            "chair": {"type": "object", "description": "chair", "base_size": [2, 2], "visual_size": [2, 3], "tint": "red"},
+        },
+        "layout": {
+            "floor_layer": [{"asset_id": "floor_wood", "command": "fill_rect", "area": [0, 0, 20, 15]}],
+            "object_layer": [
+                {"asset_id": "chair", "position": [1, 1]},
+                {"asset_id": "chair", "position": [3, 1]},
+                {"asset_id": "chair", "position": [5, 1]},
+                {"asset_id": "chair", "position": [5, 4]},
+                {"asset_id": "chair", "position": [2.5, 0.1], "flip": True},
+                {"asset_id": "chair", "position": [0.1, 0.2]},
+                {"asset_id": "chair", "position": [0.2, 0.4]},
+                {"asset_id": "chair", "position": [0.30000000000000004, 0.6]},
+            ],
+            "npc_layer": [],
+            "notes": "free text"
+        },
+        "properties": {
+            "floor_wood": {"physics": "passable", "navigation": "walkable", "semantic_tag": "floor"},
+            "chair": {"physics": "passable", "navigation": "obstacle", "semantic_tag": "chair", "seat": True},
+        }
+    }
+    _check_round_trip(base, "基础用例")
+
+    # 随机用例: 随机资产序列 + 等差/随机位置 + 随机额外字段
+    rng = random.Random(42)
+    for case in range(300):
+        plan = copy.deepcopy(base)
+        ids = ["a", "b", "c"]
+        objects = []
+        for _ in range(rng.randint(0, 40)):
+            entry = {"asset_id": rng.choice(ids), "position": [rng.randint(0, 5), rng.choice([0, 1, 2.5])]}
+            if rng.random() < 0.05:
+                entry["rotation"] = 90
+            objects.append(entry)
+        plan["layout"]["object_layer"] = objects
+        _check_round_trip(plan, f"随机用例 {case}")
+
+    # 真实范例的压缩率 (与以前 indent=4 的提示格式相比)
+    try:
+        from manager_agent_zh import EXAMPLE_SCENE_JSON
+        _check_round_trip(EXAMPLE_SCENE_JSON, "EXAMPLE_SCENE_JSON")
+        verbose_len = len(json.dumps(EXAMPLE_SCENE_JSON, indent=4, ensure_ascii=False))
+        compact_len = len(dumps_compact(EXAMPLE_SCENE_JSON))
+        print(f"EXAMPLE_SCENE_JSON: {verbose_len} -> {compact_len} 字符 ({compact_len / verbose_len:.0%})")
+    except SystemExit:
+        print("(跳过范例压缩率: Manager Agent 未配置 API 密钥)")
+
+    print("plan_codec 自检通过。")
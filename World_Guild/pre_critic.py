@@ -0,0 +1,233 @@
+# 文件名: pre_critic.py
+import re
+import math
+from typing import List, Dict, Any
+
+# ===================================================================
+# 规则预审 (Rule-based Pre-Critic)
+# ===================================================================
+# 在调用 VLM (每次 10~30 秒) 之前，先用确定性规则审查场景:
+#   - 发现 "阻断性" 问题 (门不在墙上、尺寸比例明显错误) -> 直接进入修复，不调用 VLM；
+#   - 没有发现任何问题 -> 视为通过，跳过 VLM；
+#   - 其余情况 -> 照常调用 VLM，规则发现的轻微问题并入报告 (VLM 通过时也会交给 Manager)。
+# 规则只覆盖少数几种问题，有轻微问题的场景往往还有规则看不到的问题，因此不按得分跳过 VLM。
+
+# 每条警告扣分 (得分只用于追踪与日志)
+WARNING_PENALTIES = {
+    "chair_without_table": 0.05,
+    "door_blocked": 0.1,
+    "tall_proportion": 0.05,
+    "empty_area": 0.2,
+}
+
+# 椅子与最近桌子的最大距离 (瓦片，底边中点之间)
+CHAIR_TABLE_MAX_DISTANCE = 3.5
+# 超过此边长的正方形空地视为 "空旷" (与 Critic 提示中的 10x10 一致)
+EMPTY_SQUARE_LIMIT = 10
+# visual 高度超过 base 高度的倍数 (且差值超过 4 格) 视为比例可疑
+TALL_RATIO_LIMIT = 4
+# NPC / Agent 的合理 visual_size 范围: 宽 1~3, 高 2~4
+CHARACTER_VISUAL_RANGE = ((1, 3), (2, 4))
+
+
+def _tag_of(asset_id: str, plan: dict) -> str:
+    """ 语义标签 (没有则用 asset_id)，小写 """
+    props = plan.get("properties", {}).get(asset_id) or {}
+    return str(props.get("semantic_tag") or asset_id).lower()
+
+
+def _is_kind(asset_id: str, plan: dict, keyword: str) -> bool:
+    """ 按单词匹配语义标签或 asset_id (避免 'indoor' 被当成 'door') """
+    words = set(re.split(r"[^a-z0-9]+", f"{_tag_of(asset_id, plan)} {asset_id.lower()}"))
+    return keyword in words or f"{keyword}s" in words
+
+
+def _wall_cells(plan: dict) -> set:
+    cells = set()
+    for entry in plan.get("layout", {}).get("wall_layer", []):
+        area = entry.get("area")
+        if isinstance(area, list) and len(area) == 4:
+            x, y, w, h = area
+            cells.update((cx, cy) for cx in range(x, x + w) for cy in range(y, y + h))
+    return cells
+
+
+def _footprint(position: list, base_size: list) -> tuple:
+    """ 物体底座覆盖的格子范围 (x0, y0, x1, y1)，position 为底边中点 """
+    x, y = position
+    w, h = base_size
+    return math.floor(x - w / 2), math.floor(y - h), math.ceil(x + w / 2), math.ceil(y)
+
+
+# ===================================================================
+# 规则 (Rules)
+# ===================================================================
+
+def check_proportions(plan: dict) -> tuple:
+    """ 尺寸比例: 返回 (阻断性问题, 警告) """
+    blocking, warnings = [], []
+    for asset_id, details in plan.get("assets", {}).items():
+        base = details.get("base_size")
+        visual = details.get("visual_size")
+        if not (isinstance(base, list) and isinstance(visual, list) and len(base) == 2 and len(visual) == 2):
+            continue
+        asset_type = details.get("type")
+
+        if asset_type in ("npc", "agent"):
+            (w_min, w_max), (h_min, h_max) = CHARACTER_VISUAL_RANGE
+            if not (w_min <= visual[0] <= w_max and h_min <= visual[1] <= h_max):
+                blocking.append(f"比例错误: 角色 '{asset_id}' 的 visual_size {visual} 不合理 (标准为 [2, 3])。")
+        elif asset_type == "object":
+            if visual[1] < base[1]:
+                blocking.append(f"比例错误: '{asset_id}' 的 visual_size 高度 {visual[1]} 小于 base_size 高度 {base[1]}。")
+            elif visual[1] > base[1] * TALL_RATIO_LIMIT and visual[1] - base[1] > 4:
+                warnings.append(("tall_proportion", f"比例可疑: '{asset_id}' 的 visual_size {visual} 相对 base_size {base} 过高。"))
+    return blocking, warnings
+
+
+def check_doors(plan: dict) -> tuple:
+    """ 门必须贴着墙 (底座周围一圈内有墙格)，门前不能被实心物体堵住 """
+    blocking, warnings = [], []
+    assets = plan.get("assets", {})
+    walls = _wall_cells(plan)
+    objects = plan.get("layout", {}).get("object_layer", [])
+
+    solid_footprints = []
+    for entry in objects:
+        asset_id = entry.get("asset_id", "")
+        details = assets.get(asset_id) or {}
+        props = plan.get("properties", {}).get(asset_id) or {}
+        if props.get("physics") == "solid" and isinstance(entry.get("position"), list) and details.get("base_size"):
+            solid_footprints.append((asset_id, _footprint(entry["position"], details["base_size"])))
+
+    for entry in objects:
+        asset_id = entry.get("asset_id", "")
+        details = assets.get(asset_id) or {}
+        if not _is_kind(asset_id, plan, "door") or not isinstance(entry.get("position"), list):
+            continue
+        x0, y0, x1, y1 = _footprint(entry["position"], details.get("base_size", [1, 1]))
+
+        if walls:
+            ring = {(cx, cy) for cx in range(x0 - 1, x1 + 1) for cy in range(y0 - 1, y1 + 1)}
+            if not ring & walls:
+                blocking.append(f"门的位置错误: '{asset_id}' (位置 {entry['position']}) 没有贴着任何墙壁。")
+
+        # 门前 (下方) 一格
+        front = (x0, y1, x1, y1 + 1)
+        for other_id, (ox0, oy0, ox1, oy1) in solid_footprints:
+            if other_id == asset_id:
+                continue
+            if ox0 < front[2] and front[0] < ox1 and oy0 < front[3] and front[1] < oy1:
+                warnings.append(("door_blocked", f"门被堵住: '{asset_id}' (位置 {entry['position']}) 前方有 '{other_id}'。"))
+                break
+    return blocking, warnings
+
+
+def check_chairs_have_tables(plan: dict) -> list:
+    """ 每把椅子附近都应该有桌子/吧台 """
+    warnings = []
+    objects = plan.get("layout", {}).get("object_layer", [])
+    tables = [
+        entry["position"] for entry in objects
+        if isinstance(entry.get("position"), list)
+        and any(_is_kind(entry.get("asset_id", ""), plan, k) for k in ("table", "counter", "desk", "bar"))
+    ]
+    for entry in objects:
+        asset_id = entry.get("asset_id", "")
+        position = entry.get("position")
+        if not isinstance(position, list) or not any(_is_kind(asset_id, plan, k) for k in ("chair", "stool", "seat")):
+            continue
+        if not any(math.dist(position, t) <= CHAIR_TABLE_MAX_DISTANCE for t in tables):
+            warnings.append(("chair_without_table", f"布局问题: 椅子 '{asset_id}' (位置 {position}) 附近没有桌子。"))
+    return warnings
+
+
+def largest_empty_square(plan: dict) -> int:
+    """
+    室内空旷度: 在有地板的格子中，找出不含墙壁与物体的最大正方形边长 (动态规划)。
+    室外地面 (grass / water 等) 不参与计算。
+    """
+    grid_w, grid_h = plan.get("metadata", {}).get("grid_size", [0, 0])
+    if not grid_w or not grid_h:
+        return 0
+
+    outdoor_words = ("grass", "water", "dirt", "sand", "snow", "garden", "road", "street", "asphalt", "gravel")
+    free = [[False] * grid_w for _ in range(grid_h)]
+    for entry in plan.get("layout", {}).get("floor_layer", []):
+        area = entry.get("area")
+        asset_id = entry.get("asset_id", "")
+        if not (isinstance(area, list) and len(area) == 4):
+            continue
+        if any(word in _tag_of(asset_id, plan) or word in asset_id.lower() for word in outdoor_words):
+            continue
+        x, y, w, h = area
+        for cy in range(max(0, y), min(grid_h, y + h)):
+            for cx in range(max(0, x), min(grid_w, x + w)):
+                free[cy][cx] = True
+
+    for cx, cy in _wall_cells(plan):
+        if 0 <= cx < grid_w and 0 <= cy < grid_h:
+            free[cy][cx] = False
+    assets = plan.get("assets", {})
+    for layer in ("object_layer", "npc_layer"):
+        for entry in plan.get("layout", {}).get(layer, []):
+            details = assets.get(entry.get("asset_id")) or {}
+            if not isinstance(entry.get("position"), list):
+                continue
+            x0, y0, x1, y1 = _footprint(entry["position"], details.get("base_size", [1, 1]))
+            for cy in range(max(0, y0), min(grid_h, y1)):
+                for cx in range(max(0, x0), min(grid_w, x1)):
+                    free[cy][cx] = False
+
+    best = 0
+    prev = [0] * (grid_w + 1)
+    for cy in range(grid_h):
+        row = [0] * (grid_w + 1)
+        for cx in range(grid_w):
+            if free[cy][cx]:
+                row[cx + 1] = 1 + min(prev[cx], prev[cx + 1], row[cx])
+                best = max(best, row[cx + 1])
+        prev = row
+    return best
+
+
+# ===================================================================
+# 主入口函数
+# ===================================================================
+
+def run_pre_critic(plan_json: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    运行全部规则。
+    :return: {
+        "blocking": [阻断性问题],
+        "warnings": [轻微问题],
+        "score": 0~1 (有阻断性问题时为 0),
+        "skip_vlm": 是否可以跳过 VLM (没有任何问题时)
+    }
+    """
+    blocking: List[str] = []
+    warnings: List[tuple] = []
+
+    proportion_blocking, proportion_warnings = check_proportions(plan_json)
+    door_blocking, door_warnings = check_doors(plan_json)
+    blocking += proportion_blocking + door_blocking
+    warnings += proportion_warnings + door_warnings + check_chairs_have_tables(plan_json)
+
+    empty_square = largest_empty_square(plan_json)
+    if empty_square >= EMPTY_SQUARE_LIMIT:
+        warnings.append(("empty_area", f"空旷度问题: 室内存在约 {empty_square}x{empty_square} 瓦片的空地，请用家具或装饰填充。"))
+
+    if blocking:
+        score = 0.0
+    else:
+        score = max(0.0, 1.0 - sum(WARNING_PENALTIES.get(kind, 0.05) for kind, _ in warnings))
+
+    result = {
+        "blocking": blocking,
+        "warnings": [message for _, message in warnings],
+        "score": round(score, 3),
+        "skip_vlm": not blocking and not warnings,
+        "largest_empty_square": empty_square
+    }
+    print(f"[Pre-Critic] 阻断性问题: {len(blocking)}, 轻微问题: {len(warnings)}, 得分: {result['score']}")
+    return result
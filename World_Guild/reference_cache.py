@@ -0,0 +1,160 @@
+# 文件名: reference_cache.py
+import os
+import sys
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    print("!!! 错误: 缺少 'opencv-python-headless' 或 'numpy' !!!")
+    print("请运行: pip install opencv-python-headless numpy")
+    exit(1)
+
+# ===================================================================
+# 参考图载荷缓存 (Reference Payload Cache)
+# ===================================================================
+# 生成物体时，每次都要打开匹配到的参考 PNG、整份 base64 后作为 data URL 注入；
+# 生成角色时，同样那几张 character_base_sheets 对每个 NPC 都重新读取、重新编码。
+# 这里把参考图统一规范化一次:
+#   - 转为 BGRA，最长边超过 max_side 时用 INTER_AREA 缩小 (上传字节数与图像 token 都随像素数下降)
+#   - 以最高压缩重新编码 PNG；结果不比原文件小时直接沿用原文件字节
+# 结果按 "源文件内容哈希 + max_side" 存为 reference_cache/<hash>_<side>.png，
+# 源文件变化时哈希随之变化，自然重新生成；进程内再用 LRU 缓存编码好的 data URL。
+# 角色骨架图传 max_side=None: 模型输出必须与骨架同尺寸，只做重新编码，不缩放。
+
+REFERENCE_CACHE_DIR = "./reference_cache"
+REFERENCE_MAX_SIDE = 256          # 物体参考图只用来约束结构与透视，256 像素足够
+REFERENCE_LRU_SIZE = 256          # 进程内缓存的 data URL 数量
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+_stats = {"hits": 0, "disk_hits": 0, "encoded": 0, "source_bytes": 0, "payload_bytes": 0}
+
+
+def _cache_file_name(content_hash: str, max_side) -> str:
+    return f"{content_hash}_{max_side or 'full'}.png"
+
+
+def _normalize(data: bytes, max_side) -> bytes:
+    """ 解码 -> BGRA -> (可选) 缩小 -> 重新编码 PNG；失败或没有收益时返回原字节 """
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return data
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    elif img.shape[2] == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+
+    h, w = img.shape[:2]
+    if max_side and max(w, h) > max_side:
+        scale = max_side / max(w, h)
+        img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    elif data[:8] == b"\x89PNG\r\n\x1a\n":
+        # 尺寸不变的 PNG: 只有重新编码确实更小时才替换
+        ok, encoded = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+        return encoded.tobytes() if ok and len(encoded) < len(data) else data
+
+    ok, encoded = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+    return encoded.tobytes() if ok else data
+
+
+def _load_or_build(data: bytes, max_side, cache_dir: str) -> bytes:
+    """ 命中磁盘缓存则直接读取；否则规范化后写入 (先写临时文件再原子替换，多线程安全) """
+    cache_path = os.path.join(cache_dir, _cache_file_name(hashlib.sha1(data).hexdigest()[:16], max_side))
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            _stats["disk_hits"] += 1
+            return f.read()
+
+    payload = _normalize(data, max_side)
+    _stats["encoded"] += 1
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"  [Reference Cache] 警告: 无法写入缓存 {cache_path}: {e}")
+    return payload
+
+
+def get_reference_payload(image_path: str, max_side=REFERENCE_MAX_SIDE, cache_dir: str = REFERENCE_CACHE_DIR) -> str:
+    """
+    返回可直接放进 image_url 的 data URL (data:image/png;base64,...)
+    :param max_side: 最长边上限；None 表示不缩放 (角色骨架图)
+    :raises OSError: 参考图不存在或无法读取
+    """
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, max_side)
+    with _lru_lock:
+        if key in _lru:
+            _lru.move_to_end(key)
+            _stats["hits"] += 1
+            return _lru[key]
+
+    with open(image_path, "rb") as f:
+        data = f.read()
+    payload = _load_or_build(data, max_side, cache_dir)
+    url = "data:image/png;base64," + base64.b64encode(payload).decode("ascii")
+
+    with _lru_lock:
+        _stats["source_bytes"] += len(data)
+        _stats["payload_bytes"] += len(payload)
+        _lru[key] = url
+        while len(_lru) > REFERENCE_LRU_SIZE:
+            _lru.popitem(last=False)
+    return url
+
+
+def reference_cache_stats() -> dict:
+    return dict(_stats)
+
+
+def build_reference_cache(index: dict, max_side=REFERENCE_MAX_SIDE, cache_dir: str = REFERENCE_CACHE_DIR) -> dict:
+    """
+    与资产索引一起预构建: 为索引中的每个参考图生成规范化载荷 (已存在的直接跳过)
+    :param index: build_asset_index 产出的索引 ({"metadata": {"base_path"}, "assets": {...}})
+    :return: {"references", "encoded", "source_bytes", "payload_bytes"}
+    """
+    base_path = index.get("metadata", {}).get("base_path", ".")
+    summary = {"references": 0, "encoded": 0, "source_bytes": 0, "payload_bytes": 0}
+    # 簇内的每个成员都可能被检索为参考图 (见 asset_retriever.py)，因此为全部条目构建；
+    # 像素完全相同的文件共用一个载荷 (按内容哈希)
+    for doc in index.get("assets", {}).values():
+        path = os.path.join(base_path, doc["path_relative"])
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            print(f"  [Reference Cache] 跳过无法读取的参考图 {path}: {e}")
+            continue
+        encoded_before = _stats["encoded"]
+        payload = _load_or_build(data, max_side, cache_dir)
+        summary["references"] += 1
+        summary["encoded"] += _stats["encoded"] - encoded_before
+        summary["source_bytes"] += len(data)
+        summary["payload_bytes"] += len(payload)
+    print(f"  [Reference Cache] {summary['references']} 张参考图 (新编码 {summary['encoded']})，"
+          f"{summary['source_bytes'] / 1e6:.2f} MB -> {summary['payload_bytes'] / 1e6:.2f} MB")
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="为资产索引中的参考图预构建载荷缓存")
+    parser.add_argument("--index", default="./asset_index.json", help="资产索引文件")
+    parser.add_argument("--max-side", type=int, default=REFERENCE_MAX_SIDE, help="最长边上限 (0 表示不缩放)")
+    args = parser.parse_args()
+    try:
+        with open(args.index, "r", encoding="utf-8") as f:
+            index_data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"!!! [Reference Cache] 无法加载索引 {args.index}: {e}", file=sys.stderr)
+        sys.exit(1)
+    build_reference_cache(index_data, max_side=args.max_side or None)
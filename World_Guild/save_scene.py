@@ -1,24 +1,61 @@
 import os
 import json
-def save_scene_to_file(scene_plan: dict, project_path: str, filename: str = "my_first_level.json") -> str:
+from tracing import traced, span
+from nav_grid import save_navigation_artifacts
+from texture_manifest import save_texture_manifest
+from scene_format import write_scene, SCENE_EXTENSION
+
+# 默认保存格式: "wgscene" (紧凑二进制容器，见 scene_format.py) 或 "json"
+SAVE_FORMAT = "wgscene"
+
+@traced("save")
+def save_scene_to_file(scene_plan: dict, project_path: str, filename: str = "my_first_level.json", bake_navigation: bool = True, scene_format: str = SAVE_FORMAT) -> str:
     """
-    将场景规划字典保存为 JSON 文件。
+    将场景规划字典保存为场景文件。
     
     :param scene_plan: 场景规划字典
     :param project_path: Godot 项目的根路径
-    :param filename: 要保存的文件名
+    :param filename: 要保存的文件名 (scene_format 为 "wgscene" 时扩展名替换为 .wgscene)
+    :param bake_navigation: 是否同时烘焙导航数据 (可行走位图、语义标签距离场、最近实例表)，
+                            路径写入 metadata["navigation"]，Godot 构建场景时自动加载
+    :param scene_format: "wgscene" (二进制，Godot 直接按列读取) 或 "json" (可读，调试用)
     :return: 成功则返回完整保存路径, 失败则返回 None
+
+    贴图清单 (每个唯一资产的内容哈希与像素尺寸) 总会写出，路径写入 metadata["textures"]。
     """
+    if bake_navigation:
+        try:
+            with span("save.navigation"):
+                nav_path = save_navigation_artifacts(scene_plan, project_path, os.path.splitext(filename)[0])
+            # 替换而不是原地修改 metadata (它可能与版本库中的上一个版本共享)
+            scene_plan["metadata"] = {**scene_plan.get("metadata", {}), "navigation": nav_path}
+        except Exception as e:
+            # 烘焙失败不影响保存，Godot 会退回到组查找 + 实时寻路
+            print(f"\n[Main] 警告：烘焙导航数据失败: {e}")
+
+    try:
+        with span("save.textures"):
+            manifest_path = save_texture_manifest(scene_plan, project_path, os.path.splitext(filename)[0])
+        scene_plan["metadata"] = {**scene_plan.get("metadata", {}), "textures": manifest_path}
+    except Exception as e:
+        # 没有清单时 Godot 退回按文件名加载 (仍然按路径缓存)
+        print(f"\n[Main] 警告：生成贴图清单失败: {e}")
+
     save_dir = os.path.join(project_path, "saved_levels")
     os.makedirs(save_dir, exist_ok=True)
+    if scene_format == "wgscene":
+        filename = os.path.splitext(filename)[0] + SCENE_EXTENSION
     save_path = os.path.join(save_dir, filename)
     
     try:
-        with open(save_path, 'w', encoding='utf-8') as f:
-            json.dump(scene_plan, f, ensure_ascii=False, indent=4) 
+        if scene_format == "wgscene":
+            write_scene(scene_plan, save_path)
+        else:
+            with open(save_path, 'w', encoding='utf-8') as f:
+                json.dump(scene_plan, f, ensure_ascii=False, indent=4) 
             
         print(f"\n[Main] 场景规划已成功保存到: {save_path}")
         return save_path
     except Exception as e:
-        print(f"\n[Main] 错误：保存 JSON 失败: {e}")
+        print(f"\n[Main] 错误：保存场景失败: {e}")
         return None
\ No newline at end of file
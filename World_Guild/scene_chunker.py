@@ -0,0 +1,199 @@
+# 文件名: scene_chunker.py
+import math
+import json
+import argparse
+
+from scene_format import CHUNK_TILES, load_scene_file
+
+# ===================================================================
+# 场景分块 (Scene Chunker)
+# ===================================================================
+# build_scene_procedurally 一次性创建整个世界，再等一次全局导航烘焙；大场景会让引擎卡住数秒。
+# 这里把规划切成 CHUNK_TILES x CHUNK_TILES 的空间块，每块带自己的摆放与资产列表，
+# 按离焦点 (默认第一个 agent 的位置，其次第一个角色，否则地图中心) 由近到远排序，
+# 由 godot_client.stream_scene 逐块发送:
+#   begin_streamed_build {metadata, assets, properties, chunk_tiles, chunk_count, focus}
+#   build_chunk          {id, rect, assets, layout, nav_outlines, nav_obstructions}   (每块一条)
+#   end_streamed_build   (带 reply 时，全部完成后回传构建剖析)
+# Godot 每帧只执行预算内的任务，并按块异步烘焙导航 (scene_builder_server.gd 的 "分块流式构建" 一节)。
+#
+# 切分规则:
+#   - area 指令 (地板 / 墙) 与多个块相交时，每块一条，原 "area" 不变，另加 "clip" (与块的交集)；
+#     Godot 按整个 area 判定墙的边缘偏移与地板的步长相位，只实例化 clip 内的格子。
+#   - position 指令 (物体 / 角色) 归入锚点所在的块；同一块内保持原图层顺序 (墙先于挂件)。
+#   - 超出地图的部分 (整体构建也会画出来) 归入边缘的块。
+#   - 块的导航烘焙区域向外扩 NAV_BORDER_TILES (= Godot 的 agent_radius)，因此 nav_outlines (可行走地板)
+#     与 nav_obstructions (实心墙) 按扩大后的矩形裁剪，邻块还没到达时边缘也能正确收缩。
+
+NAV_BORDER_TILES = 1
+AREA_LAYERS = ("floor_layer", "wall_layer")
+_UNBOUNDED = 1 << 30
+POSITION_LAYERS = ("object_layer", "npc_layer")
+
+
+def _intersect(a: list, b: list):
+    """ 两个 [x, y, w, h] 的交集；不相交返回 None """
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return [x0, y0, x1 - x0, y1 - y0]
+
+
+def find_focus(plan: dict) -> list:
+    """ 默认焦点: 第一个 agent 的位置，其次第一个角色，否则地图中心 (瓦片坐标) """
+    assets = plan.get("assets", {})
+    characters = [e for e in plan.get("layout", {}).get("npc_layer", []) if isinstance(e, dict) and "position" in e]
+    for entry in characters:
+        if assets.get(entry.get("asset_id"), {}).get("type") == "agent":
+            return list(entry["position"][:2])
+    if characters:
+        return list(characters[0]["position"][:2])
+    width, height = plan.get("metadata", {}).get("grid_size", [25, 20])
+    return [width // 2, height // 2]
+
+
+def split_scene(plan: dict, chunk_tiles: int = CHUNK_TILES) -> tuple:
+    """
+    :return: (header, chunks)。header 是除 layout 以外的顶层数据；
+             chunks 是 {"id": [cx, cy], "rect": [x, y, w, h], "assets": [...], "layout": {...},
+                        "nav_outlines": [...], "nav_obstructions": [...]} 的列表 (空块不输出)，按块坐标排序
+    """
+    width, height = plan.get("metadata", {}).get("grid_size", [25, 20])
+    cols, rows = max(1, math.ceil(width / chunk_tiles)), max(1, math.ceil(height / chunk_tiles))
+    properties = plan.get("properties", {})
+    layout = plan.get("layout", {})
+
+    chunks = {}
+
+    def clip_bounds(cx, cy) -> list:
+        """ 块负责的范围: 边缘的块向地图外无限延伸 """
+        x0 = -_UNBOUNDED if cx == 0 else cx * chunk_tiles
+        y0 = -_UNBOUNDED if cy == 0 else cy * chunk_tiles
+        x1 = _UNBOUNDED if cx == cols - 1 else (cx + 1) * chunk_tiles
+        y1 = _UNBOUNDED if cy == rows - 1 else (cy + 1) * chunk_tiles
+        return [x0, y0, x1 - x0, y1 - y0]
+
+    def chunk_at(cx, cy) -> dict:
+        if (cx, cy) not in chunks:
+            rect = [cx * chunk_tiles, cy * chunk_tiles,
+                    min(chunk_tiles, width - cx * chunk_tiles), min(chunk_tiles, height - cy * chunk_tiles)]
+            chunks[(cx, cy)] = {"id": [cx, cy], "rect": rect, "assets": set(),
+                                "layout": {name: [] for name in AREA_LAYERS + POSITION_LAYERS},
+                                "nav_outlines": [], "nav_obstructions": []}
+        return chunks[(cx, cy)]
+
+    for layer_name in AREA_LAYERS:
+        for entry in layout.get(layer_name, []):
+            area = entry.get("area") if isinstance(entry, dict) else None
+            if not area or len(area) != 4:
+                continue
+            cx0 = min(cols - 1, max(0, area[0] // chunk_tiles))
+            cy0 = min(rows - 1, max(0, area[1] // chunk_tiles))
+            cx1 = min(cols - 1, max(0, (area[0] + area[2] - 1) // chunk_tiles))
+            cy1 = min(rows - 1, max(0, (area[1] + area[3] - 1) // chunk_tiles))
+            for cy in range(cy0, cy1 + 1):
+                for cx in range(cx0, cx1 + 1):
+                    clip = _intersect(area, clip_bounds(cx, cy))
+                    if clip is None:
+                        continue
+                    chunk = chunk_at(cx, cy)
+                    chunk["layout"][layer_name].append(entry if clip == list(area) else {**entry, "clip": clip})
+                    if entry.get("asset_id"):
+                        chunk["assets"].add(entry["asset_id"])
+
+    for layer_name in POSITION_LAYERS:
+        for entry in layout.get(layer_name, []):
+            position = entry.get("position") if isinstance(entry, dict) else None
+            if not position or len(position) < 2:
+                continue
+            cx = min(cols - 1, max(0, int(position[0]) // chunk_tiles))
+            cy = min(rows - 1, max(0, int(position[1]) // chunk_tiles))
+            chunk = chunk_at(cx, cy)
+            chunk["layout"][layer_name].append(entry)
+            if entry.get("asset_id"):
+                chunk["assets"].add(entry["asset_id"])
+
+    # 导航几何: 按扩大 NAV_BORDER_TILES 的矩形裁剪 (只需要 fill_rect；Godot 不实例化 draw_rect_outline 的墙)
+    walkable = [e["area"] for e in layout.get("floor_layer", [])
+                if isinstance(e, dict) and e.get("command") == "fill_rect" and len(e.get("area") or []) == 4
+                and properties.get(e.get("asset_id"), {}).get("navigation") == "walkable"]
+    solid = [e["area"] for e in layout.get("wall_layer", [])
+             if isinstance(e, dict) and e.get("command") == "fill_rect" and len(e.get("area") or []) == 4
+             and properties.get(e.get("asset_id"), {}).get("physics") == "solid"]
+    for chunk in chunks.values():
+        x, y, w, h = chunk["rect"]
+        grown = [x - NAV_BORDER_TILES, y - NAV_BORDER_TILES, w + 2 * NAV_BORDER_TILES, h + 2 * NAV_BORDER_TILES]
+        chunk["nav_outlines"] = [r for r in (_intersect(a, grown) for a in walkable) if r]
+        chunk["nav_obstructions"] = [r for r in (_intersect(a, grown) for a in solid) if r]
+        chunk["assets"] = sorted(chunk["assets"])
+
+    header = {k: v for k, v in plan.items() if k != "layout"}
+    header["chunk_tiles"] = chunk_tiles
+    header["chunk_count"] = len(chunks)
+    return header, [chunks[key] for key in sorted(chunks, key=lambda c: (c[1], c[0]))]
+
+
+def order_chunks(chunks: list, focus: list) -> list:
+    """ 按块中心到焦点的距离由近到远排序 (距离相同按块坐标) """
+    def distance(chunk):
+        x, y, w, h = chunk["rect"]
+        return (x + w / 2 - focus[0]) ** 2 + (y + h / 2 - focus[1]) ** 2
+
+    return sorted(chunks, key=lambda c: (distance(c), c["id"][1], c["id"][0]))
+
+
+def stream_commands(plan: dict, chunk_tiles: int = CHUNK_TILES, focus: list = None) -> list:
+    """ 流式构建的完整指令序列 (begin -> 各块按优先级 -> end) """
+    focus = list(focus) if focus else find_focus(plan)
+    header, chunks = split_scene(plan, chunk_tiles)
+    header["focus"] = focus
+    commands = [{"action": "begin_streamed_build", "payload": header}]
+    commands += [{"action": "build_chunk", "payload": chunk} for chunk in order_chunks(chunks, focus)]
+    commands.append({"action": "end_streamed_build"})
+    return commands
+
+
+def _check_split(plan: dict, chunk_tiles: int):
+    """ 自检: 每个摆放格子恰好落在一个块里 (地板按步长锚点，墙按格子)，position 条目一个不丢 """
+    _, chunks = split_scene(plan, chunk_tiles)
+    assets = plan.get("assets", {})
+    layout = plan.get("layout", {})
+
+    def cells(entry, layer_name):
+        x, y, w, h = entry["area"]
+        cx, cy, cw, ch = entry.get("clip", entry["area"])
+        step_w, step_h = (1, 1)
+        if layer_name == "floor_layer":
+            step_w, step_h = (max(1, v) for v in assets.get(entry.get("asset_id"), {}).get("visual_size", [1, 1]))
+        return {(i, j) for i in range(x, x + w, step_w) for j in range(y, y + h, step_h)
+                if cx <= i < cx + cw and cy <= j < cy + ch}
+
+    for layer_name in AREA_LAYERS:
+        for index, entry in enumerate(layout.get(layer_name, [])):
+            expected = cells(entry, layer_name)
+            got = [cells(e, layer_name) for c in chunks for e in c["layout"][layer_name]
+                   if {k: v for k, v in e.items() if k != "clip"} == entry]
+            union = set().union(*got) if got else set()
+            assert union == expected and sum(len(g) for g in got) == len(expected), (layer_name, index)
+    for layer_name in POSITION_LAYERS:
+        assert sum(len(c["layout"][layer_name]) for c in chunks) == len(layout.get(layer_name, [])), layer_name
+    return len(chunks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把场景切成流式构建用的块 (打印块的统计与发送顺序)")
+    parser.add_argument("scene", help=".wgscene 或 .json 场景文件")
+    parser.add_argument("--chunk-tiles", type=int, default=CHUNK_TILES)
+    args = parser.parse_args()
+
+    scene_plan = load_scene_file(args.scene)
+    print(f"[Scene Chunker] 自检通过: {_check_split(scene_plan, args.chunk_tiles)} 个块")
+    for command in stream_commands(scene_plan, args.chunk_tiles):
+        payload = command.get("payload", {})
+        if command["action"] == "build_chunk":
+            counts = {name: len(entries) for name, entries in payload["layout"].items() if entries}
+            print(f"  块 {payload['id']} rect={payload['rect']} 资产 {len(payload['assets'])} {counts} "
+                  f"({len(json.dumps(payload, ensure_ascii=False)) / 1024:.1f} KB)")
+        else:
+            print(f"  {command['action']}" + (f" focus={payload.get('focus')}" if payload else ""))
@@ -0,0 +1,334 @@
+# 文件名: scene_compositor.py
+import os
+import math
+import zlib
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    print("!!! 错误: 缺少 'numpy' 或 'Pillow' !!!")
+    print("请运行: pip install numpy Pillow")
+    exit(1)
+
+from scene_format import load_scene_file
+
+# ===================================================================
+# 无引擎场景合成器 (Headless Scene Compositor)
+# ===================================================================
+# 不启动 Godot，直接用最终规划 + generated_assets 合成场景图:
+#   - 地板瓦片 (z=-5)、地毯类装饰 (z=-1)、墙壁 / 物体 / 角色 (z=0，按锚点 y 排序)、挂件 (z=1)；
+#   - 摆放规则与 scene_builder_server.gd 一致 (底边中点对齐格子中心、墙的边缘偏移、挂件居中提升)；
+#   - 输出按 RENDER_TILE_SIZE 的块逐块合成，每合成完一行块就流式压缩写入 PNG，
+#     内存中最多只有一个条带 (render_tile x 宽度)，8K 以上的图也不需要整张画布；
+#   - 批量缩略图用进程池并行，几百个场景不需要引擎。
+
+TILE_SIZE = 16                      # 世界瓦片像素 (与 Godot 一致)
+RENDER_TILE_SIZE = 512              # 输出分块边长 (像素)
+BACKGROUND_COLOR = (77, 77, 77, 255)  # Godot 默认清屏色
+THUMBNAIL_SIZE = 256
+# 角色贴图是 6x5 的动作表，取第 0 帧 (idle_down)，节点缩放 0.5、偏移 (0, -7)
+CHARACTER_FRAMES = (6, 5)
+CHARACTER_SCALE = 0.5
+CHARACTER_OFFSET_Y = -7
+
+Z_FLOOR, Z_DECOR, Z_SORTED, Z_HANGING = -5, -1, 0, 1
+
+
+# ===================================================================
+# 1. 规划 -> 绘制列表 (世界像素坐标)
+# ===================================================================
+
+def _cell_center(x, y) -> tuple:
+    return (x + 0.5) * TILE_SIZE, (y + 0.5) * TILE_SIZE
+
+
+def _is_floor_decor(asset_id: str, props: dict) -> bool:
+    """ 与 scene_builder_server.gd 步骤 C 的地毯判定一致 """
+    sem_tag = props.get("semantic_tag", "")
+    nav = props.get("navigation", "")
+    decor = props.get("physics", "") == "passable" and nav == "walkable"
+    decor = decor or any(word in asset_id or word in sem_tag for word in ("rug", "carpet"))
+    return decor and not ("door" in sem_tag or nav == "walkable_door")
+
+
+class _TextureBank:
+    """ 每张贴图只读取一次；缩放后的版本按目标尺寸缓存 """
+
+    def __init__(self, asset_dir: str):
+        self.asset_dir = asset_dir
+        self._images = {}
+        self._scaled = {}
+
+    def image(self, asset_id: str):
+        if asset_id not in self._images:
+            path = os.path.join(self.asset_dir, f"{asset_id}.png")
+            try:
+                with Image.open(path) as img:
+                    self._images[asset_id] = img.convert("RGBA")
+            except (OSError, ValueError):
+                self._images[asset_id] = None
+        return self._images[asset_id]
+
+    def size(self, asset_id: str, crop=None):
+        img = self.image(asset_id)
+        if img is None:
+            return None
+        return (crop[2] - crop[0], crop[3] - crop[1]) if crop else img.size
+
+    def scaled(self, asset_id: str, crop, width: int, height: int) -> np.ndarray:
+        """ 缩放到输出尺寸的 float32 RGBA (0~1)，alpha 已预乘 """
+        key = (asset_id, crop, width, height)
+        if key not in self._scaled:
+            img = self.image(asset_id)
+            if crop:
+                img = img.crop(crop)
+            resample = Image.NEAREST if width >= img.width else Image.BOX
+            arr = np.asarray(img.resize((width, height), resample), dtype=np.float32) / 255.0
+            arr[..., :3] *= arr[..., 3:4]
+            self._scaled[key] = arr
+        return self._scaled[key]
+
+
+def build_draw_list(plan: dict, bank: _TextureBank) -> list:
+    """
+    :return: [(排序键, asset_id, crop, x0, y0, w, h)]，坐标为世界像素 (左上角 + 尺寸)，已按绘制顺序排好
+    """
+    assets = plan.get("assets", {})
+    properties = plan.get("properties", {})
+    layout = plan.get("layout", {})
+    grid_w, grid_h = plan.get("metadata", {}).get("grid_size", [25, 20])
+    draws = []
+    order = 0
+
+    def add(z, sort_y, asset_id, crop, x0, y0, w, h):
+        nonlocal order
+        draws.append(((z, sort_y if z == Z_SORTED else 0, order), asset_id, crop, x0, y0, w, h))
+        order += 1
+
+    # --- 地板: 按 visual_size 步长铺设，多格瓦片以格子中心为中心 ---
+    for cmd in layout.get("floor_layer", []):
+        asset_id = cmd.get("asset_id")
+        size = bank.size(asset_id)
+        area = cmd.get("area")
+        if size is None or not isinstance(area, list) or len(area) != 4:
+            continue
+        vw, vh = [max(1, int(v)) for v in (assets.get(asset_id, {}).get("visual_size") or [1, 1])[:2]]
+        x, y, w, h = [int(v) for v in area]
+        for cy in range(y, y + h, vh):
+            for cx in range(x, x + w, vw):
+                center_x, center_y = _cell_center(cx, cy)
+                add(Z_FLOOR, 0, asset_id, None, center_x - size[0] / 2, center_y - size[1] / 2, size[0], size[1])
+
+    # --- 墙壁: 每格一个精灵，底边中点对齐格子中心；左右墙与角落的偏移同 _fill_rect_with_sprites ---
+    wall_heights = {}
+    for cmd in layout.get("wall_layer", []):
+        asset_id = cmd.get("asset_id")
+        size = bank.size(asset_id)
+        area = cmd.get("area")
+        if size is None or not isinstance(area, list) or len(area) != 4:
+            continue
+        x, y, w, h = [int(v) for v in area]
+        is_top = y == 0 and x == 0 and w == grid_w
+        is_bottom = y == grid_h
+        is_left = x == 0 and y > 0 and w == 1
+        is_right = x == grid_w - 1 and y > 0 and w == 1
+        for cy in range(y, y + h):
+            for cx in range(x, x + w):
+                wall_heights[(cx, cy)] = size[1]
+                center_x, center_y = _cell_center(cx, cy)
+                offset_x, scale_x = 0.0, 1.0
+                if is_left:
+                    offset_x = -TILE_SIZE / 2
+                elif is_right:
+                    offset_x = TILE_SIZE / 2
+                elif (is_top or is_bottom) and cx in (0, grid_w - 1):
+                    scale_x = 1.5
+                    offset_x = -TILE_SIZE / 4 if cx == 0 else TILE_SIZE / 4
+                width = size[0] * scale_x
+                add(Z_SORTED, center_y, asset_id, None, center_x + offset_x - width / 2, center_y - size[1], width, size[1])
+
+    # --- 物体: 底边中点对齐；挂件在墙面上垂直居中；地毯类放到底层 ---
+    for cmd in layout.get("object_layer", []):
+        asset_id = cmd.get("asset_id")
+        if assets.get(asset_id, {}).get("type") != "object" or not isinstance(cmd.get("position"), list):
+            continue
+        size = bank.size(asset_id)
+        if size is None:
+            continue
+        tile = (int(cmd["position"][0]), int(cmd["position"][1]))
+        center_x, center_y = _cell_center(*tile)
+        top = center_y - size[1]
+        z = Z_SORTED
+        if tile in wall_heights and size[1] <= wall_heights[tile]:
+            top -= (wall_heights[tile] - size[1]) / 2
+            z = Z_HANGING
+        if _is_floor_decor(asset_id, properties.get(asset_id, {})):
+            z = Z_DECOR
+        add(z, center_y, asset_id, None, center_x - size[0] / 2, top, size[0], size[1])
+
+    # --- 角色: 动作表第 0 帧，居中绘制 ---
+    for cmd in layout.get("npc_layer", []):
+        asset_id = cmd.get("asset_id")
+        if not isinstance(cmd.get("position"), list):
+            continue
+        sheet = bank.size(asset_id)
+        if sheet is None:
+            continue
+        frame_w, frame_h = sheet[0] // CHARACTER_FRAMES[0], sheet[1] // CHARACTER_FRAMES[1]
+        if not frame_w or not frame_h:
+            continue
+        center_x, center_y = _cell_center(int(cmd["position"][0]), int(cmd["position"][1]))
+        w, h = frame_w * CHARACTER_SCALE, frame_h * CHARACTER_SCALE
+        add(Z_SORTED, center_y, asset_id, (0, 0, frame_w, frame_h), center_x - w / 2, center_y + CHARACTER_OFFSET_Y - h / 2, w, h)
+
+    draws.sort(key=lambda d: d[0])
+    return draws
+
+
+# ===================================================================
+# 2. 分块合成 + 流式 PNG
+# ===================================================================
+
+class _PngStreamWriter:
+    """ 逐行压缩写 PNG (RGBA8)：每次写入一段行，不需要整张图 """
+
+    def __init__(self, path: str, width: int, height: int):
+        self.width = width
+        self._compressor = zlib.compressobj(6)
+        self._file = open(path, "wb")
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+
+    def _chunk(self, tag: bytes, data: bytes):
+        self._file.write(struct.pack(">I", len(data)) + tag + data)
+        self._file.write(struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+    def write_rows(self, rows: np.ndarray):
+        raw = np.zeros((rows.shape[0], self.width * 4 + 1), dtype=np.uint8)  # 每行前置过滤字节 0
+        raw[:, 1:] = rows.reshape(rows.shape[0], -1)
+        data = self._compressor.compress(raw.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+
+    def close(self):
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+        self._file.close()
+
+
+def render_scene(plan: dict, asset_dir: str, output_path: str, scale: float = 1.0, render_tile: int = RENDER_TILE_SIZE) -> str:
+    """
+    合成整张场景图。
+    :param scale: 输出像素 / 世界像素 (e.g., 0.25 缩略图，6.0 约等于 80x80 格场景的 8K)
+    :return: 输出路径
+    """
+    bank = _TextureBank(asset_dir)
+    grid_w, grid_h = plan.get("metadata", {}).get("grid_size", [25, 20])
+    out_w = max(1, int(math.ceil(grid_w * TILE_SIZE * scale)))
+    out_h = max(1, int(math.ceil(grid_h * TILE_SIZE * scale)))
+
+    # 绘制列表 -> 输出像素矩形，并分配到覆盖的各个块 (保持绘制顺序)
+    tiles_x, tiles_y = math.ceil(out_w / render_tile), math.ceil(out_h / render_tile)
+    buckets = [[] for _ in range(tiles_x * tiles_y)]
+    for _, asset_id, crop, x0, y0, w, h in build_draw_list(plan, bank):
+        px0, py0 = math.floor(x0 * scale), math.floor(y0 * scale)
+        px1, py1 = math.floor((x0 + w) * scale), math.floor((y0 + h) * scale)
+        if px1 <= px0 or py1 <= py0 or px1 <= 0 or py1 <= 0 or px0 >= out_w or py0 >= out_h:
+            continue
+        sprite = (asset_id, crop, px0, py0, px1, py1)
+        for ty in range(max(0, py0 // render_tile), min(tiles_y, (py1 - 1) // render_tile + 1)):
+            for tx in range(max(0, px0 // render_tile), min(tiles_x, (px1 - 1) // render_tile + 1)):
+                buckets[ty * tiles_x + tx].append(sprite)
+
+    # 一次只合成一行块 (render_tile 像素高的条带)，合成完立即压缩写出
+    background = np.array(BACKGROUND_COLOR, dtype=np.float32) / 255.0
+    writer = _PngStreamWriter(output_path, out_w, out_h)
+    try:
+        for ty in range(tiles_y):
+            by0, by1 = ty * render_tile, min(out_h, (ty + 1) * render_tile)
+            band = np.empty((by1 - by0, out_w, 4), dtype=np.uint8)
+            for tx in range(tiles_x):
+                bx0, bx1 = tx * render_tile, min(out_w, (tx + 1) * render_tile)
+                block = np.empty((by1 - by0, bx1 - bx0, 4), dtype=np.float32)
+                block[:] = background
+                for asset_id, crop, px0, py0, px1, py1 in buckets[ty * tiles_x + tx]:
+                    src = bank.scaled(asset_id, crop, px1 - px0, py1 - py0)
+                    ix0, iy0, ix1, iy1 = max(px0, bx0), max(py0, by0), min(px1, bx1), min(py1, by1)
+                    s = src[iy0 - py0:iy1 - py0, ix0 - px0:ix1 - px0]
+                    d = block[iy0 - by0:iy1 - by0, ix0 - bx0:ix1 - bx0]
+                    d *= 1.0 - s[..., 3:4]
+                    d += s
+                band[:, bx0:bx1] = np.clip(block * 255.0 + 0.5, 0, 255).astype(np.uint8)
+            writer.write_rows(band)
+    finally:
+        writer.close()
+
+    print(f"[Compositor] {output_path} ({out_w}x{out_h}, {tiles_x * tiles_y} 块)")
+    return output_path
+
+
+# ===================================================================
+# 3. 批量缩略图
+# ===================================================================
+
+def _default_asset_dir(scene_path: str) -> str:
+    """ <项目>/saved_levels/x.wgscene -> <项目>/generated_assets """
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(scene_path))), "generated_assets")
+
+
+def _render_thumbnail(scene_path: str, out_dir: str, max_size: int) -> str:
+    plan = load_scene_file(scene_path)
+    grid_w, grid_h = plan.get("metadata", {}).get("grid_size", [25, 20])
+    scale = max_size / (max(grid_w, grid_h) * TILE_SIZE)
+    name = os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(scene_path))))
+    stem = os.path.splitext(os.path.basename(scene_path))[0]
+    return render_scene(plan, _default_asset_dir(scene_path), os.path.join(out_dir, f"{name}_{stem}.png"), scale=scale)
+
+
+def render_thumbnails(scene_paths: list, out_dir: str, max_size: int = THUMBNAIL_SIZE, max_workers: int = None) -> list:
+    """ 并行为一批场景生成缩略图 (长边 max_size 像素)；失败的场景返回 None """
+    os.makedirs(out_dir, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_render_thumbnail, path, out_dir, max_size) for path in scene_paths]
+        for path, future in zip(scene_paths, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"!!! [Compositor] 缩略图失败 {path}: {e}")
+                results.append(None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="不启动 Godot，从场景规划合成预览图")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("render", help="合成单个场景")
+    p.add_argument("scene", help=".wgscene 或 .json 场景文件")
+    p.add_argument("output", help="输出 PNG")
+    p.add_argument("--assets", default=None, help="贴图目录 (默认 <项目>/generated_assets)")
+    p.add_argument("--scale", type=float, default=1.0, help="输出像素 / 世界像素")
+    p.add_argument("--width", type=int, default=None, help="按目标宽度计算缩放 (覆盖 --scale)")
+    p = sub.add_parser("thumbs", help="批量缩略图")
+    p.add_argument("scenes", nargs="+")
+    p.add_argument("--out-dir", default="output/thumbnails")
+    p.add_argument("--size", type=int, default=THUMBNAIL_SIZE)
+    p.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "render":
+        plan = load_scene_file(args.scene)
+        scale = args.scale
+        if args.width:
+            scale = args.width / (plan.get("metadata", {}).get("grid_size", [25, 20])[0] * TILE_SIZE)
+        render_scene(plan, args.assets or _default_asset_dir(args.scene), args.output, scale=scale)
+    else:
+        render_thumbnails(args.scenes, args.out_dir, args.size, args.workers)
+
+
+if __name__ == "__main__":
+    main()
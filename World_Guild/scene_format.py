@@ -0,0 +1,354 @@
+# 文件名: scene_format.py
+import os
+import sys
+import json
+import math
+import time
+import struct
+import argparse
+from array import array
+
+# ===================================================================
+# 紧凑二进制场景容器 (.wgscene)
+# ===================================================================
+# 大场景有成千上万个摆放，indent=4 的 JSON 保存 / 传输 / 在 Godot 中 JSON.parse_string 都很慢。
+# .wgscene 的布局:
+#   [0:4]   魔数 b"WGSC"
+#   [4:6]   u16 版本号
+#   [6:8]   u16 保留
+#   [8:16]  u64 头部 (JSON) 偏移
+#   [16:24] u64 头部长度
+#   [24:..] 各图层的数据块 (chunk)，流式写入
+#   [头部]  UTF-8 JSON: 字符串表 (asset_id)、非摆放数据 (metadata / assets / properties ...)、
+#           每个图层的列类型 (逐列)、全层相同的额外字段 (common, e.g. "command": "fill_rect")、
+#           稀疏的逐条额外字段、以及每个块的偏移 / 条数 / 包围盒
+# 每个块内按列存储 (小端):
+#   index u32[n]      条目在原图层中的序号 (导出 JSON 时恢复原顺序)
+#   坐标  i32/f64[k][n] 逐列: area 图层 k=4 (x, y, w, h)，position 图层 k=2 (x, y)；
+#                     每列单独选类型，f64 列中原本是整数的条目记在头部 (int_rows)，读取时还原为 int
+#   asset u16[n]      字符串表下标 (0xFFFF 表示条目没有 asset_id)
+# 块按锚点所在的 CHUNK_TILES x CHUNK_TILES 区域划分，读取时可以只加载与某个矩形相交的块。
+
+SCENE_MAGIC = b"WGSC"
+SCENE_FORMAT_VERSION = 2           # 2: 逐列类型 (dtypes) + common；仍可读取版本 1
+SCENE_EXTENSION = ".wgscene"
+CHUNK_TILES = 32
+NO_ASSET = 0xFFFF
+
+_PREAMBLE = struct.Struct("<4sHHQQ")
+
+# 图层几何: (条目中的键, 坐标个数)
+GEOMETRIES = {"area": ("area", 4), "position": ("position", 2)}
+_COORD_TYPES = {"i4": "i", "f8": "d"}
+
+
+def _to_le_bytes(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le_bytes(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _layer_geometry(entries: list):
+    """ 判断图层能否按列存储: 返回 "area" / "position"，否则 None (整层原样放进头部) """
+    for geometry, (key, size) in GEOMETRIES.items():
+        if entries and all(
+            isinstance(e, dict) and isinstance(e.get(key), list) and len(e[key]) == size
+            and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in e[key])
+            and (e.get("asset_id") is None or isinstance(e.get("asset_id"), str))
+            for e in entries
+        ):
+            return geometry
+    return None
+
+
+# ===================================================================
+# 写入 (Streaming Writer)
+# ===================================================================
+
+class SceneWriter:
+    """
+    流式写入: 每个图层按块写入文件后即释放，不会在内存中拼出整份 JSON。
+    用法:
+        with SceneWriter(path) as writer:
+            writer.write_plan_data(plan)        # metadata / assets / properties ...
+            writer.write_layer("floor_layer", entries)
+            ...
+    """
+
+    def __init__(self, path: str, chunk_tiles: int = CHUNK_TILES):
+        self.path = path
+        self.chunk_tiles = chunk_tiles
+        self.strings = []
+        self._string_index = {}
+        self.plan_data = {}
+        self.raw_layout = {}
+        self.layout_order = []
+        self.layers = {}
+        self._file = open(path, "wb")
+        self._file.write(_PREAMBLE.pack(SCENE_MAGIC, SCENE_FORMAT_VERSION, 0, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def _intern(self, asset_id) -> int:
+        if asset_id is None:
+            return NO_ASSET
+        if asset_id not in self._string_index:
+            if len(self.strings) >= NO_ASSET:
+                raise ValueError("字符串表已满 (最多 65535 个不同的 asset_id)")
+            self._string_index[asset_id] = len(self.strings)
+            self.strings.append(asset_id)
+        return self._string_index[asset_id]
+
+    def write_plan_data(self, plan: dict):
+        """ 写入除 layout 以外的顶层数据 (放在头部) """
+        self.plan_data = {k: v for k, v in plan.items() if k != "layout"}
+
+    def write_layer(self, name: str, entries: list):
+        self.layout_order.append(name)
+        geometry = _layer_geometry(entries) if isinstance(entries, list) else None
+        if geometry is None:
+            self.raw_layout[name] = entries
+            return
+
+        key, size = GEOMETRIES[geometry]
+        # 逐列选择类型: 整列都是 int 时用 i4；混合列用 f8，并记下其中原本是 int 的条目
+        dtypes, int_rows = [], {}
+        for c in range(size):
+            is_int = [type(e[key][c]) is int for e in entries]
+            dtypes.append("i4" if all(is_int) else "f8")
+            if dtypes[c] == "f8" and any(is_int):
+                int_rows[str(c)] = [index for index, flag in enumerate(is_int) if flag]
+
+        # 全层相同的 (标量) 额外字段只存一次 (e.g. 地板 / 墙的 "command": "fill_rect")
+        first_extra = {k: v for k, v in entries[0].items()
+                       if k not in (key, "asset_id") and (v is None or isinstance(v, (str, int, float, bool)))}
+        common = {k: v for k, v in first_extra.items() if all(k in e and e[k] == v for e in entries)}
+
+        # 按锚点分块 (块内保持原顺序)
+        chunks = {}
+        extras = {}
+        for index, entry in enumerate(entries):
+            coords = entry[key]
+            chunk_key = (math.floor(coords[0] / self.chunk_tiles), math.floor(coords[1] / self.chunk_tiles))
+            chunks.setdefault(chunk_key, []).append(index)
+            extra = {k: v for k, v in entry.items() if k not in (key, "asset_id") and k not in common}
+            if extra:
+                extras[str(index)] = extra
+
+        chunk_table = []
+        for chunk_key in sorted(chunks):
+            indices = chunks[chunk_key]
+            columns = [array(_COORD_TYPES[dtypes[c]], (entries[i][key][c] for i in indices)) for c in range(size)]
+            xs, ys = columns[0], columns[1]
+            if geometry == "area":
+                bbox = [min(xs), min(ys), max(x + w for x, w in zip(xs, columns[2])), max(y + h for y, h in zip(ys, columns[3]))]
+            else:
+                bbox = [min(xs), min(ys), max(xs) + 1, max(ys) + 1]
+
+            offset = self._file.tell()
+            self._file.write(_to_le_bytes(array("I", indices)))
+            for column in columns:
+                self._file.write(_to_le_bytes(column))
+            self._file.write(_to_le_bytes(array("H", (self._intern(entries[i].get("asset_id")) for i in indices))))
+            padding = -self._file.tell() % 4
+            self._file.write(b"\0" * padding)
+            chunk_table.append({"offset": offset, "count": len(indices), "chunk": list(chunk_key), "bbox": bbox})
+
+        self.layers[name] = {
+            "geometry": geometry,
+            "dtypes": dtypes,
+            "int_rows": int_rows,
+            "count": len(entries),
+            "common": common,
+            "extras": extras,
+            "chunks": chunk_table
+        }
+
+    def close(self):
+        header = {
+            "version": SCENE_FORMAT_VERSION,
+            "chunk_tiles": self.chunk_tiles,
+            "strings": self.strings,
+            "plan": self.plan_data,
+            "layout_order": self.layout_order,
+            "raw_layout": self.raw_layout,
+            "layers": self.layers
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        header_offset = self._file.tell()
+        self._file.write(header_bytes)
+        self._file.seek(0)
+        self._file.write(_PREAMBLE.pack(SCENE_MAGIC, SCENE_FORMAT_VERSION, 0, header_offset, len(header_bytes)))
+        self._file.close()
+
+
+def write_scene(plan: dict, path: str, chunk_tiles: int = CHUNK_TILES) -> str:
+    """ 把场景规划写成 .wgscene，返回路径 (先写临时文件再替换，写到一半失败不会破坏原文件) """
+    tmp_path = path + ".tmp"
+    try:
+        with SceneWriter(tmp_path, chunk_tiles) as writer:
+            writer.write_plan_data(plan)
+            for name, entries in plan.get("layout", {}).items():
+                writer.write_layer(name, entries)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+# ===================================================================
+# 读取 (Reader)
+# ===================================================================
+
+def read_header(f) -> dict:
+    f.seek(0)
+    magic, version, _, header_offset, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+    if magic != SCENE_MAGIC:
+        raise ValueError("不是 .wgscene 文件 (魔数不匹配)")
+    if version > SCENE_FORMAT_VERSION:
+        raise ValueError(f"不支持的 .wgscene 版本: {version} (最高支持 {SCENE_FORMAT_VERSION})")
+    f.seek(header_offset)
+    return json.loads(f.read(header_length).decode("utf-8"))
+
+
+def _bbox_intersects(bbox: list, region) -> bool:
+    x0, y0, x1, y1 = region
+    return bbox[0] < x1 and x0 < bbox[2] and bbox[1] < y1 and y0 < bbox[3]
+
+
+def _read_layer(f, header: dict, layer: dict, region=None) -> list:
+    key, size = GEOMETRIES[layer["geometry"]]
+    # 版本 1 的文件整层只有一个 dtype
+    typecodes = [_COORD_TYPES[dtype] for dtype in layer.get("dtypes") or [layer["dtype"]] * size]
+    int_rows = {int(c): set(rows) for c, rows in layer.get("int_rows", {}).items()}
+    strings = header["strings"]
+    common = layer.get("common", {})
+    extras = layer.get("extras", {})
+
+    placed = {}
+    for chunk in layer["chunks"]:
+        if region is not None and not _bbox_intersects(chunk["bbox"], region):
+            continue
+        n = chunk["count"]
+        f.seek(chunk["offset"])
+        indices = _from_le_bytes("I", f.read(4 * n))
+        columns = [_from_le_bytes(typecode, f.read(array(typecode).itemsize * n)) for typecode in typecodes]
+        assets = _from_le_bytes("H", f.read(2 * n))
+        for j, index in enumerate(indices):
+            entry = {}
+            if assets[j] != NO_ASSET:
+                entry["asset_id"] = strings[assets[j]]
+            entry[key] = [int(column[j]) if index in int_rows.get(c, ()) else column[j] for c, column in enumerate(columns)]
+            entry.update(common)
+            entry.update(extras.get(str(index), {}))
+            placed[index] = entry
+    return [placed[i] for i in sorted(placed)]
+
+
+def read_scene(path: str, region=None) -> dict:
+    """
+    读取 .wgscene，返回与原 JSON 相同结构的场景规划。
+    :param region: (x0, y0, x1, y1) 瓦片坐标；给出时只加载与该矩形相交的块 (部分加载)
+    """
+    with open(path, "rb") as f:
+        header = read_header(f)
+        plan = dict(header["plan"])
+        layout = {}
+        for name in header["layout_order"]:
+            if name in header["layers"]:
+                layout[name] = _read_layer(f, header, header["layers"][name], region)
+            else:
+                layout[name] = header["raw_layout"].get(name)
+        plan["layout"] = layout
+    return plan
+
+
+def load_scene_file(path: str) -> dict:
+    """ 按扩展名读取 .wgscene 或 .json 场景文件 """
+    if path.endswith(SCENE_EXTENSION):
+        return read_scene(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def export_json(path: str, json_path: str = None) -> str:
+    """ (调试用) 把 .wgscene 导出为可读的 JSON """
+    json_path = json_path or os.path.splitext(path)[0] + ".json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(read_scene(path), f, ensure_ascii=False, indent=4)
+    return json_path
+
+
+# ===================================================================
+# 命令行: pack / export / bench
+# ===================================================================
+
+def _bench(json_path: str):
+    """ 与 indent=4 JSON 比较保存 / 加载的大小与耗时，并校验往返一致 """
+    with open(json_path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    base = os.path.splitext(json_path)[0]
+
+    t0 = time.perf_counter()
+    with open(base + ".bench.json", "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=4)
+    t1 = time.perf_counter()
+    with open(base + ".bench.json", "r", encoding="utf-8") as f:
+        json.load(f)
+    t2 = time.perf_counter()
+    write_scene(plan, base + ".bench" + SCENE_EXTENSION)
+    t3 = time.perf_counter()
+    restored = read_scene(base + ".bench" + SCENE_EXTENSION)
+    t4 = time.perf_counter()
+
+    json_size = os.path.getsize(base + ".bench.json")
+    bin_size = os.path.getsize(base + ".bench" + SCENE_EXTENSION)
+    print(f"[Scene Format] JSON     : {json_size / 1024:8.1f} KB, 保存 {(t1 - t0) * 1000:7.1f} ms, 加载 {(t2 - t1) * 1000:7.1f} ms")
+    print(f"[Scene Format] .wgscene : {bin_size / 1024:8.1f} KB, 保存 {(t3 - t2) * 1000:7.1f} ms, 加载 {(t4 - t3) * 1000:7.1f} ms")
+    print(f"[Scene Format] 往返一致: {restored == plan}")
+    os.remove(base + ".bench.json")
+    os.remove(base + ".bench" + SCENE_EXTENSION)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=".wgscene 二进制场景容器工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pack", help="JSON -> .wgscene")
+    p.add_argument("src")
+    p.add_argument("dst", nargs="?")
+    p = sub.add_parser("export", help=".wgscene -> JSON (调试用)")
+    p.add_argument("src")
+    p.add_argument("dst", nargs="?")
+    p = sub.add_parser("bench", help="与 JSON 比较大小与耗时")
+    p.add_argument("src")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        with open(args.src, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+        print(write_scene(plan, args.dst or os.path.splitext(args.src)[0] + SCENE_EXTENSION))
+    elif args.command == "export":
+        print(export_json(args.src, args.dst))
+    else:
+        _bench(args.src)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# 文件名: scene_store.py
+import os
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from collections import Counter
+
+# ===================================================================
+# 场景版本库 (Versioned Scene Store)
+# ===================================================================
+# 生成流程中的每一个中间规划 (草稿、每次 Validator 修复、每次 Critic 修复) 都作为一个版本保存。
+# 规划被拆成按内容寻址的节点 (hash-consing):
+#   - 每个 dict / list 是一个节点，内容 = 子节点的引用 ({"$": 哈希}) 或内联的标量 / 标量列表；
+#   - 节点哈希 = 其规范编码的 sha1，所以相同的子树只存一份，相邻版本共享所有未改动的部分；
+#   - 版本 = 根哈希 + 父版本 + 标签；版本号 = 时间戳 + 随机后缀 (多个进程写同一目录也不会冲突)。
+# 因此:
+#   - 每次提交只写入新出现的节点 (改了一个物体 ≈ 写几行)，内存与 I/O 不随迭代次数线性增长；
+#   - diff 只沿哈希不同的分支向下走；
+#   - 任意版本都可以取出 (checkout)、回滚 (rollback) 或从它分叉 (branch)。
+# 磁盘布局 (SCENE_STORE_DIR 下，均为只追加):
+#   objects.jsonl   每行 "<哈希>\t<节点 JSON>"
+#   versions.jsonl  每行一个版本记录，或一条分支指针 {"ref": 分支名, "id": 版本号} (branch() 写入)
+# 批量生成时每个场景使用自己的目录 (batch_main 的工人进程中 configure_scene_store)。
+
+SCENE_STORE_DIR = "./output/scene_store"
+DEFAULT_BRANCH = "main"
+
+_REF_KEY = "$"
+
+
+def _encode(node) -> str:
+    return json.dumps(node, ensure_ascii=False, separators=(",", ":"))
+
+
+def _is_scalar(value) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+class SceneStore:
+    """ 按内容寻址、结构共享的场景版本库 (线程安全) """
+
+    def __init__(self, store_dir: str = None):
+        """ :param store_dir: 持久化目录；None 则只保存在内存中 """
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+        self._nodes = {}          # 哈希 -> 节点 (本次进程创建或已读取的)
+        self._offsets = {}        # 哈希 -> objects.jsonl 中的偏移 (磁盘上已有、尚未读取的)
+        self.versions = {}        # 版本号 -> 版本记录
+        self.heads = {}           # 分支名 -> 版本号
+        self._objects_path = self._versions_path = None
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+            self._objects_path = os.path.join(store_dir, "objects.jsonl")
+            self._versions_path = os.path.join(store_dir, "versions.jsonl")
+            self._load_index()
+
+    def _load_index(self):
+        """ 只读取节点哈希与偏移 (节点内容按需读取) 以及版本记录 """
+        if os.path.exists(self._objects_path):
+            with open(self._objects_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    self._offsets[line[:40].decode("ascii")] = offset
+                    offset += len(line)
+        if os.path.exists(self._versions_path):
+            with open(self._versions_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        if "ref" in record:
+                            self.heads[record["ref"]] = record["id"]
+                            continue
+                        self.versions[record["id"]] = record
+                        self.heads[record["branch"]] = record["id"]
+
+    # --- 节点 ---
+
+    def _has_node(self, node_hash: str) -> bool:
+        return node_hash in self._nodes or node_hash in self._offsets
+
+    def _get_node(self, node_hash: str):
+        if node_hash not in self._nodes:
+            with open(self._objects_path, "rb") as f:
+                f.seek(self._offsets[node_hash])
+                self._nodes[node_hash] = json.loads(f.readline().decode("utf-8").split("\t", 1)[1])
+        return self._nodes[node_hash]
+
+    def _intern(self, value, new_nodes: list):
+        """ 值 -> 引用；标量与标量列表内联，其余存为节点 """
+        if _is_scalar(value):
+            return value
+        if isinstance(value, dict):
+            node = {"d": [[str(k), self._intern(v, new_nodes)] for k, v in value.items()]}
+        elif isinstance(value, (list, tuple)):
+            if all(_is_scalar(v) for v in value):
+                return list(value)
+            node = {"l": [self._intern(v, new_nodes) for v in value]}
+        else:
+            raise TypeError(f"无法保存的类型: {type(value).__name__}")
+
+        encoded = _encode(node)
+        node_hash = hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+        if not self._has_node(node_hash):
+            self._nodes[node_hash] = node
+            new_nodes.append((node_hash, encoded))
+        return {_REF_KEY: node_hash}
+
+    def _materialize(self, ref):
+        """ 引用 -> 新建的 Python 对象 (调用方可以随意修改) """
+        if isinstance(ref, list):
+            return list(ref)
+        if not isinstance(ref, dict):
+            return ref
+        node = self._get_node(ref[_REF_KEY])
+        if "d" in node:
+            return {k: self._materialize(v) for k, v in node["d"]}
+        return [self._materialize(v) for v in node["l"]]
+
+    # --- 版本 ---
+
+    def commit(self, plan: dict, label: str, branch: str = DEFAULT_BRANCH, parent: str = None, **info) -> str:
+        """
+        保存一个版本。
+        :param parent: 父版本号 (默认为该分支当前的头)
+        :param info: 附加到版本记录上的信息 (e.g., attempt=2)
+        :return: 版本号
+        """
+        with self._lock:
+            new_nodes = []
+            root = self._intern(plan, new_nodes)
+            version_id = f"v{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            record = {
+                "id": version_id,
+                "root": root[_REF_KEY] if isinstance(root, dict) else None,
+                "parent": parent if parent is not None else self.heads.get(branch),
+                "branch": branch,
+                "label": label,
+                "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "new_nodes": len(new_nodes),
+                **info
+            }
+            if self.store_dir:
+                with open(self._objects_path, "a", encoding="utf-8") as f:
+                    for node_hash, encoded in new_nodes:
+                        f.write(f"{node_hash}\t{encoded}\n")
+                with open(self._versions_path, "a", encoding="utf-8") as f:
+                    f.write(_encode(record) + "\n")
+            self.versions[version_id] = record
+            self.heads[branch] = version_id
+        print(f"[Scene Store] {version_id} ({branch}/{label}) 根 {str(record['root'])[:10]}, 新节点 {len(new_nodes)} 个")
+        return version_id
+
+    def content_hash(self, version_id: str) -> str:
+        """ 版本的内容哈希 (内容相同的版本哈希相同) """
+        return self.versions[version_id]["root"]
+
+    def checkout(self, version_id: str) -> dict:
+        """ 取出某个版本的完整规划 (新对象) """
+        with self._lock:
+            root = self.versions[version_id]["root"]
+            return self._materialize({_REF_KEY: root}) if root else {}
+
+    def rollback(self, version_id: str, branch: str = DEFAULT_BRANCH) -> dict:
+        """ 把分支的头移回某个版本 (记录为一个新版本，历史不丢失)，返回该版本的规划 """
+        plan = self.checkout(version_id)
+        self.commit(plan, f"rollback:{version_id}", branch=branch)
+        return plan
+
+    def branch(self, version_id: str, name: str) -> str:
+        """ 从任意版本分叉出新分支 (之后对该分支的提交以它为父版本) """
+        with self._lock:
+            if self.store_dir:
+                with open(self._versions_path, "a", encoding="utf-8") as f:
+                    f.write(_encode({"ref": name, "id": version_id}) + "\n")
+            self.heads[name] = version_id
+        return version_id
+
+    def log(self, branch: str = DEFAULT_BRANCH) -> list:
+        """ 沿父版本链回溯，返回 (从新到旧的) 版本记录 """
+        records = []
+        version_id = self.heads.get(branch)
+        while version_id:
+            record = self.versions[version_id]
+            records.append(record)
+            version_id = record["parent"]
+        return records
+
+    # --- diff ---
+
+    def diff(self, version_a: str, version_b: str) -> list:
+        """
+        两个版本的差异: [{"path", "op": "add"/"remove"/"change", "old", "new"}]
+        只沿哈希不同的分支向下比较，未改动的子树直接跳过。
+        """
+        with self._lock:
+            changes = []
+            self._diff_refs(
+                {_REF_KEY: self.versions[version_a]["root"]},
+                {_REF_KEY: self.versions[version_b]["root"]},
+                "", changes
+            )
+            return changes
+
+    def _diff_refs(self, a, b, path: str, changes: list):
+        if a == b:
+            return
+        node_a = self._get_node(a[_REF_KEY]) if isinstance(a, dict) else None
+        node_b = self._get_node(b[_REF_KEY]) if isinstance(b, dict) else None
+
+        if node_a and node_b and "d" in node_a and "d" in node_b:
+            items_a, items_b = dict(node_a["d"]), dict(node_b["d"])
+            for key in items_a.keys() | items_b.keys():
+                sub_path = f"{path}.{key}" if path else key
+                if key not in items_b:
+                    changes.append({"path": sub_path, "op": "remove", "old": self._materialize(items_a[key]), "new": None})
+                elif key not in items_a:
+                    changes.append({"path": sub_path, "op": "add", "old": None, "new": self._materialize(items_b[key])})
+                else:
+                    self._diff_refs(items_a[key], items_b[key], sub_path, changes)
+        elif node_a and node_b and "l" in node_a and "l" in node_b:
+            list_a, list_b = node_a["l"], node_b["l"]
+            if len(list_a) == len(list_b):
+                for i, (item_a, item_b) in enumerate(zip(list_a, list_b)):
+                    self._diff_refs(item_a, item_b, f"{path}[{i}]", changes)
+            else:
+                # 长度变化 (插入 / 删除): 按元素内容做多重集合差
+                keys_a, keys_b = [_encode(item) for item in list_a], [_encode(item) for item in list_b]
+                unmatched_b, unmatched_a = Counter(keys_b), Counter(keys_a)
+                for i, (item, key) in enumerate(zip(list_a, keys_a)):
+                    if unmatched_b[key] > 0:
+                        unmatched_b[key] -= 1
+                    else:
+                        changes.append({"path": f"{path}[{i}]", "op": "remove", "old": self._materialize(item), "new": None})
+                for i, (item, key) in enumerate(zip(list_b, keys_b)):
+                    if unmatched_a[key] > 0:
+                        unmatched_a[key] -= 1
+                    else:
+                        changes.append({"path": f"{path}[{i}]", "op": "add", "old": None, "new": self._materialize(item)})
+        else:
+            changes.append({"path": path, "op": "change", "old": self._materialize(a), "new": self._materialize(b)})
+
+
+# ===================================================================
+# 全局版本库 (与检查点一样，通过 configure 设置)
+# ===================================================================
+
+_store = None
+_store_enabled = True
+_store_init_lock = threading.Lock()
+
+
+def configure_scene_store(store_dir: str = None, enabled: bool = True):
+    """
+    设置版本库目录与开关。
+    :param store_dir: 版本库目录 (None 则保持当前设置)
+    :param enabled: False 则 record_scene_version 不做任何事
+    """
+    global SCENE_STORE_DIR, _store, _store_enabled
+    if store_dir:
+        SCENE_STORE_DIR = store_dir
+    _store = None
+    _store_enabled = enabled
+    state = "启用" if enabled else "禁用"
+    print(f"[Scene Store] 场景版本库已{state}，目录: {SCENE_STORE_DIR}")
+
+
+def get_scene_store() -> SceneStore:
+    global _store
+    with _store_init_lock:
+        if _store is None:
+            _store = SceneStore(SCENE_STORE_DIR)
+        return _store
+
+
+def record_scene_version(plan: dict, label: str, branch: str = DEFAULT_BRANCH, **info):
+    """ 流程中调用: 保存一个中间版本；失败只打印警告，不影响生成 """
+    if not _store_enabled or not plan:
+        return None
+    try:
+        return get_scene_store().commit(plan, label, branch=branch, **info)
+    except Exception as e:
+        print(f"!!! [Scene Store] 警告: 无法保存版本 '{label}': {e}")
+        return None
+
+
+# ===================================================================
+# 命令行: log / show / diff
+# ===================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="查看场景版本库")
+    parser.add_argument("--store", default=SCENE_STORE_DIR, help="版本库目录")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("log", help="列出某个分支的版本")
+    p.add_argument("--branch", default=DEFAULT_BRANCH)
+    p = sub.add_parser("show", help="导出某个版本的规划")
+    p.add_argument("version")
+    p.add_argument("output", nargs="?", help="输出 JSON 路径 (默认打印)")
+    p = sub.add_parser("diff", help="比较两个版本")
+    p.add_argument("version_a")
+    p.add_argument("version_b")
+    args = parser.parse_args()
+
+    store = SceneStore(args.store)
+    if args.command == "log":
+        for record in store.log(args.branch):
+            print(f"{record['id']}  {record['created_at']}  {record['label']:<24} 根 {str(record['root'])[:10]}  新节点 {record['new_nodes']}")
+    elif args.command == "show":
+        plan = store.checkout(args.version)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(plan, f, ensure_ascii=False, indent=4)
+        else:
+            print(json.dumps(plan, ensure_ascii=False, indent=2))
+    else:
+        for change in store.diff(args.version_a, args.version_b):
+            print(f"{change['op']:<7} {change['path']}: {change['old']} -> {change['new']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+# 文件名: schedule_simulator.py
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from nav_grid import (
+    UNREACHABLE, build_walkable_grid, build_tag_fields, goal_mask, distance_fields, step_downhill
+)
+from scene_format import load_scene_file
+
+# ===================================================================
+# 无头日程模拟器 (Headless Schedule Simulator)
+# ===================================================================
+# 不启动 Godot，直接读取保存的场景 JSON 与 npc_souls，快速推进一天的时钟:
+#   - 与 npc_brain.gd / agent_brain.gd 相同的任务规则:
+#       整点分钟匹配日程键 "HH:MM"；角色忙碌时新任务被忽略；
+#       "[名字]" 是角色 -> 去找他说话，否则视为语义标签 -> 走到最近的实例；
+#   - 所有角色的状态存在 numpy 数组中，沿距离场 (nav_grid) 向量化移动，
+#     上千个角色模拟一整天只需几秒；
+#   - 报告: 不可达目标、拥堵热点 (只统计移动中的角色)、空闲角色的聚集点、空闲时间、被忽略的任务。
+
+# 与 WorldClock.gd / npc_brain.gd 保持一致
+CLOCK_START = "07:00"            # WorldClock.current_time_seconds = 25200
+CLOCK_END = "23:59"
+TILE_SIZE_PX = 16
+AI_MOVE_SPEED_PX = 70.0          # 像素 / 真实秒
+WORLD_TIME_SCALE = 60.0          # 1 真实秒 = 60 游戏秒
+NAVIGATION_TARGET_REACHED_PX = 50.0
+DIALOGUE_COOLDOWN_S = 30.0       # 真实秒
+
+# 每游戏分钟移动的格数 / 对话到达距离 (格) / 对话冷却 (游戏分钟)
+TILES_PER_MINUTE = AI_MOVE_SPEED_PX / TILE_SIZE_PX * (60.0 / WORLD_TIME_SCALE)
+TALK_REACHED_TILES = int(NAVIGATION_TARGET_REACHED_PX // TILE_SIZE_PX)
+DIALOGUE_COOLDOWN_MIN = int(DIALOGUE_COOLDOWN_S * WORLD_TIME_SCALE / 60.0)
+
+# 追踪移动目标 (角色) 时重新计算距离场的间隔 (游戏分钟)
+REPATH_INTERVAL_MIN = 5
+# 同一格中同时站着至少这么多角色时计为拥堵
+CONGESTION_THRESHOLD = 3
+# 报告中列出的条目数
+REPORT_TOP_N = 10
+
+# 动作类型
+ACTION_NONE, ACTION_MOVE_TAG, ACTION_MOVE_CHARACTER, ACTION_TALK = 0, 1, 2, 3
+
+
+def _minute_of(key: str):
+    """ "HH:MM" -> 一天中的分钟数 (格式不对返回 None) """
+    try:
+        hour, minute = key.split(":")
+        value = int(hour) * 60 + int(minute)
+        return value if 0 <= value < 24 * 60 else None
+    except (ValueError, AttributeError):
+        return None
+
+
+def _time_of(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def parse_task_string(task_string: str) -> tuple:
+    """ 与 npc_brain.gd 的 parse_task_string 相同: 返回 (action, target) """
+    start = task_string.find("[")
+    end = task_string.find("]", start) if start != -1 else -1
+    if start != -1 and end != -1:
+        return task_string[:start].strip(), task_string[start + 1:end]
+    return task_string, ""
+
+
+# ===================================================================
+# 加载人口 (Population)
+# ===================================================================
+
+def load_population(plan: dict, souls_dir: str, walkable: np.ndarray, population_scale: int = 1, seed: int = 0) -> dict:
+    """
+    从 npc_layer 与灵魂文件构建角色列表。
+    population_scale > 1 时把每个角色复制多份 (压力测试)，副本放在随机的可行走格子上；
+    每份副本中的 "[名字]" 只指向同一份副本里的角色。
+    """
+    assets = plan.get("assets", {})
+    properties = plan.get("properties", {})
+    grid_h, grid_w = walkable.shape
+
+    base = []
+    for entry in plan.get("layout", {}).get("npc_layer", []):
+        asset_id = entry.get("asset_id")
+        if (assets.get(asset_id) or {}).get("type") not in ("npc", "agent"):
+            continue
+        props = properties.get(asset_id) or {}
+        schedule = {}
+        soul_path = os.path.join(souls_dir, props.get("soul_file", ""))
+        if props.get("soul_file") and os.path.exists(soul_path):
+            with open(soul_path, 'r', encoding='utf-8') as f:
+                soul = json.load(f)
+            # NPC 使用 schedule，Agent 使用 current_dynamic_plan (格式相同)
+            schedule = soul.get("schedule") or soul.get("current_dynamic_plan") or {}
+        else:
+            print(f"[Simulator] 警告: 找不到 {asset_id} 的灵魂文件，视为没有日程。")
+        x, y = entry.get("position", [0, 0])
+        base.append({
+            "name": props.get("character_name", asset_id),
+            "tag": props.get("semantic_tag", ""),
+            "schedule": schedule,
+            "position": (min(max(int(x), 0), grid_w - 1), min(max(int(y), 0), grid_h - 1))
+        })
+
+    rng = np.random.default_rng(seed)
+    walkable_cells = np.flatnonzero(walkable)
+    names, tags, schedules, replicas, xs, ys = [], [], [], [], [], []
+    for replica in range(max(1, population_scale)):
+        for character in base:
+            if replica == 0 or len(walkable_cells) == 0:
+                x, y = character["position"]
+            else:
+                cell = int(rng.choice(walkable_cells))
+                y, x = divmod(cell, grid_w)
+            names.append(character["name"])
+            tags.append(character["tag"])
+            schedules.append(character["schedule"])
+            replicas.append(replica)
+            xs.append(x)
+            ys.append(y)
+
+    return {
+        "names": names,
+        "tags": tags,
+        "schedules": schedules,
+        "replica": np.array(replicas, dtype=np.int32),
+        "xs": np.array(xs, dtype=np.int64),
+        "ys": np.array(ys, dtype=np.int64)
+    }
+
+
+# ===================================================================
+# 模拟 (Simulation)
+# ===================================================================
+
+def simulate_schedules(plan: dict, souls_dir: str, population_scale: int = 1,
+                       start: str = CLOCK_START, end: str = CLOCK_END, seed: int = 0) -> dict:
+    """
+    快进模拟一天的日程，返回报告字典。
+    """
+    t0 = time.time()
+    walkable = build_walkable_grid(plan)
+    tags, tag_fields, _ = build_tag_fields(plan, walkable)
+    tag_lookup = {tag: i for i, tag in enumerate(tags)}
+    grid_h, grid_w = walkable.shape
+
+    population = load_population(plan, souls_dir, walkable, population_scale, seed)
+    names, schedules, replica = population["names"], population["schedules"], population["replica"]
+    xs, ys = population["xs"], population["ys"]
+    n = len(names)
+    t_setup = time.time() - t0
+
+    # (副本, 名字) -> 角色下标；(副本, 语义标签) -> 角色下标 (Godot 中角色也会加入 semantic_tag 组)
+    by_name, by_tag = {}, {}
+    for i in range(n):
+        by_name.setdefault((int(replica[i]), names[i]), i)
+        if population["tags"][i]:
+            by_tag.setdefault((int(replica[i]), population["tags"][i]), i)
+
+    # 日程事件表: 分钟 -> [(角色, 任务)]
+    events = {}
+    for i, schedule in enumerate(schedules):
+        for key, task in schedule.items():
+            minute = _minute_of(key)
+            if minute is not None and isinstance(task, str):
+                events.setdefault(minute, []).append((i, task))
+
+    action = np.zeros(n, dtype=np.int8)
+    target = np.zeros(n, dtype=np.int64)
+    task_started = np.zeros(n, dtype=np.int64)
+    cooldown_until = np.zeros(n, dtype=np.int64)
+    step_budget = np.zeros(n, dtype=np.float64)
+    idle_minutes = np.zeros(n, dtype=np.int64)
+    last_task = [""] * n
+
+    # 拥堵只统计移动中的角色；到达目标后停在原地的空闲角色另计为 "聚集"
+    congestion = np.zeros(grid_h * grid_w, dtype=np.int64)
+    peak_occupancy = np.zeros(grid_h * grid_w, dtype=np.int64)
+    idle_pileup = np.zeros(grid_h * grid_w, dtype=np.int64)
+    idle_peak = np.zeros(grid_h * grid_w, dtype=np.int64)
+    unreachable, missed = [], []
+    travel_minutes = []
+    dialogues = 0
+    completed = 0
+
+    dyn_targets = np.zeros(0, dtype=np.int64)
+    dyn_fields = np.zeros((0, grid_h, grid_w), dtype=np.int32)
+    last_repath = -REPATH_INTERVAL_MIN
+
+    def _fail(i, minute, task, reason):
+        unreachable.append({"character": names[i], "replica": int(replica[i]), "time": _time_of(minute), "task": task, "reason": reason})
+        action[i] = ACTION_NONE
+        last_task[i] = ""
+
+    start_minute, end_minute = _minute_of(start), _minute_of(end)
+    for minute in range(start_minute, end_minute + 1):
+        # 1. 分发日程任务 (稀疏事件，逐条处理)
+        for i, task in events.get(minute, ()):
+            if action[i] != ACTION_NONE:
+                missed.append({"character": names[i], "time": _time_of(minute), "task": task})
+                continue
+            if task == last_task[i]:
+                continue
+            last_task[i] = task
+            _, target_name = parse_task_string(task)
+            key = (int(replica[i]), target_name)
+            if not target_name:
+                _fail(i, minute, task, "no_target")
+            elif key in by_name and by_name[key] != i:
+                action[i], target[i] = ACTION_TALK, by_name[key]
+            elif target_name in tag_lookup:
+                t = tag_lookup[target_name]
+                if tag_fields[t, ys[i], xs[i]] == UNREACHABLE:
+                    _fail(i, minute, task, "no_path")
+                    continue
+                action[i], target[i] = ACTION_MOVE_TAG, t
+            elif key in by_tag and by_tag[key] != i:
+                action[i], target[i] = ACTION_MOVE_CHARACTER, by_tag[key]
+            else:
+                _fail(i, minute, task, "missing_target")
+                continue
+            task_started[i] = minute
+
+        # 2. 追踪移动目标: 为被追踪的角色批量计算距离场
+        dynamic = (action == ACTION_MOVE_CHARACTER) | (action == ACTION_TALK)
+        if dynamic.any():
+            wanted = np.unique(target[dynamic])
+            if minute - last_repath >= REPATH_INTERVAL_MIN or not np.isin(wanted, dyn_targets).all():
+                dyn_targets = wanted
+                goals = np.zeros((len(wanted), grid_h, grid_w), dtype=bool)
+                for k, j in enumerate(wanted):
+                    goals[k] = goal_mask(walkable, [(xs[j], ys[j], xs[j] + 1, ys[j] + 1)])
+                    goals[k, ys[j], xs[j]] = True
+                dyn_fields = distance_fields(walkable | goals.any(axis=0), goals)
+                last_repath = minute
+
+        # 3. 向量化移动
+        moving = action != ACTION_NONE
+        step_budget = np.where(moving, step_budget + TILES_PER_MINUTE, 0.0)
+        steps = np.floor(step_budget).astype(np.int64)
+        step_budget -= steps
+        for s in range(int(steps.max()) if n else 0):
+            active = steps > s
+            static = active & (action == ACTION_MOVE_TAG)
+            if static.any():
+                ys[static], xs[static] = step_downhill(tag_fields, target[static], ys[static], xs[static])
+            tracking = active & ((action == ACTION_MOVE_CHARACTER) | (action == ACTION_TALK))
+            if tracking.any():
+                layer = np.searchsorted(dyn_targets, target[tracking])
+                ys[tracking], xs[tracking] = step_downhill(dyn_fields, layer, ys[tracking], xs[tracking])
+
+        # 4. 到达判定
+        static = np.flatnonzero(action == ACTION_MOVE_TAG)
+        if len(static):
+            d = tag_fields[target[static], ys[static], xs[static]]
+            for i in static[d == UNREACHABLE]:
+                _fail(i, minute, last_task[i], "no_path")
+            arrived = static[d == 0]
+            travel_minutes.extend((minute - task_started[arrived]).tolist())
+            completed += len(arrived)
+            action[arrived] = ACTION_NONE
+
+        tracking = np.flatnonzero(dynamic & (action != ACTION_NONE))
+        if len(tracking):
+            j = target[tracking]
+            near = np.maximum(np.abs(ys[tracking] - ys[j]), np.abs(xs[tracking] - xs[j])) <= TALK_REACHED_TILES
+            arrived = tracking[near]
+            talking = arrived[(action[arrived] == ACTION_TALK) & (cooldown_until[arrived] <= minute)]
+            dialogues += len(talking)
+            cooldown_until[talking] = minute + DIALOGUE_COOLDOWN_MIN
+            travel_minutes.extend((minute - task_started[arrived]).tolist())
+            completed += len(arrived)
+            action[arrived] = ACTION_NONE
+            # 目标走到了不可达的位置
+            still = tracking[~near]
+            if len(still):
+                layer = np.searchsorted(dyn_targets, target[still])
+                for i in still[dyn_fields[layer, ys[still], xs[still]] == UNREACHABLE]:
+                    _fail(i, minute, last_task[i], "no_path")
+
+        # 5. 统计
+        idle = action == ACTION_NONE
+        idle_minutes += idle
+        cells = ys * grid_w + xs
+        for mask, counts, peak in ((~idle, congestion, peak_occupancy), (idle, idle_pileup, idle_peak)):
+            occupancy = np.bincount(cells[mask], minlength=grid_h * grid_w)
+            counts += np.where(occupancy >= CONGESTION_THRESHOLD, occupancy, 0)
+            np.maximum(peak, occupancy, out=peak)
+
+    total_minutes = end_minute - start_minute + 1
+    return _build_report(
+        names, replica, idle_minutes, total_minutes, unreachable, missed, travel_minutes,
+        (congestion, peak_occupancy), (idle_pileup, idle_peak), grid_w, dialogues, completed,
+        timing={"setup_s": round(t_setup, 3), "total_s": round(time.time() - t0, 3)},
+        grid={"size": [grid_w, grid_h], "walkable_cells": int(walkable.sum()), "tags": len(tags)}
+    )
+
+
+# ===================================================================
+# 报告 (Report)
+# ===================================================================
+
+def _top_cells(counts: np.ndarray, peak: np.ndarray, grid_w: int) -> list:
+    """ 拥堵角色·分钟最多的 REPORT_TOP_N 个格子 """
+    if not counts.any():
+        return []
+    top = np.argsort(counts)[::-1][:REPORT_TOP_N]
+    return [
+        {"cell": [int(c % grid_w), int(c // grid_w)], "agent_minutes": int(counts[c]), "peak": int(peak[c])}
+        for c in top if counts[c] > 0
+    ]
+
+
+def _build_report(names, replica, idle_minutes, total_minutes, unreachable, missed, travel_minutes,
+                  congestion, idle_pileup, grid_w, dialogues, completed, timing, grid) -> dict:
+    """
+    :param congestion: 移动中角色的 (拥堵角色·分钟, 峰值) 数组
+    :param idle_pileup: 空闲角色的 (聚集角色·分钟, 峰值) 数组
+    """
+    n = len(names)
+
+    unreachable_by_target = {}
+    for item in unreachable:
+        _, target_name = parse_task_string(item["task"])
+        key = f"{item['reason']}:{target_name}"
+        unreachable_by_target[key] = unreachable_by_target.get(key, 0) + 1
+
+    idle_ratio = idle_minutes / max(1, total_minutes)
+    most_idle = [
+        {"character": names[i], "replica": int(replica[i]), "idle_minutes": int(idle_minutes[i])}
+        for i in np.argsort(idle_minutes)[::-1][:REPORT_TOP_N]
+    ] if n else []
+
+    return {
+        "agents": n,
+        "simulated_minutes": total_minutes,
+        "grid": grid,
+        "timing": timing,
+        "tasks_completed": completed,
+        "dialogues": dialogues,
+        "mean_travel_minutes": round(float(np.mean(travel_minutes)), 2) if travel_minutes else 0.0,
+        "unreachable": {
+            "count": len(unreachable),
+            "by_target": dict(sorted(unreachable_by_target.items(), key=lambda kv: -kv[1])),
+            "examples": unreachable[:REPORT_TOP_N]
+        },
+        "missed_tasks": {"count": len(missed), "examples": missed[:REPORT_TOP_N]},
+        "hotspots": _top_cells(*congestion, grid_w),
+        "idle": {
+            "mean_ratio": round(float(idle_ratio.mean()), 3) if n else 0.0,
+            "most_idle": most_idle,
+            "pileups": _top_cells(*idle_pileup, grid_w)
+        }
+    }
+
+
+def print_report(report: dict):
+    print("\n========== [Simulator] 日程模拟报告 ==========")
+    print(f"  角色: {report['agents']}, 模拟 {report['simulated_minutes']} 分钟, 耗时 {report['timing']['total_s']}s")
+    print(f"  完成任务: {report['tasks_completed']}, 对话: {report['dialogues']}, 平均路程: {report['mean_travel_minutes']} 分钟")
+    print(f"  不可达目标: {report['unreachable']['count']}")
+    for key, count in list(report["unreachable"]["by_target"].items())[:REPORT_TOP_N]:
+        print(f"    - {key}: {count}")
+    print(f"  因忙碌被忽略的任务: {report['missed_tasks']['count']}")
+    if report["hotspots"]:
+        print("  拥堵热点 (移动中的角色；格子: 拥堵角色·分钟 / 峰值):")
+        for spot in report["hotspots"]:
+            print(f"    - {spot['cell']}: {spot['agent_minutes']} / {spot['peak']}")
+    print(f"  平均空闲比例: {report['idle']['mean_ratio']:.1%}")
+    if report["idle"]["pileups"]:
+        print("  空闲角色聚集点 (格子: 角色·分钟 / 峰值):")
+        for spot in report["idle"]["pileups"]:
+            print(f"    - {spot['cell']}: {spot['agent_minutes']} / {spot['peak']}")
+    print("==============================================")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="不启动 Godot，快进模拟场景中所有角色的日程")
+    parser.add_argument("project", help="Godot 项目路径 (包含 saved_levels/ 与 npc_souls/)")
+    parser.add_argument("--level", default="my_first_level.wgscene", help="saved_levels/ 下的场景文件名 (.wgscene 或 .json)")
+    parser.add_argument("--scale", type=int, default=1, help="人口倍数 (把每个角色复制 N 份做压力测试)")
+    parser.add_argument("--start", default=CLOCK_START, help="开始时间 HH:MM")
+    parser.add_argument("--end", default=CLOCK_END, help="结束时间 HH:MM")
+    parser.add_argument("--seed", type=int, default=0, help="副本随机位置的种子")
+    parser.add_argument("--report", default=None, help="报告 JSON 保存路径 (可选)")
+    args = parser.parse_args()
+
+    plan = load_scene_file(os.path.join(args.project, "saved_levels", args.level))
+
+    report = simulate_schedules(
+        plan, os.path.join(args.project, "npc_souls"),
+        population_scale=args.scale, start=args.start, end=args.end, seed=args.seed
+    )
+    print_report(report)
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"[Simulator] 报告已保存: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
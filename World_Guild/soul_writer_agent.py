@@ -1,46 +1,85 @@
 # 文件名: soul_writer_agent.py
 import os
+import sys
 import json
 import random
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Union
 from config import SOUL_API_CONFIG
+from api_client_utils import create_api_client, call_chat_completion
+from checkpoint_store import run_checkpointed_stage
+from token_accounting import estimate_text_tokens
+from tracing import span, traced
+from memory_service import MEMORY_SERVICE_URL, seed_memory
+
+# --- 初始化 Soul Writer 的 LLM 客户端 (与写入灵魂文件的 Agent 配置相同) ---
+try:
+    client = create_api_client(SOUL_API_CONFIG, agent_name="Soul Writer Agent")
+    SOUL_MODEL_NAME = SOUL_API_CONFIG.get("model")
+    if not SOUL_MODEL_NAME:
+        raise ValueError("'model' is not specified in SOUL_API_CONFIG in config.py")
+    print(f"[Soul Writer Agent] Using model: {SOUL_MODEL_NAME}")
+
+except Exception as e:
+    print(f"!!! Error loading Soul Writer Agent config: {e}", file=sys.stderr)
+    sys.exit(1)
+
+# 每次批量调用中 "角色列表" 部分的 Token 上限 (估算值)，超出则拆成多批
+SOUL_BATCH_TOKEN_BUDGET = 2000
+# 每批最多的角色数 (限制单次回复的长度)
+SOUL_MAX_BATCH_SIZE = 25
+# 同时进行的批量调用数 / 写文件线程数
+SOUL_MAX_WORKERS = 4
 
 # ===================================================================
-# 模拟日程生成
+# 语义标签索引 (每个场景只计算一次)
 # ===================================================================
-def _simulate_schedule_generation(character_name: str, scene_plan: dict) -> dict:
+def _build_semantic_tag_index(scene_plan: dict) -> dict:
+    """
+    从 scene_plan 中提取所有可用的“地点”语义标签 (只遍历一次 properties)。
+    :return: {"locations": ["[tag]", ...], "doors": ["[door_tag]", ...]}
+    """
+    locations = []
+    seen = set()
+    assets = scene_plan.get("assets", {})
+    for asset_id, prop in scene_plan.get("properties", {}).items():
+        # 确保这个资产不是角色
+        asset_type = (assets.get(asset_id) or {}).get("type", "")
+        if asset_type not in ("tile", "object"):
+            continue
+        # 过滤掉无意义的标签
+        tag = prop.get("semantic_tag")
+        if tag and tag not in ("floor", "wall") and tag not in seen:
+            seen.add(tag)
+            locations.append(f"[{tag}]")
+
+    return {"locations": locations, "doors": [t for t in locations if "door" in t]}
+
+
+# ===================================================================
+# 模拟日程生成 (LLM 不可用时的备用方案)
+# ===================================================================
+def _simulate_schedule_generation(character_name: str, tag_index: dict) -> dict:
     """
     (模拟 LLM) 为 NPC 生成一个基于场景上下文的日程表。
-    它会读取场景中所有可用的 semantic_tag 来创建日程。
+    使用预先计算好的语义标签索引。
     """
     print(f"  [Soul Writer] 模拟为 {character_name} 生成日程...")
-    
-    # 1. 从 scene_plan 中提取所有可用的“地点”语义标签
-    valid_tags = []
-    if "properties" in scene_plan and "assets" in scene_plan:
-        for asset_id, prop in scene_plan["properties"].items():
-            # 确保这个资产不是角色
-            asset_type = scene_plan["assets"].get(asset_id, {}).get("type", "")
-            if asset_type in ("tile", "object"):
-                # 获取语义标签
-                tag = prop.get("semantic_tag")
-                # 过滤掉无意义的标签
-                if tag and tag not in ("floor", "wall"):
-                    if f"[{tag}]" not in valid_tags:
-                        valid_tags.append(f"[{tag}]")
-
-    # 2. 如果没有找到可用标签，返回一个空日程
+    valid_tags = tag_index["locations"]
+
+    # 如果没有找到可用标签，返回一个空日程
     if not valid_tags:
         print(f"  [Soul Writer] 警告: 找不到可用的 semantic_tag 来为 {character_name} 生成日程。")
         return {}
 
-    # 3. 随机生成一个简单的 3 步日程
+    # 随机生成一个简单的 3 步日程
     # (确保 'main_door' 总是在最后，如果它存在的话)
     loc1 = random.choice(valid_tags)
     loc2 = random.choice(valid_tags)
     
     # 尝试找到一个门作为离开点
-    door_tags = [t for t in valid_tags if "door" in t]
+    door_tags = tag_index["doors"]
     loc3 = random.choice(door_tags) if door_tags else random.choice(valid_tags)
 
     schedule = {
@@ -52,128 +91,319 @@ def _simulate_schedule_generation(character_name: str, scene_plan: dict) -> dict
     return schedule
 
 # ===================================================================
-# 灵魂文件生成 (主函数)
+# 批量灵魂生成 (LLM)
 # ===================================================================
-def generate_npc_souls(scene_plan: dict, project_path: str):
+
+SOUL_SYSTEM_PROMPT = """
+你是一个游戏编剧，负责为 2.5D 模拟游戏中的角色编写“灵魂设定”。
+你会收到场景描述、场景中可去的地点 (语义标签) 以及一批角色。
+请一次性为**所有**角色输出设定，返回一个 JSON 对象，不要有任何额外的文字。
+"""
+
+SOUL_USER_PROMPT_TEMPLATE = """
+【场景】: {scene_name}
+【场景描述】: {description}
+【可去的地点】(日程中只能使用这些标签，保留方括号): {locations}
+
+【角色列表】(每行一个 JSON):
+{characters}
+
+请为每个角色生成:
+- "personality": 一两句话的性格描述，贴合角色名和场景；
+- "goals": 1~3 个今天在这个场景中的目标；
+- "dialogue": 一句默认的打招呼台词；
+- "schedule": (仅 is_agent 为 false 的角色) 3~5 条日程，键为 "HH:MM" 时间，值为包含一个地点标签的动作，例如 "在 [bar_counter] 点一杯咖啡"。
+  is_agent 为 true 的角色返回空对象 {{}}。
+
+返回格式:
+{{
+  "characters": {{
+    "<id>": {{"personality": "...", "goals": ["..."], "dialogue": "...", "schedule": {{"09:00": "..."}}}}
+  }}
+}}
+"""
+
+
+def _chunk_characters(characters: list) -> list:
+    """ 按 Token 预算与最大批大小把角色列表分批 """
+    batches, current, current_tokens = [], [], 0
+    for character in characters:
+        line_tokens = estimate_text_tokens(json.dumps(character, ensure_ascii=False))
+        if current and (current_tokens + line_tokens > SOUL_BATCH_TOKEN_BUDGET or len(current) >= SOUL_MAX_BATCH_SIZE):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(character)
+        current_tokens += line_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _call_llm_for_soul_batch(batch: list, scene_plan: dict, tag_index: dict) -> dict:
     """
-    遍历 scene_plan, 为所有 "npc" 和 "agent" 生成灵魂文件。
-    - NPC: 会获得一个模拟生成的 "schedule"。
-    - Agent: 会获得一个空的 "current_dynamic_plan"。
+    一次调用为一批角色生成设定。
+    :return: { asset_id: {"personality", "goals", "dialogue", "schedule"} }；失败时返回 None
     """
-    print("\n[Soul Writer Agent] 开始生成灵魂文件...")
+    metadata = scene_plan.get("metadata", {})
+    user_prompt = SOUL_USER_PROMPT_TEMPLATE.format(
+        scene_name=metadata.get("scene_name", "未命名场景"),
+        description=metadata.get("description", ""),
+        locations=", ".join(tag_index["locations"]) or "(无)",
+        characters="\n".join(json.dumps(c, ensure_ascii=False) for c in batch)
+    )
+    try:
+        response = call_chat_completion(
+            client, "Soul Writer Agent",
+            trace_attrs={"batch_size": len(batch)},
+            model=SOUL_MODEL_NAME,
+            messages=[
+                {"role": "system", "content": SOUL_SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            response_format={"type": "json_object"}
+        )
+        result = json.loads(response.choices[0].message.content).get("characters", {})
+        if not isinstance(result, dict):
+            raise ValueError(f"'characters' 不是对象: {type(result).__name__}")
+        return result
+
+    except Exception as e:
+        print(f"  [Soul Writer] 批量生成 {len(batch)} 个角色的设定失败: {e}")
+        return None
+
+
+def _clean_schedule(schedule, tag_index: dict) -> dict:
+    """ 只保留 "HH:MM" -> 含有效地点标签 的日程条目 """
+    if not isinstance(schedule, dict):
+        return {}
+    locations = tag_index["locations"]
+    return {
+        str(time_key): str(action) for time_key, action in sorted(schedule.items())
+        if isinstance(action, str) and any(tag in action for tag in locations)
+    }
+
+
+def _generate_character_profiles(characters: list, scene_plan: dict, tag_index: dict, use_llm: bool = True) -> tuple:
+    """
+    为所有角色生成设定 (按 Token 预算分批，各批并发调用)。
+    :return: ({ asset_id: 设定 }, 失败的批数)；LLM 没有返回的角色不在结果中
+    """
+    if not use_llm or not characters:
+        return {}, 0
+
+    batches = _chunk_characters(characters)
+    print(f"  [Soul Writer] {len(characters)} 个角色分为 {len(batches)} 批调用 LLM...")
+
+    profiles = {}
+    failed_batches = 0
+    with ThreadPoolExecutor(max_workers=SOUL_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, _call_llm_for_soul_batch, batch, scene_plan, tag_index)
+            for batch in batches
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            if result is None:
+                failed_batches += 1
+            else:
+                profiles.update(result)
+    if failed_batches:
+        print(f"  [Soul Writer] 警告: {failed_batches}/{len(batches)} 批设定生成失败，相应角色使用模拟数据。")
+    return profiles, failed_batches
+
+
+def _build_agent_api_config() -> dict:
+    """ 根据 config.py 的 SOUL_API_CONFIG 构建写入 Agent 灵魂文件的 API 配置 (所有 Agent 相同) """
+    cfg = SOUL_API_CONFIG 
     
-    # 1. 确定灵魂文件的保存路径
-    souls_dir = os.path.join(project_path, "npc_souls")
-    os.makedirs(souls_dir, exist_ok=True)
+    # 动态构建 Godot 需要的 API URL
+    api_url = ""
+    api_type = cfg.get("type", "custom")
+    
+    model_name = cfg.get("model") 
+    if not model_name:
+        print(f"  [Soul Writer] 警告: 'model' 未在 config.py 的 SOUL_API_CONFIG 中配置!")
+        model_name = "gpt-4o"
+
+    
+    if api_type == "azure":
+        endpoint = cfg.get('azure_endpoint', '').rstrip('/')
+        version = cfg.get('api_version', '')
+        api_url = f"{endpoint}/openai/deployments/{model_name}/chat/completions?api-version={version}"
+    
+    elif api_type == "openai":
+        custom_base_url = cfg.get("base_url")
+        if custom_base_url:
+            # 使用 config.py 中提供的 base_url
+            endpoint = custom_base_url.rstrip('/')
+            api_url = f"{endpoint}/chat/completions"
+        else:
+            # 使用默认的 OpenAI URL
+            api_url = "https://api.openai.com/v1/chat/completions"
+    
+    elif api_type == "custom":
+        endpoint = cfg.get('base_url', '').rstrip('/')
+        api_url = f"{endpoint}/chat/completions"
+
+    # 这是将写入 .json 文件的字典
+    return {
+        "api_type": api_type,
+        "api_key": cfg.get("api_key", "NA"),
+        "model_name": model_name, # 供 Godot 内的 AI 逻辑使用
+        "api_url": api_url         # Godot Agent 实际调用的 URL
+    }
+
+
+# ===================================================================
+# 灵魂文件生成 (主函数)
+# ===================================================================
+def _build_npc_souls(scene_plan: dict, use_llm: bool = True) -> dict:
+    """
+    遍历 scene_plan, 为所有 "npc" 和 "agent" 构建灵魂数据。
+    - 性格 / 目标 / 台词 / NPC 日程: 批量调用 LLM 生成 (失败的角色退回模拟数据)。
+    - Agent: 会获得一个空的 "current_dynamic_plan" 和 API 配置。
+    :return: {"souls": { soul_file: soul_data }, "failed_batches": LLM 调用失败的批数}
+    """
+    souls = {}
     
     assets = scene_plan.get("assets", {})
     properties = scene_plan.get("properties", {})
-    
-    # 2. 遍历所有资产
+    scene_name = scene_plan.get("metadata", {}).get("scene_name", "未命名场景")
+
+    # 1. 语义标签索引只计算一次
+    tag_index = _build_semantic_tag_index(scene_plan)
+
+    # 2. 收集所有角色
+    characters = []
     for asset_id, asset_info in assets.items():
-        asset_type = asset_info.get("type")
-        
-        if asset_type in ("npc", "agent"):
-            prop = properties.get(asset_id)
-            if not prop:
-                print(f"  [Soul Writer] Error: Could not find properties for {asset_id}, skipping.")
-                continue
-                
-            character_name = prop.get("character_name", "Unknown")
-            safe_name = character_name.lower().replace(' ', '_').replace('(', '').replace(')', '')
-            soul_file = prop.get("soul_file", f"{safe_name}_soul.json")
-            is_agent = prop.get("is_agent", False)
-            
-            print(f"  [Soul Writer] Creating soul for '{character_name}' (Agent: {is_agent})...")
-
-            # 4. 【【【 核心逻辑：根据类型分配日程和 API 】】】
-            npc_schedule = {}
-            agent_dynamic_plan = {}
-            api_config_to_write = {} # 默认为空
-
-            if is_agent:
-                # Agent: 从 config.py 读取 API 配置
-                print(f"  [Soul Writer] Is Agent. Embedding API configuration from config.py...")
-                
-                cfg = SOUL_API_CONFIG 
-                
-                # 动态构建 Godot 需要的 API URL
-                api_url = ""
-                api_type = cfg.get("type", "custom")
-                
-                model_name = cfg.get("model") 
-                if not model_name:
-                    print(f"  [Soul Writer] 警告: 'model' 未在 config.py 的 SOUL_API_CONFIG 中配置!")
-                    model_name = "gpt-4o"
-
-                
-                if api_type == "azure":
-                    endpoint = cfg.get('azure_endpoint', '').rstrip('/')
-                    version = cfg.get('api_version', '')
-                    api_url = f"{endpoint}/openai/deployments/{model_name}/chat/completions?api-version={version}"
-                
-                elif api_type == "openai":
-                    custom_base_url = cfg.get("base_url")
-                    if custom_base_url:
-                        # 使用 config.py 中提供的 base_url
-                        endpoint = custom_base_url.rstrip('/')
-                        api_url = f"{endpoint}/chat/completions"
-                    else:
-                        # 使用默认的 OpenAI URL
-                        api_url = "https://api.openai.com/v1/chat/completions"
-                
-                elif api_type == "custom":
-                    endpoint = cfg.get('base_url', '').rstrip('/')
-                    api_url = f"{endpoint}/chat/completions"
-
-                # 这是将写入 .json 文件的字典
-                api_config_to_write = {
-                    "api_type": api_type,
-                    "api_key": cfg.get("api_key", "NA"),
-                    "model_name": model_name, # 供 Godot 内的 AI 逻辑使用
-                    "api_url": api_url         # Godot Agent 实际调用的 URL
-                }
-                
-                agent_dynamic_plan = {} # Agent 获得一个空的动态计划
+        if asset_info.get("type") not in ("npc", "agent"):
+            continue
+        prop = properties.get(asset_id)
+        if not prop:
+            print(f"  [Soul Writer] Error: Could not find properties for {asset_id}, skipping.")
+            continue
+        characters.append({
+            "id": asset_id,
+            "name": prop.get("character_name", "Unknown"),
+            "is_agent": bool(prop.get("is_agent", False)),
+            "tag": prop.get("semantic_tag", "")
+        })
+
+    # 3. 批量生成设定
+    profiles, failed_batches = _generate_character_profiles(characters, scene_plan, tag_index, use_llm=use_llm)
+    agent_api_config = _build_agent_api_config() if any(c["is_agent"] for c in characters) else {}
+
+    # 4. 组装灵魂数据
+    for character in characters:
+        asset_id = character["id"]
+        character_name = character["name"]
+        is_agent = character["is_agent"]
+        prop = properties[asset_id]
+        safe_name = character_name.lower().replace(' ', '_').replace('(', '').replace(')', '')
+        soul_file = prop.get("soul_file", f"{safe_name}_soul.json")
+        profile = profiles.get(asset_id) or {}
+
+        npc_schedule = {}
+        if not is_agent:
+            npc_schedule = _clean_schedule(profile.get("schedule"), tag_index)
+            if not npc_schedule:
+                # NPC: LLM 未返回有效日程时，获得一个模拟的日程
+                npc_schedule = _simulate_schedule_generation(character_name, tag_index)
+
+        goals = profile.get("goals")
+        if not isinstance(goals, list) or not goals:
+            goals = [f"Spend a day in {scene_name}"]
+
+        # 5. 定义灵魂文件的完整结构
+        soul_data = {
+            # --- Agent (LLM) 配置 ---
+            **(agent_api_config if is_agent else {}),
             
-            else:
-                # NPC: 获得一个模拟的、硬编码的日程
-                npc_schedule = _simulate_schedule_generation(character_name, scene_plan)
-                # api_config_to_write 保持为空
+            # --- 角色基础设定 ---
+            "character_name": character_name,
+            "base_prompt": f"You are an AI agent named {character_name}.",
+            "personality": str(profile.get("personality") or "A regular person"),
+            "goals": [str(g) for g in goals],
             
-            # 5. 定义灵魂文件的完整结构
-            soul_data = {
-                # --- Agent (LLM) 配置 ---
-                **api_config_to_write,
-                
-                # --- 角色基础设定 ---
-                "base_prompt": f"You are an AI agent named {character_name}.",
-                "personality": "A regular person",
-                "goals": [f"Spend a day in {scene_plan['metadata']['scene_name']}"],
-                
-                # --- 记忆和对话 (默认为空) ---
-                "memory": [],
-                "dialogue": {
-                    "default": "Hello there."
-                },
-                
-                # --- 日程规划 (核心) ---
-                "schedule": npc_schedule,              # <--- NPC 使用
-                "current_dynamic_plan": agent_dynamic_plan # <--- Agent 使用
-            }
+            # --- 记忆和对话 (默认为空; 运行时记忆写入记忆服务，不再回写灵魂文件) ---
+            "memory": [],
+            "memory_service_url": MEMORY_SERVICE_URL,
+            "dialogue": {
+                "default": str(profile.get("dialogue") or "Hello there.")
+            },
             
-            # 6. 保存文件
-            try:
-                save_path = os.path.join(souls_dir, soul_file)
-                with open(save_path, 'w', encoding='utf-8') as f:
-                    json.dump(soul_data, f, ensure_ascii=False, indent=4)
-                print(f"  [Soul Writer] 成功保存: {soul_file}")
-            except Exception as e:
-                print(f"  [Soul Writer] 错误: 保存 {soul_file} 失败: {e}")
+            # --- 日程规划 (核心) ---
+            "schedule": npc_schedule,  # <--- NPC 使用
+            "current_dynamic_plan": {} # <--- Agent 使用
+        }
+        
+        souls[soul_file] = soul_data
+
+    print(f"  [Soul Writer] 已构建 {len(souls)} 个灵魂 (LLM 生成 {len(profiles)} 个设定)。")
+    return {"souls": souls, "failed_batches": failed_batches}
+
+
+def _write_soul_file(souls_dir: str, soul_file: str, soul_data: dict):
+    try:
+        save_path = os.path.join(souls_dir, soul_file)
+        with open(save_path, 'w', encoding='utf-8') as f:
+            json.dump(soul_data, f, ensure_ascii=False, indent=4)
+        print(f"  [Soul Writer] 成功保存: {soul_file}")
+    except Exception as e:
+        print(f"  [Soul Writer] 错误: 保存 {soul_file} 失败: {e}")
+
+
+def _seed_character_memory(project_path: str, soul_file: str, soul_data: dict):
+    """ 用性格与目标作为初始记忆，重置记忆服务中该角色的日志 """
+    character_name = soul_data.get("character_name") or os.path.splitext(soul_file)[0]
+    entries = [{"time": "00:00", "event": f"我的性格: {soul_data.get('personality', '')}", "thought": ""}]
+    entries += [{"time": "00:00", "event": f"我的目标: {goal}", "thought": ""} for goal in soul_data.get("goals", [])]
+    entries += [m for m in soul_data.get("memory", []) if isinstance(m, dict)]
+    try:
+        seed_memory(project_path, character_name, entries)
+    except Exception as e:
+        print(f"  [Soul Writer] 警告: 初始化 {character_name} 的记忆失败: {e}")
+
+
+@traced("souls")
+def generate_npc_souls(scene_plan: dict, project_path: str, use_llm: bool = True):
+    """
+    为所有 "npc" 和 "agent" 生成灵魂文件。
+    灵魂数据以场景规划为输入写入检查点，重跑时不会重新生成。
+    """
+    print("\n[Soul Writer Agent] 开始生成灵魂文件...")
+    
+    # 1. 确定灵魂文件的保存路径
+    souls_dir = os.path.join(project_path, "npc_souls")
+    os.makedirs(souls_dir, exist_ok=True)
+
+    # 2. 构建 (或从检查点复用) 灵魂数据
+    artifact = run_checkpointed_stage(
+        "souls",
+        [scene_plan, SOUL_API_CONFIG, use_llm],
+        lambda: _build_npc_souls(scene_plan, use_llm=use_llm),
+        # 有批次退回模拟数据时不写入检查点，下次重跑时重新生成
+        is_valid=lambda a: a["failed_batches"] == 0
+    )
+    souls = artifact["souls"]
+
+    # 3. 并发保存文件
+    with span("souls.write", files=len(souls)):
+        with ThreadPoolExecutor(max_workers=SOUL_MAX_WORKERS) as executor:
+            futures = {}
+            for soul_file, soul_data in souls.items():
+                futures[executor.submit(_write_soul_file, souls_dir, soul_file, soul_data)] = f"保存 {soul_file}"
+                futures[executor.submit(_seed_character_memory, project_path, soul_file, soul_data)] = f"初始化 {soul_file} 的记忆"
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"  [Soul Writer] 错误: {futures[future]} 失败: {e}")
 
 # ===================================================================
 # 世界上下文生成 (Agent 感知世界用)
 # ===================================================================
+@traced("world_context")
 def generate_world_context(scene_plan: dict, project_path: str):
     """
     为 Agent 的 LLM 生成一个 "world_context.json" 文件。
@@ -0,0 +1,86 @@
+# 文件名: texture_manifest.py
+import os
+import json
+import struct
+import hashlib
+from collections import Counter
+
+# ===================================================================
+# 贴图清单 (Texture Manifest)
+# ===================================================================
+# Godot 构建场景时，每个摆放都会按 <asset_id>.png 重新 Image.load 一次
+# (10 把 chair_library 就解码 10 次)，重建场景时所有瓦片也会重新解码。
+# 保存阶段为场景中用到的每个唯一资产写一条记录:
+#   { asset_id: {"file", "hash" (文件内容哈希), "size" [w, h] 像素, "region" [x, y, w, h], "uses" 摆放次数} }
+# Godot 按 hash 缓存 ImageTexture (跨多次 build_scene_from_json 保留)，
+# 构建时间只与唯一资产数有关；贴图内容变化时哈希随之变化，自然重新加载。
+
+TEXTURE_MANIFEST_DIR = "textures"
+TEXTURE_MANIFEST_VERSION = 1
+ASSET_DIR_NAME = "generated_assets"
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_size(header: bytes):
+    """ 从 PNG 的 IHDR 读取像素尺寸 (不解码图像)；不是 PNG 返回 None """
+    if len(header) >= 24 and header[:8] == _PNG_SIGNATURE and header[12:16] == b"IHDR":
+        return list(struct.unpack(">II", header[16:24]))
+    return None
+
+
+def _count_uses(plan: dict) -> Counter:
+    uses = Counter()
+    for entries in plan.get("layout", {}).values():
+        if isinstance(entries, list):
+            uses.update(e.get("asset_id") for e in entries if isinstance(e, dict) and e.get("asset_id"))
+    return uses
+
+
+def build_texture_manifest(plan: dict, asset_dir: str) -> dict:
+    """
+    :param asset_dir: 贴图目录 (<项目>/generated_assets)
+    :return: 清单 (缺失贴图的资产不写入，Godot 会退回按文件名加载并报错)
+    """
+    uses = _count_uses(plan)
+    textures = {}
+    missing = []
+    for asset_id in plan.get("assets", {}):
+        path = os.path.join(asset_dir, f"{asset_id}.png")
+        if not os.path.exists(path):
+            missing.append(asset_id)
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        size = _png_size(data[:24]) or [0, 0]
+        textures[asset_id] = {
+            "file": f"{asset_id}.png",
+            "hash": hashlib.sha1(data).hexdigest()[:16],
+            "size": size,
+            "region": [0, 0, size[0], size[1]],
+            "uses": uses.get(asset_id, 0)
+        }
+    if missing:
+        print(f"  [Texture Manifest] 警告: {len(missing)} 个资产没有贴图: {', '.join(missing[:5])}{' ...' if len(missing) > 5 else ''}")
+    return {
+        "version": TEXTURE_MANIFEST_VERSION,
+        "asset_dir": f"res://{ASSET_DIR_NAME}/",
+        "unique_textures": len({t["hash"] for t in textures.values()}),
+        "placements": sum(uses.values()),
+        "textures": textures
+    }
+
+
+def save_texture_manifest(plan: dict, project_path: str, basename: str) -> str:
+    """
+    写入 <项目>/textures/<basename>.textures.json
+    :return: Godot 资源路径 (res://textures/<basename>.textures.json)
+    """
+    manifest = build_texture_manifest(plan, os.path.join(project_path, ASSET_DIR_NAME))
+    save_dir = os.path.join(project_path, TEXTURE_MANIFEST_DIR)
+    os.makedirs(save_dir, exist_ok=True)
+    file_name = f"{basename}.textures.json"
+    with open(os.path.join(save_dir, file_name), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"  [Texture Manifest] {len(manifest['textures'])} 个资产 / {manifest['unique_textures']} 张唯一贴图 / {manifest['placements']} 个摆放")
+    return f"res://{TEXTURE_MANIFEST_DIR}/{file_name}"
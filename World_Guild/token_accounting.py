@@ -0,0 +1,200 @@
+# 文件名: token_accounting.py
+import os
+import json
+import time
+import threading
+
+from config import PROMPT_TOKEN_BUDGETS, MODEL_PRICING
+
+# ===================================================================
+# Token 与成本核算 (Token & Cost Accounting)
+# ===================================================================
+# - 每次模型调用记录一条: Agent、模型、提示/补全 Token、估算值、耗时、成本；
+# - 发送前估算提示大小，超出该 Agent 的预算时先尝试压缩 (compact_fn，由调用方提供；
+#   例如 Manager 裁小 few-shot 范例、截断错误报告)，
+#   压缩后仍超出则拒绝调用 (抛出 PromptBudgetExceeded，调用方按原有逻辑降级)；
+# - 用量汇总 (get_usage_totals / reset_usage) 只在本模块中维护，其它模块不再单独计数。
+# - 运行结束时生成每个场景的成本报告。
+
+# 每张图片按固定 Token 估算 (Base64 数据不按文本计)
+IMAGE_TOKEN_ESTIMATE = 800
+
+_call_records = []
+_records_lock = threading.Lock()
+
+
+class PromptBudgetExceeded(ValueError):
+    """ 提示大小超出 Agent 预算且无法压缩到预算以内 """
+    pass
+
+
+# ===================================================================
+# Token 估算 (不依赖 tokenizer)
+# ===================================================================
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    粗略估算文本的 Token 数:
+    CJK 字符约 1 Token/字，其余字符约 4 字符/Token。
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '\u3000' <= ch <= '\u9fff' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_prompt_tokens(messages: list) -> int:
+    """ 估算 messages 的提示 Token 数 (文本按字符估算，图片按固定值) """
+    total = 0
+    for message in messages:
+        total += 4  # 每条消息的角色/分隔符开销
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_text_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += estimate_text_tokens(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+
+# ===================================================================
+# 预算 (Budgets)
+# ===================================================================
+
+def enforce_prompt_budget(agent_name: str, messages: list, compact_fn=None) -> tuple:
+    """
+    检查提示是否在该 Agent 的预算内。
+    :param compact_fn: (可选) 无参函数，返回压缩后的 messages
+    :return: (最终 messages, 估算 Token 数, 是否经过压缩)
+    :raises PromptBudgetExceeded: 压缩后仍超出预算
+    """
+    estimated = estimate_prompt_tokens(messages)
+    budget = PROMPT_TOKEN_BUDGETS.get(agent_name)
+    if budget is None or estimated <= budget:
+        return messages, estimated, False
+
+    if compact_fn is not None:
+        compacted = compact_fn()
+        compacted_estimate = estimate_prompt_tokens(compacted)
+        print(f"[Token Budget] {agent_name}: 提示约 {estimated} Token，超出预算 {budget}，"
+              f"压缩后约 {compacted_estimate} Token。")
+        if compacted_estimate <= budget:
+            return compacted, compacted_estimate, True
+        estimated = compacted_estimate
+
+    raise PromptBudgetExceeded(
+        f"{agent_name} 的提示约 {estimated} Token，超出预算 {budget}，已拒绝调用。"
+    )
+
+
+# ===================================================================
+# 记录 (Records)
+# ===================================================================
+
+def _compute_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """ 按 config.MODEL_PRICING (美元 / 百万 Token) 计算成本；未知模型记为 0 """
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+    return (prompt_tokens * pricing.get("prompt", 0) + completion_tokens * pricing.get("completion", 0)) / 1_000_000
+
+
+def record_call(agent_name: str, model: str, response, estimated_prompt_tokens: int,
+                duration_s: float, compacted: bool = False) -> dict:
+    """
+    记录一次模型调用。优先使用 response.usage；端点未返回 usage 时退回估算值。
+    :return: 本次调用的记录
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        estimated = False
+    else:
+        prompt_tokens = estimated_prompt_tokens
+        try:
+            completion_tokens = estimate_text_tokens(response.choices[0].message.content or "")
+        except (AttributeError, IndexError):
+            completion_tokens = 0
+        estimated = True
+
+    record = {
+        "agent": agent_name,
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "estimated_prompt_tokens": estimated_prompt_tokens,
+        "usage_estimated": estimated,
+        "compacted": compacted,
+        "duration_s": round(duration_s, 3),
+        "cost_usd": round(_compute_cost(model, prompt_tokens, completion_tokens), 6),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    with _records_lock:
+        _call_records.append(record)
+    return record
+
+
+def get_call_records() -> list:
+    """ 返回本进程内所有调用记录的副本 """
+    with _records_lock:
+        return [dict(r) for r in _call_records]
+
+
+def reset_usage() -> None:
+    """ 清空调用记录 (批量生成时每个场景开始前调用) """
+    with _records_lock:
+        _call_records.clear()
+
+
+def get_usage_totals() -> dict:
+    """ 按 Agent 汇总: { agent_name: {"calls", "prompt_tokens", "completion_tokens", "cost_usd"} } """
+    totals = {}
+    for record in get_call_records():
+        entry = totals.setdefault(record["agent"], {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+        entry["calls"] += 1
+        entry["prompt_tokens"] += record["prompt_tokens"]
+        entry["completion_tokens"] += record["completion_tokens"]
+        entry["cost_usd"] = round(entry["cost_usd"] + record["cost_usd"], 6)
+    return totals
+
+
+# ===================================================================
+# 成本报告 (Cost Report)
+# ===================================================================
+
+def build_cost_report(scene_name: str = None) -> dict:
+    """ 生成成本报告: 按 Agent 汇总 + 总计 + 每次调用明细 """
+    records = get_call_records()
+    by_agent = get_usage_totals()
+    total = {
+        "calls": len(records),
+        "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+        "completion_tokens": sum(r["completion_tokens"] for r in records),
+        "cost_usd": round(sum(r["cost_usd"] for r in records), 6),
+        "compacted_calls": sum(1 for r in records if r["compacted"])
+    }
+    return {"scene_name": scene_name, "total": total, "by_agent": by_agent, "calls": records}
+
+
+def save_cost_report(output_dir: str, scene_name: str = None, filename: str = "cost_report.json") -> str:
+    """ 打印并保存成本报告，返回保存路径 """
+    report = build_cost_report(scene_name)
+    total = report["total"]
+
+    print("\n========== [Token] 成本报告 ==========")
+    for agent_name, entry in report["by_agent"].items():
+        print(f"  {agent_name}: {entry['calls']} 次调用, 提示 {entry['prompt_tokens']} / "
+              f"补全 {entry['completion_tokens']} Token, ${entry['cost_usd']:.4f}")
+    print(f"  合计: {total['prompt_tokens'] + total['completion_tokens']} Token, ${total['cost_usd']:.4f} "
+          f"(压缩 {total['compacted_calls']} 次)")
+    print("======================================")
+
+    os.makedirs(output_dir, exist_ok=True)
+    save_path = os.path.join(output_dir, filename)
+    with open(save_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    return save_path
@@ -0,0 +1,289 @@
+# 文件名: tracing.py
+import os
+import json
+import time
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+# ===================================================================
+# 阶段追踪 (Stage Tracing)
+# ===================================================================
+# 用 span 记录流水线每个阶段的耗时与属性:
+#   stage / asset_id / attempt / bytes_sent / bytes_received / tokens ...
+# span 通过 contextvars 自动嵌套 (线程池中需用 copy_context().run 提交任务)。
+# 运行结束后可导出:
+#   - JSONL: 每行一个 span
+#   - Chrome trace-event JSON: 在 chrome://tracing 或 Perfetto 中打开
+# 并打印关键路径与最慢资产摘要。
+
+_tracing_enabled = True
+
+# 当前所在的 span (父 span)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# 已结束的 span 记录 (进程内)
+_records = []
+_records_lock = threading.Lock()
+_next_span_id = 0
+
+
+class Span:
+    """ 一个正在进行的阶段。用 set() / add() 在阶段内部补充属性。 """
+
+    __slots__ = ("span_id", "parent_id", "name", "attrs", "start", "end", "thread_id", "status")
+
+    def __init__(self, span_id: int, parent_id, name: str, attrs: dict):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.end = None
+        self.thread_id = threading.get_ident()
+        self.status = "ok"
+
+    def set(self, **attrs):
+        """ 覆盖属性 (e.g., cached=True) """
+        self.attrs.update(attrs)
+
+    def add(self, key: str, amount):
+        """ 累加数值属性 (e.g., bytes_received, tokens) """
+        self.attrs[key] = self.attrs.get(key, 0) + (amount or 0)
+
+    def to_record(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_s": round(self.end - self.start, 6),
+            "pid": os.getpid(),
+            "thread_id": self.thread_id,
+            "status": self.status,
+            "attrs": self.attrs
+        }
+
+
+class _NullSpan:
+    """ 追踪关闭时返回的空 span，调用方无需判断 """
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, key: str, amount):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def configure_tracing(enabled: bool = True):
+    """ 打开或关闭追踪 (关闭后 span() 不产生任何记录) """
+    global _tracing_enabled
+    _tracing_enabled = enabled
+
+
+def reset_trace():
+    """ 清空已记录的 span (批量生成时每个场景开始前调用) """
+    with _records_lock:
+        _records.clear()
+
+
+def current_span():
+    """ 返回当前所在的 span (没有则返回空 span)，用于在深层函数中补充属性 """
+    return _current_span.get() or _NULL_SPAN
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    记录一个阶段。
+    用法:
+        with span("image_gen", asset_id=asset_id, attempt=1) as s:
+            ...
+            s.add("bytes_received", len(img_bytes))
+    """
+    global _next_span_id
+    if not _tracing_enabled:
+        yield _NULL_SPAN
+        return
+
+    parent = _current_span.get()
+    with _records_lock:
+        _next_span_id += 1
+        span_id = _next_span_id
+    s = Span(span_id, parent.span_id if parent else None, name, attrs)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.status = "error"
+        s.attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end = time.time()
+        _current_span.reset(token)
+        with _records_lock:
+            _records.append(s.to_record())
+
+
+def traced(name: str):
+    """ 装饰器版本: 整个函数调用记为一个 span """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_trace_records() -> list:
+    """ 返回已结束 span 的副本 (按开始时间排序) """
+    with _records_lock:
+        return sorted(_records, key=lambda r: r["start"])
+
+
+# ===================================================================
+# 导出 (Export)
+# ===================================================================
+
+def export_trace(output_dir: str, basename: str = "trace") -> tuple:
+    """
+    导出 JSONL 与 Chrome trace-event 文件。
+    :return: (jsonl_path, chrome_trace_path)
+    """
+    records = get_trace_records()
+    os.makedirs(output_dir, exist_ok=True)
+    jsonl_path = os.path.join(output_dir, f"{basename}.jsonl")
+    chrome_path = os.path.join(output_dir, f"{basename}.chrome.json")
+
+    with open(jsonl_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    # Chrome trace-event 格式: "X" (complete) 事件，时间单位为微秒
+    origin = records[0]["start"] if records else 0
+    events = []
+    for record in records:
+        events.append({
+            "name": record["name"],
+            "cat": record["attrs"].get("stage", record["name"]),
+            "ph": "X",
+            "ts": round((record["start"] - origin) * 1e6),
+            "dur": round(record["duration_s"] * 1e6),
+            "pid": record["pid"],
+            "tid": record["thread_id"],
+            "args": dict(record["attrs"], status=record["status"])
+        })
+    with open(chrome_path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+    print(f"[Tracing] 已导出 {len(records)} 个 span: {jsonl_path} / {chrome_path}")
+    return jsonl_path, chrome_path
+
+
+# ===================================================================
+# 摘要 (Summary)
+# ===================================================================
+
+def _critical_chain(spans: list) -> list:
+    """
+    在同一层的兄弟 span 中找出决定结束时间的链:
+    从最晚结束的开始，向前找在它开始之前结束的最晚 span，依此类推。
+    (串行阶段全部在链上；并行的线程池任务只保留最后完成的那个)
+    """
+    chain = []
+    cutoff = float("inf")
+    for record in sorted(spans, key=lambda r: r["end"], reverse=True):
+        if record["end"] <= cutoff:
+            chain.append(record)
+            cutoff = record["start"]
+    chain.reverse()
+    return chain
+
+
+def _critical_path(records: list) -> list:
+    """
+    关键路径: [(深度, span), ...]
+    逐层取关键链，再递归展开链上每个 span 的子阶段。
+    沿这条路径优化才能真正缩短总耗时。
+    """
+    children = {}
+    roots = []
+    for record in records:
+        if record["parent_id"] is None:
+            roots.append(record)
+        else:
+            children.setdefault(record["parent_id"], []).append(record)
+
+    path = []
+
+    def _walk(spans, depth):
+        for record in _critical_chain(spans):
+            path.append((depth, record))
+            kids = children.get(record["span_id"])
+            if kids:
+                _walk(kids, depth + 1)
+
+    _walk(roots, 0)
+    return path
+
+
+def summarize_trace(top_n: int = 5) -> dict:
+    """
+    生成并打印运行摘要:
+      - 各阶段累计耗时
+      - 关键路径
+      - 最慢的资产
+      - Token / 字节总量
+    """
+    records = get_trace_records()
+    stage_totals = {}
+    totals = {"tokens": 0, "bytes_sent": 0, "bytes_received": 0}
+    for record in records:
+        entry = stage_totals.setdefault(record["name"], {"count": 0, "total_s": 0.0, "max_s": 0.0})
+        entry["count"] += 1
+        entry["total_s"] += record["duration_s"]
+        entry["max_s"] = max(entry["max_s"], record["duration_s"])
+        # 只在叶子调用上记录字节/Token，直接累加不会重复
+        for key in totals:
+            totals[key] += record["attrs"].get(key, 0) or 0
+
+    critical_path = [
+        {"depth": depth, "name": r["name"], "duration_s": r["duration_s"],
+         **{k: r["attrs"][k] for k in ("asset_id", "attempt") if k in r["attrs"]}}
+        for depth, r in _critical_path(records)
+    ]
+
+    asset_spans = [r for r in records if r["name"] == "asset" and "asset_id" in r["attrs"]]
+    slowest_assets = [
+        {"asset_id": r["attrs"]["asset_id"], "kind": r["attrs"].get("kind"), "duration_s": r["duration_s"]}
+        for r in sorted(asset_spans, key=lambda r: r["duration_s"], reverse=True)[:top_n]
+    ]
+
+    summary = {
+        "span_count": len(records),
+        "stages": stage_totals,
+        "critical_path": critical_path,
+        "slowest_assets": slowest_assets,
+        "totals": totals
+    }
+
+    print("\n========== [Tracing] 运行摘要 ==========")
+    print(" 关键路径:")
+    for step in critical_path:
+        label = step.get("asset_id", "")
+        if "attempt" in step:
+            label += f" #{step['attempt']}"
+        print(f"   {'  ' * step['depth']}└─ {step['name']} {label} ({step['duration_s']:.2f}s)")
+    if slowest_assets:
+        print(f" 最慢的 {len(slowest_assets)} 个资产:")
+        for item in slowest_assets:
+            print(f"   - {item['asset_id']} [{item['kind']}]: {item['duration_s']:.2f}s")
+    print(f" Token: {totals['tokens']}, 发送: {totals['bytes_sent']} B, 接收: {totals['bytes_received']} B")
+    print("=========================================")
+    return summary
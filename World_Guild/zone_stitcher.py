@@ -0,0 +1,462 @@
+# 文件名: zone_stitcher.py
+import copy
+from typing import List, Dict, Any, Optional
+
+# ===================================================================
+# 分区生成与拼接 (Hierarchical Zones & Stitching)
+# ===================================================================
+# 大型世界 (例如 200x200 的城镇) 不再由一次 Manager 调用生成:
+#   1. 区域图 (zone map): 每个区域有 zone_id / rect [x, y, w, h] / theme / 门;
+#   2. 每个区域使用局部坐标独立生成、独立验证 (可并行);
+#   3. 本模块把各区域平移到全局坐标并拼接，处理共享墙壁与门洞 (接缝检查)。
+#
+# 区域图格式:
+# {
+#   "metadata": {"scene_name": ..., "grid_size": [W, H], "description": ..., "style_prompt": ...},
+#   "zones": [{"zone_id": "plaza", "rect": [x, y, w, h], "theme": ..., "description": ...}, ...],
+#   "doors": [{"between": ["plaza", "tavern"], "position": [x, y]}, ...]
+# }
+
+# 没有区域图时，按此尺寸把世界切成网格区域
+ZONE_TARGET_SIZE = 40
+# 区域的最小边长 (太小的区域放不下墙壁和家具)
+MIN_ZONE_SIZE = 8
+# 接缝上门洞的宽度 (瓦片)
+DOOR_GAP_WIDTH = 2
+
+
+def _rect_contains(outer: list, inner: list) -> bool:
+    ox, oy, ow, oh = outer
+    ix, iy, iw, ih = inner
+    return ox <= ix and oy <= iy and ix + iw <= ox + ow and iy + ih <= oy + oh
+
+
+def _cell_in_rect(cell: tuple, rect: list) -> bool:
+    return rect[0] <= cell[0] < rect[0] + rect[2] and rect[1] <= cell[1] < rect[1] + rect[3]
+
+
+def _rects_overlap(a: list, b: list) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+# ===================================================================
+# 1. 区域图 (Zone Map)
+# ===================================================================
+
+def build_fallback_zone_map(grid_size: list, scene_name: str = "Generated World", description: str = "") -> dict:
+    """
+    (备用) 把世界按 ZONE_TARGET_SIZE 切成网格区域，相邻区域之间各开一扇门。
+    """
+    width, height = grid_size
+    cols = max(1, round(width / ZONE_TARGET_SIZE))
+    rows = max(1, round(height / ZONE_TARGET_SIZE))
+    xs = [width * i // cols for i in range(cols + 1)]
+    ys = [height * j // rows for j in range(rows + 1)]
+
+    zones = []
+    doors = []
+    for j in range(rows):
+        for i in range(cols):
+            zone_id = f"zone_{i}_{j}"
+            rect = [xs[i], ys[j], xs[i + 1] - xs[i], ys[j + 1] - ys[j]]
+            zones.append({"zone_id": zone_id, "rect": rect, "theme": "", "description": ""})
+            if i > 0:
+                doors.append({"between": [f"zone_{i - 1}_{j}", zone_id], "position": [xs[i], rect[1] + rect[3] // 2]})
+            if j > 0:
+                doors.append({"between": [f"zone_{i}_{j - 1}", zone_id], "position": [rect[0] + rect[2] // 2, ys[j]]})
+
+    return {
+        "metadata": {"scene_name": scene_name, "grid_size": [width, height], "description": description},
+        "zones": zones,
+        "doors": doors
+    }
+
+
+def validate_zone_map(zone_map: dict) -> List[str]:
+    """
+    检查区域图: 区域在世界范围内、互不重叠、尺寸足够、ID 唯一。
+    :return: 错误列表 (空列表表示通过)
+    """
+    errors = []
+    if not isinstance(zone_map, dict):
+        return ["区域图不是一个字典 (dict)。"]
+    grid_size = zone_map.get("metadata", {}).get("grid_size")
+    if not (isinstance(grid_size, list) and len(grid_size) == 2):
+        return ["区域图缺少 metadata.grid_size。"]
+    world_rect = [0, 0, grid_size[0], grid_size[1]]
+
+    zones = zone_map.get("zones")
+    if not isinstance(zones, list) or not zones:
+        return ["区域图缺少 zones 列表。"]
+
+    seen_ids = set()
+    for zone in zones:
+        zone_id = zone.get("zone_id")
+        rect = zone.get("rect")
+        if not zone_id or zone_id in seen_ids:
+            errors.append(f"区域 ID 缺失或重复: {zone_id}")
+        seen_ids.add(zone_id)
+        if not (isinstance(rect, list) and len(rect) == 4 and all(isinstance(v, int) for v in rect)):
+            errors.append(f"区域 '{zone_id}' 的 rect 必须是 4 个整数: {rect}")
+            continue
+        if rect[2] < MIN_ZONE_SIZE or rect[3] < MIN_ZONE_SIZE:
+            errors.append(f"区域 '{zone_id}' 太小 ({rect[2]}x{rect[3]})，最小 {MIN_ZONE_SIZE}x{MIN_ZONE_SIZE}。")
+        if not _rect_contains(world_rect, rect):
+            errors.append(f"区域 '{zone_id}' 超出世界范围 {grid_size}: {rect}")
+
+    valid = [z for z in zones if isinstance(z.get("rect"), list) and len(z["rect"]) == 4]
+    for i in range(len(valid)):
+        for j in range(i + 1, len(valid)):
+            if _rects_overlap(valid[i]["rect"], valid[j]["rect"]):
+                errors.append(f"区域 '{valid[i]['zone_id']}' 与 '{valid[j]['zone_id']}' 重叠。")
+    return errors
+
+
+# ===================================================================
+# 2. 接缝与门 (Seams & Doors)
+# ===================================================================
+
+def _find_seam(rect_a: list, rect_b: list) -> Optional[dict]:
+    """
+    找出两个区域的共享边。
+    :return: {"axis": "x"|"y", "line": 边界坐标, "start", "end"} 或 None
+             axis="x" 表示竖直接缝 (x = line)，沿 y 方向从 start 到 end。
+    """
+    ax, ay, aw, ah = rect_a
+    bx, by, bw, bh = rect_b
+    if ax + aw == bx or bx + bw == ax:
+        start, end = max(ay, by), min(ay + ah, by + bh)
+        if end - start >= DOOR_GAP_WIDTH:
+            return {"axis": "x", "line": bx if ax + aw == bx else ax, "start": start, "end": end}
+    if ay + ah == by or by + bh == ay:
+        start, end = max(ax, bx), min(ax + aw, bx + bw)
+        if end - start >= DOOR_GAP_WIDTH:
+            return {"axis": "y", "line": by if ay + ah == by else ay, "start": start, "end": end}
+    return None
+
+
+def resolve_doors(zone_map: dict) -> List[dict]:
+    """
+    把区域图中的门投影到共享边上，计算需要在接缝两侧挖空的墙格。
+    :return: [{"between": [a, b], "seam": {...}, "cells": {(x, y), ...}}, ...]
+             无法落在共享边上的门会被丢弃 (并打印警告)。
+    """
+    rects = {z["zone_id"]: z["rect"] for z in zone_map.get("zones", [])}
+    resolved = []
+    for door in zone_map.get("doors", []):
+        between = door.get("between", [])
+        if len(between) != 2 or between[0] not in rects or between[1] not in rects:
+            print(f"  - [Zone Stitcher] 警告: 门 {door} 引用了不存在的区域，已忽略。")
+            continue
+        seam = _find_seam(rects[between[0]], rects[between[1]])
+        if seam is None:
+            print(f"  - [Zone Stitcher] 警告: 区域 {between} 不相邻，门已忽略。")
+            continue
+
+        position = door.get("position") or [0, 0]
+        along = position[1] if seam["axis"] == "x" else position[0]
+        # 门洞整体落在共享边范围内
+        along = min(max(int(along), seam["start"]), seam["end"] - DOOR_GAP_WIDTH)
+
+        cells = set()
+        for k in range(DOOR_GAP_WIDTH):
+            # 接缝两侧各一格 (两个区域的边界墙可能都在)
+            if seam["axis"] == "x":
+                cells.add((seam["line"] - 1, along + k))
+                cells.add((seam["line"], along + k))
+            else:
+                cells.add((along + k, seam["line"] - 1))
+                cells.add((along + k, seam["line"]))
+        resolved.append({"between": list(between), "seam": seam, "cells": cells})
+    return resolved
+
+
+def _local_door_cells(zone: dict, resolved_doors: List[dict]) -> List[list]:
+    """ 某区域需要留空的门洞格子 (局部坐标) """
+    zx, zy = zone["rect"][0], zone["rect"][1]
+    cells = set()
+    for door in resolved_doors:
+        if zone["zone_id"] not in door["between"]:
+            continue
+        for x, y in door["cells"]:
+            if _cell_in_rect((x, y), zone["rect"]):
+                cells.add((x - zx, y - zy))
+    return [list(c) for c in sorted(cells)]
+
+
+def build_zone_task_prompt(zone: dict, zone_map: dict, resolved_doors: List[dict], world_prompt: str) -> str:
+    """
+    为单个区域构建 Manager 任务: 局部坐标、区域尺寸、必须留空的门洞位置。
+    """
+    zx, zy, zw, zh = zone["rect"]
+    door_cells = _local_door_cells(zone, resolved_doors)
+    metadata = zone_map.get("metadata", {})
+    neighbours = sorted({z for d in resolved_doors if zone["zone_id"] in d["between"] for z in d["between"]} - {zone["zone_id"]})
+
+    door_text = (
+        f"在 wall_layer 中，以下边界格子 (局部坐标 [x, y]) **必须留空**，它们是通往相邻区域 {neighbours} 的门洞，"
+        f"门洞内侧 2 格内不要放置物体: {door_cells}"
+        if door_cells else "该区域没有通往相邻区域的门洞。"
+    )
+    return (
+        f"【整体世界】: {world_prompt}\n"
+        f"【世界风格】: {metadata.get('style_prompt', '')}\n\n"
+        f"【你的任务】: 只设计整个世界中的一个区域 '{zone['zone_id']}'。\n"
+        f"- 区域主题: {zone.get('theme', '')}\n"
+        f"- 区域描述: {zone.get('description', '')}\n"
+        f"- 区域尺寸: grid_size 必须是 [{zw}, {zh}]，使用局部坐标 (左上角为 [0, 0])。\n"
+        f"- 所有地板、墙壁、物体和 NPC **必须**完全位于 [0, 0, {zw}, {zh}] 之内。\n"
+        f"- {door_text}\n"
+        f"- 资产 ID 请使用有区分度的名字 (例如 'table_{zone['zone_id']}_oak')，不同区域的资产会被合并。"
+    )
+
+
+# ===================================================================
+# 3. 区域内检查 (Local Checks)
+# ===================================================================
+
+def check_zone_bounds(plan: dict, zone_size: list) -> List[str]:
+    """
+    检查区域规划是否越出区域范围 (局部坐标)。
+    可作为 _run_manager_with_validation 的额外检查项。
+    """
+    errors = []
+    width, height = zone_size
+    zone_rect = [0, 0, width, height]
+    assets = plan.get("assets", {}) if isinstance(plan, dict) else {}
+    layout = plan.get("layout", {}) if isinstance(plan, dict) else {}
+
+    for layer in ("floor_layer", "wall_layer"):
+        for entry in layout.get(layer, []):
+            area = entry.get("area") if isinstance(entry, dict) else None
+            if isinstance(area, list) and len(area) == 4 and not _rect_contains(zone_rect, area):
+                errors.append(f"越界错误: {layer} 中 '{entry.get('asset_id')}' 的区域 {area} 超出区域范围 [0, 0, {width}, {height}]。")
+
+    for layer in ("object_layer", "npc_layer"):
+        for entry in layout.get(layer, []):
+            position = entry.get("position") if isinstance(entry, dict) else None
+            if not (isinstance(position, list) and len(position) == 2):
+                continue
+            base_w, base_h = (assets.get(entry.get("asset_id"), {}) or {}).get("base_size", [1, 1])
+            x, y = position
+            # position 为底边中点
+            if x - base_w / 2 < 0 or x + base_w / 2 > width or y - base_h < 0 or y > height:
+                errors.append(f"越界错误: '{entry.get('asset_id')}' (位置 {position}) 超出区域范围 [{width}, {height}]。")
+
+    if len(errors) > 5:
+        return errors[:5] + [f"... (以及另外 {len(errors) - 5} 个越界错误)"]
+    return errors
+
+
+# ===================================================================
+# 4. 拼接 (Stitching)
+# ===================================================================
+
+def _area_cells(area: list) -> set:
+    x, y, w, h = area
+    return {(cx, cy) for cx in range(x, x + w) for cy in range(y, y + h)}
+
+
+def _cells_to_areas(cells: set) -> List[list]:
+    """ 把格子集合重新分解为矩形: 先按行合并连续格子，再把相同跨度的相邻行合并 """
+    runs = {}
+    for y in sorted({c[1] for c in cells}):
+        xs = sorted(c[0] for c in cells if c[1] == y)
+        start = prev = xs[0]
+        for x in xs[1:] + [None]:
+            if x is not None and x == prev + 1:
+                prev = x
+                continue
+            runs.setdefault((start, prev - start + 1), []).append(y)
+            if x is not None:
+                start = prev = x
+
+    areas = []
+    for (x, w), ys in runs.items():
+        top = last = ys[0]
+        for y in ys[1:] + [None]:
+            if y is not None and y == last + 1:
+                last = y
+                continue
+            areas.append([x, top, w, last - top + 1])
+            if y is not None:
+                top = last = y
+    return sorted(areas, key=lambda a: (a[1], a[0]))
+
+
+def _namespace_zone_assets(zone_plans: Dict[str, dict]) -> Dict[str, Dict[str, str]]:
+    """
+    资产 ID 冲突处理: 多个区域使用同一 ID 且定义相同 -> 共享；定义不同 -> 加区域后缀。
+    (后缀而不是前缀: Artist 用 'wall_' / 'floor_' 前缀识别程序化贴图)
+    :return: { zone_id: { 原始 asset_id: 全局 asset_id } }
+    """
+    definitions = {}
+    for zone_id, plan in zone_plans.items():
+        for asset_id, details in plan.get("assets", {}).items():
+            key = (details, plan.get("properties", {}).get(asset_id))
+            definitions.setdefault(asset_id, []).append((zone_id, key))
+
+    renames = {zone_id: {} for zone_id in zone_plans}
+    for asset_id, uses in definitions.items():
+        first_key = uses[0][1]
+        conflict = any(key != first_key for _, key in uses[1:])
+        for zone_id, _ in uses:
+            renames[zone_id][asset_id] = f"{asset_id}__{zone_id}" if conflict else asset_id
+    return renames
+
+
+def stitch_zone_plans(zone_map: dict, zone_plans: Dict[str, dict]) -> tuple:
+    """
+    把各区域 (局部坐标) 的规划拼接成一个全局规划，并执行接缝检查:
+      - 所有坐标平移到区域原点；资产 ID 冲突时加区域后缀；
+      - 共享边上两侧都有墙时，去掉后一个区域的那一列/行 (避免双层墙)；
+      - 在门的位置挖开两侧墙壁；
+      - 报告被物体堵住的门洞、没有墙也没有门的接缝等问题。
+
+    :param zone_plans: { zone_id: 局部规划 } (生成失败的区域可以缺失)
+    :return: (全局规划, 接缝报告列表)
+    """
+    metadata = copy.deepcopy(zone_map.get("metadata", {}))
+    zones = [z for z in zone_map.get("zones", []) if z["zone_id"] in zone_plans]
+    renames = _namespace_zone_assets(zone_plans)
+    resolved_doors = resolve_doors(zone_map)
+    seam_report = []
+
+    stitched = {
+        "metadata": metadata,
+        "assets": {},
+        "layout": {"floor_layer": [], "wall_layer": [], "object_layer": [], "npc_layer": []},
+        "properties": {}
+    }
+    metadata["zones"] = [
+        {"zone_id": z["zone_id"], "rect": z["rect"], "theme": z.get("theme", "")} for z in zone_map.get("zones", [])
+    ]
+
+    # --- A. 平移 & 重命名 ---
+    wall_entries = []   # (zone_id, entry)
+    used_soul_files = {}
+    for zone in zones:
+        zone_id = zone["zone_id"]
+        zx, zy = zone["rect"][0], zone["rect"][1]
+        plan = zone_plans[zone_id]
+        rename = renames[zone_id]
+
+        for asset_id, details in plan.get("assets", {}).items():
+            stitched["assets"][rename[asset_id]] = copy.deepcopy(details)
+        for asset_id, props in plan.get("properties", {}).items():
+            props = copy.deepcopy(props)
+            # 不同角色使用了同名灵魂文件 -> 加区域前缀
+            soul_file = props.get("soul_file") if isinstance(props, dict) else None
+            if soul_file:
+                owner = used_soul_files.setdefault(soul_file, rename.get(asset_id, asset_id))
+                if owner != rename.get(asset_id, asset_id):
+                    props["soul_file"] = f"{zone_id}_{soul_file}"
+            stitched["properties"][rename.get(asset_id, asset_id)] = props
+
+        for layer, entries in plan.get("layout", {}).items():
+            if not isinstance(entries, list):
+                continue
+            for entry in entries:
+                entry = copy.deepcopy(entry)
+                entry["asset_id"] = rename.get(entry.get("asset_id"), entry.get("asset_id"))
+                if isinstance(entry.get("area"), list) and len(entry["area"]) == 4:
+                    entry["area"][0] += zx
+                    entry["area"][1] += zy
+                if isinstance(entry.get("position"), list) and len(entry["position"]) == 2:
+                    entry["position"][0] += zx
+                    entry["position"][1] += zy
+                if layer == "wall_layer" and entry.get("command") == "fill_rect":
+                    wall_entries.append((zone_id, entry))
+                else:
+                    stitched["layout"].setdefault(layer, []).append(entry)
+
+    # --- B. 接缝: 去重双层墙 & 挖门洞 ---
+    wall_cells_by_zone = {}
+    for zone_id, entry in wall_entries:
+        wall_cells_by_zone.setdefault(zone_id, set()).update(_area_cells(entry["area"]))
+
+    removed = set()  # (zone_id, cell)
+    rects = {z["zone_id"]: z["rect"] for z in zones}
+    zone_ids = [z["zone_id"] for z in zones]
+    for i in range(len(zone_ids)):
+        for j in range(i + 1, len(zone_ids)):
+            a, b = zone_ids[i], zone_ids[j]
+            seam = _find_seam(rects[a], rects[b])
+            if seam is None:
+                continue
+            # 接缝线两侧的格子: line-1 属于一侧，line 属于另一侧
+            if seam["axis"] == "x":
+                pairs = [((seam["line"] - 1, t), (seam["line"], t)) for t in range(seam["start"], seam["end"])]
+            else:
+                pairs = [((t, seam["line"] - 1), (t, seam["line"])) for t in range(seam["start"], seam["end"])]
+            a_cells = wall_cells_by_zone.get(a, set())
+            b_cells = wall_cells_by_zone.get(b, set())
+            duplicates = 0
+            open_cells = 0
+            for cell_1, cell_2 in pairs:
+                a_side, b_side = (cell_1, cell_2) if _cell_in_rect(cell_1, rects[a]) else (cell_2, cell_1)
+                if a_side in a_cells and b_side in b_cells:
+                    removed.add((b, b_side))
+                    duplicates += 1
+                elif a_side not in a_cells and b_side not in b_cells:
+                    open_cells += 1
+
+            has_door = any(set(d["between"]) == {a, b} for d in resolved_doors)
+            seam_report.append({
+                "between": [a, b],
+                "axis": seam["axis"],
+                "line": seam["line"],
+                "length": seam["end"] - seam["start"],
+                "duplicate_wall_cells_removed": duplicates,
+                "open_cells": open_cells,
+                "has_door": has_door
+            })
+            if not has_door and open_cells == 0:
+                print(f"  - [Zone Stitcher] 提示: 区域 {a} 与 {b} 之间是实心墙，没有门。")
+
+    for door in resolved_doors:
+        for zone_id in door["between"]:
+            for cell in door["cells"]:
+                if cell in wall_cells_by_zone.get(zone_id, set()):
+                    removed.add((zone_id, cell))
+
+    for zone_id, entry in wall_entries:
+        cells = _area_cells(entry["area"])
+        to_remove = {cell for cell in cells if (zone_id, cell) in removed}
+        if not to_remove:
+            stitched["layout"]["wall_layer"].append(entry)
+            continue
+        remaining = cells - to_remove
+        if remaining:
+            for area in _cells_to_areas(remaining):
+                stitched["layout"]["wall_layer"].append(dict(entry, area=area))
+
+    # --- C. 门洞是否被物体堵住 ---
+    for door in resolved_doors:
+        blocked_by = []
+        for entry in stitched["layout"].get("object_layer", []):
+            position = entry.get("position")
+            details = stitched["assets"].get(entry.get("asset_id"), {})
+            if not (isinstance(position, list) and len(position) == 2):
+                continue
+            if stitched["properties"].get(entry.get("asset_id"), {}).get("physics") == "passable":
+                continue
+            base_w, base_h = details.get("base_size", [1, 1])
+            x_min, x_max = position[0] - base_w / 2, position[0] + base_w / 2
+            y_min, y_max = position[1] - base_h, position[1]
+            if any(x_min < cx + 1 and cx < x_max and y_min < cy + 1 and cy < y_max for cx, cy in door["cells"]):
+                blocked_by.append(entry.get("asset_id"))
+        if blocked_by:
+            message = f"门洞 {door['between']} 被物体堵住: {blocked_by}"
+            print(f"  - [Zone Stitcher] 警告: {message}")
+            for item in seam_report:
+                if set(item["between"]) == set(door["between"]):
+                    item.setdefault("blocked_doors", []).append(blocked_by)
+
+    missing = [z["zone_id"] for z in zone_map.get("zones", []) if z["zone_id"] not in zone_plans]
+    if missing:
+        print(f"  - [Zone Stitcher] 警告: 以下区域生成失败，已留空: {missing}")
+
+    print(f"[Zone Stitcher] 拼接完成: {len(zones)} 个区域, {len(stitched['assets'])} 个资产, "
+          f"{len(resolved_doors)} 个门洞, {len(removed)} 个墙格被移除。")
+    return stitched, seam_report
@@ -2,15 +2,17 @@ extends Node
 
 enum RunMode {
 	LISTEN_FOR_PYTHON,  # 模式1: (开发) 等待 Python 连接并发送指令
-	LOAD_FROM_FILE      # 模式2: (游玩) 启动时直接加载本地 JSON 文件
+	LOAD_FROM_FILE      # 模式2: (游玩) 启动时直接加载本地场景文件 (.wgscene 或 .json)
 }
 @export var run_mode: RunMode = RunMode.LISTEN_FOR_PYTHON
-@export_file("*.json") var file_to_load: String = "res://saved_levels/my_first_level.json"
+@export_file("*.wgscene", "*.json") var file_to_load: String = "res://saved_levels/my_first_level.wgscene"
 
 # --- 网络设置 (无变化) ---
 const PORT = 8080
 var server = TCPServer.new()
 var peer = null
+# 指令以换行结尾 (godot_client 总会追加 "\n")；大场景会分多帧到达，先缓冲到完整一行再解析
+var _rx_buffer: PackedByteArray = PackedByteArray()
 
 # --- 节点引用 (将在 Godot 编辑器中设置) ---
 @onready var floor_layer: TileMapLayer = $NavigationRegion2D/FloorLayer
@@ -27,6 +29,37 @@ const TILE_SIZE = Vector2i(16, 16) # 瓦片大小
 const NPC_SCENE_PATH = "res://scenes/npc.tscn"
 const AGENT_SCENE_PATH = "res://scenes/agent.tscn" # 智能体模板
 
+# --- 二进制场景容器 (与 World_Guild/scene_format.py 一致) ---
+const SCENE_MAGIC = "WGSC"
+const SCENE_FORMAT_VERSION = 2
+const SCENE_NO_ASSET = 0xFFFF
+const SCENE_GEOMETRY_KEYS = {"area": ["area", 4], "position": ["position", 2]}
+
+# --- 贴图缓存 (跨多次构建保留) ---
+# 键为贴图清单中的内容哈希 (没有清单时为 "路径@修改时间")，每张唯一贴图只解码一次
+var _texture_cache: Dictionary = {}
+var _texture_manifest: Dictionary = {} # { asset_id: {"file", "hash", "size", "region", "uses"} }
+var _texture_stats = {"decoded": 0, "cached": 0}
+var _map_dims: Vector2i = Vector2i(80, 80) # 最近一次构建的地图尺寸 (截图用)
+
+# --- 构建剖析 (每次构建重置；指令带 "reply": true 时回传给 Python) ---
+# {"steps": {步骤: 毫秒}, "counts": {步骤: 新增节点数}, "cells", "wall_tiles", "tile_sources",
+#  "textures": {"decoded", "cached"}, "bake_ms", "total_ms", "grid_size"}
+var _last_build_profile: Dictionary = {}
+
+# 墙壁高度表 (挂件附着判定用)，每次构建重置
+# 格式: { Vector2i(x, y): float_height_in_pixels }
+var grid_wall_height_map: Dictionary = {}
+
+# --- 分块流式构建 (见 "分块流式构建" 一节) ---
+const STREAM_FRAME_BUDGET_USEC = 4000 # 每帧最多花在构建任务上的时间 (微秒)
+signal stream_finished(profile: Dictionary)
+var _stream: Dictionary = {} # 进行中的流式构建；空表示没有
+var _stream_jobs: Array = [] # 待执行的任务 (Callable)
+var _stream_next_job: int = 0
+var _stream_serial: int = 0
+var _nav_chunk_regions: Array = [] # 每块一个 NavigationRegion2D
+
 	
 func _ready():
 	if run_mode == RunMode.LISTEN_FOR_PYTHON:
@@ -34,7 +67,10 @@ func _ready():
 		start_network_server() # 启动服务器
 	elif run_mode == RunMode.LOAD_FROM_FILE:
 		print("【运行模式】: 从文件加载...")
-		load_scene_from_json_file(file_to_load) # 直接加载文件
+		if file_to_load.get_extension() == "wgscene":
+			load_scene_from_binary_file(file_to_load) # 二进制容器
+		else:
+			load_scene_from_json_file(file_to_load) # 直接加载文件
 	
 func _process(_delta):
 	# 1. 只有在“监听”模式下才检查网络
@@ -43,19 +79,28 @@ func _process(_delta):
 			if peer != null:
 				peer.disconnect_from_host()
 			peer = server.take_connection()
+			_rx_buffer = PackedByteArray()
 			print("Python 客户端已连接！")
 			
 		if peer != null and peer.get_status() == StreamPeerTCP.STATUS_CONNECTED:
 			var available_bytes = peer.get_available_bytes()
 			if available_bytes > 0:
-				var data = peer.get_data(available_bytes)
-				var json_string = data[1].get_string_from_utf8()
-				handle_command(json_string)
+				_rx_buffer.append_array(peer.get_data(available_bytes)[1])
+				var newline = _rx_buffer.find(10)
+				while newline != -1:
+					var json_string = _rx_buffer.slice(0, newline).get_string_from_utf8()
+					_rx_buffer = _rx_buffer.slice(newline + 1)
+					handle_command(json_string, peer)
+					newline = _rx_buffer.find(10)
 		elif peer != null and peer.get_status() == StreamPeerTCP.STATUS_NONE:
 			print("Python 客户端已断开连接。")
 			peer = null
 	
-	# 2. 无论在哪种模式下，时钟 UI 都必须更新
+	# 2. 分块流式构建: 每帧只执行预算内的任务
+	if not _stream.is_empty():
+		_pump_stream()
+
+	# 3. 无论在哪种模式下，时钟 UI 都必须更新
 	time_display_label.text = WorldClock.get_current_time_string()
 	
 	
@@ -88,8 +133,83 @@ func load_scene_from_json_file(file_path: String):
 	call_deferred("build_scene_procedurally", scene_data)
 
 
-func handle_command(json_string: String):
-	print("收到指令: ", json_string)
+# 读取 .wgscene: 头部 JSON 很小，摆放数据按列直接转成 PackedInt32Array，不再解析整份 JSON。
+# region 非空时只加载与该矩形 (瓦片坐标) 相交的块。
+func load_scene_from_binary_file(file_path: String, region: Rect2i = Rect2i()):
+	var bytes = FileAccess.get_file_as_bytes(file_path)
+	if bytes.size() < 24 or bytes.slice(0, 4).get_string_from_ascii() != SCENE_MAGIC:
+		printerr("加载错误: 不是有效的 .wgscene 文件 %s" % file_path)
+		return
+	if bytes.decode_u16(4) > SCENE_FORMAT_VERSION:
+		printerr("加载错误: 不支持的 .wgscene 版本 %d" % bytes.decode_u16(4))
+		return
+
+	var header_offset = bytes.decode_u64(8)
+	var header = JSON.parse_string(bytes.slice(header_offset, header_offset + bytes.decode_u64(16)).get_string_from_utf8())
+	if header == null:
+		printerr("加载错误: 解析 .wgscene 头部失败 %s" % file_path)
+		return
+
+	var scene_data: Dictionary = header["plan"]
+	var layout = {}
+	for layer_name in header["layout_order"]:
+		if header["layers"].has(layer_name):
+			layout[layer_name] = _read_binary_layer(bytes, header, header["layers"][layer_name], region)
+		else:
+			layout[layer_name] = header["raw_layout"].get(layer_name)
+	scene_data["layout"] = layout
+	call_deferred("build_scene_procedurally", scene_data)
+
+
+func _read_binary_layer(bytes: PackedByteArray, header: Dictionary, layer: Dictionary, region: Rect2i) -> Array:
+	var key = SCENE_GEOMETRY_KEYS[layer["geometry"]][0]
+	var size: int = SCENE_GEOMETRY_KEYS[layer["geometry"]][1]
+	# 逐列类型 (版本 1 的文件整层只有一个 dtype)
+	var dtypes: Array = layer.get("dtypes", [])
+	if dtypes.is_empty():
+		for c in size:
+			dtypes.append(layer["dtype"])
+	var strings: Array = header["strings"]
+	var common: Dictionary = layer.get("common", {})
+	var extras: Dictionary = layer.get("extras", {})
+
+	var entries = []
+	entries.resize(int(layer["count"]))
+	for chunk in layer["chunks"]:
+		var bbox = chunk["bbox"]
+		var chunk_rect = Rect2i(int(bbox[0]), int(bbox[1]), int(bbox[2] - bbox[0]), int(bbox[3] - bbox[1]))
+		if region.has_area() and not region.intersects(chunk_rect):
+			continue
+		var n = int(chunk["count"])
+		var offset = int(chunk["offset"])
+		var indices = bytes.slice(offset, offset + 4 * n).to_int32_array()
+		offset += 4 * n
+		var columns = []
+		for c in size:
+			var item_size = 4 if dtypes[c] == "i4" else 8
+			var column_bytes = bytes.slice(offset, offset + item_size * n)
+			columns.append(column_bytes.to_int32_array() if item_size == 4 else column_bytes.to_float64_array())
+			offset += item_size * n
+		for j in n:
+			var entry = {}
+			var asset_index = bytes.decode_u16(offset + 2 * j)
+			if asset_index != SCENE_NO_ASSET:
+				entry["asset_id"] = strings[asset_index]
+			var coords = []
+			for c in size:
+				coords.append(columns[c][j])
+			entry[key] = coords
+			entry.merge(common)
+			entry.merge(extras.get(str(indices[j]), {}))
+			entries[indices[j]] = entry
+	# 部分加载时去掉未加载的空位 (保持原顺序)
+	return entries.filter(func(e): return e != null)
+
+
+# reply_peer: 发出指令的连接。指令带 "reply": true 时，处理完后回写一行 JSON
+# ({"action", "status": "ok"/"error", "profile" 或 "error"})
+func handle_command(json_string: String, reply_peer = null):
+	print("收到指令 (部分): ", json_string.left(200))
 	var result = JSON.parse_string(json_string)
 	if result == null:
 		printerr("错误: 解析 JSON 失败")
@@ -97,14 +217,16 @@ func handle_command(json_string: String):
 		
 	var command = result as Dictionary
 	var action = command.get("action", "")
+	var reply = {"action": action, "status": "ok"}
 	
 	# --- 分支 1: 构建场景 ---
 	if action == "build_scene_from_json":
 		var scene_data = command.get("payload", null) as Dictionary
 		if scene_data:
-			build_scene_procedurally(scene_data)
+			reply["profile"] = await build_scene_procedurally(scene_data)
 		else:
 			printerr("错误: 'build_scene_from_json' 指令缺少 'payload' 数据")
+			reply = {"action": action, "status": "error", "error": "missing payload"}
 			
 	# --- 分支 2: 高清截图 (新增) ---
 	elif action == "take_screenshot":
@@ -112,262 +234,99 @@ func handle_command(json_string: String):
 		var path = payload.get("path", "user://screenshot_4k.png")
 		capture_hd_screenshot_without_moving_nodes(path)
 		
+	# --- 分支 3: 读取最近一次构建的剖析结果 ---
+	elif action == "get_build_profile":
+		reply["profile"] = _last_build_profile
+		
+	# --- 分支 4: 分块流式构建 (World_Guild/scene_chunker.py) ---
+	elif action == "begin_streamed_build":
+		_begin_streamed_build(command.get("payload", {}) as Dictionary)
+	elif action == "build_chunk":
+		_queue_chunk(command.get("payload", {}) as Dictionary)
+	elif action == "end_streamed_build":
+		if _stream.is_empty():
+			printerr("错误: 'end_streamed_build' 之前没有 'begin_streamed_build'")
+			reply = {"action": action, "status": "error", "error": "no streamed build"}
+		else:
+			_stream["ended"] = true
+			reply["profile"] = await stream_finished
+		
 	else:
 		printerr("错误: 未知的 action: %s" % action)
+		reply = {"action": action, "status": "error", "error": "unknown action"}
+
+	if command.get("reply", false):
+		_send_reply(reply_peer, reply)
+
+
+func _send_reply(reply_peer, reply: Dictionary):
+	if reply_peer == null or reply_peer.get_status() != StreamPeerTCP.STATUS_CONNECTED:
+		printerr("警告: 无法回传 '%s' 的结果 (连接已断开)" % reply.get("action", ""))
+		return
+	reply_peer.put_data((JSON.stringify(reply) + "\n").to_utf8_buffer())
+
+
+# 记录一个步骤的耗时 (毫秒) 与 world_y_sort 新增的节点数，返回下一步骤的起始时刻
+# (被 queue_free 的旧节点要到帧末才移除，因此同一帧内的子节点数差值就是本步骤新增的节点)
+func _profile_step(profile: Dictionary, step: String, started_usec: int, nodes_before: int) -> int:
+	var now = Time.get_ticks_usec()
+	profile["steps"][step] = (now - started_usec) / 1000.0
+	profile["counts"][step] = world_y_sort.get_child_count() - nodes_before
+	return now
 
 
-func build_scene_procedurally(data: Dictionary) -> void:
+func build_scene_procedurally(data: Dictionary) -> Dictionary:
 	
 	print("开始全自动场景构建...")
+	var build_started = Time.get_ticks_usec()
+	var profile = {"steps": {}, "counts": {}, "cells": 0, "wall_tiles": 0, "tile_sources": 0}
+	var step_started = build_started
 
-	floor_layer.z_index = -5
-	
-	for child in world_y_sort.get_children():
-		child.queue_free()
-		
-	floor_layer.navigation_enabled = false
-	
+	_cancel_streamed_build()
+	var map_dims = _prepare_world(data)
 	var assets = data.get("assets", {}) as Dictionary
 	var properties = data.get("properties", {}) as Dictionary
 	var layout = data.get("layout", {}) as Dictionary
-	
-	
 
-	var metadata = data.get("metadata", {}) as Dictionary
-	var grid_size_arr = metadata.get("grid_size", [25, 20]) # 从 JSON 读取
-	var map_dims = Vector2i(grid_size_arr[0], grid_size_arr[1])
+	var nodes_before = world_y_sort.get_child_count()
+	step_started = _profile_step(profile, "setup", step_started, nodes_before)
 
-	# 格式: { Vector2i(x, y): float_height_in_pixels }
-
-	
 	# 步骤 A: 动态创建 TileSet (你的代码, 原封不动)
 	print("  - 步骤 A: 动态创建 TileSet...")
-	var tile_set = TileSet.new()
-	tile_set.add_physics_layer()
-	tile_set.add_navigation_layer()
+	var tile_set = _new_tile_set()
 	var source_id_map = {}
-	var current_source_id = 0
 	for asset_id in assets:
-		var asset_details = assets[asset_id] as Dictionary
-		if asset_details.get("type") == "tile": # 只处理 "tile"
-			var asset_path = ASSET_DIR.path_join(asset_id + ".png")
-			if not FileAccess.file_exists(asset_path):
-				printerr("错误: 找不到资产文件 %s" % asset_path); continue
-			
-			var img = Image.new()
-			var err = img.load(asset_path)
-			if err != OK:
-				printerr("错误: 加载图像失败 %s (错误码: %s)" % [asset_path, err]); continue
-			
-			var tex = ImageTexture.create_from_image(img)
-			if tex == null:
-				printerr("错误: 从图像创建纹理失败 %s (图像可能已损坏或为空)" % asset_path)
-				continue # 跳过这个损坏的资产
-			var atlas_source = TileSetAtlasSource.new()
-			atlas_source.texture = tex
-			var atlas_coord = Vector2i.ZERO
-			# 从 JSON 读取 visual_size
-			var v_size_arr = asset_details.get("visual_size", [1, 1])
-			var v_size_vec = Vector2i(v_size_arr[0], v_size_arr[1])
-			atlas_source.create_tile(atlas_coord, v_size_vec)
-			tile_set.add_source(atlas_source, current_source_id)
-			
-			source_id_map[asset_id] = {
-				"source_id": current_source_id, 
-				"atlas_coord": atlas_coord,
-				"texture": tex,
-				"visual_size": v_size_vec
-			}
-			
-			var tile_data = atlas_source.get_tile_data(atlas_coord, 0)
-			#set_tile_properties(tile_data, properties.get(asset_id, {}) as Dictionary)
-			set_tile_properties(tile_data, properties.get(asset_id, {}) as Dictionary, v_size_vec)
-			current_source_id += 1
+		_add_tile_source(tile_set, source_id_map, asset_id, assets[asset_id] as Dictionary, properties)
 	floor_layer.tile_set = tile_set
-	print("  - TileSet 创建完毕，包含 %d 个瓦片源。" % current_source_id)
+	print("  - TileSet 创建完毕，包含 %d 个瓦片源。" % source_id_map.size())
+	profile["tile_sources"] = source_id_map.size()
+	step_started = _profile_step(profile, "A_tileset", step_started, nodes_before)
 	
 	
 	# 步骤 B: 绘制 TileMap 图层 (你的代码, 原封不动)
 	print("  - 步骤 B: 绘制瓦片图层 (仅地板)...") 
 	for cmd_item in layout.get("floor_layer", []):
-		var cmd = cmd_item as Dictionary
-		var map_info = source_id_map.get(cmd.get("asset_id"))
-		
-		if map_info and cmd.get("command") == "fill_rect":
-			var area_arr = cmd.get("area", [0, 0, 1, 1])
-			var rect = Rect2i(area_arr[0], area_arr[1], area_arr[2], area_arr[3])
-			var tile_visual_size = map_info.get("visual_size", Vector2i(1, 1))
-			var tile_w = max(1, tile_visual_size.x) # 步长至少为 1
-			var tile_h = max(1, tile_visual_size.y) # 步长至少为 1
- 			# 使用 2x2 (tile_w, tile_h) 的步长来循环
-			for x in range(rect.position.x, rect.end.x, tile_w):
-				for y in range(rect.position.y, rect.end.y, tile_h):
-					floor_layer.set_cell(Vector2i(x, y), map_info.source_id, map_info.atlas_coord)
+		profile["cells"] += _paint_floor(cmd_item as Dictionary, source_id_map)
+	step_started = _profile_step(profile, "B_floor", step_started, nodes_before)
 
 	print("  - 步骤 B.5: 实例化墙壁...")
+	nodes_before = world_y_sort.get_child_count()
 	for cmd_item in layout.get("wall_layer", []):
-		var cmd = cmd_item as Dictionary
-		var asset_id = cmd.get("asset_id")
-		
-		var map_info = source_id_map.get(asset_id)
-		if not map_info:
-			printerr("错误: 找不到墙壁 '%s' 的资产信息" % asset_id)
-			continue
-			
-		var tex = map_info.texture as Texture2D
-		if tex == null:
-			printerr("错误: 墙壁 '%s' 的纹理为空" % asset_id)
-			continue
+		profile["wall_tiles"] += _place_wall(cmd_item as Dictionary, source_id_map, properties, map_dims).size()
+	step_started = _profile_step(profile, "B5_walls", step_started, nodes_before)
 
-		# 2. 获取属性 (用于物理)
-		var props = properties.get(asset_id, {}) as Dictionary
-		
-		# 3. 解析指令
-		var command = cmd.get("command")
-		var area_arr = cmd.get("area", [0, 0, 1, 1])
-		var rect = Rect2i(area_arr[0], area_arr[1], area_arr[2], area_arr[3])
-		
-		if command == "fill_rect":
-			var wall_pixel_height = tex.get_height()
-			# 遍历这个矩形覆盖的所有格子
-			for wx in range(rect.position.x, rect.end.x):
-				for wy in range(rect.position.y, rect.end.y):
-					grid_wall_height_map[Vector2i(wx, wy)] = wall_pixel_height
-		
-		# 4. 调用新的 Sprite 填充函数
-		if command == "fill_rect":
-			#_fill_rect_with_sprites(wall_container, rect, tex, props)
-			#_fill_rect_with_sprites(world_y_sort, rect, tex, props)
-			_fill_rect_with_sprites(world_y_sort, rect, tex, props, map_dims)
-		elif command == "draw_rect_outline":
-			# (你也可以创建一个 _draw_rect_with_sprites 函数)
-			printerr("警告: 'draw_rect_outline' 尚未实现为 Sprites")
-		
 	print("  - 步骤 C: 实例化对象...")
+	nodes_before = world_y_sort.get_child_count()
 	for cmd_item in layout.get("object_layer", []):
-		var cmd = cmd_item as Dictionary
-		var asset_id = cmd.get("asset_id")
-		if assets.get(asset_id, {}).get("type") != "object": continue 
-		
-		var asset_path = ASSET_DIR.path_join(asset_id + ".png")
-		if not FileAccess.file_exists(asset_path):
-			printerr("错误: 找不到对象资产 %s" % asset_path); continue
-		
-		var img = Image.new()
-		var err = img.load(asset_path)
-		if err != OK:
-			printerr("错误: 加载图像失败 %s" % asset_path); continue
-			
-		var tex = ImageTexture.create_from_image(img)
-		var texture_size = tex.get_size() 
-		
-		var tile_pos = Vector2i(cmd.get("position")[0], cmd.get("position")[1])
-		var world_pos_center = floor_layer.map_to_local(tile_pos)
-		
-		var sprite = Sprite2D.new()
-		sprite.texture = tex
-		sprite.name = asset_id
-		sprite.centered = false
-		sprite.offset = Vector2(-texture_size.x / 2.0, -texture_size.y)
-		sprite.position = world_pos_center
-		
-		var props = properties.get(asset_id, {}) as Dictionary
-		var asset_details = assets.get(asset_id, {}) as Dictionary
-		var json_size_array = asset_details.get("base_size", null)
-		
-		var obstacle_base_size = texture_size 
-		var obj_base_h = 1 
-		
-		if json_size_array != null and json_size_array.size() == 2:
-			obstacle_base_size = Vector2(json_size_array[0], json_size_array[1]) * Vector2(TILE_SIZE)
-			obj_base_h = json_size_array[1]
-
-		# --- 智能墙面附着判定 ---
-		var is_hanging = false
-		var target_wall_h = 0.0
-		#var is_tolerance_snap = false 
-		
-		# 判定 1: 坐标重合
-		if tile_pos in grid_wall_height_map:
-			is_hanging = true
-			target_wall_h = grid_wall_height_map[tile_pos]
-			
-		## 判定 2: 邻接且单层厚度
-		#elif (tile_pos + Vector2i.UP) in grid_wall_height_map:
-			#if obj_base_h == 1: 
-				#is_hanging = true
-				#is_tolerance_snap = true 
-				#target_wall_h = grid_wall_height_map[tile_pos + Vector2i.UP]
-				#print("    > [吸附] 挂件 '%s' @ %s 吸附到上方墙壁" % [asset_id, tile_pos])
-
-		if is_hanging:
-			var obj_pixel_h = texture_size.y
-			
-			# 检查约束: 物体高度必须 <= 墙壁高度
-			if obj_pixel_h <= target_wall_h:
-				
-				# 1. 垂直提升算法: (墙高 - 物体高) / 2
-				# 结果: 物体将在墙面上垂直居中
-				var lift_amount = (target_wall_h - obj_pixel_h) / 2.0
-				sprite.position.y -= lift_amount
-				
-				## 2. 位置修正 (如果是从地板吸附上来的)
-				#if is_tolerance_snap:
-					#sprite.position.y -= TILE_SIZE.y 
-				
-				# 3. 提升层级
-				sprite.z_index = 1 
-				
-				print("    > [生效] 挂件 '%s' 垂直居中, 提升 %.1f px" % [asset_id, lift_amount])
-			else:
-				print("    > [跳过] 挂件 '%s' 高度 (%.1f) 超过墙高 (%.1f), 取消悬挂" % [asset_id, obj_pixel_h, target_wall_h])
-				
-				
-		# -----------------------------------------------------
-		var is_floor_decor = false
-		var phys = props.get("physics", "")
-		var nav = props.get("navigation", "")
-		var sem_tag = props.get("semantic_tag", "")
-		
-		# 规则：可穿过 + 可行走 + 不是门 = 地毯/污渍
-		if phys == "passable" and nav == "walkable":
-			is_floor_decor = true
-		
-		# 规则：或者明确标记为 rug/carpet
-		if "rug" in asset_id or "carpet" in asset_id or "rug" in sem_tag or "carpet" in sem_tag:
-			is_floor_decor = true
-			
-		# 排除：门
-		if "door" in sem_tag or nav == "walkable_door":
-			is_floor_decor = false
-			
-		if is_floor_decor:
-			# 强制放在最底层，让人踩在上面
-			sprite.z_index = -1
-			print("    > [层级] 识别为地毯/装饰 '%s' -> z_index = -1" % asset_id)
-		# -------------------------------------------
-		
-		var semantic_tag = props.get("semantic_tag", "")
-		if not semantic_tag.is_empty():
-			sprite.add_to_group(semantic_tag)
-			
-		set_object_properties(sprite, props, obstacle_base_size)
-		world_y_sort.add_child(sprite)
-		
-		
+		_place_object(cmd_item as Dictionary, assets, properties)
+	step_started = _profile_step(profile, "C_objects", step_started, nodes_before)
+
 	# 步骤 D: 实例化 NPC 和 Agent
 	print("  - 步骤 D: 实例化 NPC 和 智能体...")
+	nodes_before = world_y_sort.get_child_count()
 	for cmd_item in layout.get("npc_layer", []): 
-		var cmd = cmd_item as Dictionary
-		var asset_id = cmd.get("asset_id")
-		var asset_details = assets.get(asset_id, {}) as Dictionary
-		var props = properties.get(asset_id, {}) as Dictionary
-		var tile_pos = Vector2i(cmd.get("position")[0], cmd.get("position")[1])
-		var asset_type = asset_details.get("type", "")
-		
-		# 根据类型，调用新的实例化函数
-		if asset_type == "npc" or asset_type == "agent":
-			instantiate_character(asset_id, asset_type, props, tile_pos)
+		_place_character(cmd_item as Dictionary, assets, properties)
+	step_started = _profile_step(profile, "D_characters", step_started, nodes_before)
 
 	print("  - 步骤 E: 烘焙导航网格...")
 	var nav_poly_resource = NavigationPolygon.new()
@@ -376,13 +335,514 @@ func build_scene_procedurally(data: Dictionary) -> void:
 	navigation_region.navigation_polygon = nav_poly_resource
 	navigation_region.bake_navigation_polygon()
 	await navigation_region.bake_finished
+	# 烘焙期间已过帧，旧节点已移除；烘焙本身不新增节点
+	_profile_step(profile, "E_nav_bake", step_started, world_y_sort.get_child_count())
+	profile["bake_ms"] = profile["steps"]["E_nav_bake"]
 	print("  - 导航网格烘焙完毕！")
 	
 	# 新增 步骤 F: 启动世界时钟
 	print("  - 步骤 F: 启动世界时钟...")
 	WorldClock.start_clock() # <--- 在这里启动
 
+	print("  - 贴图: 解码 %d 张，缓存命中 %d 次" % [_texture_stats["decoded"], _texture_stats["cached"]])
+	profile["textures"] = _texture_stats.duplicate()
+	profile["grid_size"] = [map_dims.x, map_dims.y]
+	profile["total_ms"] = (Time.get_ticks_usec() - build_started) / 1000.0
+	_last_build_profile = profile
+	print("  - 剖析: 总耗时 %.1f ms (烘焙 %.1f ms)，%d 个地板格，%d 块墙，新增节点 %s" % [profile["total_ms"], profile["bake_ms"], profile["cells"], profile["wall_tiles"], profile["counts"]])
 	print("全自动场景构建完毕！")
+	return profile
+
+
+# 清空上一次构建并读取 metadata (地图尺寸、预计算导航数据、贴图清单)；两种构建方式共用
+func _prepare_world(data: Dictionary) -> Vector2i:
+	floor_layer.z_index = -5
+	
+	for child in world_y_sort.get_children():
+		child.queue_free()
+	for region in _nav_chunk_regions:
+		if is_instance_valid(region):
+			region.queue_free()
+	_nav_chunk_regions = []
+		
+	floor_layer.navigation_enabled = false
+
+	var metadata = data.get("metadata", {}) as Dictionary
+	var grid_size_arr = metadata.get("grid_size", [25, 20]) # 从 JSON 读取
+	var map_dims = Vector2i(grid_size_arr[0], grid_size_arr[1])
+	_map_dims = map_dims
+
+	# 预计算导航数据 (Python 保存阶段烘焙)；没有时角色退回到组查找 + 实时寻路
+	var nav_data_path = metadata.get("navigation", "")
+	if nav_data_path.is_empty() or not NavData.load_nav_data(nav_data_path):
+		NavData.clear()
+
+	# 贴图清单 (Python 保存阶段生成)；没有时按文件名加载，仍然缓存
+	_load_texture_manifest(metadata.get("textures", ""))
+	_texture_stats = {"decoded": 0, "cached": 0}
+	grid_wall_height_map = {}
+	return map_dims
+
+
+func _new_tile_set() -> TileSet:
+	var tile_set = TileSet.new()
+	tile_set.add_physics_layer()
+	tile_set.add_navigation_layer()
+	return tile_set
+
+
+# 为一个 "tile" 资产创建图集源；缺失或损坏的资产跳过 (返回 false)
+func _add_tile_source(tile_set: TileSet, source_id_map: Dictionary, asset_id: String, asset_details: Dictionary, properties: Dictionary) -> bool:
+	if asset_details.get("type") != "tile": # 只处理 "tile"
+		return false
+	var tex = get_asset_texture(asset_id)
+	if tex == null:
+		return false # 跳过缺失或损坏的资产
+	var source_id = source_id_map.size()
+	var atlas_source = TileSetAtlasSource.new()
+	atlas_source.texture = tex
+	var atlas_coord = Vector2i.ZERO
+	# 从 JSON 读取 visual_size
+	var v_size_arr = asset_details.get("visual_size", [1, 1])
+	var v_size_vec = Vector2i(v_size_arr[0], v_size_arr[1])
+	atlas_source.create_tile(atlas_coord, v_size_vec)
+	tile_set.add_source(atlas_source, source_id)
+	
+	source_id_map[asset_id] = {
+		"source_id": source_id, 
+		"atlas_coord": atlas_coord,
+		"texture": tex,
+		"visual_size": v_size_vec
+	}
+	
+	var tile_data = atlas_source.get_tile_data(atlas_coord, 0)
+	set_tile_properties(tile_data, properties.get(asset_id, {}) as Dictionary, v_size_vec)
+	return true
+
+
+# 指令的实际作用范围: 分块指令带 "clip" (area 与块的交集)，其余为整个 area
+func _command_clip(cmd: Dictionary, rect: Rect2i) -> Rect2i:
+	var clip_arr = cmd.get("clip", null)
+	if clip_arr == null:
+		return rect
+	return rect.intersection(Rect2i(clip_arr[0], clip_arr[1], clip_arr[2], clip_arr[3]))
+
+
+# 绘制一条地板指令，返回设置的格子数
+func _paint_floor(cmd: Dictionary, source_id_map: Dictionary) -> int:
+	var map_info = source_id_map.get(cmd.get("asset_id"))
+	if not map_info or cmd.get("command") != "fill_rect":
+		return 0
+	var area_arr = cmd.get("area", [0, 0, 1, 1])
+	var rect = Rect2i(area_arr[0], area_arr[1], area_arr[2], area_arr[3])
+	var clip = _command_clip(cmd, rect)
+	var tile_visual_size = map_info.get("visual_size", Vector2i(1, 1))
+	var tile_w = max(1, tile_visual_size.x) # 步长至少为 1
+	var tile_h = max(1, tile_visual_size.y) # 步长至少为 1
+	# 使用 (tile_w, tile_h) 的步长来循环；步长的相位以整个 area 为准，分块时只画落在 clip 内的锚点
+	var start_x = rect.position.x + ceili(float(clip.position.x - rect.position.x) / tile_w) * tile_w
+	var start_y = rect.position.y + ceili(float(clip.position.y - rect.position.y) / tile_h) * tile_h
+	var cells = 0
+	for x in range(start_x, clip.end.x, tile_w):
+		for y in range(start_y, clip.end.y, tile_h):
+			floor_layer.set_cell(Vector2i(x, y), map_info.source_id, map_info.atlas_coord)
+			cells += 1
+	return cells
+
+
+# 实例化一条墙壁指令，返回创建的墙块 Sprite
+func _place_wall(cmd: Dictionary, source_id_map: Dictionary, properties: Dictionary, map_dims: Vector2i) -> Array:
+	var asset_id = cmd.get("asset_id")
+	
+	var map_info = source_id_map.get(asset_id)
+	if not map_info:
+		printerr("错误: 找不到墙壁 '%s' 的资产信息" % asset_id)
+		return []
+		
+	var tex = map_info.texture as Texture2D
+	if tex == null:
+		printerr("错误: 墙壁 '%s' 的纹理为空" % asset_id)
+		return []
+
+	# 2. 获取属性 (用于物理)
+	var props = properties.get(asset_id, {}) as Dictionary
+	
+	# 3. 解析指令 (边缘偏移按整个 area 判定，分块时只实例化 clip 内的格子)
+	var command = cmd.get("command")
+	var area_arr = cmd.get("area", [0, 0, 1, 1])
+	var rect = Rect2i(area_arr[0], area_arr[1], area_arr[2], area_arr[3])
+	var clip = _command_clip(cmd, rect)
+	
+	if command == "fill_rect":
+		var wall_pixel_height = tex.get_height()
+		# 遍历这个矩形覆盖的所有格子
+		for wx in range(clip.position.x, clip.end.x):
+			for wy in range(clip.position.y, clip.end.y):
+				grid_wall_height_map[Vector2i(wx, wy)] = wall_pixel_height
+	
+	# 4. 调用新的 Sprite 填充函数
+	if command == "fill_rect":
+		return _fill_rect_with_sprites(world_y_sort, rect, tex, props, map_dims, clip)
+	elif command == "draw_rect_outline":
+		# (你也可以创建一个 _draw_rect_with_sprites 函数)
+		printerr("警告: 'draw_rect_outline' 尚未实现为 Sprites")
+	return []
+
+
+# 实例化一条物体指令 (含挂件与地毯判定)，返回创建的 Sprite；跳过时返回 null
+func _place_object(cmd: Dictionary, assets: Dictionary, properties: Dictionary) -> Sprite2D:
+	var asset_id = cmd.get("asset_id")
+	if assets.get(asset_id, {}).get("type") != "object": return null 
+	
+	# 同一资产的所有摆放共享一张贴图
+	var tex = get_asset_texture(asset_id)
+	if tex == null: return null
+	var texture_size = tex.get_size() 
+	
+	var tile_pos = Vector2i(cmd.get("position")[0], cmd.get("position")[1])
+	var world_pos_center = floor_layer.map_to_local(tile_pos)
+	
+	var sprite = Sprite2D.new()
+	sprite.texture = tex
+	sprite.name = asset_id
+	sprite.centered = false
+	sprite.offset = Vector2(-texture_size.x / 2.0, -texture_size.y)
+	sprite.position = world_pos_center
+	
+	var props = properties.get(asset_id, {}) as Dictionary
+	var asset_details = assets.get(asset_id, {}) as Dictionary
+	var json_size_array = asset_details.get("base_size", null)
+	
+	var obstacle_base_size = texture_size 
+	var obj_base_h = 1 
+	
+	if json_size_array != null and json_size_array.size() == 2:
+		obstacle_base_size = Vector2(json_size_array[0], json_size_array[1]) * Vector2(TILE_SIZE)
+		obj_base_h = json_size_array[1]
+
+	# --- 智能墙面附着判定 ---
+	var is_hanging = false
+	var target_wall_h = 0.0
+	#var is_tolerance_snap = false 
+	
+	# 判定 1: 坐标重合
+	if tile_pos in grid_wall_height_map:
+		is_hanging = true
+		target_wall_h = grid_wall_height_map[tile_pos]
+		
+	## 判定 2: 邻接且单层厚度
+	#elif (tile_pos + Vector2i.UP) in grid_wall_height_map:
+		#if obj_base_h == 1: 
+			#is_hanging = true
+			#is_tolerance_snap = true 
+			#target_wall_h = grid_wall_height_map[tile_pos + Vector2i.UP]
+			#print("    > [吸附] 挂件 '%s' @ %s 吸附到上方墙壁" % [asset_id, tile_pos])
+
+	if is_hanging:
+		var obj_pixel_h = texture_size.y
+		
+		# 检查约束: 物体高度必须 <= 墙壁高度
+		if obj_pixel_h <= target_wall_h:
+			
+			# 1. 垂直提升算法: (墙高 - 物体高) / 2
+			# 结果: 物体将在墙面上垂直居中
+			var lift_amount = (target_wall_h - obj_pixel_h) / 2.0
+			sprite.position.y -= lift_amount
+			
+			## 2. 位置修正 (如果是从地板吸附上来的)
+			#if is_tolerance_snap:
+				#sprite.position.y -= TILE_SIZE.y 
+			
+			# 3. 提升层级
+			sprite.z_index = 1 
+			
+			print("    > [生效] 挂件 '%s' 垂直居中, 提升 %.1f px" % [asset_id, lift_amount])
+		else:
+			print("    > [跳过] 挂件 '%s' 高度 (%.1f) 超过墙高 (%.1f), 取消悬挂" % [asset_id, obj_pixel_h, target_wall_h])
+			
+			
+	# -----------------------------------------------------
+	var is_floor_decor = false
+	var phys = props.get("physics", "")
+	var nav = props.get("navigation", "")
+	var sem_tag = props.get("semantic_tag", "")
+	
+	# 规则：可穿过 + 可行走 + 不是门 = 地毯/污渍
+	if phys == "passable" and nav == "walkable":
+		is_floor_decor = true
+	
+	# 规则：或者明确标记为 rug/carpet
+	if "rug" in asset_id or "carpet" in asset_id or "rug" in sem_tag or "carpet" in sem_tag:
+		is_floor_decor = true
+		
+	# 排除：门
+	if "door" in sem_tag or nav == "walkable_door":
+		is_floor_decor = false
+		
+	if is_floor_decor:
+		# 强制放在最底层，让人踩在上面
+		sprite.z_index = -1
+		print("    > [层级] 识别为地毯/装饰 '%s' -> z_index = -1" % asset_id)
+	# -------------------------------------------
+	
+	var semantic_tag = props.get("semantic_tag", "")
+	if not semantic_tag.is_empty():
+		sprite.add_to_group(semantic_tag)
+		
+	set_object_properties(sprite, props, obstacle_base_size)
+	world_y_sort.add_child(sprite)
+	return sprite
+
+
+func _place_character(cmd: Dictionary, assets: Dictionary, properties: Dictionary) -> Node:
+	var asset_id = cmd.get("asset_id")
+	var asset_details = assets.get(asset_id, {}) as Dictionary
+	var props = properties.get(asset_id, {}) as Dictionary
+	var tile_pos = Vector2i(cmd.get("position")[0], cmd.get("position")[1])
+	var asset_type = asset_details.get("type", "")
+	
+	# 根据类型，调用新的实例化函数
+	if asset_type == "npc" or asset_type == "agent":
+		return instantiate_character(asset_id, asset_type, props, tile_pos)
+	return null
+
+
+# ==================== 分块流式构建 ====================
+# World_Guild/scene_chunker.py 把规划切成 CHUNK_TILES x CHUNK_TILES 的块，按离焦点 (出生点/相机) 由近到远发送:
+#   begin_streamed_build (metadata/assets/properties) -> build_chunk x N -> end_streamed_build
+# 每个块拆成小任务排队 (地板指令、墙壁指令、单个物体、单个角色、导航烘焙)，_process 每帧最多执行
+# STREAM_FRAME_BUDGET_USEC 的任务，因此首帧可见的时间与世界大小无关。
+# 导航按块异步烘焙: 每块一个 NavigationRegion2D，baking_rect 向外扩 border_size，相邻块的边可以相接。
+func _begin_streamed_build(header: Dictionary):
+	_cancel_streamed_build()
+	print("开始分块流式构建 (%d 块)..." % int(header.get("chunk_count", 0)))
+	var started = Time.get_ticks_usec()
+	var map_dims = _prepare_world(header)
+	var tile_set = _new_tile_set()
+	floor_layer.tile_set = tile_set
+	# 整体导航网格改由各块的导航区域提供
+	navigation_region.navigation_polygon = NavigationPolygon.new()
+
+	_stream_serial += 1
+	_stream = {
+		"id": _stream_serial,
+		"assets": header.get("assets", {}) as Dictionary,
+		"properties": header.get("properties", {}) as Dictionary,
+		"map_dims": map_dims,
+		"tile_set": tile_set,
+		"source_id_map": {},
+		"started": started,
+		"pending_bakes": 0,
+		"ended": false,
+		"profile": {
+			"streamed": true, "steps": {"setup": (Time.get_ticks_usec() - started) / 1000.0, "jobs": 0.0, "E_nav_bake": 0.0},
+			"counts": {"B5_walls": 0, "C_objects": 0, "D_characters": 0},
+			"cells": 0, "wall_tiles": 0, "tile_sources": 0,
+			"chunks": 0, "frames": 0, "max_frame_ms": 0.0, "first_chunk_ms": -1.0, "bake_ms": 0.0
+		}
+	}
+
+
+# 放弃进行中的流式构建 (新的构建开始时)；等待中的 end_streamed_build 收到 {"cancelled": true}
+func _cancel_streamed_build():
+	_stream_jobs = []
+	_stream_next_job = 0
+	if _stream.is_empty():
+		return
+	printerr("警告: 放弃未完成的流式构建")
+	_stream = {}
+	stream_finished.emit({"cancelled": true})
+
+
+func _queue_chunk(chunk: Dictionary):
+	if _stream.is_empty():
+		printerr("错误: 收到 'build_chunk' 但没有进行中的流式构建")
+		return
+	var layout = chunk.get("layout", {}) as Dictionary
+	var state = {"chunk": chunk, "nodes": []}
+	_stream_jobs.append(_stream_prepare_tiles.bind(chunk.get("assets", [])))
+	for cmd in layout.get("floor_layer", []):
+		_stream_jobs.append(_stream_floor.bind(cmd))
+	for cmd in layout.get("wall_layer", []):
+		_stream_jobs.append(_stream_wall.bind(cmd, state))
+	for cmd in layout.get("object_layer", []):
+		_stream_jobs.append(_stream_object.bind(cmd, state))
+	for cmd in layout.get("npc_layer", []):
+		_stream_jobs.append(_stream_character.bind(cmd))
+	_stream_jobs.append(_stream_finish_chunk.bind(state))
+
+
+# 每帧执行排队的任务，直到用完本帧预算 (至少执行一个)
+func _pump_stream():
+	if _stream_next_job < _stream_jobs.size():
+		var frame_started = Time.get_ticks_usec()
+		while _stream_next_job < _stream_jobs.size():
+			var job: Callable = _stream_jobs[_stream_next_job]
+			_stream_next_job += 1
+			job.call()
+			if _stream.is_empty() or Time.get_ticks_usec() - frame_started >= STREAM_FRAME_BUDGET_USEC:
+				break
+		if _stream_next_job >= _stream_jobs.size():
+			_stream_jobs = []
+			_stream_next_job = 0
+		if not _stream.is_empty():
+			var frame_ms = (Time.get_ticks_usec() - frame_started) / 1000.0
+			var profile = _stream["profile"]
+			profile["frames"] += 1
+			profile["steps"]["jobs"] += frame_ms
+			profile["max_frame_ms"] = max(profile["max_frame_ms"], frame_ms)
+	_check_stream_finished()
+
+
+# 块内用到的瓦片资产按需加入 TileSet (每张贴图仍只解码一次)
+func _stream_prepare_tiles(asset_ids: Array):
+	var source_id_map = _stream["source_id_map"]
+	for asset_id in asset_ids:
+		if not source_id_map.has(asset_id):
+			_add_tile_source(_stream["tile_set"], source_id_map, asset_id, _stream["assets"].get(asset_id, {}), _stream["properties"])
+	_stream["profile"]["tile_sources"] = source_id_map.size()
+
+
+func _stream_floor(cmd: Dictionary):
+	_stream["profile"]["cells"] += _paint_floor(cmd, _stream["source_id_map"])
+
+
+func _stream_wall(cmd: Dictionary, state: Dictionary):
+	var sprites = _place_wall(cmd, _stream["source_id_map"], _stream["properties"], _stream["map_dims"])
+	_stream["profile"]["wall_tiles"] += sprites.size()
+	_stream["profile"]["counts"]["B5_walls"] += sprites.size()
+	state["nodes"].append_array(sprites)
+
+
+func _stream_object(cmd: Dictionary, state: Dictionary):
+	var sprite = _place_object(cmd, _stream["assets"], _stream["properties"])
+	if sprite != null:
+		_stream["profile"]["counts"]["C_objects"] += 1
+		state["nodes"].append(sprite)
+
+
+func _stream_character(cmd: Dictionary):
+	if _place_character(cmd, _stream["assets"], _stream["properties"]) != null:
+		_stream["profile"]["counts"]["D_characters"] += 1
+
+
+func _stream_finish_chunk(state: Dictionary):
+	var profile = _stream["profile"]
+	profile["chunks"] += 1
+	if profile["first_chunk_ms"] < 0:
+		profile["first_chunk_ms"] = (Time.get_ticks_usec() - _stream["started"]) / 1000.0
+		print("  - 首个块已就绪: %.1f ms" % profile["first_chunk_ms"])
+	_bake_chunk_navigation(state)
+
+
+# [x, y, w, h] (瓦片) -> 像素矩形
+func _tile_rect_pixels(rect_arr: Array) -> Rect2:
+	return Rect2(Vector2(rect_arr[0], rect_arr[1]) * Vector2(TILE_SIZE), Vector2(rect_arr[2], rect_arr[3]) * Vector2(TILE_SIZE))
+
+
+func _tile_rect_outline(rect_arr: Array) -> PackedVector2Array:
+	var rect = _tile_rect_pixels(rect_arr)
+	return PackedVector2Array([rect.position, Vector2(rect.end.x, rect.position.y), rect.end, Vector2(rect.position.x, rect.end.y)])
+
+
+# 可行走区域与边框内的墙由 Python 按数据给出 ("nav_outlines" / "nav_obstructions"，已扩到 border 范围)，
+# 块内物体与墙的碰撞体从刚创建的节点解析。烘焙在后台线程进行，不占帧预算。
+func _bake_chunk_navigation(state: Dictionary):
+	var chunk = state["chunk"] as Dictionary
+	var nav_poly = NavigationPolygon.new()
+	nav_poly.set_parsed_collision_mask_value(1, true)
+	nav_poly.agent_radius = TILE_SIZE.x
+	nav_poly.border_size = TILE_SIZE.x
+	nav_poly.baking_rect = _tile_rect_pixels(chunk["rect"]).grow(nav_poly.border_size)
+
+	var source = NavigationMeshSourceGeometryData2D.new()
+	for node in state["nodes"]:
+		if is_instance_valid(node):
+			NavigationServer2D.parse_source_geometry_data(nav_poly, source, node)
+	for rect_arr in chunk.get("nav_outlines", []):
+		source.add_traversable_outline(_tile_rect_outline(rect_arr))
+	for rect_arr in chunk.get("nav_obstructions", []):
+		source.add_obstruction_outline(_tile_rect_outline(rect_arr))
+	state["nodes"] = []
+
+	var region = NavigationRegion2D.new()
+	region.name = "NavChunk_%d_%d" % [chunk["id"][0], chunk["id"][1]]
+	navigation_region.add_child(region)
+	_nav_chunk_regions.append(region)
+	_stream["pending_bakes"] += 1
+	var build_id = _stream["id"]
+	var bake_started = Time.get_ticks_usec()
+	NavigationServer2D.bake_from_source_geometry_data_async(nav_poly, source,
+		func(): _on_chunk_baked.call_deferred(build_id, region, nav_poly, bake_started))
+
+
+func _on_chunk_baked(build_id: int, region: NavigationRegion2D, nav_poly: NavigationPolygon, bake_started: int):
+	if _stream.is_empty() or _stream["id"] != build_id or not is_instance_valid(region):
+		return # 所属的构建已被放弃
+	region.navigation_polygon = nav_poly
+	_stream["pending_bakes"] -= 1
+	var bake_ms = (Time.get_ticks_usec() - bake_started) / 1000.0
+	_stream["profile"]["bake_ms"] += bake_ms
+	_stream["profile"]["steps"]["E_nav_bake"] += bake_ms
+
+
+# 收到 end_streamed_build、任务队列清空且所有块烘焙完毕后收尾
+func _check_stream_finished():
+	if _stream.is_empty() or not _stream["ended"] or _stream_next_job < _stream_jobs.size() or _stream["pending_bakes"] > 0:
+		return
+	print("  - 步骤 F: 启动世界时钟...")
+	WorldClock.start_clock()
+	var profile = _stream["profile"]
+	profile["textures"] = _texture_stats.duplicate()
+	profile["grid_size"] = [_stream["map_dims"].x, _stream["map_dims"].y]
+	profile["total_ms"] = (Time.get_ticks_usec() - _stream["started"]) / 1000.0
+	_last_build_profile = profile
+	_stream = {}
+	print("  - 剖析: 首块 %.1f ms，总耗时 %.1f ms，%d 块 / %d 帧，单帧最长 %.1f ms" % [profile["first_chunk_ms"], profile["total_ms"], profile["chunks"], profile["frames"], profile["max_frame_ms"]])
+	print("分块流式构建完毕！")
+	stream_finished.emit(profile)
+
+# ==================== 贴图缓存 ====================
+func _load_texture_manifest(manifest_path: String):
+	_texture_manifest = {}
+	if manifest_path.is_empty():
+		return
+	if not FileAccess.file_exists(manifest_path):
+		printerr("警告: 找不到贴图清单 %s，按文件名加载贴图" % manifest_path)
+		return
+	var manifest = JSON.parse_string(FileAccess.get_file_as_string(manifest_path))
+	if manifest == null:
+		printerr("警告: 解析贴图清单失败 %s" % manifest_path)
+		return
+	_texture_manifest = manifest.get("textures", {})
+	print("  - 贴图清单: %d 张唯一贴图 / %d 个摆放" % [manifest.get("unique_textures", 0), manifest.get("placements", 0)])
+
+
+# 每张唯一贴图只解码一次；失败返回 null (已打印错误)
+func get_asset_texture(asset_id: String) -> Texture2D:
+	var entry = _texture_manifest.get(asset_id, {})
+	var asset_path = ASSET_DIR.path_join(entry.get("file", asset_id + ".png"))
+	if not FileAccess.file_exists(asset_path):
+		printerr("错误: 找不到资产文件 %s" % asset_path)
+		return null
+	var key = entry.get("hash", "%s@%d" % [asset_path, FileAccess.get_modified_time(asset_path)])
+	if _texture_cache.has(key):
+		_texture_stats["cached"] += 1
+		return _texture_cache[key]
+
+	var img = Image.new()
+	var err = img.load(asset_path)
+	if err != OK:
+		printerr("错误: 加载图像失败 %s (错误码: %s)" % [asset_path, err])
+		return null
+	var tex = ImageTexture.create_from_image(img)
+	if tex == null:
+		printerr("错误: 从图像创建纹理失败 %s (图像可能已损坏或为空)" % asset_path)
+		return null
+	_texture_cache[key] = tex
+	_texture_stats["decoded"] += 1
+	return tex
+
 
 func _internal_fill_rect(layer: TileMapLayer, rect: Rect2i, source_id: int, atlas_coord: Vector2i):
 
@@ -528,20 +988,10 @@ func instantiate_character(asset_id: String, asset_type: String, props: Dictiona
 	else:
 		printerr("错误: %s 场景中找不到 'NavigationAgent2D' 子节点!" % scene_path)
 	
-	var tex_path = ASSET_DIR.path_join(asset_id + ".png")
-	if FileAccess.file_exists(tex_path):
-		var img = Image.new()
-		var err = img.load(tex_path)
-		
-		if err == OK:
-			var tex = ImageTexture.create_from_image(img)
-			# 假设 npc.tscn/agent.tscn 上的脚本有 "set_texture" 方法
-			if npc_instance.has_method("set_texture"):
-				npc_instance.set_texture(tex)
-		else:
-			printerr("警告: 加载NPC纹理失败 %s (错误码: %s)" % [tex_path, err])
-	else:
-		printerr("警告: 找不到NPC纹理: %s" % tex_path)
+	var tex = get_asset_texture(asset_id)
+	# 假设 npc.tscn/agent.tscn 上的脚本有 "set_texture" 方法
+	if tex and npc_instance.has_method("set_texture"):
+		npc_instance.set_texture(tex)
 
 	# 4. 放置到世界中
 	var local_pos_center = floor_layer.map_to_local(tile_pos)
@@ -550,6 +1000,7 @@ func instantiate_character(asset_id: String, asset_type: String, props: Dictiona
 	npc_instance.global_position = global_pos_center
 	
 	print("    - 成功实例化 %s: %s (灵魂: %s)" % [asset_type, npc_instance.name, props.get("soul_file", "无")])
+	return npc_instance
 	
 #func _fill_rect_with_sprites(container: Node2D, rect: Rect2i, tex: Texture2D, props: Dictionary, map_dims: Vector2i):
 	#var texture_size = tex.get_size()
@@ -607,8 +1058,11 @@ func instantiate_character(asset_id: String, asset_type: String, props: Dictiona
 			## 7. 添加到 Y-Sort 容器中
 			#container.add_child(sprite)
 			
-func _fill_rect_with_sprites(container: Node2D, rect: Rect2i, tex: Texture2D, props: Dictionary, map_dims: Vector2i):
+# clip: 只实例化 rect 中落在 clip 内的格子 (分块构建)；边缘判定仍按整个 rect。返回创建的 Sprite
+func _fill_rect_with_sprites(container: Node2D, rect: Rect2i, tex: Texture2D, props: Dictionary, map_dims: Vector2i, clip: Rect2i = Rect2i()) -> Array:
 	var texture_size = tex.get_size()
+	var cells = clip if clip.has_area() else rect
+	var created = []
 	
 	var TILE_HALF_WIDTH = TILE_SIZE.x / 2.0  # 8.0 像素
 	
@@ -622,8 +1076,8 @@ func _fill_rect_with_sprites(container: Node2D, rect: Rect2i, tex: Texture2D, pr
 	var is_left_rect = (rect.position.x == 0 and rect.position.y > 0 and rect.size.x == 1)
 	var is_right_rect = (rect.position.x == map_dims.x - 1 and rect.position.y > 0 and rect.size.x == 1)
 
-	for x in range(rect.position.x, rect.end.x):
-		for y in range(rect.position.y, rect.end.y):
+	for x in range(cells.position.x, cells.end.x):
+		for y in range(cells.position.y, cells.end.y):
 			
 			var tile_pos = Vector2i(x, y)
 			
@@ -678,6 +1132,8 @@ func _fill_rect_with_sprites(container: Node2D, rect: Rect2i, tex: Texture2D, pr
 			
 			# 8. 设置全局坐标 (无变化)
 			sprite.global_position = base_global_pos + offset_trick
+			created.append(sprite)
+	return created
 
 
 func _unhandled_input(event):
@@ -693,8 +1149,9 @@ func capture_hd_screenshot_without_moving_nodes(save_path: String):
 	print("📸 准备进行 8K 截图 (纯净原色版)...")
 	
 	# --- 1. 基础参数 ---
-	var map_width_in_tiles = 80
-	var map_height_in_tiles = 80
+	# (无引擎批量预览见 World_Guild/scene_compositor.py)
+	var map_width_in_tiles = _map_dims.x
+	var map_height_in_tiles = _map_dims.y
 	var tile_size = 16 
 	var map_pixel_size = Vector2(map_width_in_tiles * tile_size, map_height_in_tiles * tile_size)
 	var target_size = Vector2i(7280, 7280) # 8K
@@ -0,0 +1,163 @@
+# res://script/MemoryClient.gd (自动加载)
+# 角色记忆服务 (World_Guild/memory_service.py) 的客户端
+# - append(): 把一条记忆排队，合并成一次 POST /append 发送 (不再整体重写灵魂文件)
+# - recall(): POST /recall 取回 "摘要 + 与查询最相关的 k 条"，用于拼提示
+# 服务由 main.py 在生成流程中启动 (memory_service.ensure_memory_service)，生成结束后继续在后台运行。
+# 服务不可用时，记忆追加到 user://npc_memory/<角色>.jsonl，recall 从该文件取最近 k 条；
+# 服务恢复 (某次追加成功) 后把这些记录补发给服务 (发送失败会重新写回文件)。
+extends Node
+
+const DEFAULT_SERVICE_URL = "http://127.0.0.1:8765"
+const FALLBACK_DIR = "user://npc_memory/"
+const RETRY_INTERVAL_MS = 30000 # 服务不可用后，隔多久再尝试
+
+var service_url: String = DEFAULT_SERVICE_URL
+var _append_http: HTTPRequest
+var _queue: Array = []
+var _in_flight: Array = []
+var _retry_at_ms: int = 0
+var _has_fallback: bool = true # 本地文件中可能有待补发的记录 (启动时未知，按有处理)
+
+
+func _ready():
+	_append_http = HTTPRequest.new()
+	add_child(_append_http)
+	_append_http.request_completed.connect(_on_append_completed)
+
+
+func configure(url: String):
+	if not url.is_empty():
+		service_url = url.trim_suffix("/")
+
+
+func _service_available() -> bool:
+	return Time.get_ticks_msec() >= _retry_at_ms
+
+
+func _mark_unavailable():
+	if _service_available():
+		printerr("【记忆服务】无法连接 %s，暂时改为写入本地文件。" % service_url)
+	_retry_at_ms = Time.get_ticks_msec() + RETRY_INTERVAL_MS
+
+
+# ==================== 追加 ====================
+func append(character: String, entry: Dictionary):
+	var record = entry.duplicate()
+	record["character"] = character
+	if not _service_available():
+		_append_to_file(record)
+		return
+	_queue.append(record)
+	_send_next()
+
+
+func _send_next():
+	if not _in_flight.is_empty() or _queue.is_empty():
+		return
+	_in_flight = _queue
+	_queue = []
+	var err = _append_http.request(service_url + "/append", ["Content-Type: application/json"], HTTPClient.METHOD_POST, JSON.stringify({"entries": _in_flight}))
+	if err != OK:
+		_on_append_completed(HTTPRequest.RESULT_CANT_CONNECT, 0, PackedStringArray(), PackedByteArray())
+
+
+func _on_append_completed(result, response_code, _headers, _body):
+	if result != HTTPRequest.RESULT_SUCCESS or response_code != 200:
+		_mark_unavailable()
+		for record in _in_flight + _queue:
+			_append_to_file(record)
+		_queue = []
+	elif _has_fallback:
+		_has_fallback = false
+		_replay_fallback()
+	_in_flight = []
+	_send_next()
+
+
+func _fallback_path(character: String) -> String:
+	return FALLBACK_DIR + character.validate_filename() + ".jsonl"
+
+
+func _append_to_file(record: Dictionary):
+	_has_fallback = true
+	DirAccess.make_dir_recursive_absolute(FALLBACK_DIR)
+	var path = _fallback_path(record["character"])
+	var file = FileAccess.open(path, FileAccess.READ_WRITE if FileAccess.file_exists(path) else FileAccess.WRITE)
+	if file == null:
+		printerr("错误: 无法写入记忆文件: %s (错误码: %s)" % [path, FileAccess.get_open_error()])
+		return
+	file.seek_end()
+	file.store_line(JSON.stringify(record))
+	file.close()
+
+
+func _read_fallback(path: String) -> Array:
+	var records = []
+	var file = FileAccess.open(path, FileAccess.READ)
+	if file == null:
+		return records
+	while not file.eof_reached():
+		var line = file.get_line().strip_edges()
+		if line.is_empty():
+			continue
+		var record = JSON.parse_string(line)
+		if record is Dictionary:
+			records.append(record)
+	file.close()
+	return records
+
+
+# 把服务不可用期间写入本地的记忆补发给服务 (排在新记忆之前)
+func _replay_fallback():
+	var dir = DirAccess.open(FALLBACK_DIR)
+	if dir == null:
+		return
+	var records = []
+	for file_name in dir.get_files():
+		if not file_name.ends_with(".jsonl"):
+			continue
+		records.append_array(_read_fallback(FALLBACK_DIR + file_name))
+		dir.remove(file_name)
+	_queue = records + _queue
+
+
+# ==================== 召回 ====================
+# 返回可直接放进提示的文本 (摘要 + top-k 记忆)；服务不可用时返回本地文件中最近的 k 条 (没有则为 "")
+func recall(character: String, query: String, k: int) -> String:
+	var data = await _request_recall(character, query, k)
+	if data == null:
+		data = {"memories": _read_fallback(_fallback_path(character)).slice(-k)}
+	var text = ""
+	for line in data.get("summary", []):
+		text += "(更早) " + line + "\n"
+	for entry in data.get("memories", []):
+		text += "%s: %s\n" % [entry.get("time", ""), entry.get("event", "")]
+	return text
+
+
+# 最近的 k 条记忆 (字典数组)，角色加载时用来恢复上次运行的对话上下文
+func recent(character: String, k: int) -> Array:
+	var data = await _request_recall(character, "", k)
+	if data == null:
+		return _read_fallback(_fallback_path(character)).slice(-k)
+	return data.get("memories", [])
+
+
+# POST /recall；服务不可用或回复无效时返回 null
+func _request_recall(character: String, query: String, k: int):
+	if not _service_available():
+		return null
+	var http = HTTPRequest.new()
+	add_child(http)
+	var err = http.request(service_url + "/recall", ["Content-Type: application/json"], HTTPClient.METHOD_POST, JSON.stringify({"character": character, "query": query, "k": k}))
+	if err != OK:
+		http.queue_free()
+		_mark_unavailable()
+		return null
+	var result = await http.request_completed
+	http.queue_free()
+	if result[0] != HTTPRequest.RESULT_SUCCESS or result[1] != 200:
+		_mark_unavailable()
+		return null
+	var data = JSON.parse_string(result[3].get_string_from_utf8())
+	return data if data is Dictionary else null
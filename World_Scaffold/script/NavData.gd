@@ -0,0 +1,119 @@
+# res://script/NavData.gd (自动加载)
+# 预计算导航数据: 由 Python 保存阶段 (nav_grid.py) 烘焙到 res://navigation/
+# - 可行走位图
+# - 每个语义标签的距离场 (flow field): 每格到最近实例的步数
+# - 最近实例表: 每格最近的是该标签的第几个实例
+# 角色选目标、寻路都变成查表，不再需要 get_nodes_in_group + 实时寻路。
+extends Node
+
+const TILE_SIZE = Vector2i(16, 16) # 与 scene_builder_server.gd 一致 (FloorLayer 位于原点)
+const NEIGHBOR_OFFSETS = [Vector2i(0, -1), Vector2i(0, 1), Vector2i(-1, 0), Vector2i(1, 0)]
+
+var is_loaded: bool = false
+var grid_size: Vector2i = Vector2i.ZERO
+var _none_value: int = 65535
+var _walkable_offset: int = 0
+var _data: PackedByteArray = PackedByteArray()
+var _tags: Dictionary = {} # { tag: {"field_offset", "nearest_offset", "instances"} }
+
+
+func load_nav_data(meta_path: String) -> bool:
+	clear()
+	if not FileAccess.file_exists(meta_path):
+		printerr("【导航数据】找不到: %s" % meta_path)
+		return false
+
+	var meta = JSON.parse_string(FileAccess.get_file_as_string(meta_path))
+	if meta == null:
+		printerr("【导航数据】解析失败: %s" % meta_path)
+		return false
+
+	var data_path = meta_path.get_base_dir().path_join(meta.get("data_file", ""))
+	_data = FileAccess.get_file_as_bytes(data_path)
+	if _data.is_empty():
+		printerr("【导航数据】找不到数据文件: %s" % data_path)
+		return false
+
+	grid_size = Vector2i(meta["grid_size"][0], meta["grid_size"][1])
+	_none_value = int(meta.get("none_value", 65535))
+	_walkable_offset = int(meta.get("walkable_offset", 0))
+	_tags = meta.get("tags", {})
+	is_loaded = true
+	print("【导航数据】已加载 %d 个语义标签 (%dx%d)" % [_tags.size(), grid_size.x, grid_size.y])
+	return true
+
+
+func clear():
+	is_loaded = false
+	grid_size = Vector2i.ZERO
+	_data = PackedByteArray()
+	_tags = {}
+
+
+func has_tag(tag: String) -> bool:
+	return is_loaded and _tags.has(tag)
+
+
+func world_to_cell(world_pos: Vector2) -> Vector2i:
+	return Vector2i(floori(world_pos.x / TILE_SIZE.x), floori(world_pos.y / TILE_SIZE.y))
+
+
+func cell_to_world(cell: Vector2i) -> Vector2:
+	return (Vector2(cell) + Vector2(0.5, 0.5)) * Vector2(TILE_SIZE)
+
+
+func _in_grid(cell: Vector2i) -> bool:
+	return cell.x >= 0 and cell.y >= 0 and cell.x < grid_size.x and cell.y < grid_size.y
+
+
+func is_walkable(cell: Vector2i) -> bool:
+	return is_loaded and _in_grid(cell) and _data.decode_u8(_walkable_offset + cell.y * grid_size.x + cell.x) == 1
+
+
+func _read_u16(offset: int, cell: Vector2i) -> int:
+	return _data.decode_u16(offset + 2 * (cell.y * grid_size.x + cell.x))
+
+
+func _distance_at(tag: String, cell: Vector2i) -> int:
+	if not _in_grid(cell):
+		return -1
+	var d = _read_u16(int(_tags[tag]["field_offset"]), cell)
+	return -1 if d == _none_value else d
+
+
+# 到该标签最近实例的步数 (格)；不可达或没有该标签返回 -1
+func distance_to_tag(tag: String, world_pos: Vector2) -> int:
+	if not has_tag(tag):
+		return -1
+	return _distance_at(tag, world_to_cell(world_pos))
+
+
+# 最近实例的世界坐标 (锚点格中心)；不可达时返回 world_pos 本身
+func nearest_instance_position(tag: String, world_pos: Vector2) -> Vector2:
+	if not has_tag(tag):
+		return world_pos
+	var cell = world_to_cell(world_pos)
+	if not _in_grid(cell):
+		return world_pos
+	var index = _read_u16(int(_tags[tag]["nearest_offset"]), cell)
+	var instances = _tags[tag]["instances"]
+	if index == _none_value or index >= instances.size():
+		return world_pos
+	return cell_to_world(Vector2i(instances[index][0], instances[index][1]))
+
+
+# 沿距离场下降的下一个路点 (相邻格中心)；已到达或不可达时返回 world_pos 本身
+func next_waypoint(tag: String, world_pos: Vector2) -> Vector2:
+	if not has_tag(tag):
+		return world_pos
+	var cell = world_to_cell(world_pos)
+	var best = _distance_at(tag, cell)
+	if best <= 0:
+		return world_pos
+	var best_cell = cell
+	for offset in NEIGHBOR_OFFSETS:
+		var d = _distance_at(tag, cell + offset)
+		if d >= 0 and d < best:
+			best = d
+			best_cell = cell + offset
+	return cell_to_world(best_cell)
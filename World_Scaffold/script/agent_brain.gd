@@ -39,6 +39,7 @@ var is_thinking: bool = false
 var ai_current_task_string: String = ""
 var ai_current_action: String = ""
 var ai_current_target_name: String = ""
+var ai_flow_field_tag: String = "" # 非空时沿 NavData 的距离场移动 (不使用 NavigationAgent2D 寻路)
 const AI_MOVE_SPEED: float = 70.0
 const GOD_MOVE_SPEED: float = 150.0
 const NAVIGATION_TARGET_REACHED_DISTANCE: float = 50.0
@@ -48,6 +49,8 @@ const CHARACTER_PHYSICS_LAYER = 2
 var current_anim_state: String = "idle_down"
 
 const TARGET_UPDATE_INTERVAL: float = 0.5 
+const LOCAL_MEMORY_LIMIT: int = 20 # 本地只保留最近几条 (对话提示用)，完整记忆在记忆服务中
+const MEMORY_RECALL_K: int = 8 # 制定计划时从记忆服务召回的条数
 var _target_update_timer: float = 0.0
 
 const WORLD_CONTEXT_PATH = "res://world/world_context.json"
@@ -102,6 +105,7 @@ func set_god_control(is_active: bool):
 		navigation_agent.target_position = global_position
 		ai_current_action = ""
 		ai_current_target_name = ""
+		ai_flow_field_tag = ""
 	else:
 		print("上帝模式已停用: %s" % character_name)
 		call_deferred("on_schedule_tick", WorldClock.get_current_time_string())
@@ -123,12 +127,19 @@ func load_soul_data():
 		self.ai_personality = json.get("personality", "一个普通人")
 		self.ai_goals = json.get("goals", [])
 		self.ai_dialogue = json.get("dialogue", {})
-		self.ai_memory = json.get("memory", [])
+		self.ai_memory = json.get("memory", []).slice(-LOCAL_MEMORY_LIMIT)
+		MemoryClient.configure(json.get("memory_service_url", ""))
+		call_deferred("_restore_recent_memory")
 		self.current_dynamic_plan = json.get("current_dynamic_plan", {})
 		if not self.current_dynamic_plan.is_empty():
 			print("  - %s 成功加载【测试用】硬编码计划: %s" % [character_name, self.current_dynamic_plan])
 	else: printerr("错误: 解析灵魂文件失败: %s" % load_path)
 
+# 灵魂文件不保存运行时记忆: 从记忆服务 (或本地记忆文件) 取回最近几条，恢复上次运行的上下文
+func _restore_recent_memory():
+	var recent = await MemoryClient.recent(character_name, LOCAL_MEMORY_LIMIT)
+	ai_memory = (recent + ai_memory).slice(-LOCAL_MEMORY_LIMIT)
+
 # --- “肉体”设置 ---
 func set_texture(tex: Texture2D):
 	if sprite:
@@ -194,9 +205,10 @@ func _physics_process(delta):
 			velocity = Vector2.ZERO
 			navigation_agent.set_velocity(velocity)
 		
-		elif navigation_agent.is_navigation_finished():
+		elif is_move_finished():
 			# 已到达，且不处于任何思考状态。
 			velocity = Vector2.ZERO 
+			ai_flow_field_tag = ""
 			
 			var completed_action = ai_current_action 
 			var completed_target = ai_current_target_name
@@ -229,7 +241,7 @@ func _physics_process(delta):
 			if ai_current_action == "talk_to":
 				update_target_position(delta)
 			
-			var next_path_pos = navigation_agent.get_next_path_position()
+			var next_path_pos = get_next_move_position()
 			var ideal_velocity = global_position.direction_to(next_path_pos) * AI_MOVE_SPEED
 			navigation_agent.set_velocity(ideal_velocity)
 			velocity = navigation_agent.get_velocity()
@@ -369,6 +381,7 @@ func on_schedule_tick(current_key: String):
 			is_thinking = false # 重置“回复”思考状态
 			ai_current_action = ""
 			ai_current_target_name = ""
+			ai_flow_field_tag = ""
 			 # ai_current_task_string 将在下面被新任务覆盖
 		
 		# 2. 如果我们是空闲的 (或刚刚被中断变为空闲)
@@ -447,6 +460,21 @@ func find_character_by_name(char_name: String):
 
 # --- 寻路到物体 ---
 func find_and_move_to_target(target_tag: String):
+	# 1. 优先查预计算的导航数据: 最近实例 + 距离场，无需搜索
+	if NavData.has_tag(target_tag):
+		if NavData.distance_to_tag(target_tag, global_position) < 0:
+			printerr("错误: %s 无法到达 '%s'" % [character_name, target_tag])
+			ai_current_action = "" 
+			ai_current_target_name = ""
+			ai_current_task_string = ""
+			navigation_agent.target_position = global_position
+			return
+		ai_flow_field_tag = target_tag
+		navigation_agent.target_position = global_position # 不让 NavigationAgent2D 再寻路
+		print("%s (D-AI) GOTO: %s (最近实例 %s)" % [character_name, target_tag, NavData.nearest_instance_position(target_tag, global_position)])
+		return
+
+	# 2. 没有导航数据时: 组查找 + NavigationAgent2D 寻路
 	var potential_targets = get_tree().get_nodes_in_group(target_tag)
 	if potential_targets.is_empty(): 
 		printerr("错误: %s 找不到 '%s'" % [character_name, target_tag])
@@ -467,6 +495,19 @@ func find_and_move_to_target(target_tag: String):
 		navigation_agent.target_position = global_position
 
 
+# --- 移动 (距离场 / NavigationAgent2D) ---
+func is_move_finished() -> bool:
+	if not ai_flow_field_tag.is_empty():
+		# 0 = 已到达；-1 = 走出了可达区域 (停止，避免卡住)
+		return NavData.distance_to_tag(ai_flow_field_tag, global_position) <= 0
+	return navigation_agent.is_navigation_finished()
+
+func get_next_move_position() -> Vector2:
+	if not ai_flow_field_tag.is_empty():
+		return NavData.next_waypoint(ai_flow_field_tag, global_position)
+	return navigation_agent.get_next_path_position()
+
+
 # ==================== 对话系统 ====================
 
 # --- Agent 主动发起对话 (到达后) ---
@@ -518,27 +559,11 @@ func show_chat_bubble(text: String):
 # ==================== 日志系统 ====================
 func log_memory_event(event_text: String, thought: String = ""):
 	var log_entry = {"time": WorldClock.get_current_time_string(), "event": event_text, "thought": thought}
+	# 每条事件只追加到记忆服务 (一次小请求)，不再把整个灵魂文件重写一遍
 	ai_memory.append(log_entry)
-	var save_path = "res://npc_souls/" + soul_file
-	
-	var soul_data_to_save = {
-		"api_key": llm_api_key, 
-		"api_url": llm_api_url, 
-		"api_type": llm_api_type, 
-		"model_name": llm_model_name,
-		"base_prompt": ai_base_prompt, 
-		"personality": ai_personality, 
-		"goals": ai_goals, 
-		"dialogue": ai_dialogue,
-		"memory": ai_memory,
-		"current_dynamic_plan": current_dynamic_plan 
-	}
-	
-	var file = FileAccess.open(save_path, FileAccess.WRITE)
-	if file:
-		file.store_string(JSON.stringify(soul_data_to_save, "  ")); 
-		file.close()
-	else: printerr("错误: 无法写入记忆文件到 res://: %s (错误码: %s)" % [save_path, FileAccess.get_open_error()])
+	if ai_memory.size() > LOCAL_MEMORY_LIMIT:
+		ai_memory = ai_memory.slice(-LOCAL_MEMORY_LIMIT)
+	MemoryClient.append(character_name, log_entry)
 
 func request_daily_plan_from_llm(): 
 	if is_thinking: return
@@ -553,11 +578,16 @@ func request_daily_plan_from_llm():
 	var world_objects = world_context.get("available_objects", [])
 	var world_chars = world_context.get("available_characters", [])
 
+	# 只放入与目标相关的 top-k 记忆 + 摘要 (提示大小不随模拟时长增长)
+	var recalled_memory = await MemoryClient.recall(character_name, "%s %s" % [ai_goals, world_objects], MEMORY_RECALL_K)
+	if recalled_memory.is_empty():
+		for entry in ai_memory.slice(-MEMORY_RECALL_K): recalled_memory += entry["time"] + ": " + entry["event"] + "\n"
+
 	var system_prompt = "%s\n你的个性是: %s\n你的目标是: %s\n你过去的记忆是: %s" % [
 		ai_base_prompt, 
 		ai_personality, 
 		ai_goals, 
-		ai_memory
+		recalled_memory
 	]
 	
 	var user_prompt = """
@@ -22,6 +22,7 @@ var is_god_controlled: bool = false
 var ai_current_task_string: String = ""
 var ai_current_action: String = ""
 var ai_current_target_name: String = ""
+var ai_flow_field_tag: String = "" # 非空时沿 NavData 的距离场移动 (不使用 NavigationAgent2D 寻路)
 const AI_MOVE_SPEED: float = 70.0
 const GOD_MOVE_SPEED: float = 150.0
 const NAVIGATION_TARGET_REACHED_DISTANCE: float = 50.0
@@ -37,6 +38,7 @@ var _dialogue_cooldown: float = 0.0
 
 # 追踪计时器
 const TARGET_UPDATE_INTERVAL: float = 0.5
+const LOCAL_MEMORY_LIMIT: int = 20 # 本地只保留最近几条，完整记忆在记忆服务中
 var _target_update_timer: float = 0.0
 
 
@@ -87,9 +89,16 @@ func load_soul_data():
 	if json:
 		print("  - %s 成功加载灵魂: %s" % [character_name, load_path])
 		self.ai_schedule = json.get("schedule", {}); self.ai_dialogue = json.get("dialogue", {})
-		self.ai_memory = json.get("memory", []) # 读取记忆
+		self.ai_memory = json.get("memory", []).slice(-LOCAL_MEMORY_LIMIT) # 读取记忆
+		MemoryClient.configure(json.get("memory_service_url", ""))
+		call_deferred("_restore_recent_memory")
 	else: printerr("错误: 解析灵魂文件失败: %s" % load_path)
 
+# 灵魂文件不保存运行时记忆: 从记忆服务 (或本地记忆文件) 取回最近几条，恢复上次运行的上下文
+func _restore_recent_memory():
+	var recent = await MemoryClient.recent(character_name, LOCAL_MEMORY_LIMIT)
+	ai_memory = (recent + ai_memory).slice(-LOCAL_MEMORY_LIMIT)
+
 # --- “肉体”设置 ---
 func set_texture(tex: Texture2D):
 	if sprite: sprite.texture = tex
@@ -103,6 +112,7 @@ func set_god_control(is_active: bool):
 		navigation_agent.target_position = global_position
 		ai_current_action = ""
 		ai_current_target_name = ""
+		ai_flow_field_tag = ""
 		_dialogue_cooldown = 0
 	else:
 		print("上帝模式已停用: %s" % character_name)
@@ -120,9 +130,10 @@ func _physics_process(delta):
 		navigation_agent.set_velocity(velocity)
 	else:
 		# --- 2. 默认 AI 模式 ---
-		var navigation_finished = navigation_agent.is_navigation_finished()
+		var navigation_finished = is_move_finished()
 
 		if navigation_finished:
+			ai_flow_field_tag = ""
 			velocity = Vector2.ZERO # 停下
 			
 			# 到达后检查是否要对话
@@ -152,7 +163,7 @@ func _physics_process(delta):
 			if ai_current_action == "talk_to":
 				update_target_position(delta) 
 			
-			var next_path_pos = navigation_agent.get_next_path_position()
+			var next_path_pos = get_next_move_position()
 			var ideal_velocity = global_position.direction_to(next_path_pos) * AI_MOVE_SPEED
 			navigation_agent.set_velocity(ideal_velocity)
 			velocity = navigation_agent.get_velocity()
@@ -318,6 +329,21 @@ func find_character_by_name(char_name: String):
 	
 # --- 寻路到物体 ---
 func find_and_move_to_target(target_tag: String):
+	# 1. 优先查预计算的导航数据: 最近实例 + 距离场，无需搜索
+	if NavData.has_tag(target_tag):
+		if NavData.distance_to_tag(target_tag, global_position) < 0:
+			printerr("错误: %s 无法到达 '%s'" % [character_name, target_tag])
+			ai_current_action = ""
+			ai_current_target_name = ""
+			ai_current_task_string = ""
+			navigation_agent.target_position = global_position
+			return
+		ai_flow_field_tag = target_tag
+		navigation_agent.target_position = global_position # 不让 NavigationAgent2D 再寻路
+		print("%s GOTO: %s (最近实例 %s)" % [character_name, target_tag, NavData.nearest_instance_position(target_tag, global_position)])
+		return
+
+	# 2. 没有导航数据时: 组查找 + NavigationAgent2D 寻路
 	var potential_targets = get_tree().get_nodes_in_group(target_tag)
 	
 	if potential_targets.is_empty(): 
@@ -341,6 +367,19 @@ func find_and_move_to_target(target_tag: String):
 		navigation_agent.target_position = global_position
 
 
+# --- 移动 (距离场 / NavigationAgent2D) ---
+func is_move_finished() -> bool:
+	if not ai_flow_field_tag.is_empty():
+		# 0 = 已到达；-1 = 走出了可达区域 (停止，避免卡住)
+		return NavData.distance_to_tag(ai_flow_field_tag, global_position) <= 0
+	return navigation_agent.is_navigation_finished()
+
+func get_next_move_position() -> Vector2:
+	if not ai_flow_field_tag.is_empty():
+		return NavData.next_waypoint(ai_flow_field_tag, global_position)
+	return navigation_agent.get_next_path_position()
+
+
 # --- NPC 主动发起对话 (按计划) ---
 func initiate_dialogue(target_node):
 	if _dialogue_cooldown > 0:
@@ -394,14 +433,11 @@ func show_chat_bubble(text: String):
 
 func log_memory_event(event_text: String, thought: String = ""):
 	var log_entry = {"time": WorldClock.get_current_time_string(), "event": event_text, "thought": thought}
+	# 每条事件只追加到记忆服务，不再把整个灵魂文件重写一遍
 	ai_memory.append(log_entry)
-	var save_path = "res://npc_souls/" + soul_file
-	var soul_data_to_save = { "schedule": ai_schedule, "dialogue": ai_dialogue, "memory": ai_memory }
-	var file = FileAccess.open(save_path, FileAccess.WRITE)
-	if file:
-		file.store_string(JSON.stringify(soul_data_to_save, "  ")); file.close()
-		# print("  - [日志] %s 记忆已【直接写入】: %s" % [character_name, save_path])
-	else: printerr("错误: 无法写入记忆文件到 res://: %s (错误码: %s)" % [save_path, FileAccess.get_open_error()])
+	if ai_memory.size() > LOCAL_MEMORY_LIMIT:
+		ai_memory = ai_memory.slice(-LOCAL_MEMORY_LIMIT)
+	MemoryClient.append(character_name, log_entry)
 
 # ==================== 信号处理 ====================
 func _on_click_area_input_event(viewport: Node, event: InputEvent, shape_idx: int) -> void: